@@ -21,9 +21,13 @@ import sys
 from absl import app
 from absl import flags
 from glazier.lib import logs
+from glazier.lib import profiler
+from glazier.lib import registry
 from glazier.lib import title
 from glazier.lib import winpe
 from glazier.lib.config import builder
+from glazier.lib.config import files
+from glazier.lib.config import journal
 from glazier.lib.config import runner
 
 from glazier.lib import buildinfo
@@ -41,8 +45,8 @@ class AutoBuild(object):
   """The AutoBuild class manages the imaging process."""
 
   def __init__(self):
-    logs.Setup()
     self._build_info = buildinfo.BuildInfo()
+    logs.Setup(self._build_info)
 
   def _SetupTaskList(self):
     """Determines the location of the task list and erases if necessary."""
@@ -50,17 +54,20 @@ class AutoBuild(object):
     if winpe.check_winpe():
       location = constants.WINPE_TASK_LIST
     logging.debug('Using task list at %s', location)
-    if not _PRESERVE_TASKS.value and os.path.exists(location):
-      logging.debug('Purging old task list.')
+    if not _PRESERVE_TASKS.value:
       try:
-        os.remove(location)
-      except OSError as e:
+        journal.RemoveJournal(location)
+        if os.path.exists(location):
+          logging.debug('Purging old task list.')
+          os.remove(location)
+      except (OSError, files.Error) as e:
         terminator.log_and_exit(self._build_info, e)
     return location
 
   def RunBuild(self):
     """Perform the build."""
     try:
+      self._build_info.Prefetch()
       title.set_title()
       self._build_info.ImageID()
       self._build_info.BeyondCorp()
@@ -71,16 +78,23 @@ class AutoBuild(object):
         root_path = constants.CONFIG_ROOT_PATH.value or '/'
         try:
           b = builder.ConfigBuilder(self._build_info)
-          b.Start(out_file=task_list, in_path=root_path)
+          with profiler.Span(profiler.CATEGORY_BUILD, 'ConfigBuilder'):
+            b.Start(out_file=task_list, in_path=root_path)
         except builder.ConfigBuilderError as e:
           terminator.log_and_exit(self._build_info, e)
 
       try:
         r = runner.ConfigRunner(self._build_info)
-        r.Start(task_list=task_list)
+        with profiler.Span(profiler.CATEGORY_BUILD, 'ConfigRunner'):
+          r.Start(task_list=task_list)
       except runner.ConfigRunnerError as e:
         terminator.log_and_exit(self._build_info, e)
 
+      profiler.LogSummary()
+      cache_stats = registry.cache_stats()
+      if cache_stats:
+        logging.info('Registry cache: %s.', cache_stats)
+
     except KeyboardInterrupt:
       logging.info('KeyboardInterrupt detected, exiting.')
       sys.exit(1)
@@ -56,6 +56,13 @@ class AutobuildTest(test_utils.GlazierTestCase):
     self.assertEqual(self.autobuild._SetupTaskList(), tasklist)
     self.assertFalse(autobuild.os.path.exists(tasklist))
 
+    # A journal left behind without its task list is removed too.
+    journal_path = tasklist + autobuild.journal.JOURNAL_SUFFIX
+    with open(journal_path, 'w') as f:
+      f.write('stale')
+    self.assertEqual(self.autobuild._SetupTaskList(), tasklist)
+    self.assertFalse(autobuild.os.path.exists(journal_path))
+
   @mock.patch.object(autobuild.terminator, 'log_and_exit', autospec=True)
   @mock.patch.object(autobuild, 'os', autospec=True)
   def test_setup_task_list_error(self, mock_os, mock_log_and_exit):
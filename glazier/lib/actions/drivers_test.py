@@ -26,13 +26,11 @@ class DriversTest(test_utils.GlazierTestCase):
 
   @mock.patch.object(BuildInfo, 'ReleasePath')
   @mock.patch.object(BuildInfo, 'Branch')
-  @mock.patch('glazier.lib.download.Download.VerifyShaHash', autospec=True)
   @mock.patch('glazier.lib.download.Download.DownloadFile', autospec=True)
   @mock.patch.object(drivers.execute, 'execute_binary', autospec=True)
   @mock.patch.object(drivers.file_util, 'CreateDirectories', autospec=True)
   def test_driver_wim(self, mock_createdirectories, mock_execute_binary,
-                      mock_downloadfile, mock_verifyshahash, mock_branch,
-                      mock_releasepath):
+                      mock_downloadfile, mock_branch, mock_releasepath):
 
     bi = BuildInfo()
 
@@ -57,8 +55,8 @@ class DriversTest(test_utils.GlazierTestCase):
         mock.ANY, ('https://glazier-server.example.com/'
                    'bin/Drivers/Lenovo/W54x-Win10-Storage.wim'),
         local,
-        show_progress=True)
-    mock_verifyshahash.assert_called_with(mock.ANY, local, sha_256)
+        show_progress=False,
+        digests={'sha256': sha_256})
     cache = drivers.constants.SYS_CACHE
     mock_execute_binary.assert_called_with(
         f'{drivers.constants.WINPE_SYSTEM32}/dism.exe',
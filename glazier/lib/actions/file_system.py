@@ -17,6 +17,7 @@
 import logging
 import os
 import shutil
+from glazier.lib import copy_tree
 from glazier.lib import file_util
 from glazier.lib.actions.base import ActionError
 from glazier.lib.actions.base import BaseAction
@@ -32,16 +33,20 @@ class CopyDir(FileSystem):
 
   def Run(self):
     remove_existing = False
+    options = {}
     try:
       src = self._args[0]
       dst = self._args[1]
       if len(self._args) > 2:
         remove_existing = self._args[2]
+      if len(self._args) > 3:
+        options = self._args[3]
     except IndexError as e:
       message = f'Unable to determine source and destination from {self._args}.'
       raise ActionError(message) from e
+    sync = options.get('sync', False)
     try:
-      if os.path.exists(dst) and remove_existing:
+      if os.path.exists(dst) and remove_existing and not sync:
         logging.info('Deleting existing destination: %s', dst)
         shutil.rmtree(dst)
     except (shutil.Error, OSError) as e:
@@ -49,18 +54,44 @@ class CopyDir(FileSystem):
           f'Unable to delete existing destination folder {dst}') from e
     try:
       logging.info('Copying directory: %s to %s', src, dst)
-      shutil.copytree(src, dst)
-    except (shutil.Error, OSError) as e:
+      copy_tree.CopyTree(
+          src,
+          dst,
+          sync=sync,
+          compare=options.get('compare', copy_tree.COMPARE_MTIME),
+          include=options.get('include'),
+          exclude=options.get('exclude'),
+          mirror=options.get('mirror', False))
+    except file_util.Error as e:
       raise ActionError(f'Unable to copy {src} to {dst}') from e
 
   def Validate(self):
     self._TypeValidator(self._args, list)
-    if not 2 <= len(self._args) <= 3:
+    if not 2 <= len(self._args) <= 4:
       raise ValidationError(f'Invalid args length: {len(self._args)}')
     self._TypeValidator(self._args[0], str)  # src
     self._TypeValidator(self._args[1], str)  # dst
     if len(self._args) > 2:  # Remove existing folder
       self._TypeValidator(self._args[2], bool)
+    if len(self._args) > 3:  # Copy options
+      options = self._args[3]
+      self._TypeValidator(options, dict)
+      for key in options:
+        if key not in ('sync', 'mirror', 'compare', 'include', 'exclude'):
+          raise ValidationError(f'Unknown CopyDir option: {key}')
+      for key in ('sync', 'mirror'):
+        if key in options:
+          self._TypeValidator(options[key], bool)
+      if options.get('mirror') and not options.get('sync'):
+        raise ValidationError('The CopyDir mirror option requires sync.')
+      if options.get('compare', copy_tree.COMPARE_MTIME) not in (
+          copy_tree.COMPARE_MTIME, copy_tree.COMPARE_HASH):
+        raise ValidationError(
+            f'Invalid CopyDir compare option: {options["compare"]}')
+      for key in ('include', 'exclude'):
+        self._TypeValidator(options.get(key, []), list)
+        for pattern in options.get(key, []):
+          self._TypeValidator(pattern, str)
 
 
 class MultiCopyDir(BaseAction):
@@ -55,6 +55,39 @@ class CopyDirTest(test_utils.GlazierTestCase):
     self.assert_path_exists(os.path.join(dst_dir, 'file1.txt'))
     self.assert_path_exists(os.path.join(dst_dir, 'file2.txt'))
 
+  @mock.patch('glazier.lib.buildinfo.BuildInfo', autospec=True)
+  def test_sync(self, mock_buildinfo):
+
+    src_dir = self.create_tempdir(name='src')
+    src_dir.create_file(file_path='file1.txt', content='file1')
+    src_dir.create_file(file_path='file2.pyc', content='file2')
+    dst_dir = self.create_tempdir(name='dst')
+    dst_dir.create_file(file_path='stale.txt', content='stale')
+    args = [
+        src_dir.full_path, dst_dir.full_path, True, {
+            'sync': True,
+            'exclude': ['*.pyc']
+        }
+    ]
+
+    cd = file_system.CopyDir(args, mock_buildinfo)
+    cd.Validate()
+    with mock.patch.object(
+        file_system.copy_tree.shutil, 'copy2',
+        wraps=file_system.copy_tree.shutil.copy2) as mock_copy2:
+      cd.Run()
+      cd.Run()
+      self.assertEqual(mock_copy2.call_count, 1)
+    # remove_existing alone does not delete anything when syncing.
+    self.assertEqual(
+        sorted(os.listdir(dst_dir.full_path)), ['file1.txt', 'stale.txt'])
+
+    args[3]['mirror'] = True
+    cd = file_system.CopyDir(args, mock_buildinfo)
+    cd.Validate()
+    cd.Run()
+    self.assertEqual(sorted(os.listdir(dst_dir.full_path)), ['file1.txt'])
+
   @mock.patch('glazier.lib.buildinfo.BuildInfo', autospec=True)
   def test_exception(self, mock_buildinfo):
     temp_dir = self.create_tempdir().full_path
@@ -75,7 +108,7 @@ class CopyDirTest(test_utils.GlazierTestCase):
 
 class MultiCopyDirTest(test_utils.GlazierTestCase):
 
-  @mock.patch.object(file_system.shutil, 'copytree', autospec=True)
+  @mock.patch.object(file_system.copy_tree, 'CopyTree', autospec=True)
   @mock.patch.object(file_system.shutil, 'rmtree', autospec=True)
   @mock.patch('glazier.lib.buildinfo.BuildInfo', autospec=True)
   def test_success(self, mock_build_info, mock_rmtree, mock_copytree):
@@ -109,14 +142,18 @@ class MultiCopyDirTest(test_utils.GlazierTestCase):
 
     self.assertEqual(mock_exists.call_count, 6)
     self.assertEqual(len(temp_dirs * 2) + 1, mock_rmtree.call_count)
-    mock_copytree.assert_has_calls([
-        mock.call(temp_dirs[0][0], temp_dirs[0][1]),
-        mock.call(temp_dirs[1][0], temp_dirs[1][1]),
-        mock.call(temp_dirs[2][0], temp_dirs[2][1]),
-        mock.call(temp_dirs[3][0], temp_dirs[3][1]),
-        mock.call(temp_dirs[4][0], temp_dirs[4][1]),
-        mock.call(temp_dirs[5][0], temp_dirs[5][1]),
-    ])
+    self.assertEqual([c[0] for c in mock_copytree.call_args_list], temp_dirs)
+    self.assertFalse(any(c[1]['sync'] for c in mock_copytree.call_args_list))
+
+  @mock.patch('glazier.lib.buildinfo.BuildInfo', autospec=True)
+  def test_chained(self, mock_build_info):
+    src_dir = self.create_tempdir(name='src')
+    src_dir.create_file(file_path='file1.txt', content='file1')
+    middle = os.path.join(self.create_tempdir().full_path, 'middle')
+    last = os.path.join(self.create_tempdir().full_path, 'last')
+    file_system.MultiCopyDir([[src_dir.full_path, middle], [middle, last]],
+                             mock_build_info).Run()
+    self.assert_path_exists(os.path.join(last, 'file1.txt'))
 
   @mock.patch('glazier.lib.buildinfo.BuildInfo', autospec=True)
   def test_invalid_multi_args(self, mock_build_info):
@@ -146,10 +183,18 @@ class MultiCopyDirTest(test_utils.GlazierTestCase):
   @parameterized.parameters(
       ('String',),  # wrong overall type
       (['/src/dir/one/'],),  # too short
-      (['a', 'b', 'c', 'd'],),  # too long
+      (['a', 'b', True, {}, 'e'],),  # too long
       ([2, '/dst/dir/two/', True],),  # wrong type [0]
       (['/src/dir/three/', 3, True],),  # wrong type [1]
       (['/src/dir/four/', '/dst/dir/four/', 4],),  # wrong type [2]
+      (['/src/dir/five/', '/dst/dir/five/', True, []],),  # wrong type [3]
+      (['/src/dir/six/', '/dst/dir/six/', True, {'mirror': True}],),
+      (['/src/dir/six/', '/dst/dir/six/', True, {'sync': True,
+                                                 'mirror': 'yes'}],),
+      (['/src/dir/six/', '/dst/dir/six/', True, {'checksum': True}],),
+      (['/src/dir/seven/', '/dst/dir/seven/', True, {'compare': 'size'}],),
+      (['/src/dir/eight/', '/dst/dir/eight/', True, {'exclude': '*.pyc'}],),
+      (['/src/dir/nine/', '/dst/dir/nine/', True, {'sync': 'yes'}],),
   )
   @mock.patch('glazier.lib.buildinfo.BuildInfo', autospec=True)
   def test_validate_invalid_args(self, copydir_args, mock_build_info):
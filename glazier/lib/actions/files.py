@@ -17,11 +17,13 @@
 import logging
 import shlex
 from typing import List
-import zipfile
+from glazier.lib import artifact_store
 from glazier.lib import cache
+from glazier.lib import download_manager
 from glazier.lib import events
 from glazier.lib import execute
 from glazier.lib import file_util
+from glazier.lib import unzip
 from glazier.lib.actions.base import ActionError
 from glazier.lib.actions.base import BaseAction
 from glazier.lib.actions.base import ValidationError
@@ -94,29 +96,33 @@ class Get(BaseAction):
   """Download a file from a remote source."""
 
   def Run(self):
-    downloader = download.Download()
-    for arg in self._args:
-      src = arg[0]
-      dst = arg[1]
-      full_url = download.Transform(src, self._build_info)
-      # support legacy untagged short filenames
-      if not (download.IsRemote(full_url) or download.IsLocal(full_url)):
-        full_url = download.PathCompile(self._build_info, file_name=full_url)
-      try:
-        file_util.CreateDirectories(dst)
-      except file_util.Error as e:
-        raise ActionError(
-            f'Could not create destination directory: {dst}') from e
-      try:
-        downloader.DownloadFile(full_url, dst, show_progress=True)
-      except download.Error as e:
-        downloader.PrintDebugInfo()
-        raise ActionError(f'Transfer error while downloading {full_url}') from e
-      if len(arg) > 2 and arg[2]:
-        logging.info('Verifying SHA256 hash for %s.', dst)
-        hash_ok = downloader.VerifyShaHash(dst, arg[2])
-        if not hash_ok:
-          raise ActionError(f'SHA256 hash for {dst} was incorrect.')
+    with download_manager.DownloadManager(
+        show_progress=True,
+        store=artifact_store.ForBuild(self._build_info)) as manager:
+      for arg in self._args:
+        src = arg[0]
+        dst = arg[1]
+        full_url = download.Transform(src, self._build_info)
+        # support legacy untagged short filenames
+        if not (download.IsRemote(full_url) or download.IsLocal(full_url)):
+          full_url = download.PathCompile(self._build_info, file_name=full_url)
+        try:
+          file_util.CreateDirectories(dst)
+        except file_util.Error as e:
+          raise ActionError(
+              f'Could not create destination directory: {dst}') from e
+        sha256 = arg[2] if len(arg) > 2 and arg[2] else None
+        manager.Submit(full_url, dst, sha256=sha256)
+
+      for job in manager.Wait():
+        if isinstance(job.error, download.HashMismatchError):
+          raise ActionError(
+              f'SHA256 hash for {job.save_location} was incorrect.'
+          ) from job.error
+        if job.error:
+          job.downloader.PrintDebugInfo()
+          raise ActionError(
+              f'Transfer error while downloading {job.url}') from job.error
 
   def Validate(self):
     self._TypeValidator(self._args, list)
@@ -125,7 +131,31 @@ class Get(BaseAction):
 
 
 class Unzip(BaseAction):
-  """Unzip a zip archive to the local filesystem."""
+  """Unzip a zip archive to the local filesystem.
+
+  A remote archive is extracted as it downloads, where its layout allows, and
+  otherwise once the download completes.
+  """
+
+  def _StreamExtract(self, url: str, out_path: str):
+    """Downloads a zip archive and extracts it as it arrives."""
+    extractor = unzip.StreamExtractor(out_path)
+    downloader = download.Download(chunk_callback=extractor.Write)
+    try:
+      zip_file = downloader.DownloadFileTemp(url, show_progress=True)
+    except download.Error as e:
+      extractor.Finish()
+      downloader.PrintDebugInfo()
+      raise ActionError(f'Transfer error while downloading {url}') from e
+    try:
+      if not extractor.Finish():
+        logging.info('Extracting %s now that it has downloaded.', url)
+        unzip.Extract(zip_file, out_path)
+    finally:
+      try:
+        file_util.Remove(zip_file)
+      except file_util.Error as e:
+        logging.warning(e)
 
   def Run(self):
     try:
@@ -141,9 +171,11 @@ class Unzip(BaseAction):
       raise ActionError(f'Unable to create output path {out_path}.') from e
 
     try:
-      zf = zipfile.ZipFile(zip_file)
-      zf.extractall(out_path)
-    except (IOError, zipfile.BadZipfile) as e:
+      if download.IsRemote(zip_file):
+        self._StreamExtract(zip_file, out_path)
+      else:
+        unzip.Extract(zip_file, out_path)
+    except unzip.Error as e:
       raise ActionError('Bad zip file given as input.') from e
 
   def Validate(self):
@@ -134,7 +134,8 @@ class FilesTest(test_utils.GlazierTestCase):
         mock.ANY,
         'https://glazier-server.example.com/bin/glazier/1.0/autobuild.par',
         '/tmp/autobuild.par',
-        show_progress=True)
+        show_progress=False,
+        digests=None)
 
   @mock.patch.object(buildinfo.BuildInfo, 'ReleasePath', autospec=True)
   @mock.patch.object(buildinfo.BuildInfo, 'BinaryPath', autospec=True)
@@ -152,7 +153,8 @@ class FilesTest(test_utils.GlazierTestCase):
         mock.ANY,
         'https://glazier-server.example.com/test/script.ps1',
         '/tmp/autobuild.par',
-        show_progress=True)
+        show_progress=False,
+        digests=None)
 
   @mock.patch.object(buildinfo.BuildInfo, 'ReleasePath', autospec=True)
   @mock.patch.object(buildinfo.BuildInfo, 'BinaryPath', autospec=True)
@@ -170,7 +172,8 @@ class FilesTest(test_utils.GlazierTestCase):
         mock.ANY,
         'https://glazier-server.example.com/test/script.ps1',
         '/tmp/autobuild.par',
-        show_progress=True)
+        show_progress=False,
+        digests=None)
 
   @mock.patch.object(buildinfo.BuildInfo, 'ReleasePath', autospec=True)
   @mock.patch.object(buildinfo.BuildInfo, 'BinaryPath', autospec=True)
@@ -188,7 +191,8 @@ class FilesTest(test_utils.GlazierTestCase):
         mock.ANY,
         'C:/glazier/conf/script.ps1',
         '/tmp/autobuild.par',
-        show_progress=True)
+        show_progress=False,
+        digests=None)
 
   @mock.patch.object(buildinfo.BuildInfo, 'ReleasePath', autospec=True)
   @mock.patch.object(buildinfo.BuildInfo, 'Branch', autospec=True)
@@ -235,39 +239,40 @@ class FilesTest(test_utils.GlazierTestCase):
         mock.ANY,
         'https://glazier-server.example.com/autobuild.bat',
         '/tmp/autobuild.bat',
-        show_progress=True)
+        show_progress=False,
+        digests=None)
 
   @mock.patch.object(buildinfo.BuildInfo, 'ReleasePath', autospec=True)
   @mock.patch.object(buildinfo.BuildInfo, 'Branch', autospec=True)
   @mock.patch.object(files.download.Download, 'DownloadFile', autospec=True)
-  @mock.patch.object(files.download.Download, 'VerifyShaHash', autospec=True)
-  def test_get_hash_match(self, mock_verifyshahash, mock_downloadfile,
-                          mock_branch, mock_releasepath):
+  def test_get_hash_match(self, mock_downloadfile, mock_branch,
+                          mock_releasepath):
     mock_branch.return_value = 'stable'
     mock_releasepath.return_value = 'https://glazier-server.example.com/'
     local = r'/tmp/autobuild.par'
     test_sha256 = (
         '58157bf41ce54731c0577f801035d47ec20ed16a954f10c29359b8adedcae800')
-    self.create_tempfile(file_path='autobuild.par.sha256', content=test_sha256)
     mock_downloadfile.return_value = True
-    mock_verifyshahash.return_value = True
     files.Get([['@glazier/1.0/autobuild.par', local, test_sha256]],
               buildinfo.BuildInfo()).Run()
-    mock_verifyshahash.assert_called_with(mock.ANY, local, test_sha256)
+    mock_downloadfile.assert_called_with(
+        mock.ANY,
+        'https://glazier-server.example.com/bin/glazier/1.0/autobuild.par',
+        local,
+        show_progress=False,
+        digests={'sha256': test_sha256})
 
   @mock.patch.object(buildinfo.BuildInfo, 'ReleasePath', autospec=True)
   @mock.patch.object(buildinfo.BuildInfo, 'Branch', autospec=True)
   @mock.patch.object(files.download.Download, 'DownloadFile', autospec=True)
-  @mock.patch.object(files.download.Download, 'VerifyShaHash', autospec=True)
-  def test_get_hash_mismatch(self, mock_verifyshahash, mock_downloadfile,
-                             mock_branch, mock_releasepath):
+  def test_get_hash_mismatch(self, mock_downloadfile, mock_branch,
+                             mock_releasepath):
     mock_branch.return_value = 'stable'
     mock_releasepath.return_value = 'https://glazier-server.example.com/'
     test_sha256 = (
         '58157bf41ce54731c0577f801035d47ec20ed16a954f10c29359b8adedcae800')
-    self.create_tempfile(file_path='autobuild.par.sha256', content=test_sha256)
-    mock_downloadfile.return_value = True
-    mock_verifyshahash.return_value = False
+    mock_downloadfile.side_effect = files.download.HashMismatchError(
+        r'/tmp/autobuild.par')
     with self.assert_raises_with_validation(files.ActionError):
       files.Get(
           [['@glazier/1.0/autobuild.par', r'/tmp/autobuild.par', test_sha256]],
@@ -276,19 +281,18 @@ class FilesTest(test_utils.GlazierTestCase):
   @mock.patch.object(buildinfo.BuildInfo, 'ReleasePath', autospec=True)
   @mock.patch.object(buildinfo.BuildInfo, 'Branch', autospec=True)
   @mock.patch.object(files.download.Download, 'DownloadFile', autospec=True)
-  @mock.patch.object(files.download.Download, 'VerifyShaHash', autospec=True)
-  def test_get_no_hash(self, mock_verifyshahash, mock_downloadfile, mock_branch,
-                       mock_releasepath):
+  def test_get_no_hash(self, mock_downloadfile, mock_branch, mock_releasepath):
     mock_branch.return_value = 'stable'
     mock_releasepath.return_value = 'https://glazier-server.example.com/'
-    self.create_tempfile(
-        file_path='autobuild.par.sha256',
-        content='58157bf41ce54731c0577f801035d47ec20ed16a954f10c29359b8adedcae800'
-    )
     mock_downloadfile.return_value = True
     files.Get([['@glazier/1.0/autobuild.par', r'/tmp/autobuild.par', '']],
               buildinfo.BuildInfo()).Run()
-    self.assertFalse(mock_verifyshahash.called)
+    mock_downloadfile.assert_called_with(
+        mock.ANY,
+        'https://glazier-server.example.com/bin/glazier/1.0/autobuild.par',
+        r'/tmp/autobuild.par',
+        show_progress=False,
+        digests=None)
 
   def test_get_validate(self):
     with self.assert_raises_with_validation(files.ValidationError):
@@ -336,13 +340,46 @@ class FilesTest(test_utils.GlazierTestCase):
 
     # good
     mock_createdirectories.side_effect = None
-    with mock.patch.object(files.zipfile, 'ZipFile', autospec=True) as z:
+    with mock.patch.object(files.unzip, 'Extract', autospec=True) as extract:
       un = files.Unzip([src, dst], mock_buildinfo)
       un.Run()
-      z.assert_called_with(src)
-      z.return_value.extractall.assert_called_with(dst)
+      extract.assert_called_with(src, dst)
       mock_createdirectories.assert_called_with(dst)
 
+  @mock.patch.object(files.file_util, 'Remove', autospec=True)
+  @mock.patch.object(files.unzip, 'Extract', autospec=True)
+  @mock.patch.object(files.unzip, 'StreamExtractor', autospec=True)
+  @mock.patch.object(files.download.Download, 'DownloadFileTemp', autospec=True)
+  @mock.patch.object(files.file_util, 'CreateDirectories', autospec=True)
+  def test_unzip_remote(self, unused_mock_createdirectories,
+                        mock_downloadfiletemp, mock_streamextractor,
+                        mock_extract, mock_remove):
+    src = 'https://glazier-server.example.com/bin/drivers.zip'
+    dst = '/out/dir/path'
+    extractor = mock_streamextractor.return_value
+    mock_downloadfiletemp.return_value = '/tmp/drivers.zip'
+
+    # extracted as it downloaded
+    extractor.Finish.return_value = True
+    files.Unzip([src, dst], None).Run()
+    mock_streamextractor.assert_called_with(dst)
+    mock_downloadfiletemp.assert_called_with(mock.ANY, src, show_progress=True)
+    self.assertIs(mock_downloadfiletemp.call_args[0][0]._chunk_callback,
+                  extractor.Write)
+    self.assertFalse(mock_extract.called)
+    mock_remove.assert_called_with('/tmp/drivers.zip')
+
+    # extracted once downloaded
+    extractor.Finish.return_value = False
+    files.Unzip([src, dst], None).Run()
+    mock_extract.assert_called_with('/tmp/drivers.zip', dst)
+
+    # download error
+    mock_downloadfiletemp.side_effect = files.download.DownloadFailedError(
+        src, 404)
+    with self.assert_raises_with_validation(files.ActionError):
+      files.Unzip([src, dst], None).Run()
+
   def test_unzip_validate(self):
     un = files.Unzip('String', None)
     with self.assert_raises_with_validation(files.ValidationError):
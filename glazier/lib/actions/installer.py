@@ -22,11 +22,11 @@ from glazier.lib import events
 from glazier.lib import log_copy
 from glazier.lib import registry
 from glazier.lib import stage
+from glazier.lib import yaml_codec
 from glazier.lib.actions import file_system
 from glazier.lib.actions.base import ActionError
 from glazier.lib.actions.base import BaseAction
 from glazier.lib.actions.base import ValidationError
-import yaml
 
 from glazier.lib import constants
 
@@ -87,21 +87,23 @@ class BuildInfoSave(BaseAction):
     Args:
       reg_values: A dictionary of key/value pairs to be added to the registry.
     """
+    session = registry.Session()
     for value_name in reg_values:
       key_path = constants.REG_ROOT
       value_data = reg_values[value_name]
       if 'TIMER_' in value_name:
         key_path = r'{0}\{1}'.format(constants.REG_ROOT, 'Timers')
-      try:
-        registry.set_value(value_name, value_data, 'HKLM', key_path)
-      except registry.Error as e:
-        raise ActionError() from e
+      session.set_value(value_name, value_data, 'HKLM', key_path)
+    try:
+      session.commit()
+    except registry.Error as e:
+      raise ActionError() from e
 
   def Run(self):
     path = os.path.join(constants.SYS_CACHE, 'build_info.yaml')
     if os.path.exists(path):
       with open(path) as handle:
-        input_config = yaml.safe_load(handle)
+        input_config = yaml_codec.Load(handle)
         self._WriteRegistry(input_config['BUILD'])
       os.remove(path)
     else:
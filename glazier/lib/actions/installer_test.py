@@ -19,6 +19,7 @@ from absl.testing import absltest
 from glazier.lib import buildinfo
 from glazier.lib import events
 from glazier.lib import log_copy
+from glazier.lib import registry
 from glazier.lib import stage
 from glazier.lib import test_utils
 from glazier.lib.actions import installer
@@ -128,9 +129,10 @@ class InstallerTest(test_utils.GlazierTestCase):
     mock_buildinfo.Serialize.assert_called_with(
         '{}/build_info.yaml'.format(constants.SYS_CACHE))
 
-  @mock.patch.object(installer.registry, 'set_value', autospec=True)
   @mock.patch.object(buildinfo, 'BuildInfo', autospec=True)
-  def test_build_info_save(self, mock_buildinfo, mock_set_value):
+  def test_build_info_save(self, mock_buildinfo):
+    backend = registry.MemoryBackend()
+    self.addCleanup(registry.set_backend, registry.set_backend(backend))
 
     timer_root = r'{0}\{1}'.format(constants.REG_ROOT, 'Timers')
     temp_cache_dir = self.create_tempdir()
@@ -142,15 +144,30 @@ class InstallerTest(test_utils.GlazierTestCase):
     s = installer.BuildInfoSave(None, mock_buildinfo)
     s.Run()
 
-    mock_set_value.assert_has_calls(
-        [
-            mock.call('opt 1', True, 'HKLM', constants.REG_ROOT),
-            mock.call('TIMER_opt 2', 'some value', 'HKLM', timer_root),
-            mock.call('opt 3', 12345, 'HKLM', constants.REG_ROOT),
-        ],
-        any_order=True)
+    self.assertEqual(
+        registry.get_keys_and_values(constants.REG_ROOT), {
+            'opt 1': True,
+            'opt 3': 12345
+        })
+    self.assertEqual(
+        registry.get_keys_and_values(timer_root), {'TIMER_opt 2': 'some value'})
+    # Each key is opened once to write, and once to read back.
+    self.assertEqual(backend.opens, 4)
     s.Run()
 
+  @mock.patch.object(registry.MemoryBackend, 'open_key', autospec=True)
+  @mock.patch.object(buildinfo, 'BuildInfo', autospec=True)
+  def test_build_info_save_write_error(self, mock_buildinfo, mock_open_key):
+    self.addCleanup(registry.set_backend,
+                    registry.set_backend(registry.MemoryBackend()))
+    mock_open_key.side_effect = registry.registry.RegistryError('Test')
+    temp_cache_dir = self.create_tempdir()
+    self.patch_constant(constants, 'SYS_CACHE', temp_cache_dir.full_path)
+    temp_cache_dir.create_file(
+        file_path='build_info.yaml', content='{BUILD: {opt 1: true}}\n')
+    with self.assert_raises_with_validation(installer.ActionError):
+      installer.BuildInfoSave(None, mock_buildinfo).Run()
+
   @mock.patch.object(installer.logging, 'debug', autospec=True)
   @mock.patch.object(buildinfo, 'BuildInfo', autospec=True)
   def test_build_info_save_error(self, mock_buildinfo, mock_debug):
@@ -166,7 +183,7 @@ class InstallerTest(test_utils.GlazierTestCase):
     with self.assert_raises_with_validation(events.ServerChangeEvent):
       d.Run()
     self.assertEqual(build_info.ConfigServer(), 'http://new-server.example.com')
-    self.assertEqual(build_info.ActiveConfigPath(), '/new/conf/root')
+    self.assertEqual(build_info.ActiveConfigPath(), ['/new/conf/root'])
 
   @mock.patch.object(installer.file_system, 'CopyFile', autospec=True)
   def test_exit_win_pe(self, mock_copyfile):
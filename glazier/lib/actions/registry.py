@@ -24,16 +24,18 @@ from glazier.lib.actions.base import ValidationError
 class RegAdd(BaseAction):
   """Add a new registry key."""
 
-  def Run(self):
-
+  def AddTo(self, session: registry.Session):
+    """Adds the key to a session, to be set with others."""
     use_64bit = constants.USE_REG_64
     if len(self._args) > 5:
       use_64bit = self._args[5]
+    session.set_value(self._args[2], self._args[3], self._args[0],
+                      self._args[1], self._args[4], use_64bit=use_64bit)
 
+  def Run(self):
     try:
-      registry.set_value(self._args[2], self._args[3],
-                         self._args[0], self._args[1],
-                         self._args[4], use_64bit=use_64bit)
+      with registry.Session() as session:
+        self.AddTo(session)
     except registry.Error as e:
       raise ActionError() from e
     except IndexError as e:
@@ -59,13 +61,19 @@ class RegAdd(BaseAction):
 
 
 class MultiRegAdd(BaseAction):
-  """Perform RegAdd on multiple sets of registry entries."""
+  """Perform RegAdd on multiple sets of registry entries.
+
+  The entries are set together, opening each registry key once.
+  """
 
   def Run(self):
+    session = registry.Session()
     try:
       for arg in self._args:
-        ra = RegAdd(arg, self._build_info)
-        ra.Run()
+        RegAdd(arg, self._build_info).AddTo(session)
+      session.commit()
+    except registry.Error as e:
+      raise ActionError() from e
     except IndexError as e:
       raise ActionError(
           f'Unable to determine registry sets from {self._args}.') from e
@@ -80,15 +88,18 @@ class MultiRegAdd(BaseAction):
 class RegDel(BaseAction):
   """Delete a registry key."""
 
-  def Run(self):
+  def AddTo(self, session: registry.Session):
+    """Adds the key to a session, to be deleted with others."""
     use_64bit = True
-
     if len(self._args) > 3:
       use_64bit = self._args[3]
+    session.remove_value(self._args[2], self._args[0], self._args[1],
+                         use_64bit=use_64bit)
 
+  def Run(self):
     try:
-      registry.remove_value(self._args[2], self._args[0],
-                            self._args[1], use_64bit=use_64bit)
+      with registry.Session() as session:
+        self.AddTo(session)
     except registry.Error as e:
       raise ActionError() from e
     except IndexError as e:
@@ -107,13 +118,19 @@ class RegDel(BaseAction):
 
 
 class MultiRegDel(BaseAction):
-  """Perform RegDel on multiple sets of registry entries."""
+  """Perform RegDel on multiple sets of registry entries.
+
+  The entries are deleted together, opening each registry key once.
+  """
 
   def Run(self):
+    session = registry.Session()
     try:
       for arg in self._args:
-        rd = RegDel(arg, self._build_info)
-        rd.Run()
+        RegDel(arg, self._build_info).AddTo(session)
+      session.commit()
+    except registry.Error as e:
+      raise ActionError() from e
     except IndexError as e:
       raise ActionError(
           f'Unable to determine registry sets from {self._args}.') from e
@@ -26,29 +26,34 @@ PATH = constants.REG_ROOT
 NAME = 'some_name'
 VALUE = 'some_data'
 TYPE = 'REG_SZ'
-USE_64 = constants.USE_REG_64
 ARGS = [ROOT, PATH, NAME, VALUE, TYPE]
 
 
 class RegistryTest(test_utils.GlazierTestCase):
 
-  @mock.patch.object(registry.registry, 'set_value', autospec=True)
-  def test_add_success(self, mock_set_value):
+  def setUp(self):
+    super(RegistryTest, self).setUp()
+    self.backend = registry.registry.MemoryBackend()
+    self.addCleanup(registry.registry.set_backend,
+                    registry.registry.set_backend(self.backend))
+
+  def test_add_success(self):
     registry.RegAdd(ARGS, None).Run()
-    mock_set_value.assert_called_with(NAME, VALUE, ROOT, PATH, TYPE, USE_64)
+    self.assertEqual(self.backend.opens, 1)
+    self.assertEqual(registry.registry.get_value(NAME), VALUE)
 
-  @mock.patch.object(registry.registry, 'set_value', autospec=True)
-  def test_add_error(self, mock_set_value):
-    mock_set_value.side_effect = registry.registry.RegistryWriteError(
-        'some_name', 'some_value', 'some_path')
+  @mock.patch.object(
+      registry.registry.MemoryBackend, 'open_key', autospec=True)
+  def test_add_error(self, mock_open_key):
+    mock_open_key.side_effect = registry.registry.registry.RegistryError('Test')
     ra = registry.RegAdd(ARGS, None)
     with self.assert_raises_with_validation(registry.ActionError):
       ra.Run()
 
-  @mock.patch.object(registry.registry, 'set_value', autospec=True)
-  def test_multi_add_success(self, mock_set_value):
-    registry.RegAdd(ARGS, None).Run()
-    mock_set_value.assert_called_with(NAME, VALUE, ROOT, PATH, TYPE, USE_64)
+  def test_add_32bit(self):
+    registry.RegAdd(ARGS + [False], None).Run()
+    self.assertEqual(
+        registry.registry.get_value(NAME, use_64bit=False), VALUE)
 
   # NOTE: Reverse decoration is intentional, due to @parameterized and @mock.
   @parameterized.named_parameters(
@@ -61,23 +66,27 @@ class RegistryTest(test_utils.GlazierTestCase):
     with self.assert_raises_with_validation(registry.ActionError):
       ra.Run()
 
-  @mock.patch.object(registry.registry, 'remove_value', autospec=True)
-  def test_del_success(self, mock_remove_value):
+  def test_del_success(self):
+    registry.registry.set_value(NAME, VALUE)
+    registry.RegDel([ROOT, PATH, NAME], None).Run()
+    self.assertIsNone(registry.registry.get_value(NAME))
+    # A value which does not exist is only logged.
     registry.RegDel([ROOT, PATH, NAME], None).Run()
-    mock_remove_value.assert_called_with(NAME, ROOT, PATH, USE_64)
 
-  @mock.patch.object(registry.registry, 'remove_value', autospec=True)
-  def test_del_error(self, mock_remove_value):
-    mock_remove_value.side_effect = registry.registry.RegistryDeleteError(
-        'some_name', 'some_path')
+  @mock.patch.object(
+      registry.registry.MemoryBackend, 'open_key', autospec=True)
+  def test_del_error(self, mock_open_key):
+    mock_open_key.side_effect = registry.registry.registry.RegistryError('Test')
     rd = registry.RegDel([ROOT, PATH, NAME], None)
     with self.assert_raises_with_validation(registry.ActionError):
       rd.Run()
 
-  @mock.patch.object(registry.registry, 'remove_value', autospec=True)
-  def test_multi_del_success(self, mock_remove_value):
+  def test_del_32bit(self):
+    registry.registry.set_value(NAME, VALUE)
+    registry.registry.set_value(NAME, VALUE, use_64bit=False)
     registry.RegDel([ROOT, PATH, NAME, False], None).Run()
-    mock_remove_value.assert_called_with(NAME, ROOT, PATH, False)
+    self.assertIsNone(registry.registry.get_value(NAME, use_64bit=False))
+    self.assertEqual(registry.registry.get_value(NAME), VALUE)
 
   @parameterized.named_parameters(
       ('_missing_arguments', [ROOT, PATH]),
@@ -88,6 +97,35 @@ class RegistryTest(test_utils.GlazierTestCase):
     with self.assert_raises_with_validation(registry.ActionError):
       rd.Run()
 
+  def test_multi_add_del(self):
+    backend = self.backend
+    other = fr'{PATH}\Other'
+    registry.MultiRegAdd([
+        ARGS,
+        [ROOT, PATH, 'dword', 100, 'REG_DWORD'],
+        [ROOT, other, NAME, VALUE, TYPE, False],
+    ], None).Run()
+    self.assertEqual(backend.opens, 2)
+    self.assertEqual(registry.registry.get_value(NAME), VALUE)
+    self.assertEqual(registry.registry.get_value('dword'), 100)
+    self.assertEqual(
+        registry.registry.get_value(NAME, path=other, use_64bit=False), VALUE)
+
+    backend.opens = 0
+    registry.MultiRegDel([[ROOT, PATH, NAME], [ROOT, PATH, 'dword'],
+                          [ROOT, other, NAME, False]], None).Run()
+    self.assertEqual(backend.opens, 2)
+    self.assertIsNone(registry.registry.get_values(PATH))
+
+  @mock.patch.object(
+      registry.registry.MemoryBackend, 'open_key', autospec=True)
+  def test_multi_add_del_error(self, mock_open_key):
+    mock_open_key.side_effect = registry.registry.registry.RegistryError('Test')
+    with self.assert_raises_with_validation(registry.ActionError):
+      registry.MultiRegAdd([ARGS], None).Run()
+    with self.assert_raises_with_validation(registry.ActionError):
+      registry.MultiRegDel([[ROOT, PATH, NAME]], None).Run()
+
   @parameterized.named_parameters(
       ('_list_not_passed', NAME),
       ('_too_many_args', [ROOT, PATH, NAME, NAME, TYPE, True, NAME]),
@@ -20,15 +20,19 @@ from glazier.lib.actions.base import BaseAction
 
 
 class SetTimer(BaseAction):
-  """Create an imaging timer."""
+  """Create one or more imaging timers."""
 
   def Run(self):
-    timer = str(self._args[0])
+    names = [str(arg) for arg in self._args]
 
     try:
-      timers.Timers().Set(timer)
+      if len(names) == 1:
+        timers.Timers().Set(names[0])
+      else:
+        timers.Timers().SetMany(names)
     except timers.Error as e:
       raise ActionError() from e
 
   def Validate(self):
-    self._ListOfStringsValidator(self._args)
+    self._TypeValidator(self._args, list)
+    self._ListOfStringsValidator(self._args, 1, max(len(self._args), 1))
@@ -56,9 +56,15 @@ class TimersTest(test_utils.GlazierTestCase):
     with self.assert_raises_with_validation(ActionError):
       st.Run()
 
+  @mock.patch.object(timers.Timers, 'SetMany', autospec=True)
+  def test_set_timers(self, mock_timers_set_many):
+    timers_action.SetTimer([_VALUE_NAME, 'other'], self._build_info).Run()
+    mock_timers_set_many.assert_called_with(mock.ANY, [_VALUE_NAME, 'other'])
+
   @parameterized.named_parameters(
       ('_invalid_arg_type_1', _VALUE_NAME),
-      ('_invalid_args_length', [1, 2, 3]),
+      ('_invalid_args_length', []),
+      ('_invalid_arg_type_3', [_VALUE_NAME, 1]),
       ('_invalid_arg_type_2', [1]),
   )
   def test_set_timer_validation_error(self, action_args):
@@ -67,6 +73,7 @@ class TimersTest(test_utils.GlazierTestCase):
 
   def test_set_timer_validation_success(self):
     timers_action.SetTimer([_VALUE_NAME], None).Validate()
+    timers_action.SetTimer([_VALUE_NAME, 'other'], None).Validate()
 
 
 if __name__ == '__main__':
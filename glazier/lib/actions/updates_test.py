@@ -26,13 +26,11 @@ class UpdatesTest(test_utils.GlazierTestCase):
 
   @mock.patch.object(BuildInfo, 'ReleasePath')
   @mock.patch.object(BuildInfo, 'Branch')
-  @mock.patch('glazier.lib.download.Download.VerifyShaHash', autospec=True)
   @mock.patch('glazier.lib.download.Download.DownloadFile', autospec=True)
   @mock.patch.object(updates.execute, 'execute_binary', autospec=True)
   @mock.patch.object(updates.file_util, 'CreateDirectories', autospec=True)
   def test_update_msu(self, mock_createdirectories, mock_execute_binary,
-                      mock_downloadfile, mock_verifyshahash, mock_branch,
-                      mock_releasepath):
+                      mock_downloadfile, mock_branch, mock_releasepath):
     bi = BuildInfo()
 
     # Setup
@@ -56,8 +54,8 @@ class UpdatesTest(test_utils.GlazierTestCase):
         mock.ANY, ('https://glazier-server.example.com/'
                    'bin/Drivers/HP/KB2990941-v3-x64.msu'),
         local,
-        show_progress=True)
-    mock_verifyshahash.assert_called_with(mock.ANY, local, sha_256)
+        show_progress=False,
+        digests={'sha256': sha_256})
     cache = updates.constants.SYS_CACHE
     mock_execute_binary.assert_called_with(
         f'{updates.constants.SYS_SYSTEM32}/dism.exe', [
@@ -0,0 +1,319 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Content-addressed store for downloaded files.
+
+Each file is stored once, named by its SHA256 digest, under <root>/objects. An
+index maps the URL each file was downloaded from to its digest and HTTP
+validators, so a file can be found again either by its expected hash or by
+revalidating the URL with the server. Files are copied in and out of the
+store. Hard links can be used instead, where the file system allows it; as a
+linked file shares its contents with its destination, stored files are then
+hashed again before every use, in case the destination was written to.
+
+When the total size of the stored files exceeds the size cap, the least
+recently used files are evicted.
+
+The store only ever speeds up downloads. Failures reading or writing it are
+logged, and the caller falls back to the network.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+
+from absl import flags
+
+_ARTIFACT_CACHE_SIZE = flags.DEFINE_integer(
+    'artifact_cache_size', 0,
+    'Maximum size in megabytes of the content-addressed download cache kept '
+    'under the build cache path. 0 disables the cache.')
+_ARTIFACT_CACHE_HARDLINK = flags.DEFINE_bool(
+    'artifact_cache_hardlink', False,
+    'Hard link files between the download cache and their destinations '
+    'instead of copying them, where the file system allows it. Cached files '
+    'are then hashed again before each use.')
+
+ARTIFACTS_DIR = 'artifacts'
+INDEX_FILE = 'index.json'
+OBJECTS_DIR = 'objects'
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def ForBuild(build_info) -> Optional['ArtifactStore']:
+  """Gets the artifact store for the current build, if enabled.
+
+  Args:
+    build_info: The active BuildInfo instance.
+
+  Returns:
+    The ArtifactStore under the build's cache path, or None if the
+    artifact_cache_size flag disables the store.
+  """
+  if _ARTIFACT_CACHE_SIZE.value <= 0:
+    return None
+  root = os.path.join(build_info.CachePath(), ARTIFACTS_DIR)
+  with _stores_lock:
+    if root not in _stores:
+      _stores[root] = ArtifactStore(
+          root,
+          _ARTIFACT_CACHE_SIZE.value * 1048576,
+          hardlink=_ARTIFACT_CACHE_HARDLINK.value)
+    return _stores[root]
+
+
+def HashFile(path: str) -> str:
+  """Computes the SHA256 digest of a file.
+
+  Args:
+    path: The file to hash.
+
+  Returns:
+    The hex digest of the file contents.
+  """
+  sha_object = hashlib.sha256()
+  with open(path, 'rb') as f:
+    while True:
+      current_chunk = f.read(4194304)
+      if not current_chunk:
+        break
+      sha_object.update(current_chunk)
+  return sha_object.hexdigest()
+
+
+class ArtifactStore(object):
+  """An on-disk, content-addressed file store with LRU eviction."""
+
+  def __init__(self, root: str, max_size: int, hardlink: bool = False):
+    """Initializes the store.
+
+    Args:
+      root: The directory holding the store.
+      max_size: The size cap for all stored files, in bytes.
+      hardlink: Hard link files in and out of the store where possible, and
+        verify the digest of stored files before placing them.
+    """
+    self._root = root
+    self._max_size = max_size
+    self._hardlink = hardlink
+    self._lock = threading.RLock()
+    self._urls = {}
+    self._objects = {}
+    self._Load()
+
+  def _ObjectPath(self, sha256: str) -> str:
+    return os.path.join(self._root, OBJECTS_DIR, sha256[:2], sha256)
+
+  def _IndexPath(self) -> str:
+    return os.path.join(self._root, INDEX_FILE)
+
+  def _Load(self):
+    """Reads the index, dropping entries for files no longer on disk."""
+    try:
+      with open(self._IndexPath()) as f:
+        index = json.load(f)
+      self._urls = index.get('urls', {})
+      self._objects = index.get('objects', {})
+    except (IOError, ValueError, AttributeError):
+      self._urls = {}
+      self._objects = {}
+    for sha256 in list(self._objects):
+      if not os.path.isfile(self._ObjectPath(sha256)):
+        del self._objects[sha256]
+    self._PruneUrls()
+
+  def _Save(self):
+    """Writes the index atomically."""
+    index_path = self._IndexPath()
+    temp_path = index_path + '.tmp'
+    try:
+      os.makedirs(self._root, exist_ok=True)
+      with open(temp_path, 'w') as f:
+        json.dump({'urls': self._urls, 'objects': self._objects}, f)
+      os.replace(temp_path, index_path)
+    except OSError as e:
+      logging.warning('Unable to save artifact cache index %s: %s', index_path,
+                      e)
+
+  def _PruneUrls(self):
+    self._urls = {
+        url: entry
+        for url, entry in self._urls.items()
+        if entry.get('sha256') in self._objects
+    }
+
+  def _Place(self, src: str, dst: str):
+    """Hard links or copies src to dst, replacing any existing dst."""
+    if os.path.lexists(dst):
+      os.remove(dst)
+    if self._hardlink:
+      try:
+        os.link(src, dst)
+        return
+      except OSError as e:
+        logging.debug('Unable to hard link %s to %s, copying: %s', src, dst, e)
+    temp_path = dst + '.tmp'
+    shutil.copyfile(src, temp_path)
+    os.replace(temp_path, dst)
+
+  def Lookup(self, url: str, etag: str) -> Optional[str]:
+    """Finds the digest of a file previously downloaded from a URL.
+
+    Args:
+      url: The address the file was downloaded from.
+      etag: The ETag the server currently reports for the file.
+
+    Returns:
+      The SHA256 digest of the stored file, or None if the store has no copy of
+      this version of the file.
+    """
+    with self._lock:
+      entry = self._urls.get(url)
+      if entry and etag and entry.get('etag') == etag:
+        return entry['sha256']
+    return None
+
+  def Validators(self, url: str) -> Optional[Dict[str, str]]:
+    """Gets the validators of the stored copy of a URL.
+
+    Args:
+      url: The address the file was downloaded from.
+
+    Returns:
+      A dict with the etag, last_modified and sha256 of the stored copy, or
+      None if the store has no copy of the URL.
+    """
+    with self._lock:
+      entry = self._urls.get(url)
+      return dict(entry) if entry else None
+
+  def Contains(self, sha256: str) -> bool:
+    with self._lock:
+      return sha256.lower() in self._objects
+
+  def CopyOut(self, sha256: str, destination: str) -> bool:
+    """Places a stored file at destination.
+
+    Args:
+      sha256: The digest of the stored file.
+      destination: The path to place the file at.
+
+    Returns:
+      True if the file was placed, False if the store has no usable copy.
+    """
+    sha256 = sha256.lower()
+    with self._lock:
+      entry = self._objects.get(sha256)
+      if not entry:
+        return False
+      path = self._ObjectPath(sha256)
+      valid = False
+      try:
+        if os.path.getsize(path) != entry['size']:
+          raise OSError(f'Size of {path} does not match the index')
+        # A linked file may have been changed through one of its destinations.
+        if self._hardlink and HashFile(path) != sha256:
+          raise OSError(f'Digest of {path} does not match the index')
+        valid = True
+        self._Place(path, destination)
+      except OSError as e:
+        logging.warning('Unable to use cached copy of %s: %s', destination, e)
+        if not valid:
+          self._Remove(sha256)
+          self._Save()
+        return False
+      entry['last_used'] = time.time()
+      self._Save()
+    logging.info('Placed cached file %s at %s.', sha256, destination)
+    return True
+
+  def Add(self,
+          path: str,
+          url: Optional[str] = None,
+          etag: Optional[str] = None,
+          sha256: Optional[str] = None,
+          last_modified: Optional[str] = None) -> Optional[str]:
+    """Adds a downloaded file to the store.
+
+    Args:
+      path: The downloaded file.
+      url: The address the file was downloaded from. (Optional)
+      etag: The ETag the server reported for the file. (Optional)
+      sha256: The digest of the file, if already known. (Optional)
+      last_modified: The Last-Modified date the server reported for the file.
+        (Optional)
+
+    Returns:
+      The SHA256 digest of the file, or None if it could not be stored.
+    """
+    try:
+      sha256 = (sha256 or HashFile(path)).lower()
+      size = os.path.getsize(path)
+    except OSError as e:
+      logging.warning('Unable to hash %s for the artifact cache: %s', path, e)
+      return None
+    if size > self._max_size:
+      return sha256
+
+    with self._lock:
+      if sha256 not in self._objects:
+        object_path = self._ObjectPath(sha256)
+        try:
+          os.makedirs(os.path.dirname(object_path), exist_ok=True)
+          self._Place(path, object_path)
+        except OSError as e:
+          logging.warning('Unable to add %s to the artifact cache: %s', path, e)
+          return None
+        self._objects[sha256] = {'size': size}
+      self._objects[sha256]['last_used'] = time.time()
+      if url and (etag or last_modified):
+        self._urls[url] = {
+            'etag': etag,
+            'last_modified': last_modified,
+            'sha256': sha256
+        }
+      self._Evict()
+      self._Save()
+    return sha256
+
+  def _Remove(self, sha256: str):
+    try:
+      os.remove(self._ObjectPath(sha256))
+    except OSError as e:
+      logging.debug('Unable to remove cached file %s: %s', sha256, e)
+    self._objects.pop(sha256, None)
+    self._PruneUrls()
+
+  def _Evict(self):
+    """Removes least recently used files until the store fits its size cap."""
+    total = sum(entry['size'] for entry in self._objects.values())
+    by_age = sorted(
+        self._objects, key=lambda s: self._objects[s].get('last_used', 0))
+    for sha256 in by_age:
+      if total <= self._max_size:
+        break
+      total -= self._objects[sha256]['size']
+      logging.debug('Evicting %s from the artifact cache.', sha256)
+      self._Remove(sha256)
+
+  def Size(self) -> int:
+    """The total size of all stored files, in bytes."""
+    with self._lock:
+      return sum(entry['size'] for entry in self._objects.values())
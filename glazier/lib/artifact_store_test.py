@@ -0,0 +1,171 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for glazier.lib.artifact_store."""
+
+import hashlib
+import os
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import flagsaver
+from absl.testing import parameterized
+from glazier.lib import artifact_store
+from glazier.lib import test_utils
+
+_URL = 'https://glazier.example.com/bin/installer.msi'
+
+
+class ArtifactStoreTest(test_utils.GlazierTestCase, parameterized.TestCase):
+
+  def setUp(self):
+    super(ArtifactStoreTest, self).setUp()
+    self.root = self.create_tempdir().full_path
+    self.work = self.create_tempdir().full_path
+
+  def _make_file(self, name, content):
+    path = os.path.join(self.work, name)
+    with open(path, 'wb') as f:
+      f.write(content)
+    return path
+
+  def _read(self, path):
+    with open(path, 'rb') as f:
+      return f.read()
+
+  @parameterized.named_parameters(('hardlink', True), ('copy', False))
+  def test_add_and_copy_out(self, hardlink):
+    store = artifact_store.ArtifactStore(self.root, 1024, hardlink=hardlink)
+    src = self._make_file('installer.msi', b'installer')
+    sha256 = store.Add(src, _URL, '"v1"')
+    self.assertEqual(sha256, hashlib.sha256(b'installer').hexdigest())
+    self.assertTrue(store.Contains(sha256.upper()))
+    self.assertEqual(store.Lookup(_URL, '"v1"'), sha256)
+    self.assertIsNone(store.Lookup(_URL, '"v2"'))
+    self.assertIsNone(store.Lookup(_URL, None))
+
+    dst = os.path.join(self.work, 'copy.msi')
+    self.assertTrue(store.CopyOut(sha256, dst))
+    self.assertEqual(self._read(dst), b'installer')
+    self.assertFalse(store.CopyOut('0' * 64, dst))
+
+  def test_copy_out_replaces_destination(self):
+    store = artifact_store.ArtifactStore(self.root, 1024)
+    sha256 = store.Add(self._make_file('a', b'new'))
+    dst = self._make_file('b', b'old contents')
+    self.assertTrue(store.CopyOut(sha256, dst))
+    self.assertEqual(self._read(dst), b'new')
+
+  def test_copy_out_isolated(self):
+    store = artifact_store.ArtifactStore(self.root, 1024)
+    src = self._make_file('a', b'content')
+    sha256 = store.Add(src)
+    dst = os.path.join(self.work, 'dst')
+    self.assertTrue(store.CopyOut(sha256, dst))
+    for path in (src, dst):
+      with open(path, 'r+b') as f:
+        f.write(b'CONTENT')
+    self.assertEqual(self._read(store._ObjectPath(sha256)), b'content')
+    self.assertTrue(store.CopyOut(sha256, dst))
+    self.assertEqual(self._read(dst), b'content')
+
+  def test_hardlink_modified(self):
+    store = artifact_store.ArtifactStore(self.root, 1024, hardlink=True)
+    sha256 = store.Add(self._make_file('a', b'content'), _URL, '"v1"')
+    dst = os.path.join(self.work, 'dst')
+    self.assertTrue(store.CopyOut(sha256, dst))
+    # An in place write to a destination reaches the linked object.
+    with open(dst, 'r+b') as f:
+      f.write(b'CONTENT')
+    self.assertFalse(store.CopyOut(sha256, os.path.join(self.work, 'other')))
+    self.assertFalse(store.Contains(sha256))
+    self.assertIsNone(store.Lookup(_URL, '"v1"'))
+
+  def test_hardlink_fallback(self):
+    store = artifact_store.ArtifactStore(self.root, 1024, hardlink=True)
+    with mock.patch.object(
+        artifact_store.os, 'link', autospec=True) as mock_link:
+      mock_link.side_effect = OSError('cross-device link')
+      sha256 = store.Add(self._make_file('a', b'content'))
+      dst = os.path.join(self.work, 'dst')
+      self.assertTrue(store.CopyOut(sha256, dst))
+    self.assertEqual(self._read(dst), b'content')
+
+  def test_persistence(self):
+    store = artifact_store.ArtifactStore(self.root, 1024)
+    sha256 = store.Add(self._make_file('a', b'content'), _URL, '"v1"')
+    reloaded = artifact_store.ArtifactStore(self.root, 1024)
+    self.assertEqual(reloaded.Lookup(_URL, '"v1"'), sha256)
+    self.assertEqual(reloaded.Size(), len(b'content'))
+
+  def test_missing_object(self):
+    store = artifact_store.ArtifactStore(self.root, 1024)
+    sha256 = store.Add(self._make_file('a', b'content'), _URL, '"v1"')
+    os.remove(store._ObjectPath(sha256))
+    self.assertFalse(store.CopyOut(sha256, os.path.join(self.work, 'dst')))
+    self.assertFalse(store.Contains(sha256))
+    self.assertIsNone(store.Lookup(_URL, '"v1"'))
+
+  def test_corrupt_object(self):
+    store = artifact_store.ArtifactStore(self.root, 1024)
+    sha256 = store.Add(self._make_file('a', b'content'))
+    with open(store._ObjectPath(sha256), 'ab') as f:
+      f.write(b'garbage')
+    self.assertFalse(store.CopyOut(sha256, os.path.join(self.work, 'dst')))
+    self.assertFalse(store.Contains(sha256))
+
+  def test_corrupt_index(self):
+    with open(os.path.join(self.root, artifact_store.INDEX_FILE), 'w') as f:
+      f.write('{not json')
+    store = artifact_store.ArtifactStore(self.root, 1024)
+    self.assertEqual(store.Size(), 0)
+
+  @mock.patch.object(artifact_store.time, 'time', autospec=True)
+  def test_lru_eviction(self, mock_time):
+    store = artifact_store.ArtifactStore(self.root, 20)
+    mock_time.return_value = 1
+    first = store.Add(self._make_file('a', b'a' * 8), _URL, '"v1"')
+    mock_time.return_value = 2
+    second = store.Add(self._make_file('b', b'b' * 8))
+    mock_time.return_value = 3
+    self.assertTrue(store.CopyOut(first, os.path.join(self.work, 'dst')))
+    mock_time.return_value = 4
+    third = store.Add(self._make_file('c', b'c' * 8))
+    self.assertTrue(store.Contains(first))
+    self.assertFalse(store.Contains(second))
+    self.assertTrue(store.Contains(third))
+    self.assertEqual(store.Size(), 16)
+    self.assertFalse(os.path.exists(store._ObjectPath(second)))
+
+  def test_add_oversized(self):
+    store = artifact_store.ArtifactStore(self.root, 4)
+    sha256 = store.Add(self._make_file('a', b'too large'))
+    self.assertFalse(store.Contains(sha256))
+
+  def test_add_missing_file(self):
+    store = artifact_store.ArtifactStore(self.root, 1024)
+    self.assertIsNone(store.Add(os.path.join(self.work, 'missing')))
+
+  def test_for_build(self):
+    build_info = mock.Mock()
+    build_info.CachePath.return_value = self.root
+    with flagsaver.flagsaver(artifact_cache_size=0):
+      self.assertIsNone(artifact_store.ForBuild(build_info))
+    with flagsaver.flagsaver(artifact_cache_size=10):
+      store = artifact_store.ForBuild(build_info)
+      self.assertIsInstance(store, artifact_store.ArtifactStore)
+      self.assertIs(artifact_store.ForBuild(build_info), store)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -11,12 +11,33 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Glazier host information discovery subsystem."""
-
+"""Glazier host information discovery subsystem.
+
+Host facts are collected the first time they are needed, and cached on the
+BuildInfo instance until invalidated (see Invalidate and Refresh). Facts which
+can change during a build, such as whether the host is on battery or what
+software is installed, are not cached, and are queried on every request. With
+--buildinfo_prefetch_workers, Prefetch collects the hardware facts concurrently
+in the background instead, so that the slow WMI queries behind them overlap
+with each other and with downloading the config.
+
+With --buildinfo_snapshot, the hardware facts which cannot change while a host
+is being built are also kept in the build cache, keyed by BIOS serial and boot
+stage (WinPE or the host OS), and reused after a reboot rather than queried
+again. Facts which can change, such as whether the host is on battery, what
+software is installed, or the BIOS version (which firmware updates change), are
+always collected afresh.
+"""
+
+import collections
+import concurrent.futures
 import functools
+import json
 import logging
+import os
+import threading
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
 # do not remove: internal placeholder 1
 
@@ -26,9 +47,9 @@ from glazier.lib import os_selector
 from glazier.lib import registry
 from glazier.lib import timers
 from glazier.lib import winpe
+from glazier.lib import yaml_codec
 from glazier.lib.config import files
 from glazier.lib.spec import spec
-import yaml
 
 from glazier.lib import beyondcorp
 from glazier.lib import constants
@@ -41,12 +62,54 @@ flags.DEFINE_enum(
     'glazier_spec', 'flag', list(spec.SPEC_OPTS.keys()),
     ('Which host specification module to use for determining host features '
      'like Hostname and OS.'))
+_BUILDINFO_PREFETCH_WORKERS = flags.DEFINE_integer(
+    'buildinfo_prefetch_workers', 0,
+    'Number of host facts to collect concurrently at startup, ahead of their '
+    'first use. 0 disables prefetching.')
+
+_BUILDINFO_SNAPSHOT = flags.DEFINE_bool(
+    'buildinfo_snapshot', False,
+    'Keep hardware facts in the build cache, and reuse them after a reboot '
+    'instead of querying WMI again.')
+
+SNAPSHOT_FILE = 'host_facts.json'
+SNAPSHOT_VERSION = 1
+# Hardware facts which do not change while a host is being built.
+SNAPSHOT_FACTS = frozenset([
+    'ComputerManufacturer',
+    'ComputerModel',
+    'DeviceIds',
+    'IsLaptop',
+    'IsVirtual',
+    'TpmPresent',
+])
+
+# Hardware facts which are independent of one another, and of the config.
+PREFETCH_FACTS = (
+    'BIOSVersion',
+    'ComputerManufacturer',
+    'ComputerModel',
+    'ComputerSerial',
+    'DeviceIds',
+    'IsLaptop',
+    'IsVirtual',
+    'TpmPresent',
+    'VideoControllers',
+)
 
 
 class Error(errors.GlazierError):
   pass
 
 
+class UnknownFactError(Error):
+
+  def __init__(self, fact: str):
+    super().__init__(
+        error_code=errors.ErrorCode.UNKNOWN_FACT,
+        message=f'Referencing unknown host fact: {fact}')
+
+
 class IllegalPinError(Error):
 
   def __init__(self, pin_name: str):
@@ -95,16 +158,183 @@ class UnsupportedReleaseVersionError(Error):
         message=f'Unable to find a release that supports {os}.')
 
 
+# The pins available to configs, and the BuildInfo methods they check.
+_EXPORTED_PINS = {
+    'computer_model': 'ComputerModel',
+    'computer_name': 'ComputerName',
+    'device_id': 'DeviceIds',
+    'encryption_type': 'EncryptionLevel',
+    'graphics': 'VideoControllersByName',
+    'is_laptop': 'IsLaptop',
+    'os_code': 'OsCode',
+    'beyond_corp': 'BeyondCorp',
+    'lab': 'Lab',
+    'is_installed': 'InstalledSoftware',
+    'image_type': 'ImageType',
+    'winpe': 'WinPE',
+}
+# Pins which match the start of the host value, rather than all of it.
+_LOOSE_PINS = frozenset(['computer_model', 'computer_name', 'device_id'])
+# Pins whose host value can change during the build, so are never memoized.
+_VOLATILE_PINS = frozenset(['is_installed'])
+
+
+class _PinMatcher(object):
+  """A set of pin values, compiled for matching against host values.
+
+  Implements the rules described in BuildInfo._StringPinner. Exact values are
+  kept in a set. Loose values are also kept in a set, along with their
+  lengths, so each host value is only looked up once per distinct length
+  rather than compared against every pin value.
+  """
+
+  def __init__(self, match_list: Iterable[Any], loose: bool = False):
+    self._loose = loose
+    self._valid = bool(match_list)
+    inverse = [str(pin).lower()[1:] for pin in match_list
+               if pin and str(pin).startswith('!')]
+    self._inverse = bool(inverse)
+    if inverse:
+      self._values = frozenset(inverse)
+    else:
+      self._values = frozenset(str(pin).lower() for pin in match_list)
+    self._lengths = sorted(set(len(pin) for pin in self._values))
+
+  def _Matches(self, item: str) -> bool:
+    if not self._loose:
+      return item in self._values
+    return any(item[:length] in self._values
+               for length in self._lengths
+               if length <= len(item))
+
+  def Match(self, check_list: List[Any]) -> bool:
+    """Checks host values against the pin values.
+
+    Args:
+      check_list: List of known strings.
+
+    Returns:
+      True for a match between check_list and the pin values, else False.
+    """
+    if not check_list or not self._valid:
+      logging.debug('Invalid string comparison sets. [%s, %s]', check_list,
+                    sorted(self._values))
+      return False
+    for item in check_list:
+      if self._Matches(str(item).lower()):
+        if self._inverse:
+          logging.debug('Excluded by inverse pin. [%s]', item)
+          return False
+        logging.debug('Included by direct pin. [%s]', item)
+        return True
+    if self._inverse:
+      logging.debug('Included by inverse pinning.')
+    return self._inverse
+
+
+# The names of all cached host facts.
+_FACTS = set()
+
+
+def _Fact(fn):
+  """Caches a host fact on the BuildInfo instance it was collected by.
+
+  Unlike functools.lru_cache, which would keep every BuildInfo alive in a cache
+  shared by all instances, the cache belongs to the instance, and single facts
+  can be invalidated. Facts a fact was derived from are tracked, so that
+  invalidating one also invalidates those derived from it.
+
+  Args:
+    fn: The BuildInfo method which collects the fact.
+
+  Returns:
+    The wrapped method.
+  """
+  name = fn.__name__
+
+  @functools.wraps(fn)
+  def Wrapper(self):
+    stack = self._FactStack()
+    with self._facts_lock:
+      if stack:
+        self._fact_dependents[name].add(stack[-1])
+      if name in self._facts:
+        self._fact_hits[name] += 1
+        return self._facts[name]
+      self._fact_misses[name] += 1
+    stack.append(name)
+    try:
+      value = fn(self)
+    finally:
+      stack.pop()
+    with self._facts_lock:
+      return self._facts.setdefault(name, value)
+
+  _FACTS.add(name)
+  return Wrapper
+
+
+def _HostFact(fn):
+  """Looks a fact up in the snapshot, or waits for its prefetch, if any.
+
+  Goes beneath _Fact, so only runs when the fact is not cached.
+  Facts in SNAPSHOT_FACTS are taken from the snapshot when it has them, and
+  added to it when it does not. A fact whose prefetch is running is not
+  collected again, but taken from the prefetch.
+
+  Args:
+    fn: The BuildInfo method which collects the fact.
+
+  Returns:
+    The wrapped method.
+  """
+  name = fn.__name__
+
+  @functools.wraps(fn)
+  def Wrapper(self, *args, **kwargs):
+    snapshot = name in SNAPSHOT_FACTS and _BUILDINFO_SNAPSHOT.value
+    if snapshot:
+      facts = self._SnapshotFacts()
+      if name in facts:
+        return facts[name]
+    future = self._prefetch_futures.get(name)
+    if future and not getattr(self._local, 'worker', False):
+      try:
+        return future.result()
+      except Exception:  # pylint: disable=broad-except
+        pass  # Collect it again, so any error is raised here.
+    result = fn(self, *args, **kwargs)
+    if snapshot:
+      self._SnapshotStore(name, result)
+    return result
+
+  return Wrapper
+
+
 class BuildInfo(object):
   """Encapsulates information pertaining to the build."""
 
   def __init__(self):
-    self._active_conf_path = []
+    # Every config path in use, keyed by itself, so equal paths share a tuple.
+    self._config_paths = {}  # type: Dict[Tuple[str, ...], Tuple[str, ...]]
+    self._active_conf_path = self.InternConfigPath(())
     self._binary_server = ''
     self._chooser_pending = []
     self._chooser_responses = {}
     self._glazier_server = ''
     self._hw_info = None
+    self._pin_matchers = {}
+    self._pin_results = {}
+    self._prefetch_futures = {}
+    self._local = threading.local()  # Per-thread state.
+    self._snapshot = None
+    self._snapshot_key = None
+    self._snapshot_lock = threading.RLock()
+    self._facts = {}
+    self._facts_lock = threading.Lock()
+    self._fact_dependents = collections.defaultdict(set)
+    self._fact_hits = collections.Counter()
+    self._fact_misses = collections.Counter()
     self._net_info = None
     self._release_info = None
     self._tpm_info = None
@@ -181,7 +411,7 @@ class BuildInfo(object):
       self._glazier_server = constants.CONFIG_SERVER.value
     return self._glazier_server.rstrip('/')
 
-  @functools.lru_cache()
+  @_Fact
   def ImageID(self) -> str:
     """Optionally generate a unique image identifier.
 
@@ -190,7 +420,7 @@ class BuildInfo(object):
     """
     return identifier.check_id()
 
-  @functools.lru_cache()
+  @_Fact
   def Release(self) -> Optional[str]:
     """Determine the current build release.
 
@@ -228,10 +458,11 @@ class BuildInfo(object):
     path += '/'
     return path
 
-  def ActiveConfigPath(self,
-                       append: Optional[str] = None,
-                       pop: bool = False,
-                       set_to: Optional[List[str]] = None) -> List[str]:
+  def ActiveConfigPath(
+      self,
+      append: Optional[str] = None,
+      pop: bool = False,
+      set_to: Optional[Union[str, Iterable[str]]] = None) -> List[str]:
     """Tracks the active configuration path beneath the config root.
 
     Use append/pop for directory traversal.
@@ -239,19 +470,49 @@ class BuildInfo(object):
     Args:
       append: Append a string to the active config path.
       pop: Pop the rightmost string from the active config path.
-      set_to: Set the config path to an entirely new path.
+      set_to: Set the config path to an entirely new path. A single string is
+        a path of one directory.
 
     Returns:
-      The active config path after any modifications.
+      A copy of the active config path after any modifications.
     """
     if append:
-      self._active_conf_path.append(append)
+      self._active_conf_path = self.InternConfigPath(self._active_conf_path +
+                                                     (append,))
     elif set_to is not None:
-      self._active_conf_path = set_to
+      if isinstance(set_to, str):
+        set_to = [set_to]
+      self._active_conf_path = self.InternConfigPath(set_to)
     elif pop and self._active_conf_path:
-      self._active_conf_path.pop()
+      self._active_conf_path = self.InternConfigPath(
+          self._active_conf_path[:-1])
+    return list(self._active_conf_path)
+
+  def InternedConfigPath(self) -> Tuple[str, ...]:
+    """Returns the active config path as an immutable, shared tuple.
+
+    Every caller at the same position in the config tree gets the same object,
+    so it can be stored with each task without copying.
+
+    Returns:
+      The active config path.
+    """
     return self._active_conf_path
 
+  def InternConfigPath(self, path: Iterable[str]) -> Tuple[str, ...]:
+    """Returns the shared, immutable instance of a config path.
+
+    Paths are shared for the life of this instance, which is that of a build.
+
+    Args:
+      path: The directories of the config path.
+
+    Returns:
+      A tuple equal to path, which is the same object for every equal path.
+    """
+    path = tuple(path)
+    return self._config_paths.setdefault(path, path)
+
   def _VersionInfo(self):
     """Obtain version information from either cache or the version-info file.
 
@@ -288,6 +549,10 @@ class BuildInfo(object):
     os_code).  Pins also support negation match by beginning the pin value
     with ! (!win7 matches anything except win7).  See _StringPinner for details.
 
+    Each distinct set of pin values is compiled into a matcher once, and the
+    result of each distinct pin check is remembered, as the host values it
+    depends on do not change (installed software aside).
+
     Special cases:
       computer_model: Permits partial string matching.
       computer_name: Permits partial string matching.
@@ -307,40 +572,216 @@ class BuildInfo(object):
     Raises:
       Error: Reference made to an unsupported pin.
     """
-    known_pins = self.GetExportedPins()
     if pin_name.startswith('USER_'):
       if pin_name in self._chooser_responses:
         return self._StringPinner([self._chooser_responses[pin_name]],
                                   pin_values)
       else:
         return False
-    elif pin_name not in known_pins:
+    elif pin_name not in _EXPORTED_PINS:
       raise IllegalPinError(pin_name)
 
-    loose = False
-    if pin_name in ['computer_model', 'computer_name', 'device_id']:
-      loose = True
-    values = known_pins[pin_name]()
+    key = (pin_name, tuple(str(pin) for pin in pin_values or ()))
+    if key in self._pin_results:
+      return self._pin_results[key]
+    values = getattr(self, _EXPORTED_PINS[pin_name])()
     values = values if isinstance(values, list) else [values]
-    return self._StringPinner(values, pin_values, loose=loose)
+    match = self._StringPinner(
+        values, pin_values, loose=pin_name in _LOOSE_PINS)
+    if pin_name not in _VOLATILE_PINS:
+      self._pin_results[key] = match
+    return match
+
+  def Prefetch(self, facts: Iterable[str] = PREFETCH_FACTS):
+    """Starts collecting host facts concurrently in the background.
+
+    Does nothing unless --buildinfo_prefetch_workers is set. Each fact is
+    collected by calling its method on a worker thread, which stores it in the
+    method's cache as usual. A fact requested before its prefetch completes
+    waits for it; a fact which fails to prefetch is collected again when it is
+    requested, so errors surface where they would have without prefetching.
+
+    Args:
+      facts: The names of the BuildInfo methods to call.
+    """
+    workers = _BUILDINFO_PREFETCH_WORKERS.value
+    if workers <= 0 or self._prefetch_futures:
+      return
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=workers,
+        thread_name_prefix='buildinfo',
+        initializer=self._PrefetchWorker)
+    for fact in facts:
+      self._prefetch_futures[fact] = executor.submit(self._PrefetchFact, fact)
+    executor.shutdown(wait=False)
+
+  def _PrefetchWorker(self):
+    """Prepares a prefetch thread."""
+    self._local.worker = True
+    try:
+      import pythoncom  # pylint: disable=g-import-not-at-top
+    except ImportError:
+      return
+    pythoncom.CoInitialize()
+
+  def _PrefetchFact(self, fact: str) -> Any:
+    start = time.time()
+    try:
+      return getattr(self, fact)()
+    except Exception as e:  # pylint: disable=broad-except
+      logging.debug('Unable to prefetch %s: %s', fact, e)
+      raise
+    finally:
+      logging.debug('Prefetched %s in %.3fs.', fact, time.time() - start)
+
+  def _FactStack(self) -> List[str]:
+    """The facts being collected on the current thread, innermost last."""
+    if not hasattr(self._local, 'facts'):
+      self._local.facts = []
+    return self._local.facts
+
+  def Invalidate(self, *facts: str):
+    """Discards cached host facts, so they are collected again when requested.
+
+    Facts derived from those named (such as EncryptionLevel, from IsVirtual and
+    TpmPresent) are discarded with them, as are remembered pin results and the
+    facts' entries in the snapshot.
+
+    Args:
+      *facts: The names of the BuildInfo methods which collect the facts.
+
+    Raises:
+      UnknownFactError: A name is not that of a cached fact.
+    """
+    for fact in facts:
+      if fact not in _FACTS:
+        raise UnknownFactError(fact)
+    discarded = set()
+    with self._facts_lock:
+      pending = list(facts)
+      while pending:
+        fact = pending.pop()
+        if fact not in discarded:
+          discarded.add(fact)
+          self._facts.pop(fact, None)
+          pending.extend(self._fact_dependents.pop(fact, ()))
+      self._pin_results.clear()
+    for fact in discarded:
+      self._prefetch_futures.pop(fact, None)
+    with self._snapshot_lock:
+      for fact in discarded:
+        if self._snapshot:
+          self._snapshot.pop(fact, None)
+    logging.debug('Invalidated host facts: %s', ', '.join(sorted(discarded)))
+
+  def Refresh(self):
+    """Discards all cached host facts, so each is collected from the host again.
+
+    For use after a change to the hardware, such as a firmware setting which
+    enables the TPM. The snapshot is discarded too, in memory and on disk, and
+    facts collected from now on start a new one.
+    """
+    with self._facts_lock:
+      self._facts.clear()
+      self._fact_dependents.clear()
+      self._pin_results.clear()
+    self._prefetch_futures = {}
+    with self._snapshot_lock:
+      self._snapshot = {}
+      if not self._snapshot_key:
+        return
+      try:
+        os.remove(self._SnapshotPath())
+      except FileNotFoundError:
+        pass
+      except OSError as e:
+        logging.warning('Unable to remove host fact snapshot: %s', e)
+
+  def FactStats(self) -> Dict[str, Dict[str, int]]:
+    """Reports how often each host fact was found in the cache.
+
+    Returns:
+      A dict of fact names, to a dict with the number of 'hits' and 'misses'.
+    """
+    with self._facts_lock:
+      return {
+          fact: {
+              'hits': self._fact_hits[fact],
+              'misses': self._fact_misses[fact]
+          } for fact in set(self._fact_hits) | set(self._fact_misses)
+      }
+
+  def _SnapshotPath(self) -> str:
+    return os.path.join(self.CachePath(), SNAPSHOT_FILE)
+
+  def _SnapshotFacts(self) -> Dict[str, Any]:
+    """Loads the snapshot of hardware facts from a previous boot, once.
+
+    Returns:
+      The facts in the snapshot, or an empty dict if there is no snapshot for
+      this host and boot stage.
+    """
+    with self._snapshot_lock:
+      if self._snapshot is not None:
+        return self._snapshot
+      self._snapshot = {}
+      try:
+        self._snapshot_key = {
+            'version': SNAPSHOT_VERSION,
+            'serial': str(self.ComputerSerial()),
+            'stage': 'winpe' if self.WinPE() else 'host',
+        }
+      except Exception as e:  # pylint: disable=broad-except
+        logging.debug('Not using a host fact snapshot: %s', e)
+        return self._snapshot
+      path = self._SnapshotPath()
+      try:
+        with open(path) as f:
+          snapshot = json.load(f)
+      except FileNotFoundError:
+        return self._snapshot
+      except (OSError, ValueError) as e:
+        logging.warning('Ignoring unreadable host fact snapshot %s: %s', path,
+                        e)
+        return self._snapshot
+      if not isinstance(snapshot, dict) or snapshot.get(
+          'key') != self._snapshot_key:
+        logging.info('Ignoring host fact snapshot %s from another host or boot '
+                     'stage.', path)
+        return self._snapshot
+      facts = snapshot.get('facts')
+      if isinstance(facts, dict):
+        self._snapshot = {k: v for k, v in facts.items() if k in SNAPSHOT_FACTS}
+        logging.info('Using %d host fact(s) from snapshot %s.',
+                     len(self._snapshot), path)
+      return self._snapshot
+
+  def _SnapshotStore(self, fact: str, value: Any):
+    """Adds a fact to the snapshot, and writes it to the build cache.
+
+    Args:
+      fact: The name of the fact.
+      value: The value of the fact.
+    """
+    with self._snapshot_lock:
+      if self._SnapshotFacts().get(fact) == value or not self._snapshot_key:
+        return
+      self._snapshot[fact] = value
+      path = self._SnapshotPath()
+      try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+          json.dump({'key': self._snapshot_key, 'facts': self._snapshot}, f)
+        os.replace(path + '.tmp', path)
+      except (OSError, TypeError, ValueError) as e:
+        logging.warning('Unable to write host fact snapshot %s: %s', path, e)
 
   def GetExportedPins(self) -> Dict[str, Any]:
     return {
-        'computer_model': self.ComputerModel,
-        'computer_name': self.ComputerName,
-        'device_id': self.DeviceIds,
-        'encryption_type': self.EncryptionLevel,
-        'graphics': self.VideoControllersByName,
-        'is_laptop': self.IsLaptop,
-        'os_code': self.OsCode,
-        'beyond_corp': self.BeyondCorp,
-        'lab': self.Lab,
-        'is_installed': self.InstalledSoftware,
-        'image_type': self.ImageType,
-        'winpe': self.WinPE(),
+        name: getattr(self, method) for name, method in _EXPORTED_PINS.items()
     }
 
-  @functools.lru_cache()
+  @_Fact
   def BeyondCorp(self) -> bool:
     """Cache whether the image is running Beyond Corp.
 
@@ -350,7 +791,8 @@ class BuildInfo(object):
     self._beyondcorp = beyondcorp.BeyondCorp()
     return self._beyondcorp.CheckBeyondCorp()
 
-  @functools.lru_cache()
+  @_Fact
+  @_HostFact
   def BIOSVersion(self) -> str:
     """Get the BIOS version from WMI.
 
@@ -359,7 +801,7 @@ class BuildInfo(object):
     """
     return self._HWInfo().BIOSVersion()
 
-  @functools.lru_cache()
+  @_Fact
   def CachePath(self):
     """Get the path to the local build cache.
 
@@ -370,7 +812,8 @@ class BuildInfo(object):
       return constants.WINPE_CACHE
     return constants.SYS_CACHE
 
-  @functools.lru_cache()
+  @_Fact
+  @_HostFact
   def ComputerManufacturer(self) -> str:
     """Get the computer manufacturer from WMI.
 
@@ -385,7 +828,8 @@ class BuildInfo(object):
       raise WMIError('System manufacturer could not be determined.')
     return result
 
-  @functools.lru_cache()
+  @_Fact
+  @_HostFact
   def ComputerModel(self) -> str:
     """Get the computer model from WMI.
 
@@ -402,7 +846,7 @@ class BuildInfo(object):
       raise WMIError('System model could not be determined.')
     return result
 
-  @functools.lru_cache()
+  @_Fact
   def ComputerName(self) -> str:
     """Get the assigned computer name string.
 
@@ -411,7 +855,7 @@ class BuildInfo(object):
     """
     return spec.GetModule().GetHostname()
 
-  @functools.lru_cache()
+  @_Fact
   def ComputerOs(self) -> str:
     """Get the assigned computer OS string.
 
@@ -425,7 +869,8 @@ class BuildInfo(object):
       os_code = self._osselector.AutoOrManual(self.ComputerModel())
     return os_code
 
-  @functools.lru_cache()
+  @_Fact
+  @_HostFact
   def ComputerSerial(self) -> str:
     """Get the computer serial from WMI.
 
@@ -434,7 +879,8 @@ class BuildInfo(object):
     """
     return self._HWInfo().BiosSerial()
 
-  @functools.lru_cache()
+  @_Fact
+  @_HostFact
   def DeviceIds(self) -> List[str]:
     """Get local hardware device Ids.
 
@@ -450,7 +896,7 @@ class BuildInfo(object):
       dev_ids.append(dev_str)
     return dev_ids
 
-  @functools.lru_cache()
+  @_Fact
   def EncryptionLevel(self) -> str:
     """Determines what encryption level is required for this machine.
 
@@ -493,7 +939,7 @@ class BuildInfo(object):
 
     return installed_software
 
-  @functools.lru_cache()
+  @_Fact
   def Fqdn(self) -> str:
     """Get the assigned FQDN string.
 
@@ -503,11 +949,16 @@ class BuildInfo(object):
     return spec.GetModule().GetFqdn()
 
   def _HWInfo(self):
+    if getattr(self._local, 'worker', False):
+      # WMI objects cannot be shared between threads.
+      if not getattr(self._local, 'hw_info', None):
+        self._local.hw_info = hw_info.HWInfo()
+      return self._local.hw_info
     if not self._hw_info:
       self._hw_info = hw_info.HWInfo()
     return self._hw_info
 
-  @functools.lru_cache()
+  @_Fact
   def ImageType(self) -> str:
     """ImageType returns a string based on the image_type spec setting."""
     t = spec.GetModule().GetImageType()
@@ -515,7 +966,8 @@ class BuildInfo(object):
         'ffu': 'ffu',
     }.get(t.lower(), 'unknown')
 
-  @functools.lru_cache()
+  @_Fact
+  @_HostFact
   def IsLaptop(self) -> bool:
     """Whether or not this machine is a laptop.
 
@@ -524,16 +976,18 @@ class BuildInfo(object):
     """
     return self._HWInfo().IsLaptop()
 
-  @functools.lru_cache()
   def IsOnBattery(self) -> bool:
     """Whether or not this machine is on battery right now.
 
+    Not cached, as the host can be plugged in or unplugged at any time.
+
     Returns:
       true if on battery, else false
     """
     return self._HWInfo().IsOnBattery()
 
-  @functools.lru_cache()
+  @_Fact
+  @_HostFact
   def IsVirtual(self) -> bool:
     """Whether or not this build is in a virtual environment.
 
@@ -542,7 +996,7 @@ class BuildInfo(object):
     """
     return self._HWInfo().IsVirtualMachine()
 
-  @functools.lru_cache()
+  @_Fact
   def KnownBranches(self) -> Dict[str, str]:
     return self._VersionInfo()['versions']
 
@@ -563,7 +1017,7 @@ class BuildInfo(object):
     ni = net_info.NetInfo(active_only=active_only, poll=True)
     return ni.Interfaces()
 
-  @functools.lru_cache()
+  @_Fact
   def Lab(self) -> bool:
     """Get state of lab pin.
 
@@ -574,7 +1028,7 @@ class BuildInfo(object):
       return True
     return False
 
-  @functools.lru_cache()
+  @_Fact
   def OsCode(self) -> str:
     """Return the OS code associated with this build.
 
@@ -592,7 +1046,7 @@ class BuildInfo(object):
         return os_codes[os]['code']
     raise UnknownOsCodeError(os)
 
-  @functools.lru_cache()
+  @_Fact
   def WinPE(self) -> bool:
     """Return True if the host is running inside of WinPE.
 
@@ -652,7 +1106,7 @@ class BuildInfo(object):
       build_data['BUILD'][k] = str(v)
 
     with open(to_file, 'w') as handle:
-      yaml.dump(build_data, handle)
+      yaml_codec.Dump(build_data, handle)
 
   def _StringPinner(self, check_list, match_list, loose=False):
     """Checks a list of strings for acceptable matches.
@@ -694,38 +1148,14 @@ class BuildInfo(object):
     Returns:
       True for a match between check_list and match_list, else False.
     """
-    if not check_list or not match_list:
-      logging.debug('Invalid string comparison sets. [%s, %s]', check_list,
-                    match_list)
-      return False
-    inverse_in_set = False
-    for pin in match_list:
-      if not pin:
-        continue
-      pin = str(pin).lower()
-      if pin[0] == '!':
-        for item in check_list:
-          real_pin = pin[1:]
-          if ((loose and str(item).lower().startswith(real_pin)) or
-              (not loose and real_pin == str(item).lower())):
-            logging.debug('Excluded by inverse pin. [%s]', item)
-            return False
-        inverse_in_set = True
-
-    if inverse_in_set:
-      logging.debug('Included by inverse pinning.')
-      return True
-
-    for pin in match_list:
-      pin = str(pin).lower()
-      for item in check_list:
-        if ((loose and str(item).lower().startswith(pin)) or
-            (not loose and pin == str(item).lower())):
-          logging.debug('Included by direct pin. [%s]', item)
-          return True
-    return False
-
-  @functools.lru_cache()
+    key = (tuple(str(pin) for pin in match_list or ()), loose)
+    matcher = self._pin_matchers.get(key)
+    if matcher is None:
+      matcher = _PinMatcher(match_list or [], loose=loose)
+      self._pin_matchers[key] = matcher
+    return matcher.Match(check_list)
+
+  @_Fact
   def SupportedModels(self) -> Dict[str, List[str]]:
     """Returns the list of known supported models (tier1 and tier2).
 
@@ -742,7 +1172,7 @@ class BuildInfo(object):
     ]
     return supported_models
 
-  @functools.lru_cache()
+  @_Fact
   def SupportTier(self) -> int:
     """Determines the support tier for the current device.
 
@@ -763,11 +1193,16 @@ class BuildInfo(object):
     return 0
 
   def _TpmInfo(self) -> tpm_info.TpmInfo:
+    if getattr(self._local, 'worker', False):
+      if not getattr(self._local, 'tpm_info', None):
+        self._local.tpm_info = tpm_info.TpmInfo()
+      return self._local.tpm_info
     if not self._tpm_info:
       self._tpm_info = tpm_info.TpmInfo()
     return self._tpm_info
 
-  @functools.lru_cache()
+  @_Fact
+  @_HostFact
   def TpmPresent(self) -> bool:
     """Get the TPM presence from WMI.
 
@@ -776,7 +1211,8 @@ class BuildInfo(object):
     """
     return self._TpmInfo().TpmPresent()
 
-  @functools.lru_cache()
+  @_Fact
+  @_HostFact
   def VideoControllers(self):
     """Get any local video (graphics) controllers.
 
@@ -785,7 +1221,7 @@ class BuildInfo(object):
     """
     return self._HWInfo().VideoControllers()
 
-  @functools.lru_cache()
+  @_Fact
   def VideoControllersByName(self) -> List[str]:
     """Get all names of detected video controllers.
 
@@ -797,7 +1233,7 @@ class BuildInfo(object):
       names.append(v['name'])
     return names
 
-  @functools.lru_cache()
+  @_Fact
   def WinpeVersion(self) -> int:
     """The production WinPE version according to the distribution source."""
     return self._VersionInfo()['winpe-version']
@@ -13,8 +13,11 @@
 # limitations under the License.
 """Tests for glazier.lib.buildinfo."""
 
+import collections
 import datetime
 import re
+import threading
+import time
 from unittest import mock
 
 from absl import flags
@@ -67,6 +70,50 @@ class _REGEXP(object):
     return '<REGEXP(%s)>' % self._regexp.pattern
 
 
+_LATENCY = 0.2
+
+
+class _SlowProvider(object):
+  """Fake WMI provider, which takes a while to answer each query."""
+
+  calls = collections.Counter()
+  lock = threading.Lock()
+  model = 'HP Z620 Workstation'
+
+  def _Query(self, name, result):
+    with self.lock:
+      self.calls[name] += 1
+    time.sleep(_LATENCY)
+    return result
+
+  def BIOSVersion(self):
+    return self._Query('BIOSVersion', '1.0')
+
+  def BiosSerial(self):
+    return self._Query('BiosSerial', 'ABC123')
+
+  def ComputerSystemManufacturer(self):
+    return self._Query('ComputerSystemManufacturer', 'HP')
+
+  def ComputerSystemModel(self):
+    return self._Query('ComputerSystemModel', self.model)
+
+  def IsLaptop(self):
+    return self._Query('IsLaptop', False)
+
+  def IsVirtualMachine(self):
+    return self._Query('IsVirtualMachine', False)
+
+  def PciDevices(self):
+    return self._Query('PciDevices', [])
+
+  def TpmPresent(self):
+    return self._Query('TpmPresent', True)
+
+  def VideoControllers(self):
+    return self._Query('VideoControllers', [{'name': 'Card'}])
+
+
 class BuildInfoTest(test_utils.GlazierTestCase):
 
   def setUp(self):
@@ -178,7 +225,7 @@ class BuildInfoTest(test_utils.GlazierTestCase):
     mock_check_winpe.return_value = False
     self.assertFalse(self.buildinfo.WinPE())
 
-    self.buildinfo.WinPE.cache_clear()
+    self.buildinfo.Invalidate('WinPE')
     mock_check_winpe.return_value = True
     self.assertTrue(self.buildinfo.WinPE())
 
@@ -279,6 +326,155 @@ class BuildInfoTest(test_utils.GlazierTestCase):
     with self.assert_raises_with_validation(buildinfo.Error):
       self.buildinfo.BuildPinMatch('no_existo', ['invalid pin value'])
 
+  @mock.patch.object(buildinfo.BuildInfo, 'DeviceIds', autospec=True)
+  def test_build_pin_match_memoized(self, mock_deviceids):
+    mock_deviceids.return_value = ['PCI\\VEN_%04X&DEV_0001' % i
+                                   for i in range(1000)]
+    pins = ['PCI\\VEN_%04X' % i for i in range(2000, 2500)]
+    self.assertFalse(self.buildinfo.BuildPinMatch('device_id', pins))
+    self.assertTrue(
+        self.buildinfo.BuildPinMatch('device_id', pins + ['pci\\ven_0010']))
+    self.assertFalse(self.buildinfo.BuildPinMatch('device_id', pins))
+    self.assertEqual(mock_deviceids.call_count, 2)
+    self.assertTrue(
+        self.buildinfo.BuildPinMatch('device_id', ['!' + p for p in pins]))
+    self.assertEqual(mock_deviceids.call_count, 3)
+
+  @mock.patch.object(buildinfo.registry, 'get_values', autospec=True)
+  def test_build_pin_match_volatile(self, mock_get_values):
+    mock_get_values.return_value = []
+    self.assertFalse(
+        self.buildinfo.BuildPinMatch('is_installed', ['Google Chrome']))
+    mock_get_values.return_value = ['Google Chrome']
+    self.assertTrue(
+        self.buildinfo.BuildPinMatch('is_installed', ['Google Chrome']))
+
+  @mock.patch.object(buildinfo.winpe, 'check_winpe', autospec=True)
+  def test_build_pin_match_winpe(self, mock_check_winpe):
+    mock_check_winpe.return_value = True
+    self.assertTrue(self.buildinfo.BuildPinMatch('winpe', [True]))
+    self.assertFalse(self.buildinfo.BuildPinMatch('winpe', ['!true']))
+
+  @flagsaver.flagsaver(buildinfo_prefetch_workers=len(buildinfo.PREFETCH_FACTS))
+  @mock.patch.object(buildinfo.tpm_info, 'TpmInfo', _SlowProvider)
+  @mock.patch.object(buildinfo.hw_info, 'HWInfo', _SlowProvider)
+  def test_prefetch(self):
+    _SlowProvider.calls.clear()
+    start = time.time()
+    self.buildinfo.Prefetch()
+    self.assertEqual(self.buildinfo.ComputerModel(), _SlowProvider.model)
+    self.assertEqual(self.buildinfo.EncryptionLevel(), 'tpm')
+    for fact in buildinfo.PREFETCH_FACTS:
+      getattr(self.buildinfo, fact)()
+    # The facts were collected at once, rather than one after another.
+    self.assertLess(time.time() - start,
+                    _LATENCY * len(buildinfo.PREFETCH_FACTS) / 2)
+    self.assertLen(_SlowProvider.calls, len(buildinfo.PREFETCH_FACTS))
+    self.assertEqual(set(_SlowProvider.calls.values()), {1})
+    # Later calls come from the cache.
+    self.buildinfo.Prefetch()
+    self.assertTrue(self.buildinfo.BuildPinMatch('computer_model', ['hp z6']))
+    self.assertEqual(_SlowProvider.calls['ComputerSystemModel'], 1)
+
+  @flagsaver.flagsaver(buildinfo_prefetch_workers=2)
+  @mock.patch.object(buildinfo.hw_info, 'HWInfo', _SlowProvider)
+  def test_prefetch_failure(self):
+    _SlowProvider.calls.clear()
+    with mock.patch.object(_SlowProvider, 'model', ''):
+      self.buildinfo.Prefetch(['ComputerModel'])
+      with self.assert_raises_with_validation(buildinfo.WMIError):
+        self.buildinfo.ComputerModel()
+    self.assertEqual(_SlowProvider.calls['ComputerSystemModel'], 2)
+
+  @mock.patch.object(buildinfo.hw_info, 'HWInfo', _SlowProvider)
+  def test_prefetch_disabled(self):
+    self.buildinfo.Prefetch()
+    self.assertEmpty(self.buildinfo._prefetch_futures)
+
+  @flagsaver.flagsaver(buildinfo_snapshot=True)
+  @mock.patch.object(buildinfo.winpe, 'check_winpe', autospec=True)
+  @mock.patch.object(buildinfo.BuildInfo, 'CachePath', autospec=True)
+  @mock.patch.object(buildinfo.hw_info, 'HWInfo', _SlowProvider)
+  def test_snapshot(self, mock_cachepath, mock_check_winpe):
+    mock_cachepath.return_value = self.create_tempdir().full_path
+    mock_check_winpe.return_value = False
+    _SlowProvider.calls.clear()
+    self.assertEqual(self.buildinfo.ComputerModel(), _SlowProvider.model)
+    self.assertEqual(self.buildinfo.BIOSVersion(), '1.0')
+    self.assertEqual(_SlowProvider.calls['ComputerSystemModel'], 1)
+
+    # After a reboot, only the volatile facts are collected again.
+    rebooted = buildinfo.BuildInfo()
+    self.assertEqual(rebooted.ComputerModel(), _SlowProvider.model)
+    self.assertEqual(rebooted.BIOSVersion(), '1.0')
+    self.assertEqual(_SlowProvider.calls['ComputerSystemModel'], 1)
+    self.assertEqual(_SlowProvider.calls['BIOSVersion'], 2)
+
+    # Another boot stage has its own snapshot.
+    mock_check_winpe.return_value = True
+    self.assertEqual(buildinfo.BuildInfo().ComputerModel(),
+                     _SlowProvider.model)
+    self.assertEqual(_SlowProvider.calls['ComputerSystemModel'], 2)
+
+    # As does another host.
+    mock_check_winpe.return_value = False
+    with mock.patch.object(_SlowProvider, 'BiosSerial', return_value='XYZ'):
+      buildinfo.BuildInfo().ComputerModel()
+    self.assertEqual(_SlowProvider.calls['ComputerSystemModel'], 3)
+
+    # Refreshing discards the snapshot on disk, even with nothing collected
+    # since.
+    rebooted.Refresh()
+    buildinfo.BuildInfo().ComputerModel()
+    self.assertEqual(_SlowProvider.calls['ComputerSystemModel'], 4)
+
+  @flagsaver.flagsaver(buildinfo_snapshot=True)
+  @mock.patch.object(buildinfo.winpe, 'check_winpe', autospec=True)
+  @mock.patch.object(buildinfo.BuildInfo, 'CachePath', autospec=True)
+  @mock.patch.object(buildinfo.hw_info, 'HWInfo', _SlowProvider)
+  def test_snapshot_unreadable(self, mock_cachepath, mock_check_winpe):
+    mock_cachepath.return_value = self.create_tempdir().full_path
+    mock_check_winpe.return_value = False
+    with open(self.buildinfo._SnapshotPath(), 'w') as f:
+      f.write('{not json')
+    _SlowProvider.calls.clear()
+    self.assertEqual(self.buildinfo.ComputerModel(), _SlowProvider.model)
+    self.assertEqual(_SlowProvider.calls['ComputerSystemModel'], 1)
+    buildinfo.BuildInfo().ComputerModel()
+    self.assertEqual(_SlowProvider.calls['ComputerSystemModel'], 1)
+
+  @mock.patch.object(buildinfo.tpm_info, 'TpmInfo', _SlowProvider)
+  @mock.patch.object(buildinfo.hw_info, 'HWInfo', _SlowProvider)
+  def test_invalidate(self):
+    _SlowProvider.calls.clear()
+    self.assertEqual(self.buildinfo.EncryptionLevel(), 'tpm')
+    self.assertTrue(self.buildinfo.BuildPinMatch('encryption_type', ['tpm']))
+    self.assertEqual(self.buildinfo.FactStats()['IsVirtual'], {
+        'hits': 0,
+        'misses': 1
+    })
+    self.buildinfo.EncryptionLevel()
+    self.assertEqual(self.buildinfo.FactStats()['EncryptionLevel'], {
+        'hits': 2,
+        'misses': 1
+    })
+
+    # Derived facts, and pin results, go with the facts they depend on.
+    with mock.patch.object(_SlowProvider, 'IsVirtualMachine',
+                           return_value=True):
+      self.buildinfo.Invalidate('IsVirtual')
+      self.assertEqual(self.buildinfo.EncryptionLevel(), 'none')
+      self.assertFalse(
+          self.buildinfo.BuildPinMatch('encryption_type', ['tpm']))
+    self.assertEqual(_SlowProvider.calls['TpmPresent'], 1)
+
+    self.buildinfo.Refresh()
+    self.assertEqual(self.buildinfo.EncryptionLevel(), 'tpm')
+    self.assertEqual(_SlowProvider.calls['TpmPresent'], 2)
+
+    with self.assert_raises_with_validation(buildinfo.UnknownFactError):
+      self.buildinfo.Invalidate('ReleasePath')
+
   def test_build_user_pin_match(self):
     self.buildinfo.StoreChooserResponses({'puppet': True, 'locale': 'de-de'})
     self.assertFalse(self.buildinfo.BuildPinMatch('USER_puppet', [False]))
@@ -332,7 +528,7 @@ class BuildInfoTest(test_utils.GlazierTestCase):
     mock_manufacturer.return_value = 'Google Inc.'
     result = self.buildinfo.ComputerManufacturer()
     self.assertEqual(result, 'Google Inc.')
-    self.buildinfo.ComputerManufacturer.cache_clear()
+    self.buildinfo.Invalidate('ComputerManufacturer')
     mock_manufacturer.return_value = None
     with self.assert_raises_with_validation(buildinfo.Error):
       self.buildinfo.ComputerManufacturer()
@@ -345,10 +541,10 @@ class BuildInfoTest(test_utils.GlazierTestCase):
     self.assertEqual(result, 'HP Z620 Workstation')
     mock_model.return_value = '2537CE2'
     self.assertEqual(result, 'HP Z620 Workstation')  # caching
-    self.buildinfo.ComputerModel.cache_clear()
+    self.buildinfo.Invalidate('ComputerModel')
     result = self.buildinfo.ComputerModel()
     self.assertEqual(result, '2537CE2')
-    self.buildinfo.ComputerModel.cache_clear()
+    self.buildinfo.Invalidate('ComputerModel')
     mock_model.return_value = None
     with self.assert_raises_with_validation(buildinfo.Error):
       self.buildinfo.ComputerModel()
@@ -435,7 +631,7 @@ class BuildInfoTest(test_utils.GlazierTestCase):
   def test_is_laptop(self, mock_islaptop):
     mock_islaptop.return_value = True
     self.assertTrue(self.buildinfo.IsLaptop())
-    self.buildinfo.IsLaptop.cache_clear()
+    self.buildinfo.Invalidate('IsLaptop')
     mock_islaptop.return_value = False
     self.assertFalse(self.buildinfo.IsLaptop())
 
@@ -443,16 +639,18 @@ class BuildInfoTest(test_utils.GlazierTestCase):
   def test_is_on_battery(self, mock_isonbattery):
     mock_isonbattery.return_value = True
     self.assertTrue(self.buildinfo.IsOnBattery())
-    self.buildinfo.IsOnBattery.cache_clear()
+    # Never cached: a change of power source shows up straight away.
     mock_isonbattery.return_value = False
     self.assertFalse(self.buildinfo.IsOnBattery())
+    with self.assert_raises_with_validation(buildinfo.UnknownFactError):
+      self.buildinfo.Invalidate('IsOnBattery')
 
   @mock.patch.object(
       buildinfo.hw_info.HWInfo, 'IsVirtualMachine', autospec=True)
   def test_is_virtual(self, mock_isvirtualmachine):
     mock_isvirtualmachine.return_value = False
     self.assertFalse(self.buildinfo.IsVirtual())
-    self.buildinfo.IsVirtual.cache_clear()
+    self.buildinfo.Invalidate('IsVirtual')
     mock_isvirtualmachine.return_value = True
     self.assertTrue(self.buildinfo.IsVirtual())
 
@@ -476,10 +674,10 @@ class BuildInfoTest(test_utils.GlazierTestCase):
     mock_computeros.return_value = 'windows-10-stable'
     self.assertEqual(self.buildinfo.OsCode(), 'win10')
     mock_computeros.return_value = 'win2012r2-x64-se'
-    self.buildinfo.OsCode.cache_clear()
+    self.buildinfo.Invalidate('OsCode')
     self.assertEqual(self.buildinfo.OsCode(), 'win2012r2-x64-se')
     mock_computeros.return_value = 'win2000-x64-se'
-    self.buildinfo.OsCode.cache_clear()
+    self.buildinfo.Invalidate('OsCode')
     with self.assert_raises_with_validation(buildinfo.Error):
       self.buildinfo.OsCode()
 
@@ -505,10 +703,10 @@ class BuildInfoTest(test_utils.GlazierTestCase):
     self.assertEqual(self.buildinfo.Release(), '1234')
     mock_read.assert_called_with(
         'https://glazier-server.example.com/unstable/release-id.yaml')
-    self.buildinfo.Release.cache_clear()
+    self.buildinfo.Invalidate('Release')
     mock_read.return_value = {'no_release_id': '1234'}
     self.assertIsNone(self.buildinfo.Release())
-    self.buildinfo.Release.cache_clear()
+    self.buildinfo.Invalidate('Release')
 
     # read error
     mock_read.side_effect = buildinfo.files.FileReadError('some_path')
@@ -538,17 +736,17 @@ class BuildInfoTest(test_utils.GlazierTestCase):
     mock_computeros.return_value = 'windows-7-stable'
     expected = 'https://glazier-server.example.com/stable/'
     self.assertEqual(self.buildinfo.ReleasePath(), expected)
-    self.buildinfo.ComputerOs.cache_clear()
+    self.buildinfo.Invalidate('ComputerOs')
     mock_computeros.return_value = 'windows-10-unstable'
     expected = 'https://glazier-server.example.com/unstable/'
     self.assertEqual(self.buildinfo.ReleasePath(), expected)
-    self.buildinfo.ComputerOs.cache_clear()
+    self.buildinfo.Invalidate('ComputerOs')
 
     # no os
     mock_computeros.return_value = None
     with self.assert_raises_with_validation(buildinfo.Error):
       self.buildinfo.ReleasePath()
-    self.buildinfo.ComputerOs.cache_clear()
+    self.buildinfo.Invalidate('ComputerOs')
 
     # invalid os
     mock_computeros.return_value = 'invalid-os-string'
@@ -572,6 +770,22 @@ class BuildInfoTest(test_utils.GlazierTestCase):
     self.buildinfo.ActiveConfigPath(set_to=['/foo', 'bar', 'baz'])
     self.assertEqual(self.buildinfo.ActiveConfigPath(), ['/foo', 'bar', 'baz'])
 
+  def test_active_config_path_interned(self):
+    self.buildinfo.ActiveConfigPath(append='/foo')
+    path = self.buildinfo.InternedConfigPath()
+    self.assertEqual(path, ('/foo',))
+    self.buildinfo.ActiveConfigPath().append('/bar')
+    self.assertEqual(self.buildinfo.ActiveConfigPath(), ['/foo'])
+    self.buildinfo.ActiveConfigPath(set_to='/bar/baz')
+    self.assertEqual(self.buildinfo.InternedConfigPath(), ('/bar/baz',))
+    self.buildinfo.ActiveConfigPath(set_to=['/foo'])
+    self.assertIs(self.buildinfo.InternedConfigPath(), path)
+    self.assertIs(self.buildinfo.InternConfigPath(['/foo']), path)
+    # Each instance has its own table, which goes with it.
+    other = buildinfo.BuildInfo()
+    other.ActiveConfigPath(set_to=['/foo'])
+    self.assertIsNot(other.InternedConfigPath(), path)
+
   def test_string_pinner(self):
     self.assertFalse(self.buildinfo._StringPinner(['A', 'B'], []))
     self.assertFalse(self.buildinfo._StringPinner(['A', 'B'], None))
@@ -609,17 +823,17 @@ class BuildInfoTest(test_utils.GlazierTestCase):
         'tier2': ['precision workstation t3400', '20BT'],
     }
     self.assertEqual(self.buildinfo.SupportTier(), 1)
-    self.buildinfo.SupportTier.cache_clear()
+    self.buildinfo.Invalidate('SupportTier')
 
     # Tier 2
     mock_computermodel.return_value = 'Precision WorkStation T3400'
     self.assertEqual(self.buildinfo.SupportTier(), 2)
-    self.buildinfo.SupportTier.cache_clear()
+    self.buildinfo.Invalidate('SupportTier')
 
     # Partial Match
     mock_computermodel.return_value = '20BTS0A400'
     self.assertEqual(self.buildinfo.SupportTier(), 2)
-    self.buildinfo.SupportTier.cache_clear()
+    self.buildinfo.Invalidate('SupportTier')
 
     # Unsupported
     mock_computermodel.return_value = 'Best Buy Special of the Day'
@@ -637,7 +851,7 @@ class BuildInfoTest(test_utils.GlazierTestCase):
     self.assertTrue(self.buildinfo.TpmPresent())
     mock_tpmpresent.return_value = False
     self.assertTrue(self.buildinfo.TpmPresent())  # caching
-    self.buildinfo.TpmPresent.cache_clear()
+    self.buildinfo.Invalidate('TpmPresent')
     self.assertFalse(self.buildinfo.TpmPresent())
 
   @mock.patch.object(files, 'Read', autospec=True)
@@ -674,13 +888,13 @@ class BuildInfoTest(test_utils.GlazierTestCase):
     self.assertEqual(self.buildinfo.EncryptionLevel(), 'none')
     mock_info.assert_called_with(_REGEXP('^Virtual machine type .*'), mock.ANY)
     mock_isvirtual.return_value = False
-    self.buildinfo.EncryptionLevel.cache_clear()
+    self.buildinfo.Invalidate('EncryptionLevel')
 
     # tpm
     mock_tpmpresent.return_value = True
     self.assertEqual(self.buildinfo.EncryptionLevel(), 'tpm')
     mock_info.assert_called_with(_REGEXP('^TPM detected .*'))
-    self.buildinfo.EncryptionLevel.cache_clear()
+    self.buildinfo.Invalidate('EncryptionLevel')
 
     # default
     self.assertEqual(self.buildinfo.EncryptionLevel(), 'tpm')
@@ -14,13 +14,17 @@
 
 """Manages the on-disk build cache."""
 
+import hashlib
 import os
 import re
 import typing
-from typing import Optional
+from typing import List, Optional
 
+from glazier.lib import artifact_store
 from glazier.lib import download
+from glazier.lib import download_manager
 from glazier.lib import errors
+from glazier.lib import file_util
 
 if typing.TYPE_CHECKING:
   from glazier.lib import buildinfo
@@ -44,9 +48,6 @@ class CacheError(Error):
 class Cache(object):
   """Handles interation with the on-disk build cache."""
 
-  def __init__(self):
-    self._downloader = download.Download(show_progress=False)
-
   def _DestinationPath(self, cache_path: str, url: str) -> str:
     """Determines the local path for a file being downloaded.
 
@@ -61,19 +62,21 @@ class Cache(object):
     destination = os.path.join(cache_path + os.sep, file_name)
     return destination
 
-  def _FindDownload(self, line: str) -> Optional[str]:
+  def _FindDownloads(self, line: str) -> List[str]:
     """Searches a command line for any download strings.
 
     Args:
       line: the command line to search
 
     Returns:
-      the url which requires downloading or none
+      the urls which require downloading, in order, without duplicates
     """
-    result = DNLD_RE.search(line)
-    if result:
-      return result.group(1).rstrip('"\'')
-    return None
+    found = []
+    for match in DNLD_RE.findall(line):
+      match = match.rstrip('"\'')
+      if match not in found:
+        found.append(match)
+    return found
 
   def CacheFromLine(self, line: str,
                     build_info: 'buildinfo.BuildInfo') -> Optional[str]:
@@ -89,18 +92,32 @@ class Cache(object):
     Raises:
       CacheError: unable to download a file to the local cache
     """
-    match = self._FindDownload(line)
-    while match:
-      file_path = download.Transform(match, build_info)
-      if download.IsRemote(file_path):
-        destination = self._DestinationPath(build_info.CachePath(), file_path)
-        try:
-          self._downloader.DownloadFile(file_path, destination)
-        except download.Error as e:
-          self._downloader.PrintDebugInfo()
-          raise CacheError(file_path) from e
-      else:  # bypass download for local files
-        destination = file_path
+    destinations = {}
+    with download_manager.DownloadManager(
+        store=artifact_store.ForBuild(build_info)) as manager:
+      for match in self._FindDownloads(line):
+        file_path = download.Transform(match, build_info)
+        if download.IsRemote(file_path):
+          destination = self._DestinationPath(build_info.CachePath(), file_path)
+          if destination in destinations.values():
+            # Keep different files with the same name apart.
+            url_hash = hashlib.sha256(file_path.encode()).hexdigest()[:8]
+            destination = self._DestinationPath(
+                os.path.join(build_info.CachePath(), url_hash), file_path)
+            try:
+              file_util.CreateDirectories(destination)
+            except file_util.Error as e:
+              raise CacheError(file_path) from e
+          manager.Submit(file_path, destination)
+        else:  # bypass download for local files
+          destination = file_path
+        destinations[match] = destination
+
+      for job in manager.Wait():
+        if job.error:
+          job.downloader.PrintDebugInfo()
+          raise CacheError(job.url) from job.error
+
+    for match, destination in destinations.items():
       line = line.replace(match, destination)
-      match = self._FindDownload(line)
     return line
@@ -51,17 +51,40 @@ class CacheTest(test_utils.GlazierTestCase):
     mock_transform.side_effect = self.fake_transform
     result = self.cache.CacheFromLine(line_in, build_info)
     self.assertEqual(result, line_out)
-    call1 = mock.call(self.cache._downloader,
-                      'https://test.example.com/bin/%s' % remote1, local1)
-    call2 = mock.call(self.cache._downloader,
-                      'https://test.example.com/release/%s' % remote2, local2)
-    mock_downloadfile.assert_has_calls([call1, call2])
+    call1 = mock.call(mock.ANY, 'https://test.example.com/bin/%s' % remote1,
+                      local1, show_progress=False, digests=None)
+    call2 = mock.call(mock.ANY,
+                      'https://test.example.com/release/%s' % remote2, local2,
+                      show_progress=False, digests=None)
+    mock_downloadfile.assert_has_calls([call1, call2], any_order=True)
     # download exception
     transfer_err = cache.download.Error('Error message.')
     mock_downloadfile.side_effect = transfer_err
     with self.assert_raises_with_validation(cache.CacheError):
       self.cache.CacheFromLine('@%s' % remote2, build_info)
 
+  @mock.patch.object(cache.file_util, 'CreateDirectories', autospec=True)
+  @mock.patch.object(cache.download.Download, 'DownloadFile', autospec=True)
+  def test_cache_from_line_same_name(self, mock_downloadfile,
+                                     mock_createdirectories):
+    cache_path = r'C:\Cache\Path'
+    build_info = mock.Mock()
+    build_info.CachePath.return_value = cache_path
+    url1 = 'https://test.example.com/a/setup.exe'
+    url2 = 'https://test.example.com/b/setup.exe'
+    url_hash = cache.hashlib.sha256(url2.encode()).hexdigest()[:8]
+    local1 = os.path.join(cache_path, 'setup.exe')
+    local2 = os.path.join(cache_path, url_hash, 'setup.exe')
+    with mock.patch.object(
+        cache.download, 'Transform', side_effect=lambda x, _: x[1:]):
+      result = self.cache.CacheFromLine(f'@{url1} /chain @{url2}', build_info)
+    self.assertEqual(result, f'{local1} /chain {local2}')
+    mock_createdirectories.assert_called_with(local2)
+    mock_downloadfile.assert_has_calls([
+        mock.call(mock.ANY, url1, local1, show_progress=False, digests=None),
+        mock.call(mock.ANY, url2, local2, show_progress=False, digests=None)
+    ], any_order=True)
+
   @mock.patch.object(cache.download, 'Transform', autospec=True)
   def test_cache_from_line_local(self, mock_transform):
     line_in = 'powershell.exe -file @path/to/script.ps1'
@@ -76,18 +99,21 @@ class CacheTest(test_utils.GlazierTestCase):
         'an_installer.msi')
     self.assertEqual(path, os.path.join('C:', 'an_installer.msi'))
 
-  def test_find_download(self):
-    line_test = self.cache._FindDownload('powershell -file '
-                                         r'C:\run_some_file.ps1')
-    self.assertIsNone(line_test)
-    line_test = self.cache._FindDownload('msiexec /i @installer.msi /qa')
-    self.assertEqual(line_test, '@installer.msi')
-    line_test = self.cache._FindDownload(r'C:\install_some_program.exe '
-                                         '/i ARGS=FOO')
-    self.assertIsNone(line_test)
-    line_test = self.cache._FindDownload(
+  def test_find_downloads(self):
+    line_test = self.cache._FindDownloads('powershell -file '
+                                          r'C:\run_some_file.ps1')
+    self.assertEmpty(line_test)
+    line_test = self.cache._FindDownloads('msiexec /i @installer.msi /qa')
+    self.assertEqual(line_test, ['@installer.msi'])
+    line_test = self.cache._FindDownloads(r'C:\install_some_program.exe '
+                                          '/i ARGS=FOO')
+    self.assertEmpty(line_test)
+    line_test = self.cache._FindDownloads(
         'some_executable.exe /conf=#remote.conf /flag1 /flag1')
-    self.assertEqual(line_test, '#remote.conf')
+    self.assertEqual(line_test, ['#remote.conf'])
+    line_test = self.cache._FindDownloads(
+        'setup.exe /a="@a.msi" /b=#b.conf /c=@a.msi')
+    self.assertEqual(line_test, ['@a.msi', '#b.conf'])
 
 
 if __name__ == '__main__':
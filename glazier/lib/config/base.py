@@ -20,6 +20,7 @@ classes.  It is meant to be inherited rather than run directly.
 
 from glazier.lib import actions
 from glazier.lib import errors
+from glazier.lib import profiler
 
 
 class Error(errors.GlazierError):
@@ -66,6 +67,7 @@ class ConfigBase(object):
       ConfigError: The action is either undefined, or failed to execute.
     """
     try:
-      self._GetAction(action, params).Run()
+      with profiler.Span(profiler.CATEGORY_ACTION, str(action)):
+        self._GetAction(action, params).Run()
     except actions.ActionError as e:
       raise ConfigError('Error while running configured action') from e
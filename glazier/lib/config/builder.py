@@ -41,17 +41,53 @@ BuildInfo tracks our position in the directory tree.  Additional levels
 process the include.  At the end of processing the stack is popped, returning us
 to our previous level.  This allows us to reference other files relative to the
 location of the active config.
+
+## Prefetching
+
+With --config_prefetch_workers, included files are downloaded ahead of time.
+As soon as a file is parsed, the includes it references (in any control or template, whether or not their pins
+match) are fetched concurrently in the background, and each prefetched file in
+turn prefetches its own includes.  Processing still walks the files strictly in
+order, evaluating pins as it goes, but normally finds each include already
+downloaded.  A file which fails to prefetch is read again when it is reached,
+so errors surface exactly where they did before.  As includes behind pins which
+do not match are fetched too, and each fetch retries for as long as any other
+download, prefetching is best suited to config trees whose includes are all
+reachable.
+
+## Task List Cache
+
+With --task_list_cache, the builder records which config files it read and the
+outcome of each pin check, and stores the compiled task list keyed by that
+trace (see task_list_cache).  A later build first replays the stored traces:
+if every recorded pin check has the same outcome and every recorded file has
+the same content, the stored task list is used without walking the tree.
+
+## Binary Task List
+
+With --binary_task_list, the task list is written in the binary format of
+task_file instead of YAML.  Config paths are stored once and shared between
+tasks, and the runner decodes only the task it is about to run, so its memory
+use and startup time do not grow with the length of the list.
 """
 
+import concurrent.futures
 import copy
+import logging
+import threading
 # do not remove: internal placeholder 1
+from absl import flags
 from glazier.lib import buildinfo
 from glazier.lib.config import base
 from glazier.lib.config import files
+from glazier.lib.config import journal
+from glazier.lib.config import task_file
+from glazier.lib.config import task_list_cache
 
 from glazier.lib import actions
 from glazier.lib import download
 from glazier.lib import errors
+from glazier.lib import profiler
 
 _ALLOW_IN_TEMPLATE = [
     'include',
@@ -61,6 +97,16 @@ _ALLOW_IN_TEMPLATE = [
 ] + dir(actions)
 _ALLOW_IN_CONTROL = _ALLOW_IN_TEMPLATE + ['pin']
 
+_CONFIG_PREFETCH_WORKERS = flags.DEFINE_integer(
+    'config_prefetch_workers', 0,
+    'Number of included config files to download concurrently while building '
+    'the task list, including those behind pins which do not match this host. '
+    '0 disables prefetching.')
+_BINARY_TASK_LIST = flags.DEFINE_bool(
+    'binary_task_list', False,
+    'Write the task list in the binary format, which the runner reads one '
+    'task at a time, instead of YAML.')
+
 
 class Error(errors.GlazierError):
   pass
@@ -93,6 +139,13 @@ class UnknownActionError(Error):
 class ConfigBuilder(base.ConfigBase):
   """Builds the complete task list for the installation."""
 
+  def __init__(self, build_info):
+    super(ConfigBuilder, self).__init__(build_info)
+    self._executor = None
+    self._prefetched = {}
+    self._prefetch_lock = threading.Lock()
+    self._trace = None
+
   def Start(self, out_file, in_path, in_file='build.yaml'):
     """Start parsing configuration files.
 
@@ -102,14 +155,38 @@ class ConfigBuilder(base.ConfigBase):
       in_file: The root configuration file name.
     """
     self._task_list = []
-    while True:
-      try:
-        self._Start(in_path, in_file)
-        break
-      except actions.ServerChangeEvent:
-        in_path = ''  # restart with a fresh path
+    self._prefetched = {}
+    self._trace = {'files': {}, 'pins': []}
+    cache = self._TaskListCache(in_path, in_file)
+    if _CONFIG_PREFETCH_WORKERS.value > 0:
+      self._executor = concurrent.futures.ThreadPoolExecutor(
+          max_workers=_CONFIG_PREFETCH_WORKERS.value)
     try:
-      files.Dump(out_file, self._task_list, mode='a')
+      task_list = self._FromCache(cache) if cache else None
+      if task_list is not None:
+        self._task_list = task_list
+      else:
+        while True:
+          try:
+            self._Start(in_path, in_file)
+            break
+          except actions.ServerChangeEvent:
+            in_path = ''  # restart with a fresh path
+        if cache and self._trace:
+          cache.Store(self._trace, self._task_list)
+    finally:
+      if self._executor:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+      self._prefetched = {}
+    try:
+      # Progress recorded against an earlier list must not apply to this one,
+      # even if both have the same content.
+      journal.RemoveJournal(out_file)
+      if _BINARY_TASK_LIST.value:
+        task_file.Write(out_file, self._task_list)
+      else:
+        files.Dump(out_file, self._task_list, mode='a')
     except files.Error as e:
       raise ConfigBuilderError() from e
 
@@ -120,35 +197,165 @@ class ConfigBuilder(base.ConfigBase):
       conf_path: The path to the config below root.
       conf_file: A named config file, normally build.yaml.
     """
-    self._build_info.ActiveConfigPath(append=conf_path.rstrip('/'))
-    try:
-      path = download.PathCompile(self._build_info, file_name=conf_file)
-      yaml_config = files.Read(path)
-    except (files.Error, buildinfo.Error) as e:
-      raise ConfigBuilderError() from e
-    timer_start = 'start_{}_{}'.format(conf_path.rstrip('/'), conf_file)
-    active_path = copy.deepcopy(self._build_info.ActiveConfigPath())
-    self._task_list.append({
-        'path': active_path,
-        'data': {
-            'SetTimer': [timer_start]
-        }
-    })
-    controls = yaml_config['controls']  # pytype: disable=unsupported-operands  # always-use-return-annotations
-    try:
-      for control in controls:
-        if 'pin' not in control or self._MatchPin(control['pin']):
-          self._StoreControls(control, yaml_config.get('templates'))  # pytype: disable=attribute-error  # always-use-return-annotations
-    finally:
-      # close out any timers before raising a server change
-      timer_stop = 'stop_{}_{}'.format(conf_path.rstrip('/'), conf_file)
+    name = '{}/{}'.format(conf_path.rstrip('/'), conf_file)
+    with profiler.Span(profiler.CATEGORY_INCLUDE, name):
+      self._build_info.ActiveConfigPath(
+          set_to=_IncludePath(self._build_info,
+                              self._build_info.InternedConfigPath(),
+                              conf_path))
+      try:
+        path = download.PathCompile(self._build_info, file_name=conf_file)
+        yaml_config = self._Read(path)
+        if self._executor:
+          self._Prefetch(yaml_config, self._build_info.InternedConfigPath(),
+                         self._build_info.ReleasePath())
+      except (files.Error, buildinfo.Error) as e:
+        raise ConfigBuilderError() from e
+      if self._trace is not None:
+        digest = task_list_cache.Digest(yaml_config)
+        if digest:
+          self._trace['files'][path] = digest
+        else:
+          self._trace = None
+      timer_start = 'start_{}_{}'.format(conf_path.rstrip('/'), conf_file)
+      active_path = self._build_info.InternedConfigPath()
       self._task_list.append({
           'path': active_path,
           'data': {
-              'SetTimer': [timer_stop]
+              'SetTimer': [timer_start]
           }
       })
-    self._build_info.ActiveConfigPath(pop=True)
+      controls = yaml_config['controls']  # pytype: disable=unsupported-operands  # always-use-return-annotations
+      try:
+        for control in controls:
+          if 'pin' not in control or self._MatchPin(control['pin']):
+            self._StoreControls(control, yaml_config.get('templates'))  # pytype: disable=attribute-error  # always-use-return-annotations
+      finally:
+        # close out any timers before raising a server change
+        timer_stop = 'stop_{}_{}'.format(conf_path.rstrip('/'), conf_file)
+        self._task_list.append({
+            'path': active_path,
+            'data': {
+                'SetTimer': [timer_stop]
+            }
+        })
+      self._build_info.ActiveConfigPath(pop=True)
+
+  def _TaskListCache(self, in_path, in_file):
+    """Gets the task list cache for a root config, if enabled.
+
+    Args:
+      in_path: The path to the root configuration file.
+      in_file: The root configuration file name.
+
+    Returns:
+      A TaskListCache, or None if the cache is disabled.
+    """
+    directories = task_list_cache.Directories(self._build_info)
+    if not directories:
+      return None
+    try:
+      release_path = self._build_info.ReleasePath()
+    except buildinfo.Error as e:
+      raise ConfigBuilderError() from e
+    return task_list_cache.TaskListCache(
+        directories, '{}|{}|{}'.format(release_path, in_path, in_file))
+
+  def _FromCache(self, cache):
+    """Finds a cached task list whose trace matches this host.
+
+    Args:
+      cache: The TaskListCache to search.
+
+    Returns:
+      The cached task list, or None if no entry matches.
+    """
+    for manifest in cache.Manifests():
+      if self._TraceMatches(manifest['trace']):
+        task_list = cache.Load(manifest)
+        if task_list is not None:
+          logging.info('Using cached task list %s.', manifest['path'])
+          return task_list
+    return None
+
+  def _TraceMatches(self, trace):
+    """Replays a build trace against this host and the config server.
+
+    Args:
+      trace: The files read and pin checks made by an earlier build.
+
+    Returns:
+      True if every pin check has the same outcome and every file has the same
+      content as in the earlier build.
+    """
+    for pin in trace['pins']:
+      try:
+        pin_name, pin_values, result = pin
+        if self._build_info.BuildPinMatch(pin_name, pin_values) != result:
+          return False
+      except (buildinfo.Error, TypeError, ValueError):
+        return False
+    for path in trace['files']:
+      self._Submit(path, files.Read, path)
+    for path, digest in trace['files'].items():
+      try:
+        if task_list_cache.Digest(self._Read(path)) != digest:
+          return False
+      except files.Error:
+        return False
+    return True
+
+  def _Read(self, path):
+    """Reads a config file, using the prefetched copy if there is one.
+
+    Args:
+      path: The path (either local or remote) to read from.
+
+    Returns:
+      The parsed YAML content from the file.
+    """
+    with self._prefetch_lock:
+      future = self._prefetched.get(path)
+    if future:
+      try:
+        # Each include gets its own copy, as the task list keeps references.
+        return copy.deepcopy(future.result())
+      except Exception as e:  # pylint: disable=broad-except
+        logging.debug('Prefetch of %s failed, reading again: %s', path, e)
+    return files.Read(path)
+
+  def _Prefetch(self, yaml_config, conf_path, base):
+    """Starts fetching the files included by a config in the background.
+
+    Args:
+      yaml_config: The parsed config.
+      conf_path: The config path below root the config was read from.
+      base: The release path the config was read from.
+    """
+    for inc_path, inc_file in _Includes(yaml_config):
+      sub_path = _IncludePath(self._build_info, conf_path, inc_path)
+      url = download.PathCompile(
+          self._build_info,
+          file_name=inc_file,
+          base=base,
+          conf_path=list(sub_path))
+      self._Submit(url, self._PrefetchFile, url, sub_path, base)
+
+  def _Submit(self, path, fn, *args):
+    """Runs fn in the background to fetch path, unless already started."""
+    with self._prefetch_lock:
+      if not self._executor or path in self._prefetched:
+        return
+      try:
+        self._prefetched[path] = self._executor.submit(fn, *args)
+      except RuntimeError:
+        pass  # The build has finished.
+
+  def _PrefetchFile(self, url, conf_path, base):
+    """Reads an included config and prefetches its own includes."""
+    yaml_config = files.Read(url)
+    self._Prefetch(yaml_config, conf_path, base)
+    return yaml_config
 
   def _MatchPin(self, pins):
     """Check all pin entries for a mismatch.
@@ -178,10 +385,17 @@ class ConfigBuilder(base.ConfigBase):
     """
     for pin in pins:
       try:
-        if not self._build_info.BuildPinMatch(pin, pins[pin]):
-          return False
+        with profiler.Span(profiler.CATEGORY_PIN, pin, values=pins[pin]):
+          match = self._build_info.BuildPinMatch(pin, pins[pin])
       except buildinfo.Error as e:
         raise SysInfoError() from e
+      if self._trace is not None:
+        if pin.startswith('USER_'):
+          self._trace = None  # Chooser responses are not host facts.
+        else:
+          self._trace['pins'].append([pin, pins[pin], match])
+      if not match:
+        return False
     return True
 
   def _StoreControls(self, control, templates):
@@ -205,11 +419,64 @@ class ConfigBuilder(base.ConfigBase):
           self._Start(conf_path=sub_inc[0], conf_file=sub_inc[1])
       elif element in _ALLOW_IN_CONTROL:
         if self._IsRealtimeAction(element, control[element]):
+          self._trace = None  # The build now depends on the action's effects.
           self._ProcessAction(element, control[element])
         else:
           self._task_list.append({
-              'path': copy.deepcopy(self._build_info.ActiveConfigPath()),
+              'path': self._build_info.InternedConfigPath(),
               'data': {element: control[element]}
           })
       else:
         raise UnknownActionError(str(element))
+
+
+def _IncludePath(build_info, conf_path, inc_path):
+  """The config path of an include.
+
+  Args:
+    build_info: The BuildInfo the config path is interned by.
+    conf_path: The config path of the including file.
+    inc_path: The path of the include, relative to the including file.
+
+  Returns:
+    The interned config path the include is read from.
+  """
+  inc_path = inc_path.rstrip('/')
+  if not inc_path:
+    return conf_path
+  return build_info.InternConfigPath(conf_path + (inc_path,))
+
+
+def _Includes(yaml_config):
+  """Lists the includes referenced anywhere in a config.
+
+  Args:
+    yaml_config: The parsed config.
+
+  Returns:
+    A list of [path, file] includes, in the order they appear in controls and
+    the templates the controls use.
+  """
+  includes = []
+  if not isinstance(yaml_config, dict):
+    return includes
+  templates = yaml_config.get('templates') or {}
+  seen = set()
+
+  def _Walk(control):
+    if not isinstance(control, dict):
+      return
+    for sub_inc in control.get('include') or []:
+      if (isinstance(sub_inc, (list, tuple)) and len(sub_inc) == 2 and
+          all(isinstance(part, str) for part in sub_inc)):
+        includes.append(sub_inc)
+    for template in control.get('template') or []:
+      if isinstance(template, str) and template not in seen:
+        seen.add(template)
+        if isinstance(templates, dict):
+          _Walk(templates.get(template))
+
+  for control in yaml_config.get('controls') or []:
+    _Walk(control)
+  return includes
+
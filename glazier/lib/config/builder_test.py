@@ -15,9 +15,14 @@
 
 from unittest import mock
 
+import os
+import threading
+
 from absl.testing import absltest
+from absl.testing import flagsaver
 from glazier.lib import buildinfo
 from glazier.lib import test_utils
+from glazier.lib import yaml_codec
 from glazier.lib.config import builder
 from glazier.lib.config import files
 
@@ -99,6 +104,24 @@ class ConfigBuilderTest(test_utils.GlazierTestCase):
     ])
     mock_dump.assert_called_with('/task/list/path.yaml', [], mode='a')
 
+  @mock.patch.object(builder.ConfigBuilder, '_Start', autospec=True)
+  def test_start_removes_journal(self, unused_start):
+    out_file = self.create_tempfile('task_list.yaml').full_path
+    journal_path = self.create_tempfile(
+        'task_list.yaml' + builder.journal.JOURNAL_SUFFIX).full_path
+    self.cb.Start(out_file, '/root1')
+    self.assertFalse(os.path.exists(journal_path))
+
+  @flagsaver.flagsaver(binary_task_list=True)
+  @mock.patch.object(builder.ConfigBuilder, '_Start', autospec=True)
+  @mock.patch.object(builder.task_file, 'Write', autospec=True)
+  @mock.patch.object(files, 'Dump', autospec=True)
+  def test_start_binary(self, mock_dump, mock_write, mock_start):
+    self.cb.Start('/task/list/path.yaml', '/root1')
+    mock_start.assert_called_with(self.cb, '/root1', 'build.yaml')
+    mock_write.assert_called_with('/task/list/path.yaml', [])
+    mock_dump.assert_not_called()
+
   @mock.patch.object(builder.ConfigBuilder, '_StoreControls', autospec=True)
   @mock.patch.object(builder.download, 'PathCompile', autospec=True)
   @mock.patch.object(builder.files, 'Read', autospec=True)
@@ -119,6 +142,219 @@ class ConfigBuilderTest(test_utils.GlazierTestCase):
     self.assertEqual(self.cb._task_list[1]['data']['SetTimer'],
                      ['stop_/task/path_list.yaml'])
 
+  def _read_tree(self, path):
+    configs = {
+        'https://glazier/build.yaml': {
+            'controls': [{
+                'include': [['a/', 'a.yaml']]
+            }, {
+                'pin': {'os_code': ['win7']},
+                'include': [['skipped/', 'skipped.yaml']]
+            }, {
+                'template': ['b']
+            }],
+            'templates': {
+                'b': {
+                    'include': [['b/', 'b.yaml']]
+                }
+            }
+        },
+        'https://glazier/a/a.yaml': {
+            'controls': [{
+                'include': [['', 'c.yaml']]
+            }, {
+                'SetTimer': ['a']
+            }]
+        },
+        'https://glazier/a/c.yaml': {'controls': [{'SetTimer': ['c']}]},
+        'https://glazier/b/b.yaml': {'controls': [{'SetTimer': ['b']}]},
+        'https://glazier/skipped/skipped.yaml': {'controls': []},
+    }
+    with self.lock:
+      self.reads.append((path, threading.current_thread().name))
+    if path not in configs:
+      raise files.FileReadError(path)
+    return configs[path]
+
+  def _timers(self, task_list):
+    return [task['data']['SetTimer'][0] for task in task_list]
+
+  @mock.patch.object(buildinfo.BuildInfo, 'BuildPinMatch', autospec=True)
+  @mock.patch.object(buildinfo.BuildInfo, 'ReleasePath', autospec=True)
+  @mock.patch.object(files, 'Dump', autospec=True)
+  @mock.patch.object(builder.files, 'Read', autospec=True)
+  def test_prefetch(self, mock_read, mock_dump, mock_releasepath,
+                    mock_buildpinmatch):
+    self.reads = []
+    self.lock = threading.Lock()
+    mock_read.side_effect = self._read_tree
+    mock_releasepath.return_value = 'https://glazier/'
+    mock_buildpinmatch.return_value = False
+    expected = [
+        'start__build.yaml', 'start_a_a.yaml', 'start__c.yaml', 'c',
+        'stop__c.yaml', 'a', 'stop_a_a.yaml', 'start_b_b.yaml', 'b',
+        'stop_b_b.yaml', 'stop__build.yaml'
+    ]
+
+    with flagsaver.flagsaver(config_prefetch_workers=0):
+      self.cb.Start('/task_list.yaml', '')
+    self.assertEqual(self._timers(mock_dump.call_args[0][1]), expected)
+    self.assertLen(self.reads, 4)
+
+    self.reads = []
+    with flagsaver.flagsaver(config_prefetch_workers=4):
+      self.cb.Start('/task_list.yaml', '')
+    self.assertEqual(self._timers(mock_dump.call_args[0][1]), expected)
+    urls = [url for url, _ in self.reads]
+    self.assertCountEqual(urls, set(urls))
+    self.assertIn('https://glazier/skipped/skipped.yaml', urls)
+    main = threading.current_thread().name
+    self.assertEqual([url for url, thread in self.reads if thread == main],
+                     ['https://glazier/build.yaml'])
+    self.assertEqual(self.buildinfo.ActiveConfigPath(), [])
+
+  @mock.patch.object(buildinfo.BuildInfo, 'BuildPinMatch', autospec=True)
+  @mock.patch.object(buildinfo.BuildInfo, 'ReleasePath', autospec=True)
+  @mock.patch.object(files, 'Dump', autospec=True)
+  @mock.patch.object(builder.files, 'Read', autospec=True)
+  def test_profile(self, mock_read, mock_dump, mock_releasepath,
+                   mock_buildpinmatch):
+    self.reads = []
+    self.lock = threading.Lock()
+    mock_read.side_effect = self._read_tree
+    mock_releasepath.return_value = 'https://glazier/'
+    mock_buildpinmatch.return_value = False
+    trace = self.create_tempfile().full_path
+    with flagsaver.flagsaver(config_prefetch_workers=0, profile_trace=trace):
+      self.cb.Start('/task_list.yaml', '')
+    self.assertTrue(mock_dump.called)
+    self.assertEqual(
+        [(e['cat'], e['name']) for e in builder.profiler.Load(trace)], [
+            ('include', '/c.yaml'),
+            ('include', 'a/a.yaml'),
+            ('pin', 'os_code'),
+            ('include', 'b/b.yaml'),
+            ('include', '/build.yaml'),
+        ])
+
+  @flagsaver.flagsaver(config_prefetch_workers=0)
+  @mock.patch.object(buildinfo.BuildInfo, 'ReleasePath', autospec=True)
+  @mock.patch.object(files, 'Dump', autospec=True)
+  @mock.patch.object(builder.files, 'Read', autospec=True)
+  def test_shared_paths(self, mock_read, mock_dump, mock_releasepath):
+    mock_releasepath.return_value = 'https://glazier/'
+    mock_read.return_value = {
+        'controls': [{'SetTimer': ['a']}, {'SetTimer': ['b']}]
+    }
+    self.cb.Start('/task_list.yaml', 'sub')
+    paths = [task['path'] for task in self.cb._task_list]
+    self.assertLen(paths, 4)
+    for path in paths:
+      self.assertIs(path, paths[0])
+    # The shared paths are written out in full, not as aliases.
+    document = yaml_codec.Dump(mock_dump.call_args[0][1])
+    self.assertNotIn('&id', document)
+    self.assertEqual(yaml_codec.Load(document)[1]['path'], ['sub'])
+
+  @mock.patch.object(buildinfo.BuildInfo, 'ReleasePath', autospec=True)
+  @mock.patch.object(files, 'Dump', autospec=True)
+  @mock.patch.object(builder.files, 'Read', autospec=True)
+  def test_prefetch_failure(self, mock_read, mock_dump, mock_releasepath):
+    mock_releasepath.return_value = 'https://glazier/'
+    root = {'controls': [{'include': [['', 'missing.yaml']]}]}
+    mock_read.side_effect = iter([
+        root,
+        files.FileReadError('https://glazier/missing.yaml'),
+        files.FileReadError('https://glazier/missing.yaml'),
+    ])
+    with flagsaver.flagsaver(config_prefetch_workers=4):
+      with self.assert_raises_with_validation(builder.ConfigBuilderError):
+        self.cb.Start('/task_list.yaml', '')
+    self.assertEqual(mock_read.call_count, 3)
+    mock_dump.assert_not_called()
+
+  @mock.patch.object(buildinfo.BuildInfo, 'BuildPinMatch', autospec=True)
+  @mock.patch.object(buildinfo.BuildInfo, 'CachePath', autospec=True)
+  @mock.patch.object(buildinfo.BuildInfo, 'ReleasePath', autospec=True)
+  @mock.patch.object(files, 'Dump', autospec=True)
+  @mock.patch.object(builder.files, 'Read', autospec=True)
+  def test_task_list_cache(self, mock_read, mock_dump, mock_releasepath,
+                           mock_cachepath, mock_buildpinmatch):
+    self.reads = []
+    self.lock = threading.Lock()
+    mock_releasepath.return_value = 'https://glazier/'
+    mock_cachepath.return_value = self.create_tempdir().full_path
+    mock_buildpinmatch.return_value = False
+    stored = {}
+
+    def _dump(path, data, mode='w'):
+      del mode
+      stored[path] = data
+
+    def _read(path):
+      return stored[path] if path in stored else self._read_tree(path)
+
+    mock_dump.side_effect = _dump
+    mock_read.side_effect = _read
+
+    with flagsaver.flagsaver(task_list_cache=True, config_prefetch_workers=0):
+      self.cb.Start('/task_list.yaml', '')
+      built = stored['/task_list.yaml']
+      self.assertLen(stored, 2)
+      self.assertLen(self.reads, 4)
+
+      # Same files and pin outcomes: the cached list is reused.
+      self.reads = []
+      del stored['/task_list.yaml']
+      with mock.patch.object(
+          builder.ConfigBuilder, '_Start', autospec=True) as mock_start:
+        self.cb.Start('/task_list.yaml', '')
+        mock_start.assert_not_called()
+      self.assertEqual(stored['/task_list.yaml'], built)
+      mock_buildpinmatch.assert_called_with(mock.ANY, 'os_code', ['win7'])
+      self.assertLen(self.reads, 4)
+
+      # A pin outcome changes: the tree is built again.
+      self.reads = []
+      mock_buildpinmatch.return_value = True
+      self.cb.Start('/task_list.yaml', '')
+      self.assertIn(('https://glazier/skipped/skipped.yaml', mock.ANY),
+                    self.reads)
+      self.assertNotEqual(stored['/task_list.yaml'], built)
+      self.assertLen(stored, 3)
+
+  @mock.patch.object(builder.ConfigBuilder, '_ProcessAction', autospec=True)
+  def test_realtime_not_cached(self, unused_mock_processaction):
+    self.cb._trace = {'files': {}, 'pins': []}
+    self.cb._StoreControls({'ShowChooser': ['Chooser Stuff']}, {})
+    self.assertIsNone(self.cb._trace)
+
+  @mock.patch.object(buildinfo.BuildInfo, 'BuildPinMatch', autospec=True)
+  def test_user_pin_not_cached(self, mock_buildpinmatch):
+    mock_buildpinmatch.return_value = True
+    self.cb._trace = {'files': {}, 'pins': []}
+    self.cb._MatchPin({'os_code': ['win10']})
+    self.assertEqual(self.cb._trace['pins'], [['os_code', ['win10'], True]])
+    self.cb._MatchPin({'USER_locale': ['de-de']})
+    self.assertIsNone(self.cb._trace)
+
+  def test_includes(self):
+    config = {
+        'controls': [{
+            'include': [['x/', 'x.yaml'], 'bad'],
+            'template': ['t', 'missing']
+        }, 'bad'],
+        'templates': {
+            't': {
+                'include': [['t/', 't.yaml']],
+                'template': ['t']
+            }
+        }
+    }
+    self.assertEqual(builder._Includes(config),
+                     [['x/', 'x.yaml'], ['t/', 't.yaml']])
+    self.assertEqual(builder._Includes(None), [])
+
 
 if __name__ == '__main__':
   absltest.main()
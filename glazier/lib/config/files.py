@@ -14,14 +14,19 @@
 
 """Functions for interacting with yaml configuration files."""
 
+import os
 import re
 from typing import Any
+from glazier.lib import constants
 from glazier.lib import file_util
-import yaml
+from glazier.lib import winpe
+from glazier.lib import yaml_codec
 
 from glazier.lib import download
 from glazier.lib import errors
 
+CONFIG_CACHE_DIR = 'config'
+
 
 class Error(errors.GlazierError):
   pass
@@ -103,7 +108,7 @@ def Dump(path: str, data: Any, mode: str = 'w'):
   # Write to a .tmp file to avoid corrupting the original if aborted mid-way.
   try:
     with open(tmp_f, mode) as handle:
-      handle.write(yaml.dump(data))
+      handle.write(yaml_codec.Dump(data))
   except IOError as e:
     raise FileWriteError(path) from e
 
@@ -118,6 +123,8 @@ def Read(path: str):
   """Read a config file at path and return any data it contains.
 
   Will attempt to download files from remote repositories prior to reading.
+  With the conditional_get flag set, remote files are kept in the build cache
+  and only downloaded again when the server reports that they have changed.
 
   Args:
     path: The path (either local or remote) to read from.
@@ -131,12 +138,28 @@ def Read(path: str):
   if re.match('^http(s)?://', path):
     downloader = download.Download()
     try:
-      path = downloader.DownloadFileTemp(path)
+      if download.CONDITIONAL_GET.value:
+        path = downloader.DownloadFileCached(path, _ConfigCachePath())
+      else:
+        path = downloader.DownloadFileTemp(path)
     except download.Error as e:
       raise FileDownloadError(path) from e
   return _YamlReader(path)
 
 
+def _ConfigCachePath() -> str:
+  """The directory to keep downloaded config files in.
+
+  Matches BuildInfo.CachePath(), which cannot be used here without a circular
+  import.
+
+  Returns:
+    The path to the config cache as a string.
+  """
+  cache = constants.WINPE_CACHE if winpe.check_winpe() else constants.SYS_CACHE
+  return os.path.join(cache, CONFIG_CACHE_DIR)
+
+
 def _YamlReader(path: str) -> str:
   """Read a configuration file and return the contents.
 
@@ -150,7 +173,7 @@ def _YamlReader(path: str) -> str:
   """
   try:
     with open(path, 'r') as yaml_file:
-      yaml_config = yaml.safe_load(yaml_file)
+      yaml_config = yaml_codec.Load(yaml_file)
   except IOError as e:
     raise FileReadError(path) from e
   return yaml_config
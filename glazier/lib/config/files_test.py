@@ -14,9 +14,11 @@
 
 """Tests for glazier.lib.config.files."""
 
+import os
 from unittest import mock
 
 from absl.testing import absltest
+from absl.testing import flagsaver
 from glazier.lib import file_util
 from glazier.lib import test_utils
 from glazier.lib.config import files
@@ -59,6 +61,21 @@ class FilesTest(test_utils.GlazierTestCase):
     result = files.Read(temp_file_2)
     self.assertEqual(result['data'], 'set2')
 
+  @flagsaver.flagsaver(conditional_get=True)
+  @mock.patch.object(files.winpe, 'check_winpe', autospec=True)
+  @mock.patch.object(
+      files.download.Download, 'DownloadFileCached', autospec=True)
+  def test_read_conditional(self, mock_downloadfilecached, mock_check_winpe):
+    mock_check_winpe.return_value = True
+    mock_downloadfilecached.return_value = self.create_tempfile(
+        file_path='cached.yaml', content='data: cached').full_path
+    url = 'https://glazier-server.example.com/unstable/dir/test-build.yaml'
+    result = files.Read(url)
+    mock_downloadfilecached.assert_called_with(
+        mock.ANY, url,
+        os.path.join(files.constants.WINPE_CACHE, files.CONFIG_CACHE_DIR))
+    self.assertEqual(result['data'], 'cached')
+
   @mock.patch.object(files.file_util, 'Remove', autospec=True)
   def test_remove_without_backup(self, mock_remove):
 
@@ -0,0 +1,198 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tracks progress through a task list without rewriting it.
+
+The task list itself stays a plain YAML list, as written by ConfigBuilder.
+Progress is kept in a journal next to it, <task list>.journal, which starts
+with the digest of the task list file it applies to, followed by one line per
+completed task holding the number of tasks completed so far. Completing a task
+appends a single line, rather than serializing every remaining task again.
+
+Once the journal holds more entries than there are tasks left (and at least
+COMPACT_MIN), the remaining tasks are written back to the task list and the
+journal starts over. A journal whose digest does not match the task list is
+stale, and ignored: that is the case both for a task list freshly written by
+the builder and for one just compacted, so an interrupted compaction never
+skips or repeats a task.
+
+Task lists from older releases have no journal, and are picked up from the
+first remaining task as before.
+
+Binary task lists (see task_file) are identified by the id in their header
+rather than by a digest, and are only read one task at a time, so completed
+tasks cost nothing to skip and the list is never compacted in place.
+"""
+
+import hashlib
+import logging
+import os
+from typing import Any, Optional, Sequence
+
+from glazier.lib import yaml_codec
+from glazier.lib.config import files
+from glazier.lib.config import task_file
+
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_HEADER = 'glazier-task-journal'
+COMPACT_MIN = 64
+
+
+def RemoveJournal(path: str):
+  """Removes the journal of a task list, if any.
+
+  Args:
+    path: The path to the task list.
+
+  Raises:
+    FileRemoveError: The journal exists, but could not be removed.
+  """
+  try:
+    os.remove(path + JOURNAL_SUFFIX)
+  except FileNotFoundError:
+    pass
+  except OSError as e:
+    raise files.FileRemoveError(path + JOURNAL_SUFFIX) from e
+
+
+def _HashFile(path: str) -> str:
+  try:
+    with open(path, 'rb') as f:
+      return hashlib.sha256(f.read()).hexdigest()
+  except IOError as e:
+    raise files.FileReadError(path) from e
+
+
+class TaskJournal(object):
+  """A task list on disk, and the journal of completed tasks."""
+
+  def __init__(self, path: str):
+    """Initializes the journal.
+
+    Args:
+      path: The path to the task list.
+    """
+    self.path = path
+    self._journal_path = path + JOURNAL_SUFFIX
+    self._digest = None  # type: Optional[str]
+    self._completed = 0
+    self._binary = False
+
+  def Load(self) -> Sequence[Any]:
+    """Reads the tasks which have not been completed yet.
+
+    Returns:
+      The remaining tasks, in order. For a binary task list, this is a TaskView
+      which decodes each task as it is accessed.
+
+    Raises:
+      FileReadError: The task list could not be read or parsed.
+    """
+    if task_file.IsCompiled(self.path):
+      tasks = task_file.TaskFile(self.path)
+      self._digest = tasks.id
+      self._binary = True
+      self._completed = self._ReadJournal()
+      self._LogResume()
+      return task_file.TaskView(tasks, self._completed)
+    try:
+      with open(self.path, 'rb') as f:
+        raw = f.read()
+      tasks = yaml_codec.Load(raw) or []
+    except (IOError, yaml_codec.YAMLError) as e:
+      raise files.FileReadError(self.path) from e
+    self._digest = hashlib.sha256(raw).hexdigest()
+    self._completed = self._ReadJournal()
+    self._LogResume()
+    return tasks[self._completed:]
+
+  def _LogResume(self):
+    if self._completed:
+      logging.info('Resuming task list %s after %d completed task(s).',
+                   self.path, self._completed)
+
+  def _ReadJournal(self) -> int:
+    """Reads the number of completed tasks from the journal.
+
+    Returns:
+      The number of tasks completed, or 0 if there is no journal for the
+      current task list.
+    """
+    try:
+      with open(self._journal_path, 'r') as f:
+        lines = f.read().split('\n')
+    except FileNotFoundError:
+      return 0
+    except IOError as e:
+      raise files.FileReadError(self._journal_path) from e
+    if lines[0] != '%s %s' % (JOURNAL_HEADER, self._digest):
+      logging.info('Ignoring stale task list journal %s.', self._journal_path)
+      RemoveJournal(self.path)
+      return 0
+    # The last line is either empty or was cut short, so it does not count.
+    completed = [line for line in lines[1:-1] if line.isdigit()]
+    return int(completed[-1]) if completed else 0
+
+  def Pop(self, remaining: Sequence[Any]):
+    """Records the completion of the first task.
+
+    Args:
+      remaining: The tasks still to be completed, after the completed one.
+
+    Raises:
+      Error: The journal or task list could not be written.
+    """
+    if self._digest is None:
+      # Nothing loaded from this path: write the remaining tasks out in full.
+      self.Compact(remaining)
+      return
+    self._completed += 1
+    try:
+      new = not os.path.exists(self._journal_path)
+      with open(self._journal_path, 'a') as f:
+        if new:
+          f.write('%s %s\n' % (JOURNAL_HEADER, self._digest))
+        f.write('%d\n' % self._completed)
+    except IOError as e:
+      raise files.FileWriteError(self._journal_path) from e
+    if (not self._binary and
+        self._completed >= max(COMPACT_MIN, len(remaining))):
+      self.Compact(remaining)
+
+  def Compact(self, remaining: Sequence[Any]):
+    """Writes the remaining tasks to the task list and resets the journal.
+
+    Remaining tasks from a binary task list are written as a binary task list.
+
+    Args:
+      remaining: The tasks still to be completed.
+
+    Raises:
+      Error: The task list could not be written.
+    """
+    if isinstance(remaining, task_file.TaskView):
+      self._digest = task_file.Write(self.path, remaining)
+      self._binary = True
+    else:
+      files.Dump(self.path, remaining, mode='w')
+      self._digest = _HashFile(self.path)
+    self._completed = 0
+    RemoveJournal(self.path)
+
+  def Remove(self):
+    """Removes the finished task list and its journal.
+
+    The journal goes first, so that it never outlives its task list.
+    """
+    RemoveJournal(self.path)
+    files.Remove(self.path)
@@ -0,0 +1,156 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for glazier.lib.config.journal."""
+
+import os
+from unittest import mock
+
+from absl.testing import absltest
+from glazier.lib import test_utils
+from glazier.lib.config import files
+from glazier.lib.config import journal
+from glazier.lib.config import task_file
+
+
+class TaskJournalTest(test_utils.GlazierTestCase):
+
+  def setUp(self):
+    super(TaskJournalTest, self).setUp()
+    self.path = os.path.join(self.create_tempdir().full_path, 'task_list.yaml')
+    self.tasks = [{'data': {'SetTimer': [str(i)]}, 'path': []}
+                  for i in range(5)]
+    files.Dump(self.path, self.tasks)
+
+  def _run(self, count):
+    """Loads the task list and completes count tasks."""
+    task_journal = journal.TaskJournal(self.path)
+    remaining = task_journal.Load()
+    for _ in range(count):
+      remaining.pop(0)
+      task_journal.Pop(remaining)
+    return task_journal
+
+  def test_load_without_journal(self):
+    self.assertEqual(journal.TaskJournal(self.path).Load(), self.tasks)
+
+  @mock.patch.object(journal.files, 'Dump', autospec=True)
+  def test_resume(self, mock_dump):
+    self._run(2)
+    mock_dump.assert_not_called()
+    self.assertEqual(journal.TaskJournal(self.path).Load(), self.tasks[2:])
+    self._run(1)
+    self.assertEqual(journal.TaskJournal(self.path).Load(), self.tasks[3:])
+
+  def test_truncated_entry(self):
+    self._run(2)
+    with open(self.path + journal.JOURNAL_SUFFIX, 'a') as f:
+      f.write('3')
+    self.assertEqual(journal.TaskJournal(self.path).Load(), self.tasks[2:])
+
+  def test_stale_journal(self):
+    self._run(2)
+    files.Dump(self.path, self.tasks[:3])
+    self.assertEqual(journal.TaskJournal(self.path).Load(), self.tasks[:3])
+    self.assertFalse(os.path.exists(self.path + journal.JOURNAL_SUFFIX))
+
+  def test_compaction(self):
+    self.tasks = [{'data': {'SetTimer': [str(i)]}, 'path': []}
+                  for i in range(3 * journal.COMPACT_MIN)]
+    files.Dump(self.path, self.tasks)
+    self._run(journal.COMPACT_MIN - 1)
+    self.assertTrue(os.path.exists(self.path + journal.JOURNAL_SUFFIX))
+    # Compacts once as many tasks are done as are left, and is interrupted
+    # before the old journal is removed.
+    half = len(self.tasks) // 2
+    with mock.patch.object(
+        journal, 'RemoveJournal', autospec=True) as mock_removejournal:
+      self._run(half - journal.COMPACT_MIN + 1)
+      mock_removejournal.assert_called_once_with(self.path)
+    self.assertEqual(files.Read(self.path), self.tasks[half:])
+    self.assertEqual(journal.TaskJournal(self.path).Load(), self.tasks[half:])
+
+  def test_pop_unloaded(self):
+    other = self.path + '.moved'
+    task_journal = journal.TaskJournal(other)
+    task_journal.Pop(self.tasks[1:])
+    self.assertEqual(files.Read(other), self.tasks[1:])
+    task_journal.Pop(self.tasks[2:])
+    self.assertEqual(journal.TaskJournal(other).Load(), self.tasks[2:])
+
+  def test_remove(self):
+    task_journal = self._run(1)
+    task_journal.Remove()
+    self.assertFalse(os.path.exists(self.path))
+    self.assertFalse(os.path.exists(self.path + journal.JOURNAL_SUFFIX))
+
+  @mock.patch.object(journal.files, 'Remove', autospec=True)
+  def test_remove_error(self, mock_remove):
+    task_journal = self._run(1)
+    mock_remove.side_effect = files.FileRemoveError(self.path)
+    with self.assert_raises_with_validation(files.FileRemoveError):
+      task_journal.Remove()
+    # The journal is gone, so the task list left behind starts over.
+    self.assertFalse(os.path.exists(self.path + journal.JOURNAL_SUFFIX))
+
+  def test_binary_resume(self):
+    self.tasks = [dict(task, path=()) for task in self.tasks]
+    task_file.Write(self.path, self.tasks)
+    task_journal = self._run(2)
+    self.assertEqual(journal.TaskJournal(self.path).Load().ToList(),
+                     self.tasks[2:])
+    # Binary task lists are never compacted in place.
+    with mock.patch.object(task_file, 'Write', autospec=True) as mock_write:
+      task_journal.Compact = mock.Mock()
+      remaining = journal.TaskJournal(self.path).Load()
+      for _ in range(3):
+        remaining.pop(0)
+        task_journal.Pop(remaining)
+      task_journal.Compact.assert_not_called()
+      mock_write.assert_not_called()
+    self.assertEmpty(journal.TaskJournal(self.path).Load())
+
+  def test_binary_stale_journal(self):
+    self.tasks = [dict(task, path=()) for task in self.tasks]
+    task_file.Write(self.path, self.tasks)
+    self._run(2)
+    task_file.Write(self.path, self.tasks)
+    self.assertEqual(journal.TaskJournal(self.path).Load().ToList(),
+                     self.tasks)
+
+  def test_binary_pop_unloaded(self):
+    self.tasks = [dict(task, path=()) for task in self.tasks]
+    task_file.Write(self.path, self.tasks)
+    remaining = journal.TaskJournal(self.path).Load()
+    remaining.pop(0)
+    other = self.path + '.moved'
+    task_journal = journal.TaskJournal(other)
+    task_journal.Pop(remaining)
+    self.assertTrue(task_file.IsCompiled(other))
+    remaining.pop(0)
+    task_journal.Pop(remaining)
+    self.assertEqual(journal.TaskJournal(other).Load().ToList(),
+                     self.tasks[2:])
+    remaining.Close()
+
+  def test_load_errors(self):
+    with open(self.path, 'w') as f:
+      f.write('[not yaml')
+    with self.assert_raises_with_validation(files.FileReadError):
+      journal.TaskJournal(self.path).Load()
+    with self.assert_raises_with_validation(files.FileReadError):
+      journal.TaskJournal(self.path + '.missing').Load()
+
+
+if __name__ == '__main__':
+  absltest.main()
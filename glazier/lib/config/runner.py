@@ -21,6 +21,8 @@ from glazier.lib import logs
 from glazier.lib import power
 from glazier.lib.config import base as config_base
 from glazier.lib.config import files
+from glazier.lib.config import journal
+from glazier.lib.config import task_file
 
 from glazier.lib import download
 from glazier.lib import errors
@@ -60,21 +62,31 @@ class CheckUrlError(Error):
 class ConfigRunner(config_base.ConfigBase):
   """Executes all steps from the installation task list."""
 
+  def __init__(self, build_info):
+    super(ConfigRunner, self).__init__(build_info)
+    self._journal = None
+
   def Start(self, task_list):
     self._task_list_path = task_list
+    self._journal = journal.TaskJournal(self._task_list_path)
     try:
-      data = files.Read(self._task_list_path)
+      data = self._journal.Load()
     except files.Error as e:
       raise ConfigRunnerError() from e
     self._ProcessTasks(data)
 
   def _PopTask(self, tasks):
-    """Remove the first event from the task list and save new list to disk."""
+    """Remove the first event from the task list and record it on disk."""
     tasks.pop(0)
     try:
-      files.Dump(self._task_list_path, tasks, mode='w')
+      # The task list moved (or was never loaded): start a new journal there.
+      if not self._journal or self._journal.path != self._task_list_path:
+        self._journal = journal.TaskJournal(self._task_list_path)
+      self._journal.Pop(tasks)
       if not tasks:
-        files.Remove(self._task_list_path)
+        if isinstance(tasks, task_file.TaskView):
+          tasks.Close()  # The file cannot be moved while it is mapped.
+        self._journal.Remove()
     except files.Error as e:
       raise ConfigRunnerError() from e
 
@@ -115,6 +127,7 @@ class ConfigRunner(config_base.ConfigBase):
               self._PopTask(tasks)
             if e.pop_next:
               self._PopTask(tasks)
+            logs.Flush()
             power.Restart(e.timeout, str(e))
             sys.exit(0)
           except events.ShutdownEvent as e:
@@ -124,6 +137,7 @@ class ConfigRunner(config_base.ConfigBase):
               self._PopTask(tasks)
             if e.pop_next:
               self._PopTask(tasks)
+            logs.Flush()
             power.Shutdown(e.timeout, str(e))
             sys.exit(0)
       self._PopTask(tasks)
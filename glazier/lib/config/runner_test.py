@@ -14,7 +14,11 @@
 
 """Tests for glazier.lib.config.runner."""
 
+import gc
+import os
+import tracemalloc
 from unittest import mock
+import weakref
 
 from absl import flags
 from absl.testing import absltest
@@ -22,6 +26,7 @@ from glazier.lib import buildinfo
 from glazier.lib import events
 from glazier.lib import test_utils
 from glazier.lib.config import base
+from glazier.lib.config import builder
 from glazier.lib.config import files
 from glazier.lib.config import runner
 
@@ -62,11 +67,9 @@ class ConfigRunnerTest(test_utils.GlazierTestCase):
         'path': ['/path3']
     }]
     self.cr._ProcessTasks(conf)
-    mock_dump.assert_has_calls([
-        mock.call(self.cr._task_list_path, conf[1:], mode='w'),
-        mock.call(self.cr._task_list_path, conf[2:], mode='w'),
-        mock.call(self.cr._task_list_path, [], mode='w')
-    ])
+    # Without a loaded task list, the first pop writes the rest out in full.
+    mock_dump.assert_called_once_with(
+        self.cr._task_list_path, conf[1:], mode='w')
     mock_pull.assert_has_calls([])
     self.assertTrue(mock_remove.called)
 
@@ -74,7 +77,14 @@ class ConfigRunnerTest(test_utils.GlazierTestCase):
   def test_pop_task(self, mock_dump):
     self.cr._PopTask([1, 2, 3])
     mock_dump.assert_called_with(self.task_list_path, [2, 3], mode='w')
+    mock_dump.reset_mock()
+    self.cr._PopTask([2, 3])
+    mock_dump.assert_not_called()
+    self.cr._task_list_path = self.create_tempfile().full_path
+    self.cr._PopTask([3, 4])
+    mock_dump.assert_called_with(self.cr._task_list_path, [4], mode='w')
     mock_dump.side_effect = runner.files.FileRemoveError('/some/file/path')
+    self.cr._task_list_path = self.task_list_path
     with self.assert_raises_with_validation(runner.ConfigRunnerError):
       self.cr._PopTask([1, 2])
 
@@ -85,6 +95,78 @@ class ConfigRunnerTest(test_utils.GlazierTestCase):
     mock_dump.assert_called_with(self.task_list_path, [], mode='w')
     mock_remove.assert_called_with(self.task_list_path)
 
+  @mock.patch.object(base.actions, 'SetTimer', autospec=True)
+  def test_start_resumes(self, mock_settimer):
+    tasks = [{
+        'data': {
+            'SetTimer': ['Timer%d' % i]
+        },
+        'path': ['/autobuild']
+    } for i in range(3)]
+    runner.files.Dump(self.task_list_path, tasks)
+    with open(self.task_list_path + runner.journal.JOURNAL_SUFFIX, 'w') as f:
+      f.write('%s %s\n1\n' % (runner.journal.JOURNAL_HEADER,
+                               runner.journal._HashFile(self.task_list_path)))
+    self.cr.Start(self.task_list_path)
+    mock_settimer.assert_has_calls([
+        mock.call(build_info=self.buildinfo, args=['Timer1']),
+        mock.call().Run(),
+        mock.call(build_info=self.buildinfo, args=['Timer2']),
+        mock.call().Run(),
+    ])
+    self.assertFalse(os.path.exists(self.task_list_path))
+
+  @mock.patch.object(buildinfo.winpe, 'check_winpe', return_value=False)
+  @mock.patch.object(buildinfo.BuildInfo, 'ReleasePath',
+                     return_value='https://glazier/')
+  @mock.patch.object(builder.files, 'Read', autospec=True)
+  @mock.patch.object(base.actions, 'SetTimer', autospec=True)
+  def test_build_cycles(self, mock_settimer, mock_read, *unused_mocks):
+    mock_read.return_value = {'controls': [{'SetTimer': ['Timer']}]}
+    refs = []
+    usage = []
+    tracemalloc.start()
+    for _ in range(10):
+      build_info = buildinfo.BuildInfo()
+      build_info.WinPE()
+      build_info.WinPE()
+      builder.ConfigBuilder(build_info).Start(self.task_list_path, '')
+      runner.ConfigRunner(build_info).Start(self.task_list_path)
+      self.assertEqual(build_info.FactStats()['WinPE'], {
+          'hits': 1,
+          'misses': 1
+      })
+      refs.append(weakref.ref(build_info))
+      del build_info
+      mock_settimer.reset_mock()
+      mock_read.reset_mock()
+      gc.collect()
+      usage.append(tracemalloc.get_traced_memory()[0])
+    tracemalloc.stop()
+    # No BuildInfo, or the facts it collected, outlives its cycle.
+    self.assertEqual([ref() for ref in refs], [None] * len(refs))
+    self.assertLess(usage[-1] - usage[2], 64 * 1024)
+
+  @mock.patch.object(base.actions, 'SetTimer', autospec=True)
+  def test_start_binary(self, mock_settimer):
+    tasks = [{
+        'data': {
+            'SetTimer': ['Timer%d' % i]
+        },
+        'path': ['/autobuild']
+    } for i in range(3)]
+    file_id = runner.task_file.Write(self.task_list_path, tasks)
+    with open(self.task_list_path + runner.journal.JOURNAL_SUFFIX, 'w') as f:
+      f.write('%s %s\n1\n' % (runner.journal.JOURNAL_HEADER, file_id))
+    self.cr.Start(self.task_list_path)
+    mock_settimer.assert_has_calls([
+        mock.call(build_info=self.buildinfo, args=['Timer1']),
+        mock.call().Run(),
+        mock.call(build_info=self.buildinfo, args=['Timer2']),
+        mock.call().Run(),
+    ])
+    self.assertFalse(os.path.exists(self.task_list_path))
+
   @mock.patch.object(runner.power, 'Restart', autospec=True)
   @mock.patch.object(runner.ConfigRunner, '_ProcessAction', autospec=True)
   @mock.patch.object(runner.ConfigRunner, '_PopTask', autospec=True)
@@ -121,6 +203,19 @@ class ConfigRunnerTest(test_utils.GlazierTestCase):
     mock_restart.assert_called_with(10, 'Some other reason')
     self.assertTrue(mock_poptask.called)
 
+  @mock.patch.object(runner.logs, 'Flush', autospec=True)
+  @mock.patch.object(runner.power, 'Restart', autospec=True)
+  @mock.patch.object(runner.ConfigRunner, '_ProcessAction', autospec=True)
+  @mock.patch.object(runner.ConfigRunner, '_PopTask', autospec=True)
+  def test_restart_flushes_logs(self, unused_poptask, mock_processaction,
+                                mock_restart, mock_flush):
+    mock_flush.side_effect = lambda: self.assertFalse(mock_restart.called)
+    mock_processaction.side_effect = events.RestartEvent('Some reason', timeout=25)
+    with self.assert_raises_with_validation(SystemExit):
+      self.cr._ProcessTasks([{'data': {'Restart': ['25']}, 'path': ['path1']}])
+    mock_flush.assert_called_once_with()
+    self.assertTrue(mock_restart.called)
+
   @mock.patch.object(runner.power, 'Shutdown', autospec=True)
   @mock.patch.object(runner.ConfigRunner, '_ProcessAction', autospec=True)
   @mock.patch.object(runner.ConfigRunner, '_PopTask', autospec=True)
@@ -183,32 +278,25 @@ class ConfigRunnerTest(test_utils.GlazierTestCase):
           }]
       )
 
-  @mock.patch.object(runner.files, 'Read', autospec=True)
-  def test_start_with_missing_file(self, mock_read):
-    mock_read.side_effect = files.FileDownloadError('some_path')
+  def test_start_with_missing_file(self):
     with self.assert_raises_with_validation(runner.ConfigRunnerError):
-      self.cr.Start('/tmp/path/missing.yaml')
+      self.cr.Start(os.path.join(self.create_tempdir().full_path,
+                                 'missing.yaml'))
 
   @mock.patch.object(base.actions, 'SetTimer', autospec=True)
-  @mock.patch.object(runner.files, 'Read', autospec=True)
   @mock.patch.object(runner.files, 'Remove', autospec=True)
-  @mock.patch.object(runner.files, 'Dump', autospec=True)
-  def test_start_with_actions(
-      self, mock_dump, mock_remove, mock_read, mock_settimer):
-
-    mock_read.return_value = [{
+  def test_start_with_actions(self, mock_remove, mock_settimer):
+    files.Dump(self.task_list_path, [{
         'data': {
             'SetTimer': ['TestTimer']
         },
         'path': ['/autobuild']
-    }]
-    self.cr.Start('/tmp/path/tasks.yaml')
-    mock_read.assert_called_with('/tmp/path/tasks.yaml')
+    }])
+    self.cr.Start(self.task_list_path)
     mock_settimer.assert_called_with(
         build_info=self.buildinfo, args=['TestTimer'])
     self.assertTrue(mock_settimer.return_value.Run.called)
-    self.assertTrue(mock_dump.called)
-    self.assertTrue(mock_remove.called)
+    mock_remove.assert_called_with(self.task_list_path)
 
   @mock.patch.object(runner.download.Download, 'CheckUrl', autospec=True)
   def test_verify_urls(self, mock_checkurl):
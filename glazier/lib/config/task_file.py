@@ -0,0 +1,244 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Binary task list format, decoded one task at a time.
+
+A YAML task list has to be parsed in full before the first task can run. A
+binary task list is laid out so that the runner can memory map it and decode
+only the task it is about to run:
+
+  header   magic, version, file id, task count, table and index offsets
+  tasks    one record per task: a kind byte, then the task encoded as JSON (or
+           as YAML, for tasks JSON cannot represent faithfully)
+  paths    the distinct config paths of all tasks, as a JSON list; each task
+           refers to its path by position in this list
+  index    count + 1 little-endian offsets, the start of each task record and
+           the end of the last
+
+Each binary task list has a random id, which the task list journal uses in place
+of a digest of the whole file.
+"""
+
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, Iterable, List, Optional
+
+from glazier.lib import file_util
+from glazier.lib import yaml_codec
+from glazier.lib.config import files
+
+MAGIC = b'GZTL'
+VERSION = 1
+_HEADER = struct.Struct('<4sHH16sQQQ')
+_OFFSET = struct.Struct('<Q')
+_JSON = b'J'
+_YAML = b'Y'
+
+
+def IsCompiled(path: str) -> bool:
+  """Whether the file at path is a binary task list.
+
+  Args:
+    path: The path to the task list.
+
+  Returns:
+    True if the file starts with the binary task list magic.
+  """
+  try:
+    with open(path, 'rb') as f:
+      return f.read(len(MAGIC)) == MAGIC
+  except IOError:
+    return False
+
+
+def _Encode(path_id: int, data: Any) -> bytes:
+  """Encodes one task record, preferring JSON where it round trips."""
+  record = [path_id, data]
+  try:
+    encoded = json.dumps(record, separators=(',', ':'))
+    if json.loads(encoded) == record:
+      return _JSON + encoded.encode('utf-8')
+  except (TypeError, ValueError):
+    pass
+  return _YAML + yaml_codec.Dump(record).encode('utf-8')
+
+
+def Write(path: str, tasks: Iterable[Dict[str, Any]]) -> str:
+  """Writes a binary task list.
+
+  Args:
+    path: The destination file.
+    tasks: The tasks, each a dict with 'path' and 'data'.
+
+  Returns:
+    The id of the new file, as a hex string.
+
+  Raises:
+    Error: The file could not be written.
+  """
+  file_util.CreateDirectories(path)
+  file_id = os.urandom(16)
+  tmp_f = path + '.tmp'
+  paths = {}
+  offsets = []
+
+  # Write to a .tmp file to avoid corrupting the original if aborted mid-way.
+  try:
+    with open(tmp_f, 'wb') as f:
+      f.write(b'\0' * _HEADER.size)
+      for task in tasks:
+        conf_path = tuple(task['path'])
+        path_id = paths.setdefault(conf_path, len(paths))
+        offsets.append(f.tell())
+        f.write(_Encode(path_id, task['data']))
+      offsets.append(f.tell())
+      f.write(json.dumps([list(p) for p in paths]).encode('utf-8'))
+      index_offset = f.tell()
+      for offset in offsets:
+        f.write(_OFFSET.pack(offset))
+      f.seek(0)
+      f.write(
+          _HEADER.pack(MAGIC, VERSION, 0, file_id, len(offsets) - 1,
+                       offsets[-1], index_offset))
+  except IOError as e:
+    raise files.FileWriteError(path) from e
+  try:
+    file_util.Move(tmp_f, path)
+  except file_util.Error as e:
+    raise files.FileMoveError(tmp_f, path) from e
+  return file_id.hex()
+
+
+class TaskFile(object):
+  """A memory mapped binary task list."""
+
+  def __init__(self, path: str):
+    """Opens a binary task list.
+
+    Args:
+      path: The path to the task list.
+
+    Raises:
+      FileReadError: The file is missing or is not a binary task list.
+    """
+    self.path = path
+    self._file = None
+    self._map = None
+    try:
+      self._file = open(path, 'rb')
+      self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+      (magic, version, _, file_id, self.count, paths_offset,
+       self._index_offset) = _HEADER.unpack_from(self._map, 0)
+      if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a binary task list')
+      self.id = file_id.hex()
+      self._paths = [
+          tuple(p) for p in json.loads(
+              self._map[paths_offset:self._index_offset].decode('utf-8'))
+      ]
+    except (IOError, ValueError, struct.error) as e:
+      self.Close()
+      raise files.FileReadError(path) from e
+
+  def Get(self, i: int) -> Dict[str, Any]:
+    """Decodes a single task.
+
+    Args:
+      i: The position of the task in the file.
+
+    Returns:
+      The task, as a dict with 'path' and 'data'. Tasks in the same directory
+      share a single path tuple.
+    """
+    start, end = struct.unpack_from('<QQ', self._map,
+                                    self._index_offset + i * _OFFSET.size)
+    record = self._map[start:end]
+    if record[:1] == _JSON:
+      path_id, data = json.loads(record[1:].decode('utf-8'))
+    else:
+      path_id, data = yaml_codec.Load(record[1:])
+    return {'path': self._paths[path_id], 'data': data}
+
+  def Close(self):
+    """Releases the mapping, which must happen before the file is moved."""
+    if self._map:
+      self._map.close()
+      self._map = None
+    if self._file:
+      self._file.close()
+      self._file = None
+
+
+class TaskView(object):
+  """The remaining tasks of a TaskFile, as a list-like sequence.
+
+  Supports the subset of list operations ConfigRunner uses: len(), indexing,
+  iteration and pop(0), which advances past the first task without decoding
+  the rest. Popping any other task raises ValueError.
+  """
+
+  def __init__(self, task_file: TaskFile, start: int = 0):
+    self.task_file = task_file
+    self.start = min(start, task_file.count)
+    self._head = None  # type: Optional[Dict[str, Any]]
+
+  def __len__(self) -> int:
+    return self.task_file.count - self.start
+
+  def __getitem__(self, i: int) -> Dict[str, Any]:
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError('task index out of range')
+    if i == 0:
+      if self._head is None:
+        self._head = self.task_file.Get(self.start)
+      return self._head
+    return self.task_file.Get(self.start + i)
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def pop(self, i: int = 0) -> Dict[str, Any]:  # pylint: disable=invalid-name
+    """Removes and returns the first task.
+
+    Args:
+      i: The index of the task to remove. Only the first task can be removed,
+        as the view covers a contiguous run of the tasks in its file.
+
+    Returns:
+      The removed task.
+
+    Raises:
+      IndexError: The view is empty, or i is out of range.
+      ValueError: i refers to a task other than the first.
+    """
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError('pop index out of range')
+    if i != 0:
+      raise ValueError('Only the first task of a TaskView can be removed.')
+    task = self[0]
+    self.start += 1
+    self._head = None
+    return task
+
+  def Close(self):
+    self.task_file.Close()
+
+  def ToList(self) -> List[Dict[str, Any]]:
+    return list(self)
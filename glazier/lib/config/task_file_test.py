@@ -0,0 +1,128 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for glazier.lib.config.task_file."""
+
+import datetime
+import os
+from unittest import mock
+
+from absl.testing import absltest
+from glazier.lib import test_utils
+from glazier.lib.config import files
+from glazier.lib.config import task_file
+
+
+class TaskFileTest(test_utils.GlazierTestCase):
+
+  def setUp(self):
+    super(TaskFileTest, self).setUp()
+    self.path = os.path.join(self.create_tempdir().full_path, 'task_list.yaml')
+    self.tasks = [{
+        'data': {
+            'SetTimer': ['Timer%d' % i]
+        },
+        'path': ('/autobuild', 'sub%d' % (i % 2))
+    } for i in range(6)]
+
+  def test_round_trip(self):
+    file_id = task_file.Write(self.path, self.tasks)
+    self.assertTrue(task_file.IsCompiled(self.path))
+    tasks = task_file.TaskFile(self.path)
+    self.assertEqual(tasks.id, file_id)
+    self.assertEqual(tasks.count, len(self.tasks))
+    self.assertEqual(tasks.Get(3), self.tasks[3])
+    self.assertEqual(task_file.TaskView(tasks).ToList(), self.tasks)
+    tasks.Close()
+
+  def test_paths_are_interned(self):
+    task_file.Write(self.path, self.tasks)
+    with open(self.path, 'rb') as f:
+      self.assertEqual(f.read().count(b'sub0'), 1)
+
+  def test_paths_are_shared(self):
+    task_file.Write(self.path, self.tasks)
+    tasks = task_file.TaskFile(self.path)
+    self.assertIs(tasks.Get(0)['path'], tasks.Get(2)['path'])
+    tasks.Close()
+
+  def test_non_json_data(self):
+    self.tasks = [
+        {'data': {'Tag': {1: 'one'}}, 'path': ()},
+        {'data': {'Date': [datetime.date(2023, 1, 2)]}, 'path': ()},
+    ]
+    task_file.Write(self.path, self.tasks)
+    tasks = task_file.TaskFile(self.path)
+    self.assertEqual(task_file.TaskView(tasks).ToList(), self.tasks)
+    tasks.Close()
+
+  def test_empty(self):
+    task_file.Write(self.path, [])
+    tasks = task_file.TaskFile(self.path)
+    self.assertEqual(tasks.count, 0)
+    self.assertEmpty(task_file.TaskView(tasks))
+    tasks.Close()
+
+  def test_view(self):
+    task_file.Write(self.path, self.tasks)
+    tasks = task_file.TaskFile(self.path)
+    view = task_file.TaskView(tasks, 2)
+    self.assertLen(view, 4)
+    with mock.patch.object(tasks, 'Get', wraps=tasks.Get) as mock_get:
+      self.assertEqual(view[0]['data'], self.tasks[2]['data'])
+      self.assertEqual(view[0]['path'], self.tasks[2]['path'])
+      mock_get.assert_called_once_with(2)
+    self.assertEqual(view[-1], self.tasks[5])
+    self.assertEqual(view.pop(0), self.tasks[2])
+    self.assertEqual(view[0], self.tasks[3])
+    self.assertLen(view, 3)
+    with self.assertRaises(IndexError):
+      view[3]  # pylint: disable=pointless-statement
+    with self.assertRaises(ValueError):
+      view.pop(1)
+    with self.assertRaises(IndexError):
+      view.pop(3)
+    self.assertEqual(view.pop(-3), self.tasks[3])
+    self.assertLen(view, 2)
+    view.pop()
+    view.pop()
+    with self.assertRaises(IndexError):
+      view.pop()
+    view.Close()
+
+  def test_is_compiled(self):
+    files.Dump(self.path, [])
+    self.assertFalse(task_file.IsCompiled(self.path))
+    self.assertFalse(task_file.IsCompiled(self.path + '.missing'))
+
+  def test_open_errors(self):
+    files.Dump(self.path, [])
+    with self.assert_raises_with_validation(files.FileReadError):
+      task_file.TaskFile(self.path)
+    with self.assert_raises_with_validation(files.FileReadError):
+      task_file.TaskFile(self.path + '.missing')
+
+  @mock.patch.object(task_file.file_util, 'Move', autospec=True)
+  def test_write_error(self, mock_move):
+    mock_move.side_effect = task_file.file_util.FileMoveError('src', 'dst')
+    with self.assert_raises_with_validation(files.FileMoveError):
+      task_file.Write(self.path, self.tasks)
+
+  def test_write_error_tmp(self):
+    os.mkdir(self.path + '.tmp')
+    with self.assert_raises_with_validation(files.FileWriteError):
+      task_file.Write(self.path, self.tasks)
+
+
+if __name__ == '__main__':
+  absltest.main()
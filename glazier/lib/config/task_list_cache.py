@@ -0,0 +1,172 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cache of compiled task lists.
+
+While it builds a task list, ConfigBuilder records a trace: the digest of every
+config file it read, and the outcome of every pin check it made. A build which
+reads the same files and gets the same pin outcomes produces the same task list,
+so the trace is stored beside the task list and later builds can replay it
+instead of walking the config tree again.
+
+Builds which run realtime actions (such as the chooser or a server change) can
+depend on more than the trace records, and are never cached.
+
+Entries are kept under the local build cache and, optionally, in a shared
+directory used by many hosts. Failures reading or writing either are logged and
+treated as a cache miss.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Iterator, List, Optional
+
+from absl import flags
+from glazier.lib import yaml_codec
+from glazier.lib.config import files
+
+_TASK_LIST_CACHE = flags.DEFINE_bool(
+    'task_list_cache', False,
+    'Reuse a previously compiled task list when the config files and pin '
+    'outcomes it was built from are unchanged.')
+_TASK_LIST_CACHE_DIR = flags.DEFINE_string(
+    'task_list_cache_dir', '',
+    'A directory shared between hosts to keep compiled task lists in, in '
+    'addition to the local build cache. Requires --task_list_cache.')
+
+TASK_LIST_CACHE_DIR = 'task_lists'
+MANIFEST_SUFFIX = '.json'
+TASK_LIST_SUFFIX = '.yaml'
+
+
+def Directories(build_info) -> List[str]:
+  """Lists the directories to keep compiled task lists in.
+
+  Args:
+    build_info: The active BuildInfo instance.
+
+  Returns:
+    The local and shared cache directories, in lookup order, or an empty list
+    if the cache is disabled.
+  """
+  if not _TASK_LIST_CACHE.value:
+    return []
+  directories = [os.path.join(build_info.CachePath(), TASK_LIST_CACHE_DIR)]
+  if _TASK_LIST_CACHE_DIR.value:
+    directories.append(_TASK_LIST_CACHE_DIR.value)
+  return directories
+
+
+def Digest(data: Any) -> Optional[str]:
+  """Computes a digest of parsed config data.
+
+  Args:
+    data: The parsed YAML content of a config file.
+
+  Returns:
+    The hex SHA256 digest of a canonical form of the data, or None if it has no
+    canonical form.
+  """
+  try:
+    canonical = json.dumps(data, sort_keys=True, default=str)
+  except (TypeError, ValueError):
+    return None
+  return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class TaskListCache(object):
+  """Compiled task lists for one root config, keyed by build trace."""
+
+  def __init__(self, directories: List[str], scope: str):
+    """Initializes the cache.
+
+    Args:
+      directories: The cache directories, in lookup order.
+      scope: Identifies the root config the task lists were built from.
+    """
+    scope = hashlib.sha256(scope.encode('utf-8')).hexdigest()[:16]
+    self._directories = [os.path.join(d, scope) for d in directories]
+
+  def Manifests(self) -> Iterator[Dict[str, Any]]:
+    """Yields the stored entries, newest first within each directory.
+
+    Yields:
+      Manifests, with the trace of the build under 'trace'.
+    """
+    for directory in self._directories:
+      try:
+        paths = [
+            os.path.join(directory, name)
+            for name in os.listdir(directory)
+            if name.endswith(MANIFEST_SUFFIX)
+        ]
+        paths.sort(key=os.path.getmtime, reverse=True)
+      except OSError as e:
+        logging.debug('Unable to list task list cache %s: %s', directory, e)
+        continue
+      for path in paths:
+        try:
+          with open(path) as f:
+            manifest = json.load(f)
+          trace = manifest['trace']
+          if (not isinstance(trace['files'], dict) or
+              not isinstance(trace['pins'], list)):
+            raise ValueError('Malformed trace')
+        except (OSError, ValueError, KeyError, TypeError) as e:
+          logging.warning('Ignoring unreadable task list cache entry %s: %s',
+                          path, e)
+          continue
+        manifest['path'] = path[:-len(MANIFEST_SUFFIX)] + TASK_LIST_SUFFIX
+        yield manifest
+
+  def Load(self, manifest: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """Reads the task list stored with a manifest.
+
+    Args:
+      manifest: A manifest yielded by Manifests().
+
+    Returns:
+      The compiled task list, or None if it could not be read.
+    """
+    try:
+      task_list = files.Read(manifest['path'])
+    except (files.Error, yaml_codec.YAMLError) as e:
+      logging.warning('Unable to read cached task list %s: %s',
+                      manifest['path'], e)
+      return None
+    return task_list if isinstance(task_list, list) else None
+
+  def Store(self, trace: Dict[str, Any], task_list: List[Dict[str, Any]]):
+    """Stores a compiled task list in every cache directory.
+
+    Args:
+      trace: The files and pin outcomes the task list was built from.
+      task_list: The compiled task list.
+    """
+    key = hashlib.sha256(
+        json.dumps(trace, sort_keys=True).encode('utf-8')).hexdigest()
+    for directory in self._directories:
+      path = os.path.join(directory, key)
+      try:
+        os.makedirs(directory, exist_ok=True)
+        files.Dump(path + TASK_LIST_SUFFIX, task_list)
+        # The manifest is written last, so it never refers to a partial entry.
+        with open(path + MANIFEST_SUFFIX + '.tmp', 'w') as f:
+          json.dump({'trace': trace}, f)
+        os.replace(path + MANIFEST_SUFFIX + '.tmp', path + MANIFEST_SUFFIX)
+      except (files.Error, OSError) as e:
+        logging.warning('Unable to store task list in %s: %s', directory, e)
+        continue
+      logging.info('Stored compiled task list in %s.', directory)
@@ -0,0 +1,99 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for glazier.lib.config.task_list_cache."""
+
+import datetime
+import os
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import flagsaver
+from glazier.lib import test_utils
+from glazier.lib.config import task_list_cache
+
+_TRACE = {
+    'files': {
+        'https://glazier/build.yaml': 'abc'
+    },
+    'pins': [['os_code', ['win10'], True]]
+}
+_TASK_LIST = [{'path': [], 'data': {'SetTimer': ['start__build.yaml']}}]
+
+
+class TaskListCacheTest(test_utils.GlazierTestCase):
+
+  def setUp(self):
+    super(TaskListCacheTest, self).setUp()
+    self.local = self.create_tempdir().full_path
+    self.shared = self.create_tempdir().full_path
+
+  def test_directories(self):
+    build_info = mock.Mock()
+    build_info.CachePath.return_value = self.local
+    with flagsaver.flagsaver(task_list_cache=False):
+      self.assertEqual(task_list_cache.Directories(build_info), [])
+    with flagsaver.flagsaver(task_list_cache=True):
+      self.assertEqual(
+          task_list_cache.Directories(build_info),
+          [os.path.join(self.local, task_list_cache.TASK_LIST_CACHE_DIR)])
+    with flagsaver.flagsaver(
+        task_list_cache=True, task_list_cache_dir=self.shared):
+      self.assertEqual(task_list_cache.Directories(build_info)[1], self.shared)
+
+  def test_digest(self):
+    self.assertEqual(
+        task_list_cache.Digest({'a': 1, 'b': [1, 2]}),
+        task_list_cache.Digest({'b': [1, 2], 'a': 1}))
+    self.assertNotEqual(
+        task_list_cache.Digest({'a': 1}), task_list_cache.Digest({'a': 2}))
+    self.assertIsNotNone(
+        task_list_cache.Digest({'date': datetime.date(2023, 1, 1)}))
+    self.assertIsNone(task_list_cache.Digest({1: 'a', 'b': 'c'}))
+
+  def test_store_and_load(self):
+    cache = task_list_cache.TaskListCache([self.local, self.shared], 'root')
+    cache.Store(_TRACE, _TASK_LIST)
+    manifests = list(cache.Manifests())
+    self.assertLen(manifests, 2)
+    self.assertEqual(manifests[0]['trace'], _TRACE)
+    self.assertTrue(manifests[0]['path'].startswith(self.local))
+    self.assertTrue(manifests[1]['path'].startswith(self.shared))
+    self.assertEqual(cache.Load(manifests[1]), _TASK_LIST)
+
+    other = task_list_cache.TaskListCache([self.local], 'other root')
+    self.assertEqual(list(other.Manifests()), [])
+
+  def test_unreadable(self):
+    cache = task_list_cache.TaskListCache([self.local], 'root')
+    self.assertEqual(list(cache.Manifests()), [])
+    cache.Store(_TRACE, _TASK_LIST)
+    manifest = next(cache.Manifests())
+    with open(manifest['path'], 'w') as f:
+      f.write('not: [a list')
+    self.assertIsNone(cache.Load(manifest))
+    with open(manifest['path'][:-5] + task_list_cache.MANIFEST_SUFFIX,
+              'w') as f:
+      f.write('{"trace": {"files": []}}')
+    self.assertEqual(list(cache.Manifests()), [])
+
+  @mock.patch.object(task_list_cache.files, 'Dump', autospec=True)
+  def test_store_failure(self, mock_dump):
+    mock_dump.side_effect = task_list_cache.files.FileWriteError('path')
+    cache = task_list_cache.TaskListCache([self.local], 'root')
+    cache.Store(_TRACE, _TASK_LIST)
+    self.assertEqual(list(cache.Manifests()), [])
+
+
+if __name__ == '__main__':
+  absltest.main()
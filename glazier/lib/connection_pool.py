@@ -0,0 +1,287 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Persistent HTTP(S) connections for urllib.
+
+urllib's stock handlers open a new connection, with a full TCP and TLS
+handshake, for every request and close it as soon as the response arrives. The
+handlers here keep connections open with HTTP keep-alive and share them, per
+host, across every opener and thread in the process. New TLS connections to a
+host resume the TLS session of an earlier one, and SSL contexts are built once
+per CA file.
+
+The pool only holds idle connections, at most MAX_IDLE_CONNECTIONS per host. A
+connection in use belongs to its response, which hands it back to the pool when
+the response has been read to the end. A response which is closed early, fails,
+or is dropped without being closed closes its connection instead, so callers
+which stop reading early simply cost a new connection.
+"""
+
+import collections
+import http.client
+import logging
+import ssl
+import threading
+from typing import Callable, Deque, Dict, Optional, Tuple
+import urllib.error
+import urllib.request
+
+# Idle connections kept per scheme, host and SSL context.
+MAX_IDLE_CONNECTIONS = 8
+
+_contexts = {}
+_contexts_lock = threading.Lock()
+
+
+def GetContext(cafile: Optional[str] = None) -> ssl.SSLContext:
+  """Gets the shared client SSL context for a CA file.
+
+  Args:
+    cafile: A file of permitted root certificates, or None for the system
+      default certificates.
+
+  Returns:
+    An SSLContext, created on first use and shared afterwards.
+  """
+  with _contexts_lock:
+    if cafile not in _contexts:
+      _contexts[cafile] = ssl.create_default_context(cafile=cafile)
+    return _contexts[cafile]
+
+
+def MachineContext() -> ssl.SSLContext:
+  """Gets the shared SSL context used to retry with the machine certificates.
+
+  Returns:
+    An SSLContext, created on first use and shared afterwards.
+  """
+  with _contexts_lock:
+    if 'machine' not in _contexts:
+      _contexts['machine'] = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    return _contexts['machine']
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+  """An HTTPS connection which can resume an earlier TLS session."""
+
+  def __init__(self, host: str, session: Optional[ssl.SSLSession] = None,
+               **kwargs):
+    super().__init__(host, **kwargs)
+    self._session = session
+
+  def connect(self):
+    http.client.HTTPConnection.connect(self)
+    server_hostname = self._tunnel_host or self.host
+    self.sock = self._context.wrap_socket(
+        self.sock, server_hostname=server_hostname, session=self._session)
+    if self.sock.session_reused:
+      logging.debug('Resumed TLS session with %s.', server_hostname)
+
+
+class _PooledResponse(http.client.HTTPResponse):
+  """A response which releases its connection once it is finished with."""
+
+  # Called once with whether the connection can be reused.
+  release = None  # type: Optional[Callable[[bool], None]]
+
+  def _close_conn(self):
+    # Runs once the body has been read to the end, on close(), when reading
+    # fails, and from close() when the response is garbage collected.
+    super()._close_conn()
+    release, self.release = self.release, None
+    if release:
+      release(not self.will_close and not self.chunked and self.length == 0)
+
+
+class ConnectionPool(object):
+  """Keep-alive connections, grouped by scheme, host and SSL context."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    # Idle connections only. deque appends and pops are atomic, so responses
+    # can release connections without the lock, even from a finalizer.
+    self._idle = {}  # type: Dict[Tuple, Deque[http.client.HTTPConnection]]
+    self._sessions = {}  # type: Dict[Tuple, ssl.SSLSession]
+    self.created = 0
+    self.reused = 0
+
+  def _SaveSession(self, key: Tuple, connection: http.client.HTTPConnection):
+    session = getattr(connection.sock, 'session', None)
+    if session:
+      self._sessions[key] = session
+
+  def _Acquire(self, key: Tuple, host: str, context: Optional[ssl.SSLContext],
+               timeout: float) -> Tuple[http.client.HTTPConnection, bool]:
+    """Takes an idle connection from the pool, or creates a new one.
+
+    Args:
+      key: The pool key for the connection.
+      host: The host, and optional port, to connect to.
+      context: The SSL context for HTTPS connections, or None for HTTP.
+      timeout: The socket timeout for new connections.
+
+    Returns:
+      A tuple of the connection and whether it was reused.
+    """
+    with self._lock:
+      idle = self._idle.setdefault(key, collections.deque())
+      while idle:
+        try:
+          connection = idle.pop()
+        except IndexError:
+          break
+        if connection.sock:
+          self.reused += 1
+          return (connection, True)
+      self.created += 1
+      session = self._sessions.get(key)
+    if key[0] == 'https':
+      connection = _HTTPSConnection(
+          host, session=session, timeout=timeout, context=context)
+    else:
+      connection = http.client.HTTPConnection(host, timeout=timeout)
+    connection.response_class = _PooledResponse
+    return (connection, False)
+
+  def _Release(self, key: Tuple, connection: http.client.HTTPConnection,
+               reusable: bool):
+    """Returns a connection to the pool, or closes it.
+
+    Args:
+      key: The pool key for the connection.
+      connection: The connection, whose response is finished with.
+      reusable: Whether the response was read to the end, leaving the
+        connection ready for another request.
+    """
+    idle = self._idle.get(key)
+    if (reusable and connection.sock and idle is not None and
+        len(idle) < MAX_IDLE_CONNECTIONS):
+      idle.append(connection)
+    else:
+      connection.close()
+
+  def Open(self,
+           req: urllib.request.Request,
+           context: Optional[ssl.SSLContext] = None,
+           debuglevel: int = 0) -> http.client.HTTPResponse:
+    """Sends a request over a pooled connection.
+
+    Args:
+      req: The request, as prepared by an OpenerDirector.
+      context: The SSL context for HTTPS requests.
+      debuglevel: The http.client debug level.
+
+    Returns:
+      The response, in the form urllib handlers return it.
+
+    Raises:
+      URLError: The request could not be sent.
+    """
+    if not req.host:
+      raise urllib.error.URLError('no host given')
+    key = (req.type, req.host, context)
+
+    headers = dict(req.unredirected_hdrs)
+    headers.update(
+        {k: v for k, v in req.headers.items() if k not in headers})
+    headers['Connection'] = 'keep-alive'
+    headers = {name.title(): val for name, val in headers.items()}
+
+    while True:
+      connection, reused = self._Acquire(key, req.host, context, req.timeout)
+      connection.set_debuglevel(debuglevel)
+      try:
+        connection.request(
+            req.get_method(),
+            req.selector,
+            req.data,
+            headers,
+            encode_chunked=req.has_header('Transfer-encoding'))
+        response = connection.getresponse()
+        break
+      except (OSError, http.client.HTTPException) as e:
+        connection.close()
+        # The server may have closed an idle connection; retry on a new one.
+        if reused:
+          continue
+        if isinstance(e, OSError):
+          raise urllib.error.URLError(e)
+        raise
+
+    with self._lock:
+      self._SaveSession(key, connection)
+    response.release = (
+        lambda reusable: self._Release(key, connection, reusable))
+    response.url = req.get_full_url()
+    response.msg = response.reason
+    return response
+
+  def Close(self):
+    """Closes all idle connections and forgets saved TLS sessions."""
+    with self._lock:
+      for idle in self._idle.values():
+        while idle:
+          try:
+            idle.pop().close()
+          except IndexError:
+            break
+      self._sessions.clear()
+
+
+_pool = ConnectionPool()
+
+
+def GetPool() -> ConnectionPool:
+  """Gets the connection pool shared by the whole process."""
+  return _pool
+
+
+_openers = {}
+
+
+def BuildOpener(context: Optional[ssl.SSLContext] = None
+               ) -> urllib.request.OpenerDirector:
+  """Gets a shared opener, like urllib.request.build_opener, which pools.
+
+  Args:
+    context: The SSL context for HTTPS requests, or None for GetContext().
+
+  Returns:
+    An OpenerDirector with the default urllib handlers, but sending requests
+    over pooled connections.
+  """
+  context = context or GetContext()
+  with _contexts_lock:
+    if context not in _openers:
+      _openers[context] = urllib.request.build_opener(
+          HTTPHandler(), HTTPSHandler(context=context))
+    return _openers[context]
+
+
+class HTTPHandler(urllib.request.HTTPHandler):
+  """Sends HTTP requests over pooled keep-alive connections."""
+
+  def http_open(self, req):
+    return _pool.Open(req, debuglevel=self._debuglevel)
+
+
+class HTTPSHandler(urllib.request.HTTPSHandler):
+  """Sends HTTPS requests over pooled keep-alive connections."""
+
+  def __init__(self, context: Optional[ssl.SSLContext] = None):
+    super().__init__(context=context or GetContext())
+
+  def https_open(self, req):
+    if req._tunnel_host:  # pylint: disable=protected-access
+      return super().https_open(req)
+    return _pool.Open(req, self._context, debuglevel=self._debuglevel)
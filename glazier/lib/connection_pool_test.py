@@ -0,0 +1,171 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for glazier.lib.connection_pool."""
+
+import gc
+import http.server
+import ssl
+import threading
+from unittest import mock
+import urllib.error
+import urllib.request
+import weakref
+
+from absl.testing import absltest
+from glazier.lib import connection_pool
+from glazier.lib import test_utils
+
+
+class KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+  """Serves a fixed body over HTTP/1.1, recording each client port."""
+
+  protocol_version = 'HTTP/1.1'
+  body = b'x' * 4096
+  ports = []
+  # Close the connection after each response without saying so, the way an
+  # idle keep-alive timeout on the server looks to the client.
+  drop_idle = False
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    KeepAliveHandler.ports.append(self.client_address[1])
+    self.send_response(200)
+    self.send_header('Content-Length', str(len(self.body)))
+    self.end_headers()
+    self.wfile.write(self.body)
+    if self.drop_idle:
+      self.close_connection = True
+
+  def log_message(self, *args):
+    pass
+
+
+class ConnectionPoolTest(test_utils.GlazierTestCase):
+
+  def setUp(self):
+    super(ConnectionPoolTest, self).setUp()
+    KeepAliveHandler.ports = []
+    KeepAliveHandler.drop_idle = False
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                             KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    self.url = 'http://127.0.0.1:%d/file' % server.server_address[1]
+    self.pool = connection_pool.ConnectionPool()
+    self.opener = urllib.request.OpenerDirector()
+    self.opener.add_handler(_PoolHandler(self.pool))
+    self.addCleanup(self.pool.Close)
+
+  def test_reuse(self):
+    for _ in range(3):
+      with self.opener.open(self.url) as response:
+        self.assertEqual(response.getcode(), 200)
+        self.assertEqual(response.geturl(), self.url)
+        self.assertEqual(response.read(), KeepAliveHandler.body)
+    self.assertLen(set(KeepAliveHandler.ports), 1)
+    self.assertEqual(self.pool.created, 1)
+    self.assertEqual(self.pool.reused, 2)
+
+  def test_unread_body(self):
+    first = self.opener.open(self.url)
+    first.read(10)
+    first.close()
+    with self.opener.open(self.url) as response:
+      response.read()
+    self.assertLen(set(KeepAliveHandler.ports), 2)
+    self.assertEqual(self.pool.reused, 0)
+
+  def test_concurrent_responses(self):
+    first = self.opener.open(self.url)
+    second = self.opener.open(self.url)
+    self.assertEqual(first.read(), KeepAliveHandler.body)
+    self.assertEqual(second.read(), KeepAliveHandler.body)
+    self.assertEqual(self.pool.created, 2)
+
+  def test_dropped_response(self):
+    response = self.opener.open(self.url)
+    response.read(10)
+    ref = weakref.ref(response)
+    del response
+    gc.collect()
+    # Not kept alive by the pool, and its connection was not pooled.
+    self.assertIsNone(ref())
+    self.assertFalse(any(self.pool._idle.values()))
+    with self.opener.open(self.url) as response:
+      response.read()
+    self.assertEqual(self.pool.reused, 0)
+
+  def test_error_response(self):
+    # urllib raises HTTPError on this, with the unread response as its body.
+    response = self.opener.open(
+        urllib.request.Request(self.url, method='POST'))  # No do_POST.
+    self.assertEqual(response.getcode(), 501)
+    ref = weakref.ref(response)
+    del response
+    gc.collect()
+    self.assertIsNone(ref())
+
+  @mock.patch.object(connection_pool, 'MAX_IDLE_CONNECTIONS', 1)
+  def test_idle_limit(self):
+    responses = [self.opener.open(self.url) for _ in range(3)]
+    for response in responses:
+      self.assertEqual(response.read(), KeepAliveHandler.body)
+    self.assertEqual(sum(len(idle) for idle in self.pool._idle.values()), 1)
+
+  def test_stale_connection(self):
+    KeepAliveHandler.drop_idle = True
+    for _ in range(2):
+      with self.opener.open(self.url) as response:
+        self.assertEqual(response.read(), KeepAliveHandler.body)
+    self.assertLen(set(KeepAliveHandler.ports), 2)
+    self.assertEqual(self.pool.created, 2)
+
+  def test_unreachable(self):
+    self.pool.Close()
+    with self.assertRaises(urllib.error.URLError):
+      self.opener.open('http://127.0.0.1:1/file')
+
+  def test_build_opener(self):
+    context = connection_pool.GetContext()
+    opener = connection_pool.BuildOpener(context)
+    self.assertIs(connection_pool.BuildOpener(context), opener)
+    with opener.open(self.url) as response:
+      self.assertEqual(response.read(), KeepAliveHandler.body)
+    with self.assertRaises(urllib.error.HTTPError):
+      opener.open(self.url, data=b'')  # No do_POST, so 501.
+
+  def test_contexts(self):
+    context = connection_pool.GetContext()
+    self.assertIsInstance(context, ssl.SSLContext)
+    self.assertIs(connection_pool.GetContext(), context)
+    self.assertIs(connection_pool.MachineContext(),
+                  connection_pool.MachineContext())
+    self.assertIsNot(connection_pool.MachineContext(), context)
+    handler = connection_pool.HTTPSHandler()
+    self.assertIs(handler._context, context)
+
+
+class _PoolHandler(urllib.request.HTTPHandler):
+
+  def __init__(self, pool):
+    super(_PoolHandler, self).__init__()
+    self._pool = pool
+
+  def http_open(self, req):
+    return self._pool.Open(req)
+
+
+if __name__ == '__main__':
+  absltest.main()
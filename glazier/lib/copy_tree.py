@@ -0,0 +1,311 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Copies directory trees on a pool of threads.
+
+The files of a tree are listed up front, its directories created, and the files
+then copied concurrently. Several trees are copied one after another, in order,
+so a later copy sees the result of those before it. Copies go through shutil.copy2, which
+uses sendfile() or fcopyfile() where the platform has them and 1MB buffers
+otherwise, and keeps modification times.
+
+In sync mode, a file is only copied if the destination is missing or differs,
+by size and modification time or by SHA256 digest, so copying the same tree
+again costs little more than listing it. With mirror set, files and directories
+under the destination which are not in the source are removed.
+
+Progress is logged while files are copied, and the count, size and throughput
+of every copy once it is done.
+"""
+
+import concurrent.futures
+import fnmatch
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import List, Optional, Set, Tuple
+
+from absl import flags
+from glazier.lib import file_util
+
+_COPY_WORKERS = flags.DEFINE_integer(
+    'copy_workers', 0,
+    'Threads copying the files of directory trees in parallel. 0 uses the '
+    'Python default for I/O bound work.')
+
+COMPARE_HASH = 'hash'
+COMPARE_MTIME = 'mtime'
+
+# Modification times closer than this are treated as equal, as FAT file
+# systems only keep them to two seconds.
+MTIME_TOLERANCE = 2.0
+# Seconds between progress reports.
+PROGRESS_INTERVAL = 10.0
+
+_HASH_CHUNK_SIZE = 1048576
+
+
+class CopyStats(object):
+  """The outcome of a single tree copy."""
+
+  def __init__(self, src: str, dst: str):
+    self.src = src
+    self.dst = dst
+    self.files = 0
+    self.copied = 0
+    self.skipped = 0
+    self.removed = 0
+    self.bytes = 0
+    self.seconds = 0.0
+
+  def Throughput(self) -> float:
+    """The bytes copied per second."""
+    return self.bytes / self.seconds if self.seconds else 0.0
+
+  def __str__(self):
+    return (f'Copied {self.copied} of {self.files} files '
+            f'({self.bytes / 1048576:.1f} MB) from {self.src} to {self.dst} in '
+            f'{self.seconds:.1f}s ({self.Throughput() / 1048576:.1f} MB/s); '
+            f'{self.skipped} unchanged, {self.removed} removed.')
+
+
+def _HashFile(path: str) -> str:
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+class TreeCopy(object):
+  """Copies one directory tree to another."""
+
+  def __init__(self,
+               src: str,
+               dst: str,
+               sync: bool = False,
+               compare: str = COMPARE_MTIME,
+               include: Optional[List[str]] = None,
+               exclude: Optional[List[str]] = None,
+               mirror: bool = False):
+    """Describes the copy.
+
+    Args:
+      src: The directory to copy.
+      dst: The directory to copy to. Unless sync is set, it must not exist.
+      sync: Copy into an existing destination, skipping unchanged files.
+      compare: How sync mode finds unchanged files: COMPARE_MTIME by size and
+        modification time, or COMPARE_HASH by size and SHA256 digest.
+      include: Glob patterns. If given, only files which match one of them
+        are copied. (Optional)
+      exclude: Glob patterns of files and directories not to copy. (Optional)
+      mirror: Remove files and directories under dst which are not copied
+        from src. Only applies in sync mode.
+    """
+    self.src = src
+    self.dst = dst
+    self.sync = sync
+    self.compare = compare
+    self.include = include or []
+    self.exclude = exclude or []
+    self.mirror = mirror
+    self.stats = CopyStats(src, dst)
+    self._lock = threading.Lock()
+
+  def _Matches(self, rel_path: str, patterns: List[str]) -> bool:
+    """Whether a path relative to the tree, or its name, matches a pattern."""
+    name = rel_path.rsplit('/', 1)[-1]
+    return any(
+        fnmatch.fnmatch(rel_path, p) or fnmatch.fnmatch(name, p)
+        for p in patterns)
+
+  def Plan(self) -> List[Tuple[str, str, os.stat_result]]:
+    """Lists the files to copy, and prepares the destination for them.
+
+    Creates the directories of the destination, and in mirror mode removes
+    whatever the copy would not put there.
+
+    Returns:
+      The source path, destination path and source stat of each file.
+
+    Raises:
+      file_util.Error: The source could not be read, or the destination could
+        not be prepared.
+    """
+    if not self.sync and os.path.exists(self.dst):
+      raise file_util.FileCopyError(self.src, self.dst) from FileExistsError(
+          f'{self.dst} already exists.')
+    # A destination under the source is not part of the copy.
+    skip = os.path.normcase(os.path.realpath(self.dst))
+    dirs = ['']
+    files = []
+    pending = ['']
+    try:
+      while pending:
+        rel_dir = pending.pop()
+        with os.scandir(os.path.join(self.src, rel_dir)) as entries:
+          for entry in entries:
+            rel_path = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+            if self._Matches(rel_path, self.exclude):
+              continue
+            if entry.is_dir():
+              if os.path.normcase(os.path.realpath(entry.path)) != skip:
+                dirs.append(rel_path)
+                pending.append(rel_path)
+            elif not self.include or self._Matches(rel_path, self.include):
+              files.append((rel_path, entry.stat()))
+    except OSError as e:
+      raise file_util.FileCopyError(self.src, self.dst) from e
+
+    if self.sync and self.mirror:
+      self._RemoveExtra(
+          set(os.path.normcase(rel) for rel in dirs),
+          set(os.path.normcase(rel) for rel, _ in files))
+    for rel_dir in dirs:
+      path = os.path.join(self.dst, *rel_dir.split('/'))
+      try:
+        os.makedirs(path, exist_ok=True)
+      except OSError as e:
+        raise file_util.DirectoryCreationError(path) from e
+    self.stats.files = len(files)
+    return [(os.path.join(self.src, *rel.split('/')),
+             os.path.join(self.dst, *rel.split('/')), stat)
+            for rel, stat in files]
+
+  def _RemoveExtra(self, dirs: Set[str], files: Set[str]):
+    """Removes whatever is under the destination but not in the copy.
+
+    Args:
+      dirs: The relative paths of the directories in the copy, normcased.
+      files: The relative paths of the files in the copy, normcased.
+
+    Raises:
+      file_util.Error: A file or directory could not be removed.
+    """
+    for root, dir_names, file_names in os.walk(self.dst, topdown=False):
+      rel_root = os.path.relpath(root, self.dst).replace(os.path.sep, '/')
+      rel_root = '' if rel_root == '.' else rel_root + '/'
+      for name in file_names:
+        if os.path.normcase(rel_root + name) not in files:
+          path = os.path.join(root, name)
+          logging.debug('Removing %s, which is not in %s.', path, self.src)
+          file_util.Remove(path)
+          self.stats.removed += 1
+      for name in dir_names:
+        path = os.path.join(root, name)
+        if os.path.normcase(rel_root + name) not in dirs:
+          try:
+            if os.path.islink(path):
+              os.remove(path)
+            else:
+              os.rmdir(path)
+          except OSError as e:
+            raise file_util.FileRemoveError(path) from e
+          self.stats.removed += 1
+
+  def _Unchanged(self, src: str, dst: str, stat: os.stat_result) -> bool:
+    """Whether the destination already holds an identical file."""
+    try:
+      dst_stat = os.stat(dst)
+      if dst_stat.st_size != stat.st_size:
+        return False
+      if self.compare == COMPARE_HASH:
+        return _HashFile(src) == _HashFile(dst)
+      return abs(dst_stat.st_mtime - stat.st_mtime) < MTIME_TOLERANCE
+    except OSError:
+      return False
+
+  def CopyFile(self, src: str, dst: str, stat: os.stat_result):
+    """Copies a single file of the tree.
+
+    Args:
+      src: The source file.
+      dst: The destination file.
+      stat: The stat of the source file, from Plan().
+
+    Raises:
+      file_util.Error: The file could not be copied.
+    """
+    if self.sync and self._Unchanged(src, dst, stat):
+      with self._lock:
+        self.stats.skipped += 1
+      return
+    try:
+      shutil.copy2(src, dst)
+    except (shutil.Error, OSError) as e:
+      raise file_util.FileCopyError(src, dst) from e
+    with self._lock:
+      self.stats.copied += 1
+      self.stats.bytes += stat.st_size
+
+
+def _CopyFiles(executor: concurrent.futures.Executor, copy: TreeCopy):
+  """Plans a single tree copy, and copies its files on the executor."""
+  start = time.perf_counter()
+  plan = copy.Plan()
+  total_bytes = sum(stat.st_size for _, _, stat in plan)
+  logging.info('Copying %d files (%.1f MB) from %s to %s.', len(plan),
+               total_bytes / 1048576, copy.src, copy.dst)
+  pending = set(executor.submit(copy.CopyFile, *f) for f in plan)
+  try:
+    while pending:
+      done, pending = concurrent.futures.wait(
+          pending,
+          timeout=PROGRESS_INTERVAL,
+          return_when=concurrent.futures.FIRST_EXCEPTION)
+      for future in done:
+        future.result()
+      if pending:
+        logging.info('Copied %d of %d files (%.1f of %.1f MB).',
+                     len(plan) - len(pending), len(plan),
+                     copy.stats.bytes / 1048576, total_bytes / 1048576)
+  except BaseException:
+    for future in pending:
+      future.cancel()
+    raise
+  copy.stats.seconds = time.perf_counter() - start
+  logging.info('%s', copy.stats)
+
+
+def CopyTrees(copies: List[TreeCopy], workers: int = 0) -> List[CopyStats]:
+  """Copies directory trees in order, sharing one pool of threads.
+
+  Each copy is planned only once those before it are complete, so copies may
+  be chained (A to B, then B to C) or overlap.
+
+  Args:
+    copies: The copies to make.
+    workers: The number of threads to copy with. Defaults to the copy_workers
+      flag.
+
+  Returns:
+    The stats of each copy, in order.
+
+  Raises:
+    file_util.Error: A copy failed. Files not yet started, and later copies,
+      are not copied.
+  """
+  with concurrent.futures.ThreadPoolExecutor(
+      max_workers=workers or _COPY_WORKERS.value or None,
+      thread_name_prefix='copy') as executor:
+    for copy in copies:
+      _CopyFiles(executor, copy)
+  return [copy.stats for copy in copies]
+
+
+def CopyTree(src: str, dst: str, **kwargs) -> CopyStats:
+  """Copies a single directory tree. Takes the arguments of TreeCopy."""
+  return CopyTrees([TreeCopy(src, dst, **kwargs)])[0]
@@ -0,0 +1,183 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for glazier.lib.copy_tree."""
+
+import os
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from glazier.lib import copy_tree
+from glazier.lib import file_util
+from glazier.lib import test_utils
+
+_FILES = {
+    'autobuild.py': b'main',
+    'lib/buildinfo.py': b'buildinfo',
+    'lib/__pycache__/buildinfo.pyc': b'compiled',
+    'resources/logo.bmp': b'\x00' * 100000,
+    'resources/empty/': None,
+}
+
+
+class CopyTreeTest(test_utils.GlazierTestCase, parameterized.TestCase):
+
+  def setUp(self):
+    super(CopyTreeTest, self).setUp()
+    self.src = self.create_tempdir().full_path
+    self.dst = os.path.join(self.create_tempdir().full_path, 'dst')
+    for name, content in _FILES.items():
+      path = os.path.join(self.src, *name.split('/'))
+      if content is None:
+        os.makedirs(path)
+      else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+          f.write(content)
+
+  def _listing(self, root):
+    listing = {}
+    for path, dirs, files in os.walk(root):
+      rel = os.path.relpath(path, root).replace(os.path.sep, '/')
+      prefix = '' if rel == '.' else rel + '/'
+      if not dirs and not files and prefix:
+        listing[prefix] = None
+      for name in files:
+        with open(os.path.join(path, name), 'rb') as f:
+          listing[prefix + name] = f.read()
+    return listing
+
+  def _copy2(self):
+    return mock.patch.object(
+        copy_tree.shutil, 'copy2', wraps=copy_tree.shutil.copy2)
+
+  def test_copy_tree(self):
+    stats = copy_tree.CopyTree(self.src, self.dst)
+    self.assertEqual(self._listing(self.dst), _FILES)
+    self.assertEqual(stats.files, 4)
+    self.assertEqual(stats.copied, 4)
+    self.assertEqual(stats.bytes, sum(len(c) for c in _FILES.values() if c))
+    self.assertIn('Copied 4 of 4 files', str(stats))
+
+  def test_copy_tree_exists(self):
+    os.makedirs(self.dst)
+    with self.assert_raises_with_validation(file_util.FileCopyError):
+      copy_tree.CopyTree(self.src, self.dst)
+
+  def test_copy_tree_missing_source(self):
+    with self.assert_raises_with_validation(file_util.FileCopyError):
+      copy_tree.CopyTree(os.path.join(self.src, 'missing'), self.dst)
+
+  def test_copy_tree_into_source(self):
+    dst = os.path.join(self.src, 'dst')
+    copy_tree.CopyTree(self.src, dst)
+    self.assertEqual(self._listing(dst), _FILES)
+
+  def test_copy_tree_error(self):
+    with mock.patch.object(
+        copy_tree.shutil, 'copy2', autospec=True) as mock_copy2:
+      mock_copy2.side_effect = OSError('disk full')
+      with self.assert_raises_with_validation(file_util.FileCopyError):
+        copy_tree.CopyTree(self.src, self.dst)
+
+  def test_filters(self):
+    copy_tree.CopyTree(
+        self.src,
+        self.dst,
+        include=['*.py', 'resources/*'],
+        exclude=['__pycache__'])
+    self.assertEqual(
+        self._listing(self.dst), {
+            'autobuild.py': b'main',
+            'lib/buildinfo.py': b'buildinfo',
+            'resources/logo.bmp': _FILES['resources/logo.bmp'],
+            'resources/empty/': None,
+        })
+
+  @parameterized.named_parameters(
+      ('_Mtime', copy_tree.COMPARE_MTIME),
+      ('_Hash', copy_tree.COMPARE_HASH),
+  )
+  def test_sync(self, compare):
+    copy_tree.CopyTree(self.src, self.dst)
+    with self._copy2() as mock_copy2:
+      stats = copy_tree.CopyTree(
+          self.src, self.dst, sync=True, compare=compare)
+      self.assertFalse(mock_copy2.called)
+    self.assertEqual(stats.skipped, 4)
+
+    # A changed file is copied again.
+    path = os.path.join(self.src, 'autobuild.py')
+    with open(path, 'wb') as f:
+      f.write(b'changed')
+    with self._copy2() as mock_copy2:
+      stats = copy_tree.CopyTree(
+          self.src, self.dst, sync=True, compare=compare)
+      mock_copy2.assert_called_once_with(path, mock.ANY)
+    self.assertEqual(stats.copied, 1)
+    self.assertEqual(self._listing(self.dst)['autobuild.py'], b'changed')
+
+  def test_sync_hash(self):
+    copy_tree.CopyTree(self.src, self.dst)
+    # Same size and modification time, different content.
+    path = os.path.join(self.dst, 'autobuild.py')
+    stat = os.stat(path)
+    with open(path, 'wb') as f:
+      f.write(b'MAIN')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    copy_tree.CopyTree(self.src, self.dst, sync=True)
+    self.assertEqual(self._listing(self.dst)['autobuild.py'], b'MAIN')
+    copy_tree.CopyTree(
+        self.src, self.dst, sync=True, compare=copy_tree.COMPARE_HASH)
+    self.assertEqual(self._listing(self.dst)['autobuild.py'], b'main')
+
+  def test_mirror(self):
+    copy_tree.CopyTree(self.src, self.dst)
+    os.makedirs(os.path.join(self.dst, 'stale', 'dir'))
+    with open(os.path.join(self.dst, 'stale', 'dir', 'old.txt'), 'wb') as f:
+      f.write(b'old')
+    with open(os.path.join(self.dst, 'lib', 'old.py'), 'wb') as f:
+      f.write(b'old')
+    stats = copy_tree.CopyTree(
+        self.src, self.dst, sync=True, mirror=True, exclude=['*.pyc'])
+    expected = dict(_FILES)
+    del expected['lib/__pycache__/buildinfo.pyc']
+    expected['lib/__pycache__/'] = None
+    self.assertEqual(self._listing(self.dst), expected)
+    self.assertEqual(stats.removed, 5)
+
+  def test_copy_trees(self):
+    other = self.create_tempdir().full_path
+    with open(os.path.join(other, 'other.txt'), 'wb') as f:
+      f.write(b'other')
+    other_dst = os.path.join(self.dst, 'other')
+    stats = copy_tree.CopyTrees([
+        copy_tree.TreeCopy(self.src, self.dst),
+        copy_tree.TreeCopy(other, other_dst)
+    ], workers=2)
+    self.assertEqual([s.copied for s in stats], [4, 1])
+    self.assertEqual(self._listing(other_dst), {'other.txt': b'other'})
+
+  def test_copy_trees_chained(self):
+    chained = os.path.join(self.create_tempdir().full_path, 'chained')
+    stats = copy_tree.CopyTrees([
+        copy_tree.TreeCopy(self.src, self.dst),
+        copy_tree.TreeCopy(self.dst, chained)
+    ])
+    self.assertEqual([s.copied for s in stats], [4, 4])
+    self.assertEqual(self._listing(chained), _FILES)
+
+
+if __name__ == '__main__':
+  absltest.main()
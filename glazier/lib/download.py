@@ -19,37 +19,71 @@
       A certificate file containing permitted root certs for SSL validation.
 
 """
+import concurrent.futures
 import hashlib
+import http.client
+import json
 import logging
 import os
 import re
 import socket
-import ssl
 import sys
 import tempfile
+import threading
 import time
 
-import typing
-from typing import List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import urllib.request
 
+from absl import flags
 import backoff
+from glazier.lib import artifact_store
+from glazier.lib import connection_pool
 from glazier.lib import constants
 from glazier.lib import file_util
+from glazier.lib import profiler
 from glazier.lib import winpe
 
 from glazier.lib import beyondcorp
 from glazier.lib import errors
 
-if typing.TYPE_CHECKING:
-  import http.client
+_DOWNLOAD_SEGMENTS = flags.DEFINE_integer(
+    'download_segments', 1,
+    'Split large downloads into this many byte ranges, each fetched over its '
+    'own connection, when the server supports Range requests. 1 disables '
+    'segmented downloads.')
+_DOWNLOAD_SEGMENT_MIN_SIZE = flags.DEFINE_integer(
+    'download_segment_min_size', 64 * 1024 * 1024,
+    'Minimum size in bytes of a file to be downloaded in segments.')
+CONDITIONAL_GET = flags.DEFINE_bool(
+    'conditional_get', False,
+    'Keep the ETag and Last-Modified validators of downloaded files next to '
+    'them, and revalidate existing copies with conditional requests instead '
+    'of downloading them again.')
 
 CHUNK_BYTE_SIZE = 65536
+# Files already on disk are hashed in 4MB chunks.
+HASH_CHUNK_SIZE = 4194304
 SLEEP = 20
 
+# Transfers are written to <save_location>.partial and renamed into place once
+# complete. The validators needed to resume an interrupted transfer with an HTTP
+# Range request are kept alongside, in <save_location>.partial.json.
+PARTIAL_SUFFIX = '.partial'
+PARTIAL_INFO_SUFFIX = '.partial.json'
+# Validators for revalidating a completed download are kept in
+# <save_location>.validators.json when conditional_get is enabled.
+VALIDATORS_SUFFIX = '.validators.json'
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
 # Maximum amount of time to spend on all backoff retries, in seconds.
 BACKOFF_MAX_TIME = 600
 
+# Openers installed by _InstallOpeners, keyed by their handlers' types and SSL
+# contexts, so that repeated downloads share one set of pooled connections.
+_openers = {}
+_openers_lock = threading.Lock()
+
 
 class Error(errors.GlazierError):
   pass
@@ -111,6 +145,10 @@ class StreamToDiskError(Error):
         message=message)
 
 
+class StreamInterruptedError(StreamToDiskError):
+  """The transfer stopped early, but the partial file can be resumed."""
+
+
 class FileValidationError(Error):
 
   def __init__(self, message: str):
@@ -119,6 +157,12 @@ class FileValidationError(Error):
         message=message)
 
 
+class HashMismatchError(FileValidationError):
+
+  def __init__(self, file_path: str, algorithm: str = 'sha256'):
+    super().__init__(f'{algorithm.upper()} hash for {file_path} was incorrect.')
+
+
 # Required in order to patch BACKOFF_MAX_TIME to a more reasonable value in the
 # unit tests. Passing a callable to the max_time argument of
 # @backoff.on_exception() pushes the evaluation of that value to runtime,
@@ -169,7 +213,8 @@ def Transform(string: str, build_info) -> str:
 
 def PathCompile(build_info,
                 file_name: Optional[str] = None,
-                base: Optional[str] = None) -> str:
+                base: Optional[str] = None,
+                conf_path: Optional[List[str]] = None) -> str:
   """Compile the active path from the base path and the active conf path.
 
     Attempt to do a reasonable job of joining path components with single
@@ -186,6 +231,7 @@ def PathCompile(build_info,
     build_info: the current build information
     file_name: append a filename to the path
     base: use a non-default base path
+    conf_path: use a config path other than the active one
 
   Returns:
     The compiled URL as a string.
@@ -196,7 +242,9 @@ def PathCompile(build_info,
 
   path = path.rstrip('/')
 
-  sub_path = build_info.ActiveConfigPath()
+  sub_path = conf_path
+  if sub_path is None:
+    sub_path = build_info.ActiveConfigPath()
   if sub_path:
     path += '/'
     sub_path = '/'.join(sub_path).strip('/')
@@ -213,10 +261,40 @@ def PathCompile(build_info,
 class BaseDownloader(object):
   """Downloads files over HTTPS."""
 
-  def __init__(self, show_progress: bool = False):
+  def __init__(self,
+               show_progress: bool = False,
+               progress_callback: Optional[Callable[[int, int], None]] = None,
+               store: Optional[artifact_store.ArtifactStore] = None,
+               chunk_callback: Optional[Callable[[int, bytes], None]] = None,
+               host_slots: Optional[Callable[[str],
+                                             threading.Semaphore]] = None):
+    """Initializes the downloader.
+
+    Args:
+      show_progress: Print download progress to stdout by default.
+      progress_callback: Called with (bytes_so_far, total_size) after every
+        chunk written to disk, regardless of show_progress.
+      store: An artifact store to reuse and keep copies of downloaded files.
+      chunk_callback: Called with (offset, chunk) after every chunk written to
+        disk, in the order of the file. Segmented downloads, which write
+        chunks out of order, are disabled.
+      host_slots: Gets the semaphore limiting concurrent connections to the
+        host of a URL, which the caller already holds a slot of for this
+        download. Every extra connection of a segmented download takes
+        another slot, if one is free; with fewer free slots, fewer segments
+        are used.
+    """
+    self._artifact_store = store
+    self._chunk_callback = chunk_callback
+    self._host_slots = host_slots
     self._debug_info = {}
+    self._expected_digests = {}
+    # Hex digests of the last file placed, by hash algorithm.
+    self.digests = {}
     self._save_location = None
+    self._source_url = None
     self._default_show_progress = show_progress
+    self._progress_callback = progress_callback
     self._ca_cert_file = None
     self._beyondcorp = beyondcorp.BeyondCorp()
 
@@ -247,13 +325,19 @@ class BaseDownloader(object):
     return size
 
   def _GetHandlers(self):
-    return [urllib.request.HTTPSHandler()]
+    return [connection_pool.HTTPSHandler()]
 
   def _InstallOpeners(self):
-    opener = urllib.request.OpenerDirector()
-    for handler in self._GetHandlers():
-      opener.add_handler(handler)
-    urllib.request.install_opener(opener)
+    """Installs an opener for the handlers, reusing one built earlier."""
+    handlers = self._GetHandlers()
+    key = tuple((type(h), getattr(h, '_context', None)) for h in handlers)
+    with _openers_lock:
+      if key not in _openers:
+        opener = urllib.request.OpenerDirector()
+        for handler in handlers:
+          opener.add_handler(handler)
+        _openers[key] = opener
+      urllib.request.install_opener(_openers[key])
 
   @backoff.on_exception(
       backoff.expo,
@@ -263,13 +347,16 @@ class BaseDownloader(object):
   def _OpenFileStream(
       self,
       url: str,
-      status_codes: Optional[List[int]] = None) -> 'http.client.HTTPResponse':
+      status_codes: Optional[List[int]] = None,
+      headers: Optional[Dict[str, str]] = None
+  ) -> 'http.client.HTTPResponse':
     """Opens a connection to a remote resource, with retries.
 
     Args:
       url: The address of the file to be downloaded.
       status_codes: A list of acceptable status codes to be returned by the
         remote endpoint.
+      headers: Additional HTTP request headers. (Optional)
 
     Returns:
       file_stream: urlopen's file stream
@@ -281,14 +368,20 @@ class BaseDownloader(object):
     if status_codes:
       logging.debug('Expected status code(s): %s', status_codes)
 
+    request = urllib.request.Request(url, headers=headers or {})
     try:
       if winpe.check_winpe():
-        file_stream = urllib.request.urlopen(url, cafile=self._ca_cert_file)
+        opener = connection_pool.BuildOpener(
+            connection_pool.GetContext(self._ca_cert_file))
+        file_stream = opener.open(request)
       else:
-        file_stream = urllib.request.urlopen(url)
+        file_stream = urllib.request.urlopen(request)
 
     # First attempt failed with HTTPError. Reraise and trigger a retry.
-    except urllib.error.HTTPError:
+    except urllib.error.HTTPError as e:
+      # Openers with an error processor raise for codes such as 304.
+      if status_codes and e.code in status_codes:
+        return e
       logging.error('File not found on remote server: %s.', url)
       raise
 
@@ -298,11 +391,13 @@ class BaseDownloader(object):
 
       try:
         logging.info('Trying again with machine context...')
-        ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        file_stream = urllib.request.urlopen(url, context=ctx)
+        file_stream = urllib.request.urlopen(
+            request, context=connection_pool.MachineContext())
 
       # Second attempt failed with HTTPError. Reraise and trigger a retry.
-      except urllib.error.HTTPError:
+      except urllib.error.HTTPError as e:
+        if status_codes and e.code in status_codes:
+          return e
         logging.error('File not found on remote server: %s.', url)
         raise
 
@@ -318,7 +413,7 @@ class BaseDownloader(object):
     # In the case of a redirection, just call into _OpenFileStream() again with
     # the redirect URL.
     elif file_stream.getcode() in [302]:
-      return self._OpenFileStream(file_stream.geturl(), status_codes)
+      return self._OpenFileStream(file_stream.geturl(), status_codes, headers)
 
     # For anything else, fail permanently with a DownloadError.
     else:
@@ -327,13 +422,16 @@ class BaseDownloader(object):
   def _OpenStream(
       self,
       url: str,
-      status_codes: Optional[List[int]] = None) -> 'http.client.HTTPResponse':
+      status_codes: Optional[List[int]] = None,
+      headers: Optional[Dict[str, str]] = None
+  ) -> 'http.client.HTTPResponse':
     """Opens a connection to a remote resource.
 
     Args:
       url:  The address of the file to be downloaded.
       status_codes: A list of acceptable status codes to be returned by the
         remote endpoint.
+      headers: Additional HTTP request headers. (Optional)
 
     Returns:
       file_stream: urlopen's file stream
@@ -349,7 +447,7 @@ class BaseDownloader(object):
     if not parsed.netloc:
       raise InvalidRemoteUrlError(url)
 
-    return self._OpenFileStream(url, status_codes)
+    return self._OpenFileStream(url, status_codes, headers)
 
   def CheckUrl(self, url: str, status_codes: List[int]) -> bool:
     """Check a remote URL for availability.
@@ -364,7 +462,7 @@ class BaseDownloader(object):
     logging.info('Checking URL: %s', url)
 
     try:
-      self._OpenStream(url, status_codes=status_codes)
+      self._OpenStream(url, status_codes=status_codes).close()
       return True
     except Error as e:
       logging.error(e)
@@ -373,33 +471,52 @@ class BaseDownloader(object):
   def DownloadFile(self,
                    url: str,
                    save_location: str,
-                   show_progress: bool = False):
+                   show_progress: bool = False,
+                   digests: Optional[Dict[str, str]] = None):
     """Downloads a file from one location to another.
 
     If URL references a local path, the file will be copied rather than
     downloaded.
 
+    With the conditional_get flag set, an existing copy at save_location that
+    was downloaded from the same URL is revalidated with the server, and only
+    downloaded again if it has changed.
+
+    Expected digests are computed as the file is streamed to disk, and checked
+    before the completed file is moved to save_location, so a file which fails
+    verification is never put in place. Files placed any other way are hashed
+    once they are in place. Either way, the digests end up in self.digests.
+
     Args:
       url:  The address of the file to be downloaded.
       save_location: The full path of where the file should be saved.
       show_progress: Print download progress to stdout (overrides default).
+      digests: The expected hex digests of the file, keyed by hashlib
+        algorithm name, such as {'sha256': '...'}. (Optional)
 
     Raises:
+      FileValidationError: An algorithm in digests is not supported.
+      HashMismatchError: The file did not match an expected digest.
       LocalCopyError: failure writing file to the save_location
     """
     logging.info('Downloading file: %s', url)
 
     self._save_location = save_location
+    self._expected_digests = {}
+    for algorithm, expected in (digests or {}).items():
+      algorithm = algorithm.lower()
+      if algorithm not in hashlib.algorithms_available:
+        raise FileValidationError(f'Unsupported hash algorithm: {algorithm}')
+      self._expected_digests[algorithm] = expected.lower()
+    self.digests = {}
     if IsRemote(url):
-      if self._beyondcorp.CheckBeyondCorp():
-        url = self._SetUrl(url)
-      file_stream = self._OpenStream(url)
-      self._StreamToDisk(file_stream, show_progress)
+      self._DownloadRemote(url, show_progress, CONDITIONAL_GET.value)
     else:
       try:
         file_util.Copy(url, save_location)
       except file_util.Error as e:
         raise LocalCopyError(url, save_location) from e
+      self._CheckDigests(save_location)
 
   def DownloadFileTemp(self, url: str, show_progress: bool = False) -> str:
     """Downloads a file to temporary storage.
@@ -413,14 +530,276 @@ class BaseDownloader(object):
     """
     logging.info('Downloading temp file: %s', url)
 
+    self._expected_digests = {}
     destination = tempfile.NamedTemporaryFile()
     self._save_location = destination.name
     destination.close()
+    self._DownloadRemote(url, show_progress)
+    return self._save_location
+
+  def DownloadFileCached(self,
+                         url: str,
+                         cache_dir: str,
+                         show_progress: bool = False) -> str:
+    """Downloads a file to a per-URL location, revalidating earlier copies.
+
+    Args:
+      url:  The address of the file to be downloaded.
+      cache_dir: The directory to keep downloaded copies in.
+      show_progress: Print download progress to stdout (overrides default).
+
+    Returns:
+      A string containing a path to the downloaded file.
+
+    Raises:
+      StreamToDiskError: The cache location could not be created.
+    """
+    logging.info('Downloading cached file: %s', url)
+
+    url_hash = hashlib.sha256(url.encode()).hexdigest()[:16]
+    file_name = urllib.parse.urlparse(url).path.split('/').pop() or 'index'
+    self._save_location = os.path.join(cache_dir, url_hash, file_name)
+    self._expected_digests = {}
+    try:
+      file_util.CreateDirectories(self._save_location)
+    except file_util.Error as e:
+      raise StreamToDiskError(
+          f'Unable to create cache location {self._save_location}') from e
+    self._DownloadRemote(url, show_progress, revalidate=True)
+    return self._save_location
+
+  @backoff.on_exception(
+      backoff.expo,
+      StreamInterruptedError,
+      max_time=GetBackoffMaxTime,
+      on_giveup=BackoffGiveupHandler)
+  def _DownloadRemote(self,
+                      url: str,
+                      show_progress: Optional[bool] = None,
+                      revalidate: bool = False):
+    """Downloads a remote file to the current save location, with retries.
+
+    If an earlier attempt left a partial file behind, the transfer is resumed
+    from the end of that file with an HTTP Range request. The If-Range header
+    makes the server send the whole file instead if it has changed since.
+
+    Otherwise, if a validated copy of the file exists, either at the save
+    location or in the artifact store, it is revalidated with a conditional
+    request and reused if the server responds with 304 Not Modified.
+
+    Args:
+      url: The address of the file to be downloaded.
+      show_progress: Print download progress to stdout (overrides default).
+      revalidate: Keep validators next to the downloaded file, and revalidate
+        an existing copy at the save location.
+    """
+    self._source_url = url
+    self.digests = {}
     if self._beyondcorp.CheckBeyondCorp():
       url = self._SetUrl(url)
-    file_stream = self._OpenStream(url)
-    self._StreamToDisk(file_stream, show_progress)
-    return self._save_location
+
+    resume_from, headers = self._ResumeRequest()
+    if not resume_from:
+      cached_sha256, headers = self._ConditionalRequest(revalidate)
+      if headers:
+        file_stream = self._OpenStream(url, [200, 304], headers)
+        if file_stream.getcode() == 304:
+          file_stream.close()
+          if self._UseNotModified(cached_sha256):
+            self._CheckDigests(self._save_location)
+            return
+          file_stream = self._OpenStream(url)
+      else:
+        file_stream = self._OpenStream(url)
+      if self._CopyFromStore(file_stream):
+        self._CheckDigests(self._save_location)
+        return
+      if self._CanSegment(file_stream):
+        self._SegmentedDownload(url, file_stream, show_progress)
+      else:
+        self._StreamToDisk(file_stream, show_progress)
+    else:
+      logging.info('Resuming download of "%s" from byte %d.', self._source_url,
+                   resume_from)
+      file_stream = self._OpenStream(url, [200, 206], headers)
+      if file_stream.getcode() != 206:
+        logging.info('Server returned the full file; restarting download.')
+        resume_from = 0
+      self._StreamToDisk(file_stream, show_progress, resume_from=resume_from)
+    if revalidate:
+      self._SaveValidators(file_stream)
+    if self._artifact_store:
+      self._artifact_store.Add(
+          self._save_location,
+          self._source_url,
+          file_stream.headers.get('ETag'),
+          sha256=self.digests.get('sha256'),
+          last_modified=file_stream.headers.get('Last-Modified'))
+
+  def _ValidatorsPath(self) -> str:
+    return os.fspath(self._save_location) + VALIDATORS_SUFFIX
+
+  def _SaveValidators(self, file_stream: 'http.client.HTTPResponse'):
+    """Records the validators of a completed download next to the file."""
+    info = {
+        'url': self._source_url,
+        'etag': file_stream.headers.get('ETag'),
+        'last_modified': file_stream.headers.get('Last-Modified'),
+        'size': os.path.getsize(self._save_location),
+    }
+    if not info['etag'] and not info['last_modified']:
+      return
+    try:
+      with open(self._ValidatorsPath(), 'w') as f:
+        json.dump(info, f)
+    except IOError as e:
+      logging.warning('Unable to save validators for %s: %s',
+                      self._save_location, e)
+
+  def _ConditionalRequest(
+      self, revalidate: bool) -> Tuple[Optional[str], Optional[Dict[str, str]]]:
+    """Builds the headers to revalidate an existing copy of the file.
+
+    A copy at the save location is preferred over one in the artifact store.
+
+    Args:
+      revalidate: Whether a copy at the save location may be revalidated.
+
+    Returns:
+      A tuple of the SHA256 digest of the stored copy (None for a copy at the
+      save location) and the conditional request headers, or (None, None) if
+      there is no copy to revalidate.
+    """
+    info = None
+    sha256 = None
+    if revalidate:
+      try:
+        with open(self._ValidatorsPath()) as f:
+          info = json.load(f)
+        if (info.get('url') != self._source_url or
+            os.path.getsize(self._save_location) != info.get('size')):
+          info = None
+      except (IOError, ValueError, AttributeError):
+        info = None
+    if not info and self._artifact_store:
+      info = self._artifact_store.Validators(self._source_url)
+      sha256 = info and info.get('sha256')
+    if not info:
+      return (None, None)
+    headers = {}
+    if info.get('etag'):
+      headers['If-None-Match'] = info['etag']
+    if info.get('last_modified'):
+      headers['If-Modified-Since'] = info['last_modified']
+    if not headers:
+      return (None, None)
+    return (sha256, headers)
+
+  def _UseNotModified(self, sha256: Optional[str]) -> bool:
+    """Reuses the revalidated copy of a file after a 304 response.
+
+    Args:
+      sha256: The digest of the copy in the artifact store, or None if the copy
+        is the one already at the save location.
+
+    Returns:
+      True if the save location now holds the revalidated copy.
+    """
+    if sha256:
+      if not self._artifact_store.CopyOut(sha256, self._save_location):
+        return False
+      self.digests['sha256'] = sha256
+    logging.info('File "%s" is not modified; using local copy.',
+                 self._source_url)
+    return True
+
+  def _CopyFromStore(self, file_stream: 'http.client.HTTPResponse') -> bool:
+    """Places a stored copy of the file being downloaded, if there is one.
+
+    Args:
+      file_stream: The open response for the file. It is closed unread if a
+        stored copy with the same URL and ETag is placed.
+
+    Returns:
+      True if the file was placed from the artifact store.
+    """
+    if not self._artifact_store:
+      return False
+    sha256 = self._artifact_store.Lookup(self._source_url,
+                                         file_stream.headers.get('ETag'))
+    if sha256 and self._artifact_store.CopyOut(sha256, self._save_location):
+      logging.info('Using cached copy of "%s".', self._source_url)
+      self.digests['sha256'] = sha256
+      file_stream.close()
+      return True
+    return False
+
+  def _PartialPath(self) -> str:
+    return os.fspath(self._save_location) + PARTIAL_SUFFIX
+
+  def _PartialInfoPath(self) -> str:
+    return os.fspath(self._save_location) + PARTIAL_INFO_SUFFIX
+
+  def _SavePartialInfo(self, file_stream: 'http.client.HTTPResponse', url: str,
+                       total_size: int):
+    """Records the validators needed to resume the current transfer.
+
+    Args:
+      file_stream: The file stream of the transfer being started.
+      url: The address the transfer was requested from.
+      total_size: The full size of the file, in bytes.
+    """
+    info = {
+        'url': self._source_url or url,
+        'etag': file_stream.headers.get('ETag'),
+        'last_modified': file_stream.headers.get('Last-Modified'),
+        'size': total_size,
+    }
+    try:
+      with open(self._PartialInfoPath(), 'w') as f:
+        json.dump(info, f)
+    except IOError as e:
+      logging.warning('Unable to save resume information for %s: %s',
+                      self._save_location, e)
+
+  def _LoadPartialInfo(self) -> Optional[Dict[str, str]]:
+    try:
+      with open(self._PartialInfoPath()) as f:
+        return json.load(f)
+    except (IOError, ValueError):
+      return None
+
+  def _DiscardPartial(self):
+    """Removes any partial file and resume information for the transfer."""
+    for path in (self._PartialPath(), self._PartialInfoPath()):
+      try:
+        file_util.Remove(path)
+      except file_util.Error as e:
+        logging.warning(e)
+
+  def _ResumeRequest(self) -> Tuple[int, Optional[Dict[str, str]]]:
+    """Determines whether the current transfer can resume a partial file.
+
+    Returns:
+      A tuple of the byte offset to resume from and the request headers needed
+      to do so, or (0, None) if the transfer must start from the beginning.
+    """
+    info = self._LoadPartialInfo()
+    if not info or info.get('url') != self._source_url:
+      return (0, None)
+    etag = info.get('etag')
+    # Weak entity tags cannot be used with If-Range.
+    validator = etag if etag and not etag.startswith('W/') else None
+    validator = validator or info.get('last_modified')
+    if not validator:
+      return (0, None)
+    try:
+      offset = os.path.getsize(self._PartialPath())
+    except OSError:
+      return (0, None)
+    if not 0 < offset < info.get('size', 0):
+      return (0, None)
+    return (offset, {'Range': f'bytes={offset}-', 'If-Range': validator})
 
   def _DownloadChunkReport(self, bytes_so_far: int, total_size: int):
     """Prints download progress information.
@@ -505,15 +884,23 @@ class BaseDownloader(object):
 
   def _StreamToDisk(self,
                     file_stream: 'http.client.HTTPResponse',
-                    show_progress: bool = None):
+                    show_progress: bool = None,
+                    resume_from: int = 0):
     """Save a file stream to disk.
 
+    The stream is written to a partial file which is only renamed to the save
+    location once the transfer is complete and valid. If the stream is cut
+    short, the partial file is kept so that the transfer can be resumed.
+
     Args:
       file_stream: The file stream returned by a successful urlopen()
       show_progress: Print download progress to stdout (overrides default).
+      resume_from: The number of bytes already in the partial file, when
+        file_stream is the response to a Range request.
 
     Raises:
       Error: Error retrieving file or saving to disk.
+      StreamInterruptedError: The transfer stopped early and can be resumed.
     """
     progress = self._default_show_progress
     if show_progress is not None:
@@ -522,49 +909,382 @@ class BaseDownloader(object):
     if file_stream is None:
       raise MissingFileStreamError()
 
-    bytes_so_far = 0
+    bytes_so_far = resume_from
     url, total_size = self._GetFileStreamSize(file_stream)
+    if resume_from:
+      total_size = self._ValidateResume(file_stream, resume_from, total_size)
+    else:
+      self._SavePartialInfo(file_stream, url, total_size)
 
+    partial_path = self._PartialPath()
     try:
-      with open(self._save_location, 'wb') as output_file:
+      hashers = self._NewHashers(partial_path if resume_from else None)
+      with open(partial_path, 'ab' if resume_from else 'wb') as output_file:
         logging.info('Downloading file "%s" to "%s".',
                      url.split('?')[0], self._save_location)
         while 1:
-          chunk = file_stream.read(CHUNK_BYTE_SIZE)
+          try:
+            chunk = file_stream.read(CHUNK_BYTE_SIZE)
+          except (socket.error, http.client.HTTPException) as e:
+            self._StoreDebugInfo(file_stream, str(e))
+            raise StreamInterruptedError(
+                'Socket error during download.') from e
           bytes_so_far += len(chunk)
           if not chunk:
             break
           output_file.write(chunk)
+          for hasher in hashers.values():
+            hasher.update(chunk)
+          profiler.AddBytes(len(chunk))
+          if self._chunk_callback:
+            self._chunk_callback(bytes_so_far - len(chunk), chunk)
           if progress:
             self._DownloadChunkReport(bytes_so_far, total_size)
-    except socket.error as e:
-      self._StoreDebugInfo(file_stream, str(e))
-      raise StreamToDiskError('Socket error during download.') from e
+          if self._progress_callback:
+            self._progress_callback(bytes_so_far, total_size)
+    except IOError as e:
+      message = (
+          f'File location could not be opened for writing: '
+          f'{self._save_location}')
+      raise StreamToDiskError(message) from e
+
+    self._CompletePartial(file_stream, total_size, hashers)
+    file_stream.close()
+
+  def _CompletePartial(self,
+                       file_stream: 'http.client.HTTPResponse',
+                       total_size: int,
+                       hashers: Optional[Dict[str, Any]] = None):
+    """Validates the partial file and moves it to the save location.
+
+    Args:
+      file_stream: The file stream the partial file was downloaded from.
+      total_size: The expected size of the file, in bytes.
+      hashers: Hash objects fed every byte of the partial file, by algorithm.
+        Digests they do not cover are computed from the partial file.
+
+    Raises:
+      Error: The partial file failed validation or could not be moved.
+    """
+    partial_path = self._PartialPath()
+    try:
+      self._Validate(file_stream, total_size, partial_path)
+      for algorithm, hasher in (hashers or {}).items():
+        self.digests[algorithm] = hasher.hexdigest()
+      self._CheckDigests(partial_path)
+    except FileValidationError:
+      self._DiscardPartial()
+      raise
+    try:
+      os.replace(partial_path, self._save_location)
+    except OSError as e:
+      self._DiscardPartial()
+      raise StreamToDiskError(
+          f'Unable to move completed download to {self._save_location}') from e
+    self._DiscardPartial()
+
+  def _CanSegment(self, file_stream: 'http.client.HTTPResponse') -> bool:
+    """Whether a response is eligible for a segmented download."""
+    if _DOWNLOAD_SEGMENTS.value < 2 or self._chunk_callback:
+      return False
+    accept_ranges = file_stream.headers.get('Accept-Ranges') or ''
+    if accept_ranges.strip().lower() != 'bytes':
+      return False
+    try:
+      total_size = int(file_stream.headers.get('Content-Length'))
+    except (TypeError, ValueError):
+      return False
+    return total_size >= _DOWNLOAD_SEGMENT_MIN_SIZE.value
+
+  def _SegmentedDownload(self,
+                         url: str,
+                         file_stream: 'http.client.HTTPResponse',
+                         show_progress: Optional[bool] = None):
+    """Save a file to disk in segments, over as many connections as allowed.
+
+    Extra connections are only opened while the host has free slots (see
+    host_slots), without waiting for any: waiting while holding a slot could
+    deadlock with other downloads from the same host. Without a free slot, the
+    file is streamed over its one connection.
+
+    Args:
+      url: The address of the file to be downloaded.
+      file_stream: The file stream returned by a successful urlopen()
+      show_progress: Print download progress to stdout (overrides default).
+
+    Raises:
+      Error: Error retrieving file or saving to disk.
+    """
+    extra = _DOWNLOAD_SEGMENTS.value - 1
+    semaphore = None
+    if self._host_slots:
+      semaphore = self._host_slots(self._source_url or url)
+      taken = 0
+      while taken < extra and semaphore.acquire(blocking=False):
+        taken += 1
+      extra = taken
+    try:
+      if extra:
+        self._SegmentedStreamToDisk(url, file_stream, show_progress,
+                                    segments=extra + 1)
+      else:
+        logging.debug('No free connections to the host of %s; not segmenting.',
+                      self._source_url or url)
+        self._StreamToDisk(file_stream, show_progress)
+    finally:
+      if semaphore:
+        for _ in range(extra):
+          semaphore.release()
+
+  def _SegmentedStreamToDisk(self,
+                             url: str,
+                             file_stream: 'http.client.HTTPResponse',
+                             show_progress: Optional[bool] = None,
+                             segments: Optional[int] = None):
+    """Save a file to disk over several concurrent Range requests.
+
+    The partial file is preallocated to the full size of the file, then each
+    segment is written at its own offset through a separate file handle. The
+    already open file_stream supplies the first segment.
+
+    Args:
+      url: The address of the file to be downloaded.
+      file_stream: The file stream returned by a successful urlopen()
+      show_progress: Print download progress to stdout (overrides default).
+      segments: The number of segments to split the file into. Defaults to the
+        download_segments flag.
+
+    Raises:
+      Error: Error retrieving file or saving to disk.
+    """
+    progress = self._default_show_progress
+    if show_progress is not None:
+      progress = show_progress
+
+    stream_url, total_size = self._GetFileStreamSize(file_stream)
+    self._SavePartialInfo(file_stream, stream_url, total_size)
+    try:
+      with open(self._PartialPath(), 'wb') as output_file:
+        output_file.truncate(total_size)
     except IOError as e:
       message = (
           f'File location could not be opened for writing: '
           f'{self._save_location}')
       raise StreamToDiskError(message) from e
-    self._Validate(file_stream, total_size)
+
+    segment_size = -(-total_size // (segments or _DOWNLOAD_SEGMENTS.value))
+    segments = [(start, min(start + segment_size, total_size) - 1)
+                for start in range(0, total_size, segment_size)]
+    logging.info('Downloading file "%s" to "%s" in %d segments.',
+                 stream_url.split('?')[0], self._save_location, len(segments))
+
+    lock = threading.Lock()
+    bytes_so_far = [0]
+
+    def Report(num_bytes: int):
+      with lock:
+        bytes_so_far[0] += num_bytes
+        if progress:
+          self._DownloadChunkReport(bytes_so_far[0], total_size)
+        if self._progress_callback:
+          self._progress_callback(bytes_so_far[0], total_size)
+
+    etag = file_stream.headers.get('ETag')
+    try:
+      with concurrent.futures.ThreadPoolExecutor(
+          max_workers=len(segments),
+          thread_name_prefix='segment') as executor:
+        futures = [
+            executor.submit(self._StreamSegment, url,
+                            file_stream if i == 0 else None, start, end, etag,
+                            Report) for i, (start, end) in enumerate(segments)
+        ]
+        for future in futures:
+          future.result()
+    except Error:
+      # Segments complete out of order, so the partial file cannot be resumed.
+      self._DiscardPartial()
+      raise
+
+    self._CompletePartial(file_stream, total_size)
+
+  def _StreamSegment(self, url: str,
+                     file_stream: Optional['http.client.HTTPResponse'],
+                     start: int, end: int, etag: Optional[str],
+                     report: Callable[[int], None]):
+    """Downloads one byte range of a segmented download.
+
+    Args:
+      url: The address of the file to be downloaded.
+      file_stream: An open stream positioned at start, or None to request the
+        range from the server.
+      start: The offset of the first byte of the segment.
+      end: The offset of the last byte of the segment.
+      etag: The ETag of the file, which every segment must match.
+      report: Called with the number of bytes written after every chunk.
+
+    Raises:
+      Error: Error retrieving the segment or saving it to disk.
+    """
+    ranged = file_stream is None
+    if ranged:
+      file_stream = self._OpenStream(url, [206],
+                                     {'Range': f'bytes={start}-{end}'})
+
+    remaining = end - start + 1
+    try:
+      if ranged:
+        match = CONTENT_RANGE_RE.match(
+            file_stream.headers.get('Content-Range') or '')
+        if (not match or int(match.group(1)) != start or
+            int(match.group(2)) != end or
+            (etag and file_stream.headers.get('ETag') != etag)):
+          self._StoreDebugInfo(file_stream)
+          raise StreamInterruptedError(
+              f'Segment {start}-{end} did not match the requested file.')
+      with open(self._PartialPath(), 'r+b') as output_file:
+        output_file.seek(start)
+        while remaining:
+          try:
+            chunk = file_stream.read(min(CHUNK_BYTE_SIZE, remaining))
+          except (socket.error, http.client.HTTPException) as e:
+            self._StoreDebugInfo(file_stream, str(e))
+            raise StreamInterruptedError(
+                'Socket error during download.') from e
+          if not chunk:
+            self._StoreDebugInfo(file_stream)
+            raise StreamInterruptedError(
+                f'Segment {start}-{end} ended {remaining} bytes early.')
+          output_file.write(chunk)
+          profiler.AddBytes(len(chunk))
+          remaining -= len(chunk)
+          report(len(chunk))
+    except IOError as e:
+      message = (
+          f'File location could not be opened for writing: '
+          f'{self._save_location}')
+      raise StreamToDiskError(message) from e
+    finally:
+      file_stream.close()
+
+  def _ValidateResume(self, file_stream: 'http.client.HTTPResponse',
+                      resume_from: int, content_length: int) -> int:
+    """Checks that a ranged response continues the existing partial file.
+
+    Args:
+      file_stream: The file stream returned for the Range request.
+      resume_from: The byte offset the range was requested from.
+      content_length: The Content-Length of the response.
+
+    Returns:
+      The total size of the file, in bytes.
+
+    Raises:
+      StreamInterruptedError: The response does not match the partial file. The
+        response is closed, and the partial file is discarded, so the next
+        attempt starts from scratch.
+    """
+    info = self._LoadPartialInfo() or {}
+    match = CONTENT_RANGE_RE.match(
+        file_stream.headers.get('Content-Range') or '')
+    etag = info.get('etag')
+    if (match and int(match.group(1)) == resume_from and
+        int(match.group(3)) == info.get('size') and
+        resume_from + content_length == info.get('size') and
+        (not etag or file_stream.headers.get('ETag') == etag)):
+      return info['size']
+    self._StoreDebugInfo(file_stream)
     file_stream.close()
+    self._DiscardPartial()
+    raise StreamInterruptedError(
+        f'Resumed transfer did not match the partial file for '
+        f'{self._save_location}.')
+
+  def _NewHashers(self, prefix_path: Optional[str] = None) -> Dict[str, Any]:
+    """Creates the hash objects to feed a download as it is written.
+
+    Args:
+      prefix_path: A partial file the download continues, which is hashed
+        first. (Optional)
 
-  def _Validate(self, file_stream: 'http.client.HTTPResponse',
-                expected_size: int):
+    Returns:
+      A hash object for each expected digest, and for SHA256 when the file will
+      be added to the artifact store, keyed by algorithm.
+
+    Raises:
+      IOError: The partial file could not be read.
+    """
+    algorithms = set(self._expected_digests)
+    if self._artifact_store:
+      algorithms.add('sha256')
+    hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    if hashers and prefix_path:
+      with open(prefix_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+          for hasher in hashers.values():
+            hasher.update(chunk)
+    return hashers
+
+  def _CheckDigests(self, file_path: str):
+    """Checks a file against the expected digests.
+
+    Only digests not already in self.digests are computed, from file_path.
+
+    Args:
+      file_path: The file to check, which will end up at the save location.
+
+    Raises:
+      FileValidationError: The file could not be read.
+      HashMismatchError: The file did not match an expected digest.
+    """
+    missing = [a for a in self._expected_digests if a not in self.digests]
+    if missing:
+      hashers = {algorithm: hashlib.new(algorithm) for algorithm in missing}
+      try:
+        with open(file_path, 'rb') as f:
+          for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            for hasher in hashers.values():
+              hasher.update(chunk)
+      except IOError as e:
+        raise FileValidationError(
+            f'Unable to read {file_path} for hash verification.') from e
+      for algorithm, hasher in hashers.items():
+        self.digests[algorithm] = hasher.hexdigest()
+    for algorithm, expected in self._expected_digests.items():
+      if self.digests[algorithm] != expected:
+        logging.error(
+            '%s hash for %s was %s, which did not match expected hash of %s.',
+            algorithm.upper(), self._save_location, self.digests[algorithm],
+            expected)
+        raise HashMismatchError(self._save_location, algorithm)
+      logging.info('%s hash for %s matched expected hash of %s.',
+                   algorithm.upper(), self._save_location, expected)
+
+  def _Validate(self,
+                file_stream: 'http.client.HTTPResponse',
+                expected_size: int,
+                file_path: Optional[str] = None):
     """Validate the downloaded file.
 
     Args:
       file_stream: The file stream returned by a successful urlopen()
       expected_size:  The total size of the file being downloaded.
+      file_path: The file to validate. Defaults to the save location.
 
     Raises:
       FileValidationError: File failed validation.
+      StreamInterruptedError: File is smaller than expected.
     """
-    if not os.path.exists(self._save_location):
+    file_path = file_path or self._save_location
+    if not os.path.exists(file_path):
       self._StoreDebugInfo(file_stream)
-      raise FileValidationError(
-          f'Could not locate file at {self._save_location}')
+      raise FileValidationError(f'Could not locate file at {file_path}')
 
-    actual_file_size = os.path.getsize(self._save_location)
+    actual_file_size = os.path.getsize(file_path)
+    if actual_file_size < expected_size:
+      self._StoreDebugInfo(file_stream)
+      raise StreamInterruptedError(
+          f'Transfer ended after {actual_file_size} of {expected_size} bytes.')
     if actual_file_size != expected_size:
       self._StoreDebugInfo(file_stream)
       message = (
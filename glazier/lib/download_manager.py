@@ -0,0 +1,217 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Download many files concurrently.
+
+The DownloadManager runs transfers on a bounded pool of worker threads, with a
+separate limit on the number of simultaneous connections to any one host.
+Segmented downloads count each of their connections against that limit. Each
+transfer gets its own downloader instance, as BaseDownloader keeps per-transfer
+state.
+
+Files with an expected SHA256 hash are verified by the downloader as they are
+streamed to disk, and fail before they are moved into place. If an artifact
+store already holds a file with the expected hash, it is placed without any
+network access.
+"""
+
+import concurrent.futures
+import logging
+import sys
+import threading
+import time
+from typing import List, Optional
+import urllib.parse
+
+from absl import flags
+from glazier.lib import artifact_store
+from glazier.lib import download
+
+_DOWNLOAD_WORKERS = flags.DEFINE_integer(
+    'download_workers', 8,
+    'Maximum number of files to download concurrently.')
+_DOWNLOAD_HOST_CONNECTIONS = flags.DEFINE_integer(
+    'download_host_connections', 4,
+    'Maximum number of concurrent downloads from any single host.')
+
+# Minimum time between two aggregated progress reports, in seconds.
+PROGRESS_INTERVAL = 0.5
+
+
+class DownloadJob(object):
+  """A single transfer tracked by the DownloadManager."""
+
+  def __init__(self, url: str, save_location: str,
+               sha256: Optional[str] = None):
+    self.url = url
+    self.save_location = save_location
+    self.sha256 = sha256
+    self.downloader = None
+    self.error = None
+    self.skipped = False
+    self.cached = False
+    self.bytes_so_far = 0
+    self.total_size = 0
+    self.future = None
+
+
+class DownloadManager(object):
+  """Downloads a batch of files on a bounded thread pool."""
+
+  def __init__(self,
+               max_workers: Optional[int] = None,
+               max_per_host: Optional[int] = None,
+               show_progress: bool = False,
+               store: Optional[artifact_store.ArtifactStore] = None):
+    """Initializes the manager.
+
+    Args:
+      max_workers: Maximum concurrent transfers. Defaults to the
+        download_workers flag.
+      max_per_host: Maximum concurrent transfers per remote host. Defaults to
+        the download_host_connections flag.
+      show_progress: Print aggregated progress for the batch to stdout.
+      store: An artifact store to reuse and keep copies of downloaded files.
+    """
+    self._store = store
+    self._max_workers = max(1, max_workers or _DOWNLOAD_WORKERS.value)
+    self._max_per_host = max(
+        1, max_per_host or _DOWNLOAD_HOST_CONNECTIONS.value)
+    self._show_progress = show_progress
+    self._executor = None
+    self._jobs = []
+    self._host_locks = {}
+    self._lock = threading.Lock()
+    self._abort = threading.Event()
+    self._last_report = 0.0
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused_args):
+    self.Close()
+
+  def Close(self):
+    """Releases the worker pool, waiting for running transfers to finish."""
+    if self._executor:
+      self._executor.shutdown(wait=True)
+      self._executor = None
+
+  def _HostLock(self, url: str) -> threading.BoundedSemaphore:
+    host = urllib.parse.urlparse(url).netloc.lower()
+    with self._lock:
+      if host not in self._host_locks:
+        self._host_locks[host] = threading.BoundedSemaphore(self._max_per_host)
+      return self._host_locks[host]
+
+  def Submit(self,
+             url: str,
+             save_location: str,
+             sha256: Optional[str] = None) -> DownloadJob:
+    """Queues a file for download.
+
+    Args:
+      url: The address of the file to be downloaded. Local paths are copied.
+      save_location: The full path of where the file should be saved.
+      sha256: The expected SHA256 hash of the file. (Optional)
+
+    Returns:
+      The DownloadJob tracking the transfer.
+    """
+    if not self._executor:
+      self._executor = concurrent.futures.ThreadPoolExecutor(
+          max_workers=self._max_workers,
+          thread_name_prefix='download')
+    job = DownloadJob(url, save_location, sha256)
+    job.downloader = download.Download(
+        show_progress=False,
+        progress_callback=lambda done, total: self._Progress(job, done, total),
+        store=self._store,
+        host_slots=self._HostLock)
+    self._jobs.append(job)
+    job.future = self._executor.submit(self._Run, job)
+    return job
+
+  def _Run(self, job: DownloadJob):
+    """Transfers and verifies a single file on a worker thread."""
+    if (job.sha256 and self._store and
+        self._store.CopyOut(job.sha256, job.save_location)):
+      logging.info('Using cached copy of %s.', job.url)
+      job.cached = True
+      return
+    with self._HostLock(job.url):
+      if self._abort.is_set():
+        job.skipped = True
+        return
+      try:
+        job.downloader.DownloadFile(
+            job.url,
+            job.save_location,
+            show_progress=False,
+            digests={'sha256': job.sha256} if job.sha256 else None)
+      except download.Error as e:
+        job.error = e
+        self._abort.set()
+
+  def Wait(self) -> List[DownloadJob]:
+    """Waits for all submitted transfers to finish.
+
+    Once any transfer fails, transfers which have not yet started are skipped.
+
+    Returns:
+      All submitted jobs, in submission order. Failed jobs carry the raised
+      download.Error in their error attribute.
+    """
+    futures = [job.future for job in self._jobs]
+    for future in concurrent.futures.as_completed(futures):
+      if future.cancelled():
+        continue
+      future.result()
+      if self._abort.is_set():
+        for pending in futures:
+          pending.cancel()
+    for job in self._jobs:
+      if job.future.cancelled():
+        job.skipped = True
+    if self._show_progress and self._jobs:
+      self._Report(force=True)
+    return self._jobs
+
+  def _Progress(self, job: DownloadJob, bytes_so_far: int, total_size: int):
+    job.bytes_so_far = bytes_so_far
+    job.total_size = total_size
+    if self._show_progress:
+      self._Report()
+
+  def _Report(self, force: bool = False):
+    """Prints aggregated progress for all jobs in the batch."""
+    with self._lock:
+      now = time.monotonic()
+      if not force and now - self._last_report < PROGRESS_INTERVAL:
+        return
+      self._last_report = now
+      done = sum(job.bytes_so_far for job in self._jobs)
+      total = sum(job.total_size for job in self._jobs)
+      finished = sum(
+          1 for job in self._jobs if job.future and job.future.done())
+      percent = (float(done) / total * 100) if total else 0.0
+      # pylint: disable=protected-access
+      converter = self._jobs[0].downloader._ConvertBytes
+      # pylint: enable=protected-access
+      sys.stdout.write(
+          '\rDownloaded %s of %s (%0.2f%%) - %d of %d file(s) complete%s' %
+          (converter(done), converter(total), percent, finished,
+           len(self._jobs), ' ' * 10))
+      if force:
+        sys.stdout.write('\n')
+      sys.stdout.flush()
@@ -0,0 +1,147 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for glazier.lib.download_manager."""
+
+import threading
+import time
+from unittest import mock
+
+from absl.testing import absltest
+from glazier.lib import artifact_store
+from glazier.lib import download
+from glazier.lib import download_manager
+from glazier.lib import test_utils
+
+_HOST_A = 'https://a.example.com'
+_HOST_B = 'https://b.example.com'
+
+
+class DownloadManagerTest(test_utils.GlazierTestCase):
+
+  def setUp(self):
+    super(DownloadManagerTest, self).setUp()
+    self.active = {}
+    self.peak = {}
+    self.lock = threading.Lock()
+
+  def _fake_download(self, unused_downloader, url, unused_save_location,
+                     show_progress=False, digests=None):
+    del show_progress, digests
+    host = url.rsplit('/', 1)[0]
+    with self.lock:
+      self.active[host] = self.active.get(host, 0) + 1
+      self.peak[host] = max(self.peak.get(host, 0), self.active[host])
+    time.sleep(0.05)
+    with self.lock:
+      self.active[host] -= 1
+    return True
+
+  @mock.patch.object(download.BaseDownloader, 'DownloadFile', autospec=True)
+  def test_submit_all(self, mock_downloadfile):
+    mock_downloadfile.side_effect = self._fake_download
+    urls = [f'{_HOST_A}/file{i}' for i in range(4)]
+    urls += [f'{_HOST_B}/file{i}' for i in range(4)]
+    with download_manager.DownloadManager(
+        max_workers=8, max_per_host=2) as manager:
+      for i, url in enumerate(urls):
+        manager.Submit(url, f'/tmp/file{i}')
+      jobs = manager.Wait()
+    self.assertEqual([job.url for job in jobs], urls)
+    self.assertTrue(all(job.error is None for job in jobs))
+    self.assertEqual(mock_downloadfile.call_count, len(urls))
+    self.assertEqual(self.peak[_HOST_A], 2)
+    self.assertEqual(self.peak[_HOST_B], 2)
+
+  @mock.patch.object(download.BaseDownloader, 'DownloadFile', autospec=True)
+  def test_separate_downloaders(self, mock_downloadfile):
+    mock_downloadfile.return_value = True
+    with download_manager.DownloadManager() as manager:
+      job1 = manager.Submit(f'{_HOST_A}/file1', '/tmp/file1')
+      job2 = manager.Submit(f'{_HOST_A}/file2', '/tmp/file2')
+      manager.Wait()
+    self.assertIsNot(job1.downloader, job2.downloader)
+    # Segments share the per-host limit of the whole batch.
+    self.assertIs(job1.downloader._host_slots(job1.url),
+                  job2.downloader._host_slots(f'{_HOST_A}/other'))
+
+  @mock.patch.object(download.BaseDownloader, 'DownloadFile', autospec=True)
+  def test_hash_verified(self, mock_downloadfile):
+    mock_downloadfile.return_value = True
+    with download_manager.DownloadManager() as manager:
+      job1 = manager.Submit(f'{_HOST_A}/file1', '/tmp/file1', sha256='abc')
+      job2 = manager.Submit(f'{_HOST_A}/file2', '/tmp/file2')
+      jobs = manager.Wait()
+    mock_downloadfile.assert_has_calls([
+        mock.call(job1.downloader, f'{_HOST_A}/file1', '/tmp/file1',
+                  show_progress=False, digests={'sha256': 'abc'}),
+        mock.call(job2.downloader, f'{_HOST_A}/file2', '/tmp/file2',
+                  show_progress=False, digests=None),
+    ], any_order=True)
+    self.assertIsNone(jobs[0].error)
+
+  @mock.patch.object(download.BaseDownloader, 'DownloadFile', autospec=True)
+  def test_hash_mismatch(self, mock_downloadfile):
+    mock_downloadfile.side_effect = download.HashMismatchError('/tmp/file1')
+    with download_manager.DownloadManager() as manager:
+      manager.Submit(f'{_HOST_A}/file1', '/tmp/file1', sha256='abc')
+      jobs = manager.Wait()
+    self.assertIsInstance(jobs[0].error, download.HashMismatchError)
+
+  @mock.patch.object(download.BaseDownloader, 'DownloadFile', autospec=True)
+  def test_store_hit(self, mock_downloadfile):
+    store = mock.create_autospec(artifact_store.ArtifactStore, instance=True)
+    store.CopyOut.side_effect = lambda sha256, unused_path: sha256 == 'abc'
+    with download_manager.DownloadManager(store=store) as manager:
+      cached = manager.Submit(f'{_HOST_A}/file1', '/tmp/file1', sha256='abc')
+      fetched = manager.Submit(f'{_HOST_A}/file2', '/tmp/file2', sha256='def')
+      manager.Wait()
+    self.assertTrue(cached.cached)
+    self.assertFalse(fetched.cached)
+    mock_downloadfile.assert_called_once_with(
+        fetched.downloader, f'{_HOST_A}/file2', '/tmp/file2',
+        show_progress=False,
+        digests={'sha256': 'def'})
+    self.assertIs(fetched.downloader._artifact_store, store)
+
+  @mock.patch.object(download.BaseDownloader, 'DownloadFile', autospec=True)
+  def test_failure_skips_pending(self, mock_downloadfile):
+    mock_downloadfile.side_effect = download.Error('Error')
+    with download_manager.DownloadManager(
+        max_workers=1, max_per_host=1) as manager:
+      for i in range(3):
+        manager.Submit(f'{_HOST_A}/file{i}', f'/tmp/file{i}')
+      jobs = manager.Wait()
+    self.assertIsInstance(jobs[0].error, download.Error)
+    self.assertEqual(mock_downloadfile.call_count, 1)
+    self.assertTrue(jobs[1].skipped)
+    self.assertTrue(jobs[2].skipped)
+
+  @mock.patch.object(download_manager.sys, 'stdout', autospec=True)
+  def test_progress(self, mock_stdout):
+    manager = download_manager.DownloadManager(show_progress=True)
+    job1 = download_manager.DownloadJob(f'{_HOST_A}/file1', '/tmp/file1')
+    job1.downloader = download.Download()
+    job2 = download_manager.DownloadJob(f'{_HOST_A}/file2', '/tmp/file2')
+    manager._jobs = [job1, job2]
+    manager._Progress(job1, 512, 1024)
+    manager._Progress(job2, 0, 1024)
+    manager._Report(force=True)
+    self.assertEqual(job1.bytes_so_far, 512)
+    self.assertEqual(job2.total_size, 1024)
+    self.assertIn('(25.00%) - 0 of 2 file(s) complete',
+                  mock_stdout.write.call_args_list[-2][0][0])
+
+
+if __name__ == '__main__':
+  absltest.main()
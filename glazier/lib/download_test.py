@@ -13,12 +13,19 @@
 # limitations under the License.
 """Tests for glazier.lib.download."""
 
+import hashlib
+import http.server
 import io
+import os
+import threading
+import urllib.request
 from unittest import mock
 
 from absl import flags
 from absl.testing import absltest
+from absl.testing import flagsaver
 from absl.testing import parameterized
+from glazier.lib import artifact_store
 from glazier.lib import beyondcorp
 from glazier.lib import buildinfo
 from glazier.lib import download
@@ -105,6 +112,12 @@ class PathsTest(test_utils.GlazierTestCase):
     result = download.PathCompile(
         self.buildinfo, file_name='/file.txt', base='/tmp/')
     self.assertEqual(result, '/tmp/sub/dir/other/another/file.txt')
+    result = download.PathCompile(
+        self.buildinfo, file_name='file.txt', base='/tmp', conf_path=['inc'])
+    self.assertEqual(result, '/tmp/inc/file.txt')
+    result = download.PathCompile(
+        self.buildinfo, file_name='file.txt', base='/tmp', conf_path=[])
+    self.assertEqual(result, '/tmp/file.txt')
 
 
 class DownloadTest(test_utils.GlazierTestCase):
@@ -152,6 +165,16 @@ class DownloadTest(test_utils.GlazierTestCase):
     mock_urlopen.side_effect = iter([httperr, urlerr, file_stream])
     res = self._dl._OpenStream(url)
     self.assertEqual(res, file_stream)
+    request = mock_urlopen.call_args[0][0]
+    self.assertEqual(request.full_url, url)
+    self.assertEqual(request.header_items(), [])
+
+    # Headers
+    mock_urlopen.side_effect = None
+    mock_urlopen.return_value = file_stream
+    self._dl._OpenStream(url, headers={'Range': 'bytes=10-'})
+    request = mock_urlopen.call_args[0][0]
+    self.assertEqual(request.get_header('Range'), 'bytes=10-')
 
     # Invalid URL
     with self.assertRaisesRegex(download.Error, 'Invalid remote server URL*'):
@@ -185,10 +208,21 @@ class DownloadTest(test_utils.GlazierTestCase):
     # match
     mock_urlopen.side_effect = iter([file_stream])
     self.assertTrue(self._dl.CheckUrl(_TEST_URI_YAML, status_codes=[200]))
+    file_stream.close.assert_called_once()
     # miss
     mock_urlopen.side_effect = iter([file_stream])
     self.assertFalse(self._dl.CheckUrl(_TEST_URI_YAML, status_codes=[201]))
 
+  @mock.patch.object(download.urllib.request, 'install_opener', autospec=True)
+  def test_install_openers(self, mock_install_opener):
+    self._dl._InstallOpeners()
+    download.Download()._InstallOpeners()
+    first, second = (c[0][0] for c in mock_install_opener.call_args_list)
+    self.assertIs(first, second)
+    handler = first.handle_open['https'][0]
+    self.assertIsInstance(handler, download.connection_pool.HTTPSHandler)
+    self.assertIs(handler._context, download.connection_pool.GetContext())
+
   @mock.patch.object(file_util, 'Copy', autospec=True)
   def test_download_file_local(self, mock_copy):
     self._dl.DownloadFile(
@@ -277,7 +311,7 @@ class DownloadTest(test_utils.GlazierTestCase):
     file_stream = mock.Mock()
     file_stream.getcode.return_value = 200
     file_stream.geturl.return_value = _TEST_URI_YAML
-    file_stream.headers.get = lambda x: {'Content-Length': '25'}[x]
+    file_stream.headers = {'Content-Length': '25'}
     file_stream.read = http_stream.read
 
     # success
@@ -328,14 +362,14 @@ class DownloadTest(test_utils.GlazierTestCase):
 
     # File Size
     http_stream.seek(0)
-    file_stream.headers.get = lambda x: {'Content-Length': '100000'}[x]
+    file_stream.headers = {'Content-Length': '100000'}
     self._dl._save_location = self.create_tempfile(file_path='download.txt')
     with self.assert_raises_with_validation(download.Error):
       self._dl._StreamToDisk(file_stream)
 
     # Socket Error
     http_stream.seek(0)
-    file_stream.headers.get = lambda x: {'Content-Length': '25'}[x]
+    file_stream.headers = {'Content-Length': '25'}
     file_stream.read = mock.Mock(side_effect=download.socket.error('SocketErr'))
     with self.assert_raises_with_validation(download.Error):
       self._dl._StreamToDisk(file_stream)
@@ -343,7 +377,7 @@ class DownloadTest(test_utils.GlazierTestCase):
 
     # Retries
     http_stream.seek(0)
-    file_stream.headers.get = lambda x: {'Content-Length': '100000'}[x]
+    file_stream.headers = {'Content-Length': '100000'}
     self._dl._save_location = self.create_tempfile(file_path='download.txt')
     with self.assert_raises_with_validation(download.Error):
       self._dl._StreamToDisk(file_stream)
@@ -375,5 +409,400 @@ class DownloadTest(test_utils.GlazierTestCase):
     self.assertFalse(result)
 
 
+class FlakyHandler(http.server.BaseHTTPRequestHandler):
+  """Serves a single file, dropping the connection part way through."""
+
+  content = b''
+  etag = '"v1"'
+  drops = 0
+  requests = []
+
+  def log_message(self, *unused_args):
+    pass
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    FlakyHandler.requests.append(dict(self.headers))
+    if self.headers.get('If-None-Match') == FlakyHandler.etag:
+      self.send_response(304)
+      self.send_header('ETag', FlakyHandler.etag)
+      self.end_headers()
+      return
+    start, end = 0, len(self.content) - 1
+    range_header = self.headers.get('Range')
+    if range_header and self.headers.get('If-Range') in (None,
+                                                         FlakyHandler.etag):
+      first, last = range_header[len('bytes='):].split('-')
+      start, end = int(first), int(last or end)
+      self.send_response(206)
+      self.send_header('Content-Range',
+                       'bytes %d-%d/%d' % (start, end, len(self.content)))
+    else:
+      self.send_response(200)
+    body = self.content[start:end + 1]
+    self.send_header('Accept-Ranges', 'bytes')
+    self.send_header('Content-Length', str(len(body)))
+    self.send_header('ETag', FlakyHandler.etag)
+    self.end_headers()
+    if FlakyHandler.drops:
+      FlakyHandler.drops -= 1
+      self.wfile.write(body[:len(body) // 2])
+      self.close_connection = True
+      return
+    self.wfile.write(body)
+
+
+class ResumableDownloadTest(test_utils.GlazierTestCase):
+
+  def setUp(self):
+    super(ResumableDownloadTest, self).setUp()
+    FlakyHandler.content = os.urandom(1024 * 1024)
+    FlakyHandler.etag = '"v1"'
+    FlakyHandler.drops = 0
+    FlakyHandler.requests = []
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    self.url = 'http://127.0.0.1:%d/image.wim' % server.server_address[1]
+    self.save_location = os.path.join(self.create_tempdir().full_path,
+                                      'image.wim')
+
+    for target, attribute, value in (
+        (download.BaseDownloader, '_GetHandlers',
+         lambda _: [urllib.request.HTTPHandler()]),
+        (download.winpe, 'check_winpe', lambda: False),
+        (beyondcorp.BeyondCorp, 'CheckBeyondCorp', lambda _: False),
+        (download, 'BACKOFF_MAX_TIME', 20)):
+      patcher = mock.patch.object(target, attribute, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    download.CHUNK_BYTE_SIZE = 65536
+
+  def _read_saved(self):
+    with open(self.save_location, 'rb') as f:
+      return f.read()
+
+  def test_resume_after_drop(self):
+    FlakyHandler.drops = 2
+    download.BaseDownloader().DownloadFile(self.url, self.save_location)
+    self.assertEqual(self._read_saved(), FlakyHandler.content)
+    self.assertLen(FlakyHandler.requests, 3)
+    self.assertNotIn('Range', FlakyHandler.requests[0])
+    self.assertEqual(FlakyHandler.requests[1]['Range'], 'bytes=524288-')
+    self.assertEqual(FlakyHandler.requests[1]['If-Range'], '"v1"')
+    self.assertEqual(FlakyHandler.requests[2]['Range'], 'bytes=786432-')
+    self.assertFalse(
+        os.path.exists(self.save_location + download.PARTIAL_SUFFIX))
+    self.assertFalse(
+        os.path.exists(self.save_location + download.PARTIAL_INFO_SUFFIX))
+
+  def test_resume_changed_file(self):
+    FlakyHandler.drops = 1
+    dl = download.BaseDownloader()
+    dl._save_location = self.save_location
+    dl._source_url = self.url
+    with self.assert_raises_with_validation(download.StreamInterruptedError):
+      dl._StreamToDisk(urllib.request.urlopen(self.url))
+    FlakyHandler.content = os.urandom(2048)
+    FlakyHandler.etag = '"v2"'
+    dl.DownloadFile(self.url, self.save_location)
+    self.assertEqual(self._read_saved(), FlakyHandler.content)
+    self.assertEqual(FlakyHandler.requests[-1]['If-Range'], '"v1"')
+
+  def test_resume_from_earlier_attempt(self):
+    FlakyHandler.drops = 1
+    dl = download.BaseDownloader()
+    dl._save_location = self.save_location
+    dl._source_url = self.url
+    with self.assert_raises_with_validation(download.StreamInterruptedError):
+      dl._StreamToDisk(urllib.request.urlopen(self.url))
+    self.assertEqual(dl._ResumeRequest(), (524288, {
+        'Range': 'bytes=524288-',
+        'If-Range': '"v1"'
+    }))
+    dl.DownloadFile(self.url, self.save_location)
+    self.assertEqual(self._read_saved(), FlakyHandler.content)
+    self.assertEqual(FlakyHandler.requests[-1]['Range'], 'bytes=524288-')
+
+  def test_artifact_store(self):
+    store = artifact_store.ArtifactStore(self.create_tempdir().full_path,
+                                         10 * 1024 * 1024)
+    download.BaseDownloader(store=store).DownloadFile(self.url,
+                                                      self.save_location)
+    sha256 = store.Lookup(self.url, '"v1"')
+    self.assertTrue(store.Contains(sha256))
+
+    # Same URL and ETag: placed from the store without reading the body.
+    os.remove(self.save_location)
+    dl = download.BaseDownloader(store=store)
+    with mock.patch.object(
+        dl, '_StreamToDisk', autospec=True) as mock_streamtodisk:
+      dl.DownloadFile(self.url, self.save_location)
+      self.assertFalse(mock_streamtodisk.called)
+    self.assertEqual(self._read_saved(), FlakyHandler.content)
+
+    # Changed ETag: downloaded again.
+    FlakyHandler.content = os.urandom(2048)
+    FlakyHandler.etag = '"v2"'
+    download.BaseDownloader(store=store).DownloadFile(self.url,
+                                                      self.save_location)
+    self.assertEqual(self._read_saved(), FlakyHandler.content)
+    self.assertNotEqual(store.Lookup(self.url, '"v2"'), sha256)
+
+  @flagsaver.flagsaver(conditional_get=True)
+  def test_conditional_get(self):
+    download.BaseDownloader().DownloadFile(self.url, self.save_location)
+    self.assertTrue(
+        os.path.exists(self.save_location + download.VALIDATORS_SUFFIX))
+    self.assertNotIn('If-None-Match', FlakyHandler.requests[-1])
+
+    # Unchanged: 304 and the existing copy is kept.
+    dl = download.BaseDownloader()
+    with mock.patch.object(
+        dl, '_StreamToDisk', autospec=True) as mock_streamtodisk:
+      dl.DownloadFile(self.url, self.save_location)
+      self.assertFalse(mock_streamtodisk.called)
+    self.assertEqual(FlakyHandler.requests[-1]['If-None-Match'], '"v1"')
+    self.assertEqual(self._read_saved(), FlakyHandler.content)
+
+    # Changed: downloaded again.
+    FlakyHandler.content = os.urandom(2048)
+    FlakyHandler.etag = '"v2"'
+    download.BaseDownloader().DownloadFile(self.url, self.save_location)
+    self.assertEqual(self._read_saved(), FlakyHandler.content)
+
+    # Local copy no longer matches its validators: not revalidated.
+    with open(self.save_location, 'ab') as f:
+      f.write(b'changed')
+    download.BaseDownloader().DownloadFile(self.url, self.save_location)
+    self.assertNotIn('If-None-Match', FlakyHandler.requests[-1])
+    self.assertEqual(self._read_saved(), FlakyHandler.content)
+
+  def test_conditional_get_store(self):
+    store = artifact_store.ArtifactStore(self.create_tempdir().full_path,
+                                         10 * 1024 * 1024)
+    download.BaseDownloader(store=store).DownloadFile(self.url,
+                                                      self.save_location)
+    other_location = self.save_location + '.copy'
+    download.BaseDownloader(store=store).DownloadFile(self.url, other_location)
+    self.assertEqual(FlakyHandler.requests[-1]['If-None-Match'], '"v1"')
+    with open(other_location, 'rb') as f:
+      self.assertEqual(f.read(), FlakyHandler.content)
+
+  def test_digests(self):
+    FlakyHandler.drops = 1
+    expected = {
+        'sha256': hashlib.sha256(FlakyHandler.content).hexdigest(),
+        'md5': hashlib.md5(FlakyHandler.content).hexdigest().upper(),
+    }
+    dl = download.BaseDownloader()
+    dl.DownloadFile(self.url, self.save_location, digests=expected)
+    self.assertEqual(self._read_saved(), FlakyHandler.content)
+    # Hashed as streamed, including the partial file the retry resumed.
+    self.assertEqual(dl.digests, {k: v.lower() for k, v in expected.items()})
+    self.assertEqual(FlakyHandler.requests[-1]['Range'], 'bytes=524288-')
+
+  def test_digests_mismatch(self):
+    with self.assert_raises_with_validation(download.HashMismatchError):
+      download.BaseDownloader().DownloadFile(
+          self.url, self.save_location, digests={'sha256': 'abc'})
+    self.assertFalse(os.path.exists(self.save_location))
+    self.assertFalse(
+        os.path.exists(self.save_location + download.PARTIAL_SUFFIX))
+    self.assertFalse(
+        os.path.exists(self.save_location + download.PARTIAL_INFO_SUFFIX))
+
+  def test_digests_unsupported(self):
+    with self.assert_raises_with_validation(download.FileValidationError):
+      download.BaseDownloader().DownloadFile(
+          self.url, self.save_location, digests={'crc0': 'abc'})
+    self.assertEmpty(FlakyHandler.requests)
+
+  def test_digests_store(self):
+    store = artifact_store.ArtifactStore(self.create_tempdir().full_path,
+                                         10 * 1024 * 1024)
+    sha256 = hashlib.sha256(FlakyHandler.content).hexdigest()
+    with mock.patch.object(
+        artifact_store, 'HashFile', autospec=True) as mock_hashfile:
+      download.BaseDownloader(store=store).DownloadFile(self.url,
+                                                        self.save_location)
+      self.assertFalse(mock_hashfile.called)
+    self.assertEqual(store.Lookup(self.url, '"v1"'), sha256)
+
+    # Placed from the store, the digest is the one it is stored under.
+    dl = download.BaseDownloader(store=store)
+    dl.DownloadFile(self.url, self.save_location + '.copy',
+                    digests={'sha256': sha256})
+    self.assertEqual(dl.digests, {'sha256': sha256})
+    with self.assert_raises_with_validation(download.HashMismatchError):
+      dl.DownloadFile(self.url, self.save_location + '.copy',
+                      digests={'md5': 'abc'})
+
+  @flagsaver.flagsaver(download_segments=4, download_segment_min_size=0)
+  def test_digests_segmented(self):
+    sha256 = hashlib.sha256(FlakyHandler.content).hexdigest()
+    dl = download.BaseDownloader()
+    dl.DownloadFile(self.url, self.save_location, digests={'sha256': sha256})
+    self.assertEqual(dl.digests, {'sha256': sha256})
+    with self.assert_raises_with_validation(download.HashMismatchError):
+      dl.DownloadFile(self.url, self.save_location, digests={'sha256': 'abc'})
+
+  @flagsaver.flagsaver(download_segments=4, download_segment_min_size=0)
+  def test_chunk_callback(self):
+    FlakyHandler.drops = 1
+    received = bytearray()
+
+    def Receive(offset, chunk):
+      self.assertLen(received, offset)
+      received.extend(chunk)
+
+    dl = download.BaseDownloader(chunk_callback=Receive)
+    dl.DownloadFile(self.url, self.save_location)
+    self.assertEqual(bytes(received), FlakyHandler.content)
+    # Not segmented: one request, and one to resume.
+    self.assertLen(FlakyHandler.requests, 2)
+
+  @flagsaver.flagsaver(download_segments=4, download_segment_min_size=0)
+  def test_segmented(self):
+    callback = mock.Mock()
+    dl = download.BaseDownloader(progress_callback=callback)
+    dl.DownloadFile(self.url, self.save_location)
+    self.assertEqual(self._read_saved(), FlakyHandler.content)
+    ranges = sorted(r.get('Range', '') for r in FlakyHandler.requests)
+    self.assertEqual(ranges, [
+        '', 'bytes=262144-524287', 'bytes=524288-786431',
+        'bytes=786432-1048575'
+    ])
+    callback.assert_called_with(len(FlakyHandler.content),
+                                len(FlakyHandler.content))
+    self.assertFalse(
+        os.path.exists(self.save_location + download.PARTIAL_SUFFIX))
+
+  @flagsaver.flagsaver(download_segments=4, download_segment_min_size=0)
+  def test_segmented_host_slots(self):
+    # The download holds one of three slots, so two more connections are free.
+    semaphore = threading.BoundedSemaphore(3)
+    semaphore.acquire()
+    host_slots = mock.Mock(return_value=semaphore)
+    download.BaseDownloader(host_slots=host_slots).DownloadFile(
+        self.url, self.save_location)
+    self.assertEqual(self._read_saved(), FlakyHandler.content)
+    host_slots.assert_called_with(self.url)
+    ranges = sorted(r.get('Range', '') for r in FlakyHandler.requests)
+    self.assertEqual(ranges, ['', 'bytes=349526-699051', 'bytes=699052-1048575'])
+    # Every extra slot was given back.
+    self.assertTrue(semaphore.acquire(blocking=False))
+    self.assertTrue(semaphore.acquire(blocking=False))
+    self.assertFalse(semaphore.acquire(blocking=False))
+
+    # No free slot: streamed over the one connection.
+    FlakyHandler.requests = []
+    download.BaseDownloader(host_slots=host_slots).DownloadFile(
+        self.url, self.save_location + '.copy')
+    self.assertLen(FlakyHandler.requests, 1)
+    self.assertNotIn('Range', FlakyHandler.requests[0])
+    with open(self.save_location + '.copy', 'rb') as f:
+      self.assertEqual(f.read(), FlakyHandler.content)
+
+  @flagsaver.flagsaver(download_segments=4, download_segment_min_size=0)
+  def test_segmented_retry(self):
+    # The first request still covers the first segment, so the second drop
+    # cuts a ranged segment short and the download is retried.
+    FlakyHandler.drops = 2
+    download.BaseDownloader().DownloadFile(self.url, self.save_location)
+    self.assertEqual(self._read_saved(), FlakyHandler.content)
+    self.assertGreater(len(FlakyHandler.requests), 4)
+
+  @flagsaver.flagsaver(download_segments=4, download_segment_min_size=0)
+  def test_segmented_changed_file(self):
+    dl = download.BaseDownloader()
+    dl._save_location = self.save_location
+    file_stream = urllib.request.urlopen(self.url)
+    FlakyHandler.etag = '"v2"'
+    with self.assert_raises_with_validation(download.StreamInterruptedError):
+      dl._SegmentedStreamToDisk(self.url, file_stream)
+    self.assertFalse(os.path.exists(dl._PartialPath()))
+
+  @mock.patch.object(download.BaseDownloader, '_OpenStream', autospec=True)
+  def test_segment_range_mismatch(self, mock_openstream):
+    file_stream = mock.Mock()
+    file_stream.headers = {'Content-Range': 'bytes 0-99/200', 'ETag': '"v1"'}
+    file_stream.info.return_value = file_stream.headers
+    mock_openstream.return_value = file_stream
+    dl = download.BaseDownloader()
+    dl._save_location = self.save_location
+    with self.assert_raises_with_validation(download.StreamInterruptedError):
+      dl._StreamSegment(self.url, None, 100, 199, '"v1"', mock.Mock())
+    file_stream.close.assert_called_once_with()
+
+  @flagsaver.flagsaver(download_segments=4, download_segment_min_size=4096)
+  def test_can_segment(self):
+    dl = download.BaseDownloader()
+    file_stream = mock.Mock()
+    file_stream.headers = {'Accept-Ranges': 'bytes', 'Content-Length': '8192'}
+    self.assertTrue(dl._CanSegment(file_stream))
+    file_stream.headers = {'Accept-Ranges': 'none', 'Content-Length': '8192'}
+    self.assertFalse(dl._CanSegment(file_stream))
+    file_stream.headers = {'Accept-Ranges': 'bytes', 'Content-Length': '1024'}
+    self.assertFalse(dl._CanSegment(file_stream))
+    file_stream.headers = {'Accept-Ranges': 'bytes'}
+    self.assertFalse(dl._CanSegment(file_stream))
+    with flagsaver.flagsaver(download_segments=1):
+      file_stream.headers = {
+          'Accept-Ranges': 'bytes',
+          'Content-Length': '8192'
+      }
+      self.assertFalse(dl._CanSegment(file_stream))
+
+  @mock.patch.object(download.winpe, 'check_winpe', autospec=True)
+  @mock.patch.object(
+      download.connection_pool, 'BuildOpener', autospec=True)
+  def test_open_stream_not_modified_error(self, mock_buildopener,
+                                          mock_check_winpe):
+    mock_check_winpe.return_value = True
+    not_modified = download.urllib.error.HTTPError(self.url, 304,
+                                                   'Not Modified', {}, None)
+    mock_buildopener.return_value.open.side_effect = not_modified
+    dl = download.BaseDownloader()
+    self.assertIs(
+        dl._OpenStream(self.url, [200, 304], {'If-None-Match': '"v1"'}),
+        not_modified)
+
+  def test_download_file_cached(self):
+    cache_dir = self.create_tempdir().full_path
+    with flagsaver.flagsaver(conditional_get=False):
+      path = download.BaseDownloader().DownloadFileCached(self.url, cache_dir)
+    self.assertTrue(path.startswith(cache_dir))
+    self.assertTrue(path.endswith('image.wim'))
+    with open(path, 'rb') as f:
+      self.assertEqual(f.read(), FlakyHandler.content)
+    self.assertEqual(
+        download.BaseDownloader().DownloadFileCached(self.url, cache_dir), path)
+    self.assertEqual(FlakyHandler.requests[-1]['If-None-Match'], '"v1"')
+
+  def test_resume_invalid_range(self):
+    dl = download.BaseDownloader()
+    dl._save_location = self.save_location
+    with open(dl._PartialPath(), 'wb') as f:
+      f.write(FlakyHandler.content[:100])
+    with open(dl._PartialInfoPath(), 'w') as f:
+      f.write('{"url": "%s", "etag": "\\"v1\\"", "size": %d}' %
+              (self.url, len(FlakyHandler.content)))
+    file_stream = mock.Mock()
+    file_stream.geturl.return_value = self.url
+    file_stream.headers = {
+        'Content-Length': str(len(FlakyHandler.content) - 50),
+        'Content-Range': 'bytes 50-%d/%d' % (len(FlakyHandler.content) - 1,
+                                             len(FlakyHandler.content)),
+        'ETag': '"v1"',
+    }
+    file_stream.info.return_value = file_stream.headers
+    with self.assert_raises_with_validation(download.StreamInterruptedError):
+      dl._StreamToDisk(file_stream, resume_from=100)
+    self.assertFalse(os.path.exists(dl._PartialPath()))
+    file_stream.close.assert_called_once_with()
+
+
 if __name__ == '__main__':
   absltest.main()
@@ -277,6 +277,12 @@ class ErrorCode(enum.IntEnum):
   # Error while setting an imaging timer.
   SET_TIMER_ERROR = 7083
 
+  # Reference to an unknown host fact.
+  UNKNOWN_FACT = 7084
+
+  # Error while extracting a zip archive.
+  UNZIP_ERROR = 7085
+
 
 class GlazierError(Exception):
   """Base error for all other Glazier errors."""
@@ -15,9 +15,12 @@
 
 import logging
 import subprocess
+import time
 from typing import List, Optional
 
 from glazier.lib import errors
+from glazier.lib import profiler
+from glazier.lib import registry
 
 
 class Error(errors.GlazierError):
@@ -111,6 +114,7 @@ def execute_binary(binary: str,
   if shell:
     stdout = None
     stderr = None
+  start = time.perf_counter()
   try:
     process = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, shell=shell,
                                universal_newlines=True)
@@ -127,6 +131,9 @@ def execute_binary(binary: str,
     process.stdout.close()
 
   process.wait()
+  profiler.AddChildTime(time.perf_counter() - start)
+  # The process may have written to the registry.
+  registry.clear_cache()
 
   if process.returncode not in return_codes and not check_return_code:
     raise ExecReturnError(string, process.returncode)
@@ -159,6 +166,7 @@ def check_output(binary: str,
     return_codes = [0]
 
   logging.info('Executing: %s', string)
+  start = time.perf_counter()
   try:
     process = subprocess.check_output(
         cmd,
@@ -175,5 +183,8 @@ def check_output(binary: str,
     return out
   except subprocess.TimeoutExpired as e:
     raise ExecTimeoutError(string, timeout) from e
+  finally:
+    profiler.AddChildTime(time.perf_counter() - start)
+    registry.clear_cache()
 
   return process
@@ -55,6 +55,14 @@ class ExecuteTest(test_utils.GlazierTestCase):
         [self.binary], shell=False, stdout=execute.subprocess.PIPE,
         stderr=execute.subprocess.STDOUT, universal_newlines=True)
 
+  @mock.patch.object(execute.registry, 'clear_cache', autospec=True)
+  @mock.patch.object(execute.subprocess, 'Popen', autospec=True)
+  def test_execute_binary_clear_cache(self, mock_popen, mock_clear_cache):
+    mock_popen.return_value.returncode = 0
+    mock_popen.return_value.stdout = io.BytesIO(b'')
+    execute.execute_binary(self.binary)
+    mock_clear_cache.assert_called_once()
+
   @mock.patch.object(execute.subprocess, 'Popen', autospec=True)
   def test_execute_binary_return_codes(self, mock_popen):
     popen_instance = mock_popen.return_value
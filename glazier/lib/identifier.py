@@ -20,7 +20,7 @@ import uuid
 
 from glazier.lib import registry
 from glazier.lib import winpe
-import yaml
+from glazier.lib import yaml_codec
 
 from glazier.lib import constants
 from glazier.lib import errors
@@ -95,7 +95,7 @@ def _check_file() -> str:
     with open(path) as handle:
 
       try:
-        input_config = yaml.safe_load(handle)
+        input_config = yaml_codec.Load(handle)
         image_id = input_config['BUILD']['image_id']
       except KeyError as e:
         raise BuildInfoKeyMissingError(str(e), path) from e
@@ -12,13 +12,31 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Set up logging for all imaging tools."""
+"""Set up logging for all imaging tools.
+
+The console is written to as records are logged. The build log, the Windows
+event log and syslog are each fed from a bounded queue by a thread of their
+own, so logging does not wait on them. Each thread writes the records it finds
+waiting in one batch, flushing the build log once per batch rather than once
+per record.
+
+If a sink falls behind until its queue is full, logging waits for the build log
+for up to FILE_BLOCK_SECONDS, and drops records for the event log and syslog;
+the number dropped is logged to the sink once it catches up. Flush() waits for
+the queued records to be written, and is called before Glazier exits or
+restarts the host.
+"""
 
 import logging
 import logging.handlers
 import os
+import queue
+import threading
+import time
+from typing import List, Optional
 import zipfile
 
+from absl import flags
 from glazier.lib import buildinfo
 from glazier.lib import file_util
 from glazier.lib import winpe
@@ -29,6 +47,20 @@ from glazier.lib import errors
 
 DATE_FMT = '%m%d %H:%M:%S'
 
+# Records written by a sink at a time.
+BATCH_SIZE = 256
+# How long logging waits on a full build log queue before dropping records.
+FILE_BLOCK_SECONDS = 10.0
+# How long Flush() waits for the queued records to be written.
+FLUSH_TIMEOUT = 30.0
+
+_LOG_QUEUE_SIZE = flags.DEFINE_integer(
+    'log_queue_size', 10000,
+    'Records each of the build log, event log and syslog may have waiting to '
+    'be written.')
+
+_sinks: List['_Sink'] = []
+
 
 class Error(errors.GlazierError):
   pass
@@ -50,6 +82,165 @@ class LogOpenError(Error):
         message=f'Failed to open log file: {log_file}')
 
 
+class BufferedFileHandler(logging.FileHandler):
+  """A FileHandler which leaves flushing to its caller.
+
+  Records are written to the buffered file without a flush after each one, so
+  a sink can flush once for a whole batch.
+  """
+
+  def emit(self, record: logging.LogRecord):
+    if self.stream is None:
+      self.stream = self._open()
+    try:
+      self.stream.write(self.format(record) + self.terminator)
+    except RecursionError:
+      raise
+    except Exception:  # pylint: disable=broad-except
+      self.handleError(record)
+
+
+class _Sink(logging.handlers.QueueHandler):
+  """Queues records for a handler, which a thread writes in batches.
+
+  Attributes:
+    handler: The handler records are written to.
+    dropped: The number of records dropped because the queue was full.
+  """
+
+  def __init__(self, handler: logging.Handler, queue_size: int,
+               block: float = 0.0):
+    """Starts the thread writing to the handler.
+
+    Args:
+      handler: The handler to write records to.
+      queue_size: The number of records which may wait to be written.
+      block: Seconds to wait for room in a full queue, before dropping a
+        record. 0 drops records at once.
+    """
+    super(_Sink, self).__init__(queue.Queue(max(1, queue_size)))
+    self.handler = handler
+    self.dropped = 0
+    self._block = block
+    self._reported = 0
+    self._queued = 0
+    self._written = 0
+    self._written_cv = threading.Condition()
+    self._thread = threading.Thread(
+        target=self._Run, name='log-%s' % type(handler).__name__, daemon=True)
+    self._thread.start()
+
+  def enqueue(self, record: logging.LogRecord):
+    # Runs under the handler lock, so the counters are not raced.
+    try:
+      if self._block:
+        self.queue.put(record, timeout=self._block)
+      else:
+        self.queue.put_nowait(record)
+      self._queued += 1
+    except queue.Full:
+      self.dropped += 1
+
+  def _Run(self):
+    """Writes queued records until a None is queued."""
+    while True:
+      batch = [self.queue.get()]
+      while len(batch) < BATCH_SIZE and batch[-1] is not None:
+        try:
+          batch.append(self.queue.get_nowait())
+        except queue.Empty:
+          break
+      records = [r for r in batch if r is not None]
+      for record in records:
+        self.handler.handle(record)
+      self._ReportDropped()
+      try:
+        self.handler.flush()
+      except (OSError, ValueError):
+        pass
+      with self._written_cv:
+        self._written += len(records)
+        self._written_cv.notify_all()
+      if batch[-1] is None:
+        return
+
+  def _ReportDropped(self):
+    dropped = self.dropped
+    if dropped > self._reported:
+      self.handler.handle(
+          logging.makeLogRecord({
+              'name': __name__,
+              'levelno': logging.WARNING,
+              'levelname': logging.getLevelName(logging.WARNING),
+              'msg': '%d log records were dropped, as the %s fell behind.',
+              'args': (dropped - self._reported, type(self.handler).__name__),
+          }))
+      self._reported = dropped
+
+  def Wait(self, timeout: float = FLUSH_TIMEOUT) -> bool:
+    """Waits for the records queued so far to be written.
+
+    Args:
+      timeout: The most seconds to wait.
+
+    Returns:
+      True if they were written, False if the wait timed out.
+    """
+    target = self._queued
+    deadline = time.monotonic() + timeout
+    with self._written_cv:
+      while self._written < target and self._thread.is_alive():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          return False
+        self._written_cv.wait(remaining)
+    return True
+
+  def flush(self):
+    self.Wait()
+
+  def close(self):
+    """Writes the queued records, then stops the thread and the handler."""
+    self.acquire()
+    try:
+      if self._thread.is_alive():
+        self.queue.put(None)
+        self._thread.join(FLUSH_TIMEOUT)
+      self.handler.close()
+    finally:
+      self.release()
+    super(_Sink, self).close()
+
+
+def Flush(timeout: float = FLUSH_TIMEOUT):
+  """Waits for the queued log records to be written, as before an exit.
+
+  Args:
+    timeout: The most seconds to wait for each of the build log, event log
+      and syslog.
+  """
+  for sink in _sinks:
+    if not sink.Wait(timeout):
+      logging.warning('Timed out flushing log records to the %s.',
+                      type(sink.handler).__name__)
+
+
+def Shutdown():
+  """Writes the queued log records, and stops the threads writing them."""
+  logger = logging.getLogger()
+  while _sinks:
+    sink = _sinks.pop()
+    logger.removeHandler(sink)
+    sink.close()
+
+
+def _AddSink(logger: logging.Logger, handler: logging.Handler,
+             block: float = 0.0):
+  sink = _Sink(handler, _LOG_QUEUE_SIZE.value, block)
+  _sinks.append(sink)
+  logger.addHandler(sink)
+
+
 def GetLogsPath():
   path = constants.SYS_LOGS_PATH
   if winpe.check_winpe():
@@ -73,9 +264,14 @@ def Collect(path: str):
     raise LogCollectionError() from e
 
 
-def Setup():
-  """Sets up the logging environment."""
-  build_info = buildinfo.BuildInfo()
+def Setup(build_info: Optional[buildinfo.BuildInfo] = None):
+  """Sets up the logging environment.
+
+  Args:
+    build_info: The active BuildInfo instance, used for the image ID. A new one
+      is created if not given.
+  """
+  build_info = build_info or buildinfo.BuildInfo()
   log_file = r'%s\%s' % (GetLogsPath(), constants.BUILD_LOG_FILE)
   file_util.CreateDirectories(log_file)
 
@@ -90,7 +286,9 @@ def Setup():
   # Set default logger
   logger = logging.getLogger()
   logger.setLevel(logging.DEBUG)
-  # Create empty list of handlers to enable multiple streams.
+  # Stop the sinks of any earlier setup, then create empty list of handlers to
+  # enable multiple streams.
+  Shutdown()
   logger.handlers = []
 
   # Create console handler and set level
@@ -101,19 +299,19 @@ def Setup():
 
   # Create file handler and set level
   try:
-    fh = logging.FileHandler(log_file)
+    fh = BufferedFileHandler(log_file)
   except IOError as e:
     raise LogOpenError(log_file) from e
   fh.setLevel(logging.DEBUG)
   fh.setFormatter(debug_formatter)
-  logger.addHandler(fh)
+  _AddSink(logger, fh, block=FILE_BLOCK_SECONDS)
 
   # Create Event Log handler and set level
   if not winpe.check_winpe():
     eh = logging.handlers.NTEventLogHandler('GlazierBuildLog')
     eh.setLevel(logging.DEBUG)
     eh.setFormatter(debug_formatter)
-    logger.addHandler(eh)
+    _AddSink(logger, eh)
 
   if (
       constants.SYSLOG_SERVER.value is not None
@@ -122,4 +320,4 @@ def Setup():
     sl = logging.handlers.SysLogHandler(
         address=(constants.SYSLOG_SERVER.value, constants.SYSLOG_PORT.value)
     )
-    logger.addHandler(sl)
+    _AddSink(logger, sl)
@@ -14,9 +14,12 @@
 """Tests for glazier.lib.logs."""
 
 from unittest import mock
+import logging
+import threading
 import zipfile
 
 from absl.testing import absltest
+from absl.testing import flagsaver
 from glazier.lib import file_util
 from glazier.lib import logs
 from glazier.lib import test_utils
@@ -80,23 +83,30 @@ class LoggingTest(test_utils.GlazierTestCase):
   @mock.patch.object(file_util, 'CreateDirectories')
   @mock.patch.object(logs.buildinfo.BuildInfo, 'ImageID', autospec=True)
   @mock.patch.object(winpe, 'check_winpe', autospec=True)
-  @mock.patch.object(logs.logging, 'FileHandler')
+  @mock.patch.object(logs, 'BufferedFileHandler', autospec=True)
   def test_setup(
       self, mock_filehandler, mock_check_winpe, mock_imageid,
       mock_createdirectories):
 
     mock_imageid.return_value = TEST_ID
     mock_check_winpe.return_value = False
+    self.addCleanup(logs.Shutdown)
     logs.Setup()
+    build_info = logs.buildinfo.BuildInfo()
+    logs.Setup(build_info)
+    mock_imageid.assert_called_with(build_info)
     mock_createdirectories.assert_called_with(
         r'%s\glazier.log' % logs.constants.SYS_LOGS_PATH)
     mock_filehandler.assert_called_with(
         r'%s\glazier.log' % logs.constants.SYS_LOGS_PATH)
+    # The sinks of the first setup are replaced.
+    self.assertLen(logs._sinks, 2)
+    self.assertEqual(logs.logging.getLogger().handlers[1:], logs._sinks)
 
   @mock.patch.object(file_util, 'CreateDirectories')
   @mock.patch.object(logs.buildinfo.BuildInfo, 'ImageID', autospec=True)
   @mock.patch.object(winpe, 'check_winpe', autospec=True)
-  @mock.patch.object(logs.logging, 'FileHandler')
+  @mock.patch.object(logs, 'BufferedFileHandler', autospec=True)
   def test_setup_error(
       self, mock_filehandler, mock_check_winpe, mock_imageid,
       mock_createdirectories):
@@ -108,5 +118,120 @@ class LoggingTest(test_utils.GlazierTestCase):
       logs.Setup()
     self.assertTrue(mock_createdirectories.called)
 
+
+class _SlowHandler(logging.Handler):
+  """Records what it handles, waiting for a release to handle anything."""
+
+  def __init__(self):
+    super(_SlowHandler, self).__init__()
+    self.release_event = threading.Event()
+    self.messages = []
+    self.flushes = 0
+
+  def emit(self, record):
+    self.release_event.wait(5)
+    self.messages.append(self.format(record))
+
+  def flush(self):
+    self.flushes += 1
+
+
+class SinkTest(test_utils.GlazierTestCase):
+
+  def setUp(self):
+    super(SinkTest, self).setUp()
+    self.logger = logging.getLogger('glazier.logs_test')
+    self.logger.propagate = False
+    self.logger.setLevel(logging.DEBUG)
+    self.addCleanup(setattr, self.logger, 'handlers', [])
+    self.handler = _SlowHandler()
+
+  def _sink(self, queue_size=100, block=0.0):
+    sink = logs._Sink(self.handler, queue_size, block)
+    self.logger.addHandler(sink)
+    self.addCleanup(self.logger.removeHandler, sink)
+    self.addCleanup(sink.close)
+    return sink
+
+  def test_batches(self):
+    sink = self._sink()
+    for i in range(10):
+      self.logger.info('record %d of %s', i, 'ten')
+    self.handler.release_event.set()
+    self.assertTrue(sink.Wait())
+    self.assertEqual(self.handler.messages,
+                     ['record %d of ten' % i for i in range(10)])
+    # The first record is written alone, and the other nine together.
+    self.assertLessEqual(self.handler.flushes, 2)
+
+  def test_exception(self):
+    sink = self._sink()
+    self.handler.release_event.set()
+    try:
+      raise ValueError('bad value')
+    except ValueError:
+      self.logger.exception('failed')
+    sink.Wait()
+    self.assertStartsWith(self.handler.messages[0], 'failed\nTraceback')
+    self.assertIn('ValueError: bad value', self.handler.messages[0])
+
+  def test_drop(self):
+    sink = self._sink(queue_size=5)
+    for i in range(20):
+      self.logger.info('record %d', i)
+    self.assertGreaterEqual(sink.dropped, 14)
+    self.handler.release_event.set()
+    sink.Wait()
+    self.logger.info('last')
+    sink.Wait()
+    self.assertRegex(self.handler.messages[-2],
+                     r'\d+ log records were dropped, as the _SlowHandler')
+    self.assertEqual(self.handler.messages[-1], 'last')
+
+  def test_block(self):
+    sink = self._sink(queue_size=1, block=5.0)
+    threading.Timer(0.2, self.handler.release_event.set).start()
+    for i in range(5):
+      self.logger.info('record %d', i)
+    sink.Wait()
+    self.assertEqual(sink.dropped, 0)
+    self.assertLen(self.handler.messages, 5)
+
+  def test_wait_timeout(self):
+    sink = self._sink()
+    self.logger.info('record')
+    self.assertFalse(sink.Wait(timeout=0.1))
+    self.handler.release_event.set()
+    self.assertTrue(sink.Wait())
+
+  def test_close(self):
+    sink = self._sink()
+    self.logger.info('record')
+    self.handler.release_event.set()
+    sink.close()
+    self.assertEqual(self.handler.messages, ['record'])
+
+  @flagsaver.flagsaver(log_queue_size=100)
+  def test_flush_shutdown(self):
+    logs._AddSink(self.logger, self.handler)
+    self.addCleanup(logs.Shutdown)
+    self.logger.info('record')
+    self.handler.release_event.set()
+    logs.Flush()
+    self.assertEqual(self.handler.messages, ['record'])
+    logs.Shutdown()
+    self.assertEmpty(logs._sinks)
+
+  def test_buffered_file_handler(self):
+    path = self.create_tempfile().full_path
+    handler = logs.BufferedFileHandler(path)
+    self.addCleanup(handler.close)
+    handler.emit(logging.makeLogRecord({'msg': 'first'}))
+    handler.emit(logging.makeLogRecord({'msg': 'second'}))
+    handler.flush()
+    with open(path) as f:
+      self.assertEqual(f.read(), 'first\nsecond\n')
+
+
 if __name__ == '__main__':
   absltest.main()
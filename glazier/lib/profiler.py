@@ -0,0 +1,267 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Records where the time and resources of a build go.
+
+With --profile_trace set, ConfigBuilder and ConfigRunner record a span for each
+include file, pin evaluation and action. Every span holds its wall time, the
+bytes downloaded and the time spent in child processes while it ran, and the
+peak resident set size of the process when it ended.
+
+Spans are appended to the trace file as they end, in the JSON array form of the
+Chrome trace event format, which may be left unterminated. The file can be
+opened as is in chrome://tracing or Perfetto, and keeps growing across the
+reboots of a build. Once the build is done, the spans which took the most time
+are summarized in the log.
+
+Downloads and child processes are counted for the whole process, so a span also
+accounts for any background work that happened while it was running.
+"""
+
+import collections
+import contextlib
+import ctypes
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List
+
+from absl import flags
+
+try:
+  import resource  # pylint: disable=g-import-not-at-top
+except ImportError:
+  resource = None
+
+_PROFILE_TRACE = flags.DEFINE_string(
+    'profile_trace', '',
+    'Record the time and resources taken by each include file, pin evaluation '
+    'and action of the build to this file, as a Chrome trace, and summarize '
+    'them at the end of the build.')
+_PROFILE_TOP = flags.DEFINE_integer(
+    'profile_top', 20,
+    'The number of entries in the profile summary at the end of the build.')
+
+CATEGORY_ACTION = 'action'
+CATEGORY_BUILD = 'build'
+CATEGORY_INCLUDE = 'include'
+CATEGORY_PIN = 'pin'
+
+_lock = threading.Lock()
+_counters = {'bytes': 0, 'child_seconds': 0.0}
+_trace = {'path': None, 'file': None}
+
+
+class _ProcessMemoryCounters(ctypes.Structure):
+  _fields_ = [
+      ('cb', ctypes.c_ulong),
+      ('PageFaultCount', ctypes.c_ulong),
+      ('PeakWorkingSetSize', ctypes.c_size_t),
+      ('WorkingSetSize', ctypes.c_size_t),
+      ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+      ('QuotaPagedPoolUsage', ctypes.c_size_t),
+      ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+      ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+      ('PagefileUsage', ctypes.c_size_t),
+      ('PeakPagefileUsage', ctypes.c_size_t),
+  ]
+
+
+def Enabled() -> bool:
+  return bool(_PROFILE_TRACE.value)
+
+
+def AddBytes(num_bytes: int):
+  """Counts bytes received by a download."""
+  with _lock:
+    _counters['bytes'] += num_bytes
+
+
+def AddChildTime(seconds: float):
+  """Counts time spent waiting on a child process."""
+  with _lock:
+    _counters['child_seconds'] += seconds
+
+
+def _PeakRss() -> int:
+  """The peak resident set size of this process, in bytes, or 0 if unknown."""
+  if resource:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+  try:
+    counters = _ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    kernel32 = ctypes.windll.kernel32  # pytype: disable=module-attr
+    kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+    if ctypes.windll.psapi.GetProcessMemoryInfo(  # pytype: disable=module-attr
+        ctypes.c_void_p(kernel32.GetCurrentProcess()), ctypes.byref(counters),
+        counters.cb):
+      return counters.PeakWorkingSetSize
+  except (AttributeError, OSError):
+    pass
+  return 0
+
+
+def _Record(event: Dict[str, Any]):
+  """Appends an event to the trace file."""
+  path = _PROFILE_TRACE.value
+  line = json.dumps(event, separators=(',', ':'), default=str)
+  with _lock:
+    try:
+      if _trace['path'] != path:
+        if _trace['file']:
+          _trace['file'].close()
+        _trace['path'] = None
+        _trace['file'] = None
+        directory = os.path.dirname(path)
+        if directory:
+          os.makedirs(directory, exist_ok=True)
+        f = open(path, 'ab+')
+        _trace['path'] = path
+        _trace['file'] = f
+        if not f.seek(0, os.SEEK_END):
+          f.write(b'[\n')
+        else:
+          f.seek(-1, os.SEEK_END)
+          if f.read(1) != b'\n':
+            # Start afresh after an event cut short by an interrupted write.
+            f.write(b'\n')
+      _trace['file'].write(line.encode('utf-8') + b',\n')
+      _trace['file'].flush()
+    except (OSError, ValueError) as e:
+      logging.warning('Unable to write profile trace %s: %s', path, e)
+
+
+@contextlib.contextmanager
+def Span(category: str, name: str, **args) -> Iterator[None]:
+  """Records the time and resources taken by a block of code.
+
+  Does nothing unless --profile_trace is set.
+
+  Args:
+    category: The kind of work, such as CATEGORY_ACTION.
+    name: The name of the work, such as the name of the action.
+    **args: Details to keep in the trace alongside the measurements.
+
+  Yields:
+    None, while the span is running.
+  """
+  if not Enabled():
+    yield
+    return
+  with _lock:
+    start_bytes = _counters['bytes']
+    start_child = _counters['child_seconds']
+  timestamp = time.time()
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    duration = time.perf_counter() - start
+    with _lock:
+      args['bytes'] = _counters['bytes'] - start_bytes
+      args['child_seconds'] = round(
+          _counters['child_seconds'] - start_child, 6)
+    args['peak_rss'] = _PeakRss()
+    _Record({
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': int(timestamp * 1e6),
+        'dur': int(duration * 1e6),
+        'pid': os.getpid(),
+        'tid': threading.get_ident(),
+        'args': args,
+    })
+
+
+def Load(path: str) -> List[Dict[str, Any]]:
+  """Reads the events of a trace file.
+
+  Args:
+    path: The trace file.
+
+  Returns:
+    The complete events in the file. An event cut short by an interrupted write
+    is skipped.
+  """
+  events = []
+  try:
+    with open(path) as f:
+      for line in f:
+        line = line.strip().rstrip(',')
+        if not line.startswith('{'):
+          continue
+        try:
+          event = json.loads(line)
+        except ValueError:
+          continue
+        if event.get('ph') == 'X':
+          events.append(event)
+  except OSError as e:
+    logging.warning('Unable to read profile trace %s: %s', path, e)
+  return events
+
+
+def Summarize(events: List[Dict[str, Any]], top: int) -> List[Dict[str, Any]]:
+  """Totals events by category and name.
+
+  Args:
+    events: Trace events, as returned by Load().
+    top: The number of entries to return.
+
+  Returns:
+    The entries which took the most wall time, longest first, each with the
+    number of spans and the total seconds, bytes and child process seconds,
+    and the highest peak RSS seen.
+  """
+  totals = collections.OrderedDict()
+  for event in events:
+    key = (event.get('cat', ''), event.get('name', ''))
+    args = event.get('args') or {}
+    if key not in totals:
+      totals[key] = {
+          'category': key[0],
+          'name': key[1],
+          'count': 0,
+          'seconds': 0.0,
+          'bytes': 0,
+          'child_seconds': 0.0,
+          'peak_rss': 0,
+      }
+    entry = totals[key]
+    entry['count'] += 1
+    entry['seconds'] += event.get('dur', 0) / 1e6
+    entry['bytes'] += args.get('bytes', 0)
+    entry['child_seconds'] += args.get('child_seconds', 0.0)
+    entry['peak_rss'] = max(entry['peak_rss'], args.get('peak_rss', 0))
+  return sorted(
+      totals.values(), key=lambda e: e['seconds'], reverse=True)[:top]
+
+
+def LogSummary():
+  """Logs the entries of the trace which took the most time."""
+  if not Enabled():
+    return
+  entries = Summarize(Load(_PROFILE_TRACE.value), _PROFILE_TOP.value)
+  logging.info('Build profile (%s), top %d by wall time:',
+               _PROFILE_TRACE.value, len(entries))
+  for e in entries:
+    logging.info(
+        '%10.3fs %5dx  %-8s %s  [%.1f MiB downloaded, %.3fs in child '
+        'processes, peak RSS %.1f MiB]', e['seconds'], e['count'],
+        e['category'], e['name'], e['bytes'] / 2**20, e['child_seconds'],
+        e['peak_rss'] / 2**20)
@@ -0,0 +1,134 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for glazier.lib.profiler."""
+
+import json
+import os
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import flagsaver
+from glazier.lib import profiler
+from glazier.lib import test_utils
+
+
+class ProfilerTest(test_utils.GlazierTestCase):
+
+  def setUp(self):
+    super(ProfilerTest, self).setUp()
+    self.trace = os.path.join(self.create_tempdir().full_path, 'trace.json')
+
+  def test_disabled(self):
+    with profiler.Span(profiler.CATEGORY_ACTION, 'Execute'):
+      profiler.AddBytes(10)
+    self.assertFalse(os.path.exists(self.trace))
+    self.assertFalse(profiler.Enabled())
+
+  def test_span(self):
+    with flagsaver.flagsaver(profile_trace=self.trace):
+      with profiler.Span(profiler.CATEGORY_INCLUDE, 'a/build.yaml'):
+        profiler.AddBytes(1024)
+        with profiler.Span(profiler.CATEGORY_ACTION, 'Execute', step=1):
+          profiler.AddChildTime(1.5)
+    events = profiler.Load(self.trace)
+    self.assertLen(events, 2)
+    action, include = events
+    self.assertEqual(action['name'], 'Execute')
+    self.assertEqual(action['cat'], 'action')
+    self.assertEqual(action['ph'], 'X')
+    self.assertEqual(action['args']['step'], 1)
+    self.assertEqual(action['args']['bytes'], 0)
+    self.assertEqual(action['args']['child_seconds'], 1.5)
+    self.assertEqual(include['args']['bytes'], 1024)
+    self.assertEqual(include['args']['child_seconds'], 1.5)
+    self.assertGreater(include['args']['peak_rss'], 0)
+    self.assertLessEqual(include['ts'], action['ts'])
+    self.assertGreaterEqual(include['dur'], action['dur'])
+
+  def test_span_error(self):
+    with flagsaver.flagsaver(profile_trace=self.trace):
+      with self.assertRaises(ValueError):
+        with profiler.Span(profiler.CATEGORY_ACTION, 'Execute'):
+          raise ValueError('failed')
+    self.assertLen(profiler.Load(self.trace), 1)
+
+  def test_trace_format(self):
+    with flagsaver.flagsaver(profile_trace=self.trace):
+      for name in ('a', 'b'):
+        with profiler.Span(profiler.CATEGORY_PIN, name):
+          pass
+    with open(self.trace) as f:
+      content = f.read()
+    # The array form of the trace format may be left unterminated.
+    events = json.loads(content.rstrip().rstrip(',') + ']')
+    self.assertEqual([e['name'] for e in events], ['a', 'b'])
+
+  def test_trace_appends(self):
+    with open(self.trace, 'w') as f:
+      f.write('[\n{"name":"Reboot","cat":"action","ph":"X","ts":1,"dur":5},\n'
+              '{"name":"cut sh')
+    with flagsaver.flagsaver(profile_trace=self.trace):
+      with profiler.Span(profiler.CATEGORY_ACTION, 'Execute'):
+        pass
+    self.assertEqual([e['name'] for e in profiler.Load(self.trace)],
+                     ['Reboot', 'Execute'])
+
+  def test_load_missing(self):
+    self.assertEqual(profiler.Load(self.trace), [])
+
+  @mock.patch.object(profiler.logging, 'warning', autospec=True)
+  def test_record_error(self, mock_warning):
+    os.mkdir(self.trace)
+    with flagsaver.flagsaver(profile_trace=self.trace):
+      with profiler.Span(profiler.CATEGORY_ACTION, 'Execute'):
+        pass
+    self.assertTrue(mock_warning.called)
+
+  def test_summarize(self):
+    events = [
+        {'name': 'Execute', 'cat': 'action', 'dur': 2000000,
+         'args': {'bytes': 10, 'child_seconds': 1.0, 'peak_rss': 100}},
+        {'name': 'Get', 'cat': 'action', 'dur': 1000000,
+         'args': {'bytes': 2**20, 'child_seconds': 0.0, 'peak_rss': 300}},
+        {'name': 'Execute', 'cat': 'action', 'dur': 500000,
+         'args': {'bytes': 5, 'child_seconds': 0.5, 'peak_rss': 200}},
+        {'name': 'os', 'cat': 'pin', 'dur': 10},
+    ]
+    summary = profiler.Summarize(events, 2)
+    self.assertEqual(summary, [
+        {'category': 'action', 'name': 'Execute', 'count': 2, 'seconds': 2.5,
+         'bytes': 15, 'child_seconds': 1.5, 'peak_rss': 200},
+        {'category': 'action', 'name': 'Get', 'count': 1, 'seconds': 1.0,
+         'bytes': 2**20, 'child_seconds': 0.0, 'peak_rss': 300},
+    ])
+
+  @mock.patch.object(profiler.logging, 'info', autospec=True)
+  def test_log_summary(self, mock_info):
+    profiler.LogSummary()
+    mock_info.assert_not_called()
+    with flagsaver.flagsaver(profile_trace=self.trace, profile_top=1):
+      for name in ('Execute', 'Get'):
+        with profiler.Span(profiler.CATEGORY_ACTION, name):
+          pass
+      profiler.LogSummary()
+    self.assertEqual(mock_info.call_count, 2)
+
+  def test_peak_rss(self):
+    self.assertGreater(profiler._PeakRss(), 0)
+    with mock.patch.object(profiler, 'resource', None):
+      self.assertGreaterEqual(profiler._PeakRss(), 0)
+
+
+if __name__ == '__main__':
+  absltest.main()
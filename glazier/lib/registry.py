@@ -11,15 +11,54 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Wrapper library for gwinpy.registry functions."""
+"""Wrapper library for gwinpy.registry functions.
+
+Values are read and written through a backend: the host registry by default,
+or an in-memory registry installed with set_backend(), which lets registry
+code be tested and benchmarked off Windows.
+
+With --registry_cache, values read are kept for the life of the process, so
+reading the same value again does not go back to the registry. Values set or
+removed through this module are dropped from the cache as they are written.
+
+Each call to set_value or remove_value opens and closes its key. To write many
+values, a Session collects them and applies them one key at a time, opening
+each key only once:
+
+  with registry.Session() as session:
+    session.set_value('name', 'value')
+    session.remove_value('other')
+"""
 
 import logging
-from typing import Optional, Union, List, Dict
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
+from absl import flags
 from glazier.lib import constants
 from glazier.lib import errors
 from gwinpy.registry import registry
 
+try:
+  import winreg  # pylint: disable=g-import-not-at-top
+except ImportError:
+  winreg = None
+
+_REGISTRY_CACHE = flags.DEFINE_bool(
+    'registry_cache', False,
+    'Cache the registry values read. Values written by Glazier are dropped '
+    'from the cache, but those written by other processes are not seen until '
+    'it is cleared.')
+
+# The registry roots, and the names of their winreg handles.
+_HKEYS = {
+    'HKCR': 'HKEY_CLASSES_ROOT',
+    'HKCU': 'HKEY_CURRENT_USER',
+    'HKLM': 'HKEY_LOCAL_MACHINE',
+    'HKU': 'HKEY_USERS',
+}
+
 
 class Error(errors.GlazierError):
   pass
@@ -44,6 +83,431 @@ class RegistryDeleteError(Error):
         error_code=errors.ErrorCode.REGISTRY_DELETE_ERROR, message=message)
 
 
+class Key(object):
+  """An open registry key, to set and remove values in.
+
+  The default implementation goes back to its backend for every value.
+  """
+
+  def __init__(self, backend: 'Backend', root: str, path: str,
+               use_64bit: bool):
+    self._backend = backend
+    self._root = root
+    self._path = path
+    self._use_64bit = use_64bit
+
+  def set_value(self, name: str, value: Union[str, int], reg_type: str):
+    self._backend.set_value(name, value, self._root, self._path, reg_type,
+                            self._use_64bit)
+
+  def remove_value(self, name: str):
+    self._backend.remove_value(name, self._root, self._path, self._use_64bit)
+
+  def close(self):
+    pass
+
+
+class Backend(object):
+  """Reads and writes registry values.
+
+  Methods raise gwinpy's registry.RegistryError on failure, with an errno of 2
+  if the key or value does not exist.
+  """
+
+  def get_value(self, name: str, root: str, path: str, use_64bit: bool) -> Any:
+    raise NotImplementedError()
+
+  def get_keys(self, path: str, root: str, use_64bit: bool) -> List[str]:
+    raise NotImplementedError()
+
+  def get_keys_and_values(self, path: str, root: str,
+                          use_64bit: bool) -> List[Tuple[str, Any, Any]]:
+    raise NotImplementedError()
+
+  def set_value(self, name: str, value: Union[str, int], root: str, path: str,
+                reg_type: str, use_64bit: bool):
+    raise NotImplementedError()
+
+  def remove_value(self, name: str, root: str, path: str, use_64bit: bool):
+    raise NotImplementedError()
+
+  def open_key(self, root: str, path: str, use_64bit: bool,
+               create: bool) -> Key:
+    r"""Opens a key to set or remove many values in.
+
+    Args:
+      root: Registry root (HKCR\HKCU\HKLM\HKU).
+      path: Registry key path.
+      use_64bit: True for 64 bit registry. False for 32 bit.
+      create: Create the key if it does not exist.
+
+    Returns:
+      The open key, which the caller closes.
+    """
+    del create  # set_value creates keys as needed.
+    return Key(self, root, path, use_64bit)
+
+
+class _WinregKey(Key):
+  """A key held open through winreg."""
+
+  def __init__(self, handle: Any, root: str, path: str, use_64bit: bool):
+    super(_WinregKey, self).__init__(None, root, path, use_64bit)
+    self._handle = handle
+
+  def set_value(self, name, value, reg_type):
+    try:
+      winreg.SetValueEx(self._handle, name, 0, getattr(winreg, reg_type), value)
+    except OSError as e:
+      raise registry.RegistryError(str(e), errno=e.winerror) from e
+
+  def remove_value(self, name):
+    try:
+      winreg.DeleteValue(self._handle, name)
+    except OSError as e:
+      raise registry.RegistryError(str(e), errno=e.winerror) from e
+
+  def close(self):
+    winreg.CloseKey(self._handle)
+
+
+class GwinpyBackend(Backend):
+  """The host registry, through gwinpy.
+
+  Where winreg is available, keys from open_key() are held open until closed,
+  rather than opened again for every value.
+  """
+
+  def get_value(self, name, root, path, use_64bit):
+    reg = registry.Registry(root_key=root)
+    return reg.GetKeyValue(key_path=path, key_name=name, use_64bit=use_64bit)
+
+  def get_keys(self, path, root, use_64bit):
+    reg = registry.Registry(root_key=root)
+    return reg.GetRegKeys(key_path=path, use_64bit=use_64bit)
+
+  def get_keys_and_values(self, path, root, use_64bit):
+    reg = registry.Registry(root_key=root)
+    return reg.GetRegKeysAndValues(key_path=path, use_64bit=use_64bit)
+
+  def set_value(self, name, value, root, path, reg_type, use_64bit):
+    reg = registry.Registry(root_key=root)
+    reg.SetKeyValue(
+        key_path=path,
+        key_name=name,
+        key_value=value,
+        key_type=reg_type,
+        use_64bit=use_64bit)
+
+  def remove_value(self, name, root, path, use_64bit):
+    reg = registry.Registry(root_key=root)
+    reg.RemoveKeyValue(key_path=path, key_name=name, use_64bit=use_64bit)
+
+  def open_key(self, root, path, use_64bit, create):
+    if winreg is None or root not in _HKEYS:
+      return super(GwinpyBackend, self).open_key(root, path, use_64bit, create)
+    access = winreg.KEY_ALL_ACCESS | (
+        winreg.KEY_WOW64_64KEY if use_64bit else winreg.KEY_WOW64_32KEY)
+    try:
+      if create:
+        handle = winreg.CreateKeyEx(
+            getattr(winreg, _HKEYS[root]), path, 0, access)
+      else:
+        handle = winreg.OpenKeyEx(getattr(winreg, _HKEYS[root]), path, 0, access)
+    except OSError as e:
+      raise registry.RegistryError(str(e), errno=e.winerror) from e
+    return _WinregKey(handle, root, path, use_64bit)
+
+
+class _MemoryKey(Key):
+  """A key of a MemoryBackend."""
+
+  def __init__(self, backend: 'MemoryBackend', values: Dict[str, Any]):
+    super(_MemoryKey, self).__init__(backend, '', '', True)
+    self._values = values
+
+  def set_value(self, name, value, reg_type):
+    with self._backend.lock:
+      self._values[name.lower()] = (name, value, reg_type)
+
+  def remove_value(self, name):
+    with self._backend.lock:
+      if self._values.pop(name.lower(), None) is None:
+        raise registry.RegistryError(
+            f'Registry value not found: {name}', errno=2)
+
+
+class MemoryBackend(Backend):
+  """A registry held in memory, for tests and benchmarks.
+
+  Key paths and value names are case insensitive, as in the host registry, and
+  roots other than those of the host registry are rejected.
+
+  Attributes:
+    lock: Guards the keys and their values.
+    opens: The number of times a key has been opened.
+  """
+
+  def __init__(self, latency: float = 0.0):
+    """Creates an empty registry.
+
+    Args:
+      latency: Seconds each key takes to open, to stand in for the host
+        registry in benchmarks.
+    """
+    self.lock = threading.Lock()
+    self.opens = 0
+    self._keys = {}
+    self._latency = latency
+
+  def _open(self, root: str, path: str, use_64bit: bool,
+            create: bool) -> Dict[str, Tuple[str, Any, str]]:
+    if self._latency:
+      time.sleep(self._latency)
+    with self.lock:
+      self.opens += 1
+      if (root or '').upper() not in _HKEYS:
+        raise registry.RegistryError(f'Unknown registry root: {root}')
+      key = (root.upper(), (path or '').lower(), bool(use_64bit))
+      if key not in self._keys:
+        if not create:
+          raise registry.RegistryError(
+              fr'Registry key not found: {root}:\{path}', errno=2)
+        self._keys[key] = {}
+      return self._keys[key]
+
+  def get_value(self, name, root, path, use_64bit):
+    values = self._open(root, path, use_64bit, False)
+    with self.lock:
+      if name.lower() not in values:
+        raise registry.RegistryError(
+            f'Registry value not found: {name}', errno=2)
+      return values[name.lower()][1]
+
+  def get_keys(self, path, root, use_64bit):
+    return [
+        name for name, _, _ in self.get_keys_and_values(path, root, use_64bit)
+    ]
+
+  def get_keys_and_values(self, path, root, use_64bit):
+    values = self._open(root, path, use_64bit, False)
+    with self.lock:
+      return list(values.values())
+
+  def set_value(self, name, value, root, path, reg_type, use_64bit):
+    self.open_key(root, path, use_64bit, True).set_value(name, value, reg_type)
+
+  def remove_value(self, name, root, path, use_64bit):
+    self.open_key(root, path, use_64bit, False).remove_value(name)
+
+  def open_key(self, root, path, use_64bit, create):
+    return _MemoryKey(self, self._open(root, path, use_64bit, create))
+
+
+class CacheStats(object):
+  """Counts the reads of a CachingBackend."""
+
+  def __init__(self):
+    self.hits = 0
+    self.misses = 0
+    self.invalidations = 0
+
+  def hit_rate(self) -> float:
+    """The share of reads answered from the cache."""
+    reads = self.hits + self.misses
+    return self.hits / reads if reads else 0.0
+
+  def __str__(self):
+    return (f'{self.hits} hits, {self.misses} misses '
+            f'({self.hit_rate():.0%} hit rate), '
+            f'{self.invalidations} invalidations')
+
+
+# Cached in place of a value which does not exist.
+_MISSING = object()
+
+
+class _CachingKey(Key):
+  """An open key of a CachingBackend, invalidating values as they change."""
+
+  def __init__(self, backend: 'CachingBackend', key: Key, root: str, path: str,
+               use_64bit: bool):
+    super(_CachingKey, self).__init__(backend, root, path, use_64bit)
+    self._key = key
+
+  def set_value(self, name, value, reg_type):
+    try:
+      self._key.set_value(name, value, reg_type)
+    finally:
+      self._backend.invalidate(name, self._root, self._path, self._use_64bit)
+
+  def remove_value(self, name):
+    try:
+      self._key.remove_value(name)
+    finally:
+      self._backend.invalidate(name, self._root, self._path, self._use_64bit)
+
+  def close(self):
+    self._key.close()
+
+
+class CachingBackend(Backend):
+  """Caches the values read from another backend.
+
+  Values are cached by root, key path, value name and registry view, including
+  those which do not exist. The values listed under a key are cached by root,
+  key path and view. Setting or removing a value through the backend drops it,
+  and the listing of its key, from the cache.
+
+  Attributes:
+    backend: The backend values are read from and written to.
+    stats: The hits and misses of the cache.
+  """
+
+  def __init__(self, backend: Backend):
+    self.backend = backend
+    self.stats = CacheStats()
+    self._lock = threading.Lock()
+    self._values = {}
+    self._listings = {}
+    # Counts writes, so that a read racing a write does not cache its result.
+    self._generation = 0
+
+  def _key(self, root: str, path: str, use_64bit: bool) -> Tuple[Any, ...]:
+    return ((root or '').upper(), (path or '').lower(), bool(use_64bit))
+
+  def _read(self, cache: Dict[Any, Any], key: Any,
+            read: Callable[[], Any]) -> Any:
+    """Reads through the cache, caching a value which does not exist as such.
+
+    Args:
+      cache: The cache to look in.
+      key: The key of the cache to look up.
+      read: Reads the value from the backend, if it is not cached.
+
+    Returns:
+      The value, or _MISSING if it does not exist.
+
+    Raises:
+      registry.RegistryError: The value could not be read.
+    """
+    with self._lock:
+      if key in cache:
+        self.stats.hits += 1
+        return cache[key]
+      self.stats.misses += 1
+      generation = self._generation
+    try:
+      value = read()
+    except registry.RegistryError as e:
+      if e.errno != 2:
+        raise
+      value = _MISSING
+    with self._lock:
+      if generation == self._generation:
+        cache[key] = value
+    return value
+
+  def clear(self):
+    """Drops everything cached."""
+    with self._lock:
+      self._generation += 1
+      self._values.clear()
+      self._listings.clear()
+
+  def invalidate(self, name: str, root: str, path: str, use_64bit: bool):
+    """Drops a value, and the listing of its key, from the cache."""
+    key = self._key(root, path, use_64bit)
+    with self._lock:
+      self._generation += 1
+      self.stats.invalidations += 1
+      self._values.pop(key + ((name or '').lower(),), None)
+      self._listings.pop(key, None)
+
+  def get_value(self, name, root, path, use_64bit):
+    value = self._read(
+        self._values,
+        self._key(root, path, use_64bit) + ((name or '').lower(),),
+        lambda: self.backend.get_value(name, root, path, use_64bit))
+    if value is _MISSING:
+      raise registry.RegistryError(
+          fr'Registry value not found: {root}:\{path}\{name}', errno=2)
+    return value
+
+  def get_keys(self, path, root, use_64bit):
+    return self.backend.get_keys(path, root, use_64bit)
+
+  def get_keys_and_values(self, path, root, use_64bit):
+    result = self._read(
+        self._listings, self._key(root, path, use_64bit),
+        lambda: self.backend.get_keys_and_values(path, root, use_64bit))
+    if result is _MISSING:
+      raise registry.RegistryError(
+          fr'Registry key not found: {root}:\{path}', errno=2)
+    return list(result) if result else result
+
+  def set_value(self, name, value, root, path, reg_type, use_64bit):
+    try:
+      self.backend.set_value(name, value, root, path, reg_type, use_64bit)
+    finally:
+      self.invalidate(name, root, path, use_64bit)
+
+  def remove_value(self, name, root, path, use_64bit):
+    try:
+      self.backend.remove_value(name, root, path, use_64bit)
+    finally:
+      self.invalidate(name, root, path, use_64bit)
+
+  def open_key(self, root, path, use_64bit, create):
+    key = self.backend.open_key(root, path, use_64bit, create)
+    return _CachingKey(self, key, root, path, use_64bit)
+
+
+_backend = None
+
+
+def get_backend() -> Backend:
+  """Returns the backend registry values are read from and written to.
+
+  Unless one was set, this is the host registry, cached with --registry_cache.
+  """
+  global _backend
+  if _backend is None:
+    _backend = GwinpyBackend()
+    if _REGISTRY_CACHE.value:
+      _backend = CachingBackend(_backend)
+  return _backend
+
+
+def set_backend(backend: Optional[Backend] = None) -> Optional[Backend]:
+  """Replaces the registry backend.
+
+  Args:
+    backend: The new backend. Defaults to the host registry, cached with
+      --registry_cache.
+
+  Returns:
+    The backend replaced, if one was in use.
+  """
+  global _backend
+  previous = _backend
+  _backend = backend
+  return previous
+
+
+def clear_cache():
+  """Drops every value cached, as after other processes write the registry."""
+  if isinstance(_backend, CachingBackend):
+    _backend.clear()
+
+
+def cache_stats() -> Optional[CacheStats]:
+  """Returns the hits and misses of the registry cache, if one is in use."""
+  if isinstance(_backend, CachingBackend):
+    return _backend.stats
+  return None
+
+
 def get_value(name: str,
               root: Optional[str] = 'HKLM',
               path: Optional[str] = constants.REG_ROOT,
@@ -63,8 +527,7 @@ def get_value(name: str,
     The registry value a string or None.
   """
   try:
-    reg = registry.Registry(root_key=root)
-    value = reg.GetKeyValue(key_path=path, key_name=name, use_64bit=use_64bit)
+    value = get_backend().get_value(name, root, path, use_64bit)
     if value:
       if log:
         logging.debug(r'Got registry value: %s:\%s\%s = %s.', root, path, name,
@@ -95,13 +558,7 @@ def set_value(name: str,
     log: Log the registry operation to the standard logger. Defaults to True.
   """
   try:
-    reg = registry.Registry(root_key=root)
-    reg.SetKeyValue(
-        key_path=path,
-        key_name=name,
-        key_value=value,
-        key_type=reg_type,
-        use_64bit=use_64bit)
+    get_backend().set_value(name, value, root, path, reg_type, use_64bit)
     if log:
       logging.debug(r'Set registry value: %s:\%s\%s = %s', root, path, name,
                     str(value))
@@ -126,8 +583,7 @@ def get_values(path: str,
     The registry values as a List of strings or None.
   """
   try:
-    reg = registry.Registry(root_key=root)
-    values = reg.GetRegKeys(key_path=path, use_64bit=use_64bit)
+    values = get_backend().get_keys(path, root, use_64bit)
     if values:
       if log:
         logging.debug(r'Registry keys under %s:\%s = %s.', root, path, values)
@@ -155,8 +611,7 @@ def get_keys_and_values(path: str,
   """
   keys_and_values = {}
   try:
-    reg = registry.Registry(root_key=root)
-    result = reg.GetRegKeysAndValues(key_path=path, use_64bit=use_64bit)
+    result = get_backend().get_keys_and_values(path, root, use_64bit)
     if result:
       if log:
         logging.debug(r'Registry keys under %s:\%s...', root, path)
@@ -185,8 +640,7 @@ def remove_value(name: str,
     log: Log the registry operation to the standard logger. Defaults to True.
   """
   try:
-    reg = registry.Registry(root_key=root)
-    reg.RemoveKeyValue(key_path=path, key_name=name, use_64bit=use_64bit)
+    get_backend().remove_value(name, root, path, use_64bit)
     if log:
       logging.debug(r'Removed registry key: %s:\%s\%s', root, path, name)
   except registry.RegistryError as e:
@@ -195,3 +649,119 @@ def remove_value(name: str,
                       root, path, name)
     else:
       raise RegistryDeleteError(name, path) from e
+
+
+class Session(object):
+  """Batches registry writes, applying them a key at a time.
+
+  Values set and removed are held until commit(), then applied in order,
+  grouped by key, with each key opened once. Used as a context manager, the
+  session commits on exit unless an exception was raised.
+
+  The registry has no transactions: if a write fails, writes applied before it
+  are kept, and those after it are not attempted.
+  """
+
+  def __init__(self, log: Optional[bool] = True):
+    """Starts an empty session.
+
+    Args:
+      log: Log each registry operation to the standard logger. Defaults to
+        True.
+    """
+    self._log = log
+    # (root, path, use_64bit) -> [(name, value, reg_type)], in the order each
+    # key was first written. A reg_type of None removes the value.
+    self._pending = {}
+
+  def __enter__(self) -> 'Session':
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    if exc_type is None:
+      self.commit()
+    else:
+      self._pending = {}
+
+  def __len__(self) -> int:
+    return sum(len(ops) for ops in self._pending.values())
+
+  def _add(self, root, path, use_64bit, op):
+    self._pending.setdefault((root, path, use_64bit), []).append(op)
+
+  def set_value(self,
+                name: str,
+                value: Union[str, int],
+                root: Optional[str] = 'HKLM',
+                path: Optional[str] = constants.REG_ROOT,
+                reg_type: Optional[str] = 'REG_SZ',
+                use_64bit: Optional[bool] = constants.USE_REG_64):
+    """Sets a registry value on commit. Takes the arguments of set_value."""
+    self._add(root, path, use_64bit, (name, value, reg_type))
+
+  def remove_value(self,
+                   name: str,
+                   root: Optional[str] = 'HKLM',
+                   path: Optional[str] = constants.REG_ROOT,
+                   use_64bit: Optional[bool] = constants.USE_REG_64):
+    """Removes a registry value on commit. Takes the arguments of remove_value.
+
+    As with remove_value, a value which does not exist is only logged.
+    """
+    self._add(root, path, use_64bit, (name, None, None))
+
+  def commit(self):
+    """Applies the pending writes, and empties the session.
+
+    Raises:
+      RegistryWriteError: A value could not be set.
+      RegistryDeleteError: A value could not be removed.
+    """
+    pending, self._pending = self._pending, {}
+    for (root, path, use_64bit), ops in pending.items():
+      self._apply(root, path, use_64bit, ops)
+
+  def _apply(self, root: str, path: str, use_64bit: bool,
+             ops: List[Tuple[str, Any, Optional[str]]]):
+    """Applies the writes to a single key."""
+    create = any(reg_type is not None for _, _, reg_type in ops)
+    try:
+      key = get_backend().open_key(root, path, use_64bit, create)
+    except registry.RegistryError as e:
+      name, value, reg_type = ops[0]
+      if reg_type is not None:
+        raise RegistryWriteError(name, value, path) from e
+      if e.errno != 2:
+        raise RegistryDeleteError(name, path) from e
+      for name, _, _ in ops:
+        logging.warning(
+            r'Failed to delete non-existant registry key: %s:\%s\%s', root,
+            path, name)
+      return
+    try:
+      for name, value, reg_type in ops:
+        if reg_type is None:
+          self._remove(key, root, path, name)
+          continue
+        try:
+          key.set_value(name, value, reg_type)
+        except registry.RegistryError as e:
+          raise RegistryWriteError(name, value, path) from e
+        if self._log:
+          logging.debug(r'Set registry value: %s:\%s\%s = %s', root, path,
+                        name, str(value))
+    finally:
+      key.close()
+
+  def _remove(self, key: Key, root: str, path: str, name: str):
+    try:
+      key.remove_value(name)
+    except registry.RegistryError as e:
+      if e.errno == 2:
+        logging.warning(
+            r'Failed to delete non-existant registry key: %s:\%s\%s', root,
+            path, name)
+        return
+      raise RegistryDeleteError(name, path) from e
+    if self._log:
+      logging.debug(r'Removed registry key: %s:\%s\%s', root, path, name)
@@ -18,6 +18,7 @@ import logging
 from unittest import mock
 
 from absl.testing import absltest
+from absl.testing import flagsaver
 from glazier.lib import registry
 from glazier.lib import test_utils
 from gwinpy.registry import registry as gwinpy_registry
@@ -164,5 +165,207 @@ class RegistryTest(test_utils.GlazierTestCase):
     self.assertFalse(mock_debug.called)
 
 
+class SessionTest(test_utils.GlazierTestCase):
+
+  def setUp(self):
+    super(SessionTest, self).setUp()
+    self.backend = registry.MemoryBackend()
+    self.addCleanup(registry.set_backend, registry.set_backend(self.backend))
+
+  def test_memory_backend(self):
+    registry.set_value('Name', 'value', path=r'SOFTWARE\Test')
+    self.assertEqual(
+        registry.get_value('name', path=r'software\test'), 'value')
+    self.assertEqual(
+        registry.get_keys_and_values(r'SOFTWARE\Test'), {'Name': 'value'})
+    self.assertEqual(registry.get_values(r'SOFTWARE\Test'), ['Name'])
+    self.assertIsNone(registry.get_value('Name', path=r'SOFTWARE\Other'))
+    self.assertIsNone(
+        registry.get_value('Name', path=r'SOFTWARE\Test', use_64bit=False))
+    registry.remove_value('Name', path=r'SOFTWARE\Test')
+    self.assertIsNone(registry.get_value('Name', path=r'SOFTWARE\Test'))
+    with self.assert_raises_with_validation(registry.RegistryWriteError):
+      registry.set_value('Name', 'value', root='HKXX')
+
+  def test_commit(self):
+    registry.set_value('stale', 'value')
+    with registry.Session() as session:
+      for i in range(10):
+        session.set_value(f'name{i}', i, reg_type='REG_DWORD')
+        session.set_value(f'timer{i}', str(i), path=r'SOFTWARE\Timers')
+      session.remove_value('stale')
+      session.remove_value('missing', path=r'SOFTWARE\Missing')
+      self.assertLen(session, 22)
+      self.backend.opens = 0
+    self.assertEqual(self.backend.opens, 3)
+    self.assertLen(session, 0)
+    self.assertEqual(registry.get_value('name9'), 9)
+    self.assertEqual(registry.get_value('timer9', path=r'SOFTWARE\Timers'), '9')
+    self.assertIsNone(registry.get_value('stale'))
+
+  def test_commit_order(self):
+    session = registry.Session()
+    session.set_value('name', 'first')
+    session.remove_value('name')
+    session.set_value('name', 'last')
+    session.commit()
+    self.assertEqual(registry.get_value('name'), 'last')
+
+  def test_exception(self):
+    with self.assertRaises(ValueError):
+      with registry.Session() as session:
+        session.set_value('name', 'value')
+        raise ValueError()
+    self.assertIsNone(registry.get_value('name'))
+
+  @mock.patch.object(registry.MemoryBackend, 'open_key', autospec=True)
+  def test_commit_write_error(self, mock_open_key):
+    mock_open_key.return_value.set_value.side_effect = (
+        gwinpy_registry.RegistryError('Test', errno=5))
+    session = registry.Session()
+    session.set_value('name', 'value')
+    with self.assert_raises_with_validation(registry.RegistryWriteError):
+      session.commit()
+    mock_open_key.return_value.close.assert_called_once()
+
+  @mock.patch.object(registry.MemoryBackend, 'open_key', autospec=True)
+  def test_commit_delete_error(self, mock_open_key):
+    mock_open_key.return_value.remove_value.side_effect = (
+        gwinpy_registry.RegistryError('Test', errno=5))
+    session = registry.Session()
+    session.remove_value('name')
+    with self.assert_raises_with_validation(registry.RegistryDeleteError):
+      session.commit()
+
+  @mock.patch.object(logging, 'warning', autospec=True)
+  def test_commit_delete_missing(self, mock_warning):
+    registry.set_value('other', 'value')
+    with registry.Session() as session:
+      session.remove_value('name')
+    mock_warning.assert_called_with(
+        r'Failed to delete non-existant registry key: '
+        r'%s:\%s\%s', 'HKLM', constants.REG_ROOT, 'name')
+
+  @mock.patch.object(gwinpy_registry, 'Registry', autospec=True)
+  def test_gwinpy_backend(self, mock_registry):
+    registry.set_backend(registry.GwinpyBackend())
+    with registry.Session() as session:
+      session.set_value('name1', 'value1')
+      session.set_value('name2', 'value2')
+    mock_registry.return_value.SetKeyValue.assert_has_calls([
+        mock.call(
+            key_path=constants.REG_ROOT,
+            key_name='name1',
+            key_value='value1',
+            key_type='REG_SZ',
+            use_64bit=constants.USE_REG_64),
+        mock.call(
+            key_path=constants.REG_ROOT,
+            key_name='name2',
+            key_value='value2',
+            key_type='REG_SZ',
+            use_64bit=constants.USE_REG_64),
+    ])
+
+
+class CacheTest(test_utils.GlazierTestCase):
+
+  def setUp(self):
+    super(CacheTest, self).setUp()
+    self.memory = registry.MemoryBackend()
+    self.backend = registry.CachingBackend(self.memory)
+    self.addCleanup(registry.set_backend, registry.set_backend(self.backend))
+
+  def test_get_value(self):
+    registry.set_value('name', 'value')
+    self.memory.opens = 0
+    for _ in range(3):
+      self.assertEqual(registry.get_value('name'), 'value')
+      self.assertEqual(registry.get_value('NAME'), 'value')
+    self.assertEqual(self.memory.opens, 1)
+    stats = registry.cache_stats()
+    self.assertEqual((stats.hits, stats.misses), (5, 1))
+    self.assertIn('83% hit rate', str(stats))
+
+  def test_get_value_missing(self):
+    registry.set_value('other', 'value')
+    self.memory.opens = 0
+    self.assertIsNone(registry.get_value('name'))
+    self.assertIsNone(registry.get_value('name'))
+    self.assertEqual(self.memory.opens, 1)
+    registry.set_value('name', 'value')
+    self.assertEqual(registry.get_value('name'), 'value')
+
+  def test_get_value_view(self):
+    registry.set_value('name', '64')
+    registry.set_value('name', '32', use_64bit=False)
+    self.assertEqual(registry.get_value('name'), '64')
+    self.assertEqual(registry.get_value('name', use_64bit=False), '32')
+
+  def test_invalidation(self):
+    registry.set_value('name', 'first')
+    self.assertEqual(registry.get_value('name'), 'first')
+    self.assertEqual(registry.get_keys_and_values(constants.REG_ROOT),
+                     {'name': 'first'})
+    registry.set_value('name', 'second')
+    self.assertEqual(registry.get_value('name'), 'second')
+    self.assertEqual(registry.get_keys_and_values(constants.REG_ROOT),
+                     {'name': 'second'})
+    with registry.Session() as session:
+      session.set_value('name', 'third')
+      session.set_value('other', 'value')
+    self.assertEqual(registry.get_value('name'), 'third')
+    self.assertEqual(registry.get_keys_and_values(constants.REG_ROOT),
+                     {'name': 'third', 'other': 'value'})
+    registry.remove_value('name')
+    self.assertIsNone(registry.get_value('name'))
+    self.assertEqual(registry.cache_stats().invalidations, 5)
+
+  @mock.patch.object(registry.MemoryBackend, 'set_value', autospec=True)
+  def test_invalidation_error(self, mock_set_value):
+    registry.remove_value('name')
+    self.assertIsNone(registry.get_value('name'))
+    mock_set_value.side_effect = gwinpy_registry.RegistryError('Test')
+    with self.assert_raises_with_validation(registry.RegistryWriteError):
+      registry.set_value('name', 'value')
+    misses = registry.cache_stats().misses
+    registry.get_value('name')
+    self.assertEqual(registry.cache_stats().misses, misses + 1)
+
+  def test_get_keys_and_values(self):
+    registry.set_value('name', 'value', path=r'SOFTWARE\Test')
+    self.memory.opens = 0
+    for _ in range(3):
+      self.assertEqual(
+          registry.get_keys_and_values(r'SOFTWARE\Test'), {'name': 'value'})
+      self.assertIsNone(registry.get_keys_and_values(r'SOFTWARE\Missing'))
+    self.assertEqual(self.memory.opens, 2)
+
+  def test_clear_cache(self):
+    registry.set_value('name', 'first')
+    registry.get_value('name')
+    self.memory.set_value('name', 'second', 'HKLM', constants.REG_ROOT,
+                          'REG_SZ', constants.USE_REG_64)
+    self.assertEqual(registry.get_value('name'), 'first')
+    registry.clear_cache()
+    self.assertEqual(registry.get_value('name'), 'second')
+
+  @mock.patch.object(registry.MemoryBackend, 'get_value', autospec=True)
+  def test_read_error(self, mock_get_value):
+    mock_get_value.side_effect = gwinpy_registry.RegistryError('Test', errno=5)
+    self.assertIsNone(registry.get_value('name'))
+    self.assertIsNone(registry.get_value('name'))
+    self.assertEqual(mock_get_value.call_count, 2)
+
+  def test_default_backend(self):
+    registry.set_backend(None)
+    self.assertIsInstance(registry.get_backend(), registry.GwinpyBackend)
+    self.assertIsNone(registry.cache_stats())
+    registry.set_backend(None)
+    with flagsaver.flagsaver(registry_cache=True):
+      self.assertIsInstance(registry.get_backend(), registry.CachingBackend)
+    self.assertIsNotNone(registry.cache_stats())
+
+
 if __name__ == '__main__':
   absltest.main()
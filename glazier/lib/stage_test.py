@@ -23,6 +23,7 @@ from unittest import mock
 from absl import flags
 from absl.testing import absltest
 from absl.testing import flagsaver
+from glazier.lib import registry
 from glazier.lib import stage
 from glazier.lib import test_utils
 
@@ -54,6 +55,19 @@ class StageTest(test_utils.GlazierTestCase):
     mock_get_value.assert_called_with('_Active', 'HKLM', stage.STAGES_ROOT)
     mock_check_expiration.assert_called_with(5)
 
+  def test_get_status_cached(self):
+    memory = registry.MemoryBackend()
+    backend = registry.CachingBackend(memory)
+    self.addCleanup(registry.set_backend, registry.set_backend(backend))
+    stage.set_stage(1)
+    memory.opens = 0
+    self.assertEqual(stage.get_status(), 'Running')
+    self.assertEqual(stage.get_status(), 'Running')
+    # _Active, Start and End are each read from the registry once.
+    self.assertEqual(memory.opens, 3)
+    stage.exit_stage(1)
+    self.assertEqual(stage.get_status(), 'Unknown')
+
   @mock.patch.object(stage.registry, 'get_value', autospec=True)
   @mock.patch.object(stage, '_load_time', autospec=True)
   def test_get_active_time_with_end(self, mock_load_time, mock_get_value):
@@ -47,7 +47,8 @@ def log_and_exit(build_info: buildinfo.BuildInfo,
     exception: The Exception object.
     collect: Whether to collect log files.
   """
-  # Start by collecting logs, if specified.
+  # Start by collecting logs, if specified, once queued records are written.
+  logs.Flush()
   if collect:
     try:
       logs.Collect(os.path.join(build_info.CachePath(), r'\glazier_logs.zip'))
@@ -93,4 +94,5 @@ def log_and_exit(build_info: buildinfo.BuildInfo,
 
   # Print everything and bail.
   logging.critical(string, exc_info=False)
+  logs.Flush()
   sys.exit(1)
@@ -16,7 +16,7 @@
 
 import datetime
 import logging
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from glazier.lib import gtime
 from glazier.lib import registry
@@ -87,3 +87,22 @@ class Timers(object):
       logging.info('Set image timer: %s (%s)', name, value_data)
     except registry.Error as e:
       raise SetTimerError(value_name, value_data) from e
+
+  def SetMany(self, names: List[str]) -> None:
+    """Set several timers at once, to the current time in UTC.
+
+    The timers are written together, opening the timers key once.
+
+    Args:
+      names: Names of the timers being set.
+    """
+    value_data = str(gtime.now())
+    session = registry.Session(log=False)
+    for name in names:
+      session.set_value(f'TIMER_{name}', value_data, 'HKLM', TIMERS_PATH)
+    try:
+      session.commit()
+    except registry.Error as e:
+      raise SetTimerError(', '.join(f'TIMER_{name}' for name in names),
+                          value_data) from e
+    logging.info('Set image timers: %s (%s)', ', '.join(names), value_data)
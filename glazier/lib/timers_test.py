@@ -64,5 +64,22 @@ class TimersTest(absltest.TestCase):
     with self.assertRaises(timers.SetTimerError):
       timers.Timers().Set('fake_2')
 
+  def test_set_many(self):
+    backend = registry.MemoryBackend()
+    self.addCleanup(registry.set_backend, registry.set_backend(backend))
+    timers.Timers().SetMany(['fake_1', 'fake_2', 'fake_3'])
+    self.assertEqual(backend.opens, 1)
+    values = timers.Timers().GetAll()
+    self.assertCountEqual(values, _FAKE_DICT)
+    self.assertLen(set(values.values()), 1)
+
+  @mock.patch.object(registry.MemoryBackend, 'open_key', autospec=True)
+  def test_set_many_error(self, mock_open_key):
+    self.addCleanup(registry.set_backend,
+                    registry.set_backend(registry.MemoryBackend()))
+    mock_open_key.side_effect = registry.registry.RegistryError('Test')
+    with self.assertRaises(timers.SetTimerError):
+      timers.Timers().SetMany(['fake_1', 'fake_2'])
+
 if __name__ == '__main__':
   absltest.main()
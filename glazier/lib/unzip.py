@@ -0,0 +1,374 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Extracts zip archives, in parallel or while they are downloaded.
+
+Extract() decompresses the members of an archive on disk on a pool of threads,
+largest first. zlib and file writes release the GIL, so the threads spread the
+work across cores. Each member is copied through a fixed size buffer, so memory
+use depends on the number of threads rather than on the size of the members.
+
+StreamExtractor is given the bytes of an archive in order, as they arrive from
+the network, and extracts each member as soon as its data has arrived, from the
+local file headers rather than the central directory at the end of the archive.
+Archives it cannot follow this way, such as those with encrypted members or
+compression methods other than deflate, are left to Extract() once the download
+completes.
+"""
+
+import concurrent.futures
+import logging
+import os
+import queue
+import shutil
+import struct
+import threading
+import zipfile
+import zlib
+
+from absl import flags
+from glazier.lib import errors
+
+_UNZIP_WORKERS = flags.DEFINE_integer(
+    'unzip_workers', 0,
+    'Threads extracting the members of a zip archive in parallel. 0 uses one '
+    'per core.')
+
+# Members are copied to disk through buffers of this size.
+WRITE_BUFFER_SIZE = 1048576
+# Chunks of a streamed archive held between the download and the extractor.
+STREAM_QUEUE_CHUNKS = 64
+
+_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+_LOCAL_HEADER_SIG = b'PK\x03\x04'
+_DATA_DESCRIPTOR_SIG = b'PK\x07\x08'
+# Records which follow the last member of an archive.
+_TRAILER_SIGS = (b'PK\x01\x02', b'PK\x05\x06', b'PK\x06\x06', b'PK\x06\x08')
+_ZIP64_EXTRA_ID = 0x0001
+_ZIP64_LIMIT = 0xFFFFFFFF
+_FLAG_ENCRYPTED = 0x1
+_FLAG_DATA_DESCRIPTOR = 0x8
+_FLAG_UTF8 = 0x800
+
+
+class Error(errors.GlazierError):
+
+  def __init__(self, message: str):
+    super().__init__(
+        error_code=errors.ErrorCode.UNZIP_ERROR, message=message)
+
+
+class _Incomplete(Exception):
+  """The stream cannot be followed any further."""
+
+
+def _TargetPath(out_path: str, name: str) -> str:
+  """Maps the name of a member to a path below out_path, as ZipFile does.
+
+  Args:
+    out_path: The directory the archive is extracted to.
+    name: The name of the member.
+
+  Returns:
+    The path to extract the member to.
+
+  Raises:
+    Error: The name does not map to any path below out_path.
+  """
+  arcname = name.replace('/', os.path.sep)
+  if os.path.altsep:
+    arcname = arcname.replace(os.path.altsep, os.path.sep)
+  arcname = os.path.splitdrive(arcname)[1]
+  arcname = os.path.sep.join(
+      x for x in arcname.split(os.path.sep)
+      if x not in ('', os.path.curdir, os.path.pardir))
+  if os.path.sep == '\\':
+    arcname = zipfile.ZipFile._sanitize_windows_name(arcname, os.path.sep)  # pylint: disable=protected-access
+  if not arcname and not name.endswith('/'):
+    raise Error(f'Unable to extract zip member with name "{name}".')
+  return os.path.join(out_path, arcname)
+
+
+def _Workers(workers: int) -> int:
+  return workers or _UNZIP_WORKERS.value or os.cpu_count() or 1
+
+
+def Extract(zip_path: str, out_path: str, workers: int = 0) -> int:
+  """Extracts every member of a zip archive, in parallel.
+
+  Args:
+    zip_path: The zip archive.
+    out_path: The directory to extract the archive to.
+    workers: The number of threads to extract with. Defaults to the
+      unzip_workers flag.
+
+  Returns:
+    The number of members extracted.
+
+  Raises:
+    Error: The archive could not be read, or a member could not be extracted.
+  """
+  try:
+    with zipfile.ZipFile(zip_path) as zf:
+      members = zf.infolist()
+  except (IOError, zipfile.BadZipFile) as e:
+    raise Error(f'Unable to read zip file {zip_path}: {e}') from e
+
+  targets = {}
+  for info in members:
+    target = _TargetPath(out_path, info.filename)
+    if info.is_dir():
+      try:
+        os.makedirs(target, exist_ok=True)
+      except OSError as e:
+        raise Error(f'Unable to create directory {target}: {e}') from e
+    else:
+      # Members extracted to the same path would race, so only the last in
+      # the archive is extracted, as it would win extracting in order.
+      targets[os.path.normcase(target)] = (info, target)
+  # The largest members start first, so that they do not finish last.
+  files = sorted(
+      targets.values(), key=lambda f: f[0].compress_size, reverse=True)
+
+  local = threading.local()
+  opened = []
+  lock = threading.Lock()
+
+  def _ExtractMember(info: zipfile.ZipInfo, target: str):
+    if not hasattr(local, 'zf'):
+      # ZipFile reads through one file handle, so each thread has its own.
+      local.zf = zipfile.ZipFile(zip_path)
+      with lock:
+        opened.append(local.zf)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with local.zf.open(info) as src:
+      with open(target, 'wb', buffering=WRITE_BUFFER_SIZE) as dst:
+        shutil.copyfileobj(src, dst, WRITE_BUFFER_SIZE)
+
+  try:
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, min(_Workers(workers), len(files))),
+        thread_name_prefix='unzip') as executor:
+      futures = [executor.submit(_ExtractMember, *f) for f in files]
+      try:
+        for future in futures:
+          future.result()
+      except BaseException:
+        for future in futures:
+          future.cancel()
+        raise
+  except (IOError, RuntimeError, NotImplementedError, zipfile.BadZipFile,
+          zlib.error, EOFError) as e:
+    raise Error(f'Unable to extract zip file {zip_path}: {e}') from e
+  finally:
+    for zf in opened:
+      zf.close()
+  logging.info('Extracted %d members of %s to %s.', len(members), zip_path,
+               out_path)
+  return len(members)
+
+
+class StreamExtractor(object):
+  """Extracts a zip archive from its bytes, as they arrive.
+
+  The bytes are passed to Write() in order, from a single thread, and members
+  are extracted on a background thread. At most STREAM_QUEUE_CHUNKS writes are
+  held before Write() waits for the extractor to catch up.
+  """
+
+  def __init__(self, out_path: str):
+    """Starts the extractor.
+
+    Args:
+      out_path: The directory to extract the archive to.
+    """
+    self._out_path = out_path
+    self._queue = queue.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+    self._buffer = bytearray()
+    self._position = 0
+    self._closed = False
+    self._eof = False
+    self._broken = False
+    self._stopped = threading.Event()
+    self._complete = False
+    self.members = 0
+    self._thread = threading.Thread(
+        target=self._Run, name='unzip-stream', daemon=True)
+    self._thread.start()
+
+  def Write(self, offset: int, chunk: bytes):
+    """Passes on the next bytes of the archive.
+
+    Suitable as the chunk_callback of a downloader. Bytes which do not continue
+    from the end of those passed so far, as when a download starts over, leave
+    the extraction incomplete.
+
+    Args:
+      offset: The offset of chunk in the archive.
+      chunk: The bytes of the archive at offset.
+    """
+    if self._broken or self._stopped.is_set():
+      return
+    if offset != self._position:
+      logging.info('Zip stream restarted at byte %d of %d.', offset,
+                   self._position)
+      self._broken = True
+      self._Close()
+      return
+    self._position += len(chunk)
+    self._queue.put(bytes(chunk))
+
+  def _Close(self):
+    if not self._closed:
+      self._closed = True
+      self._queue.put(None)
+
+  def Finish(self) -> bool:
+    """Waits for the bytes passed so far to be extracted.
+
+    Returns:
+      True if every member of the archive was extracted. Otherwise, the archive
+      must be extracted again once it is complete.
+    """
+    self._Close()
+    self._thread.join()
+    return self._complete and not self._broken
+
+  def _Fill(self, size: int):
+    """Buffers at least size bytes, or raises _Incomplete at the end."""
+    while len(self._buffer) < size:
+      if self._eof:
+        raise _Incomplete(f'Zip stream ended after byte {self._position}.')
+      chunk = self._queue.get()
+      if chunk is None:
+        self._eof = True
+      else:
+        self._buffer += chunk
+
+  def _Read(self, size: int) -> bytes:
+    """Reads exactly size bytes from the stream."""
+    self._Fill(size)
+    data = bytes(self._buffer[:size])
+    del self._buffer[:size]
+    return data
+
+  def _ReadSome(self, limit: int) -> bytes:
+    """Reads between one and limit bytes from the stream."""
+    self._Fill(1)
+    data = bytes(self._buffer[:limit])
+    del self._buffer[:limit]
+    return data
+
+  def _Run(self):
+    try:
+      while True:
+        signature = self._Read(4)
+        if signature != _LOCAL_HEADER_SIG:
+          if signature not in _TRAILER_SIGS:
+            raise _Incomplete(f'Unexpected zip record {signature!r}.')
+          self._complete = True
+          break
+        self._ExtractMember()
+      logging.info('Extracted %d members of the zip stream to %s.',
+                   self.members, self._out_path)
+    except _Incomplete as e:
+      if not self._broken:
+        logging.info('Unable to extract zip stream as it arrives: %s', e)
+    except (Error, OSError, ValueError, zlib.error, struct.error) as e:
+      logging.warning('Unable to extract zip stream as it arrives: %s', e)
+    finally:
+      self._stopped.set()
+      self._buffer = bytearray()
+      while not self._eof:
+        self._eof = self._queue.get() is None
+
+  def _ExtractMember(self):
+    """Extracts the member whose local file header follows."""
+    (_, _, flag_bits, method, _, _, crc, compress_size, file_size, name_length,
+     extra_length) = _LOCAL_HEADER.unpack(_LOCAL_HEADER_SIG + self._Read(26))
+    name = self._Read(name_length).decode(
+        'utf-8' if flag_bits & _FLAG_UTF8 else 'cp437')
+    extra = self._Read(extra_length)
+    if flag_bits & _FLAG_ENCRYPTED:
+      raise _Incomplete(f'{name} is encrypted.')
+    if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+      raise _Incomplete(f'{name} uses compression method {method}.')
+    descriptor = bool(flag_bits & _FLAG_DATA_DESCRIPTOR)
+    # Directories have no data, even when their size follows it.
+    if (descriptor and method == zipfile.ZIP_STORED and
+        not name.endswith('/')):
+      raise _Incomplete(f'The size of {name} follows its data.')
+
+    zip64 = False
+    while len(extra) >= 4:
+      extra_id, size = struct.unpack('<HH', extra[:4])
+      if extra_id == _ZIP64_EXTRA_ID:
+        zip64 = True
+        count = min(size, len(extra) - 4) // 8
+        values = list(struct.unpack(f'<{count}Q', extra[4:4 + count * 8]))
+        if file_size == _ZIP64_LIMIT and values:
+          file_size = values.pop(0)
+        if compress_size == _ZIP64_LIMIT and values:
+          compress_size = values.pop(0)
+      extra = extra[4 + size:]
+
+    target = _TargetPath(self._out_path, name)
+    if name.endswith('/'):
+      os.makedirs(target, exist_ok=True)
+      output = None
+    else:
+      os.makedirs(os.path.dirname(target), exist_ok=True)
+      output = open(target, 'wb', buffering=WRITE_BUFFER_SIZE)
+    inflater = (
+        zlib.decompressobj(-zlib.MAX_WBITS)
+        if method == zipfile.ZIP_DEFLATED else None)
+    actual_crc = 0
+    actual_size = 0
+    # Without a size up front, deflated data runs until the end of its stream.
+    to_end = descriptor and inflater is not None
+    remaining = compress_size
+    try:
+      while to_end or remaining:
+        data = self._ReadSome(WRITE_BUFFER_SIZE if to_end else min(
+            remaining, WRITE_BUFFER_SIZE))
+        remaining -= len(data)
+        while data:
+          if inflater:
+            # Bounds the output of highly compressed data.
+            out = inflater.decompress(data, WRITE_BUFFER_SIZE)
+            data = inflater.unconsumed_tail
+          else:
+            out, data = data, b''
+          actual_crc = zlib.crc32(out, actual_crc)
+          actual_size += len(out)
+          if output:
+            output.write(out)
+        if inflater and inflater.eof:
+          if to_end:
+            self._buffer[:0] = inflater.unused_data
+          break
+    finally:
+      if output:
+        output.close()
+
+    if descriptor:
+      record = self._Read(4)
+      if record == _DATA_DESCRIPTOR_SIG:
+        record = self._Read(4)
+      (crc,) = struct.unpack('<I', record)
+      _, file_size = struct.unpack(
+          '<QQ' if zip64 else '<II', self._Read(16 if zip64 else 8))
+    truncated = inflater and not inflater.eof and (to_end or compress_size)
+    if truncated or actual_crc != crc or actual_size != file_size:
+      raise ValueError(f'{name} does not match its CRC or size.')
+    self.members += 1
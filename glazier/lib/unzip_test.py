@@ -0,0 +1,174 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for glazier.lib.unzip."""
+
+import io
+import os
+import zipfile
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from glazier.lib import test_utils
+from glazier.lib import unzip
+
+_MEMBERS = {
+    'readme.txt': b'Read me.\n',
+    'drivers/': None,
+    'drivers/net/e1000.inf': b'[Version]\n' * 1000,
+    'drivers/net/e1000.sys': os.urandom(300000),
+    'tools/zeros.bin': bytes(3 * unzip.WRITE_BUFFER_SIZE),
+}
+
+
+class _Unseekable(io.RawIOBase):
+  """A write-only stream, which makes ZipFile write data descriptors."""
+
+  def __init__(self):
+    super(_Unseekable, self).__init__()
+    self.data = bytearray()
+
+  def writable(self):
+    return True
+
+  def write(self, b):
+    self.data += b
+    return len(b)
+
+
+def _MakeZip(members=None, compression=zipfile.ZIP_DEFLATED,
+             descriptors=False):
+  output = _Unseekable() if descriptors else io.BytesIO()
+  with zipfile.ZipFile(output, 'w', compression=compression) as zf:
+    for name, content in (members or _MEMBERS).items():
+      if content is None:
+        zf.writestr(zipfile.ZipInfo(name), b'')
+      else:
+        zf.writestr(name, content)
+  return bytes(output.data if descriptors else output.getvalue())
+
+
+class UnzipTest(test_utils.GlazierTestCase, parameterized.TestCase):
+
+  def setUp(self):
+    super(UnzipTest, self).setUp()
+    self.out_path = self.create_tempdir().full_path
+
+  def _assert_extracted(self, members=None):
+    for name, content in (members or _MEMBERS).items():
+      path = os.path.join(self.out_path, *name.split('/'))
+      if content is None:
+        self.assertTrue(os.path.isdir(path), name)
+      else:
+        with open(path, 'rb') as f:
+          self.assertEqual(f.read(), content, name)
+
+  def _stream(self, data, chunk_size=65536):
+    extractor = unzip.StreamExtractor(self.out_path)
+    for offset in range(0, len(data), chunk_size):
+      extractor.Write(offset, data[offset:offset + chunk_size])
+    return extractor
+
+  @parameterized.named_parameters(
+      ('_Deflated', zipfile.ZIP_DEFLATED),
+      ('_Stored', zipfile.ZIP_STORED),
+      ('_Bzip2', zipfile.ZIP_BZIP2),
+  )
+  def test_extract(self, compression):
+    zip_path = self.create_tempfile(
+        content=_MakeZip(compression=compression)).full_path
+    self.assertEqual(unzip.Extract(zip_path, self.out_path, workers=4),
+                     len(_MEMBERS))
+    self._assert_extracted()
+
+  def test_extract_unsafe_names(self):
+    members = {'../../outside.txt': b'a', '/abs/inside.txt': b'b'}
+    zip_path = self.create_tempfile(content=_MakeZip(members)).full_path
+    unzip.Extract(zip_path, self.out_path)
+    self._assert_extracted({'outside.txt': b'a', 'abs/inside.txt': b'b'})
+
+  def test_extract_same_target(self):
+    members = {'dup.txt': b'first' * 100000, '../dup.txt': b'last'}
+    zip_path = self.create_tempfile(content=_MakeZip(members)).full_path
+    self.assertEqual(unzip.Extract(zip_path, self.out_path, workers=2), 2)
+    self._assert_extracted({'dup.txt': b'last'})
+
+  def test_extract_bad_zip(self):
+    zip_path = self.create_tempfile(content=b'not a zip').full_path
+    with self.assert_raises_with_validation(unzip.Error):
+      unzip.Extract(zip_path, self.out_path)
+    with self.assert_raises_with_validation(unzip.Error):
+      unzip.Extract(os.path.join(self.out_path, 'missing.zip'), self.out_path)
+
+  def test_extract_corrupt_member(self):
+    data = bytearray(_MakeZip(compression=zipfile.ZIP_STORED))
+    offset = data.index(_MEMBERS['drivers/net/e1000.sys'][:64])
+    data[offset] ^= 0xFF
+    zip_path = self.create_tempfile(content=bytes(data)).full_path
+    with self.assert_raises_with_validation(unzip.Error):
+      unzip.Extract(zip_path, self.out_path)
+
+  @parameterized.named_parameters(
+      ('_Deflated', zipfile.ZIP_DEFLATED, False),
+      ('_Stored', zipfile.ZIP_STORED, False),
+      ('_Descriptors', zipfile.ZIP_DEFLATED, True),
+  )
+  def test_stream(self, compression, descriptors):
+    data = _MakeZip(compression=compression, descriptors=descriptors)
+    extractor = self._stream(data, chunk_size=1000)
+    self.assertTrue(extractor.Finish())
+    self.assertEqual(extractor.members, len(_MEMBERS))
+    self._assert_extracted()
+
+  def test_stream_empty(self):
+    self.assertTrue(self._stream(_MakeZip({})).Finish())
+
+  @parameterized.named_parameters(
+      ('_Bzip2', zipfile.ZIP_BZIP2, False),
+      ('_StoredDescriptors', zipfile.ZIP_STORED, True),
+  )
+  def test_stream_unsupported(self, compression, descriptors):
+    data = _MakeZip(compression=compression, descriptors=descriptors)
+    self.assertFalse(self._stream(data).Finish())
+
+  def test_stream_truncated(self):
+    data = _MakeZip()
+    self.assertFalse(self._stream(data[:len(data) // 2]).Finish())
+
+  def test_stream_restarted(self):
+    data = _MakeZip()
+    extractor = unzip.StreamExtractor(self.out_path)
+    extractor.Write(0, data[:1000])
+    extractor.Write(0, data)
+    self.assertFalse(extractor.Finish())
+
+  def test_stream_corrupt(self):
+    data = bytearray(_MakeZip(compression=zipfile.ZIP_STORED))
+    offset = data.index(_MEMBERS['drivers/net/e1000.sys'][:64])
+    data[offset] ^= 0xFF
+    extractor = self._stream(bytes(data))
+    self.assertFalse(extractor.Finish())
+    self.assertEqual(extractor.members, 3)
+
+  def test_stream_bounded(self):
+    # Writes carry on past a failure, without waiting on the extractor.
+    data = _MakeZip({'a.bin': b'a'}, compression=zipfile.ZIP_BZIP2)
+    extractor = unzip.StreamExtractor(self.out_path)
+    extractor.Write(0, data)
+    for i in range(unzip.STREAM_QUEUE_CHUNKS * 4):
+      extractor.Write(len(data) + i, b'x')
+    self.assertFalse(extractor.Finish())
+
+
+if __name__ == '__main__':
+  absltest.main()
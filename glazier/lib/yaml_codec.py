@@ -0,0 +1,77 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Reads and writes YAML, using libyaml where available.
+
+PyYAML's pure Python parser and emitter are many times slower than its libyaml
+bindings, which are only present when PyYAML was built against libyaml. All
+YAML in Glazier goes through this module, which uses the bindings when they
+exist and falls back to the pure Python implementation otherwise.
+
+Load matches yaml.safe_load. Dump matches yaml.dump, and produces the same
+documents whichever implementation is in use, except that tuples are written as
+plain lists (which Load can read back) and never as aliases of one another.
+"""
+
+from typing import Any, IO, Optional, Union
+
+import yaml
+
+YAMLError = yaml.YAMLError
+
+if getattr(yaml, '__with_libyaml__', False):
+  SafeLoader = yaml.CSafeLoader
+  _BaseDumper = yaml.CDumper
+  LIBYAML = True
+else:
+  SafeLoader = yaml.SafeLoader
+  _BaseDumper = yaml.Dumper
+  LIBYAML = False
+
+
+class Dumper(_BaseDumper):
+  """Writes tuples, such as shared config paths, as plain sequences."""
+
+  def ignore_aliases(self, data):  # pylint: disable=invalid-name
+    return isinstance(data, tuple) or super().ignore_aliases(data)
+
+
+Dumper.add_representer(tuple, Dumper.represent_list)
+
+
+def Load(stream: Union[str, bytes, IO[Any]]) -> Any:
+  """Parses a YAML document, allowing only standard YAML tags.
+
+  Args:
+    stream: The document, or a file object to read it from.
+
+  Returns:
+    The parsed content of the document.
+
+  Raises:
+    YAMLError: The document is not valid YAML.
+  """
+  return yaml.load(stream, Loader=SafeLoader)
+
+
+def Dump(data: Any, stream: Optional[IO[Any]] = None) -> Optional[str]:
+  """Serializes data as a YAML document.
+
+  Args:
+    data: The data to serialize.
+    stream: A file object to write the document to. (Optional)
+
+  Returns:
+    The document, if no stream was given.
+  """
+  return yaml.dump(data, stream, Dumper=Dumper)
@@ -0,0 +1,88 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for glazier.lib.yaml_codec."""
+
+import importlib
+import io
+from unittest import mock
+
+from absl.testing import absltest
+from glazier.lib import test_utils
+from glazier.lib import yaml_codec
+import yaml
+
+_TASKS = [{
+    'data': {
+        'Get': [['https://glazier/bin/file.msi', r'C:\file.msi', 'abc123']],
+        'pin': {'os_code': ['!win7']},
+    },
+    'path': ['', 'sub dir'],
+}, {
+    'data': {'SetTimer': ['start__build.yaml']},
+    'path': [],
+}, {
+    'data': {'Sleep': [30, 'Reason: "quoted" and unicode \u00e9']},
+    'path': [],
+}]
+
+
+class YamlCodecTest(test_utils.GlazierTestCase):
+
+  def tearDown(self):
+    super(YamlCodecTest, self).tearDown()
+    importlib.reload(yaml_codec)
+
+  def test_round_trip(self):
+    document = yaml_codec.Dump(_TASKS)
+    self.assertEqual(document, yaml.dump(_TASKS))
+    self.assertEqual(yaml_codec.Load(document), _TASKS)
+    self.assertEqual(yaml_codec.Load(document.encode('utf-8')), _TASKS)
+    self.assertEqual(yaml_codec.Load(io.StringIO(document)), _TASKS)
+
+  def test_dump_stream(self):
+    stream = io.StringIO()
+    self.assertIsNone(yaml_codec.Dump(_TASKS, stream))
+    self.assertEqual(stream.getvalue(), yaml.dump(_TASKS))
+
+  def test_dump_tuples(self):
+    path = ('', 'sub dir')
+    tasks = [{'path': path, 'data': {}}, {'path': path, 'data': {}}]
+    document = yaml_codec.Dump(tasks)
+    self.assertNotIn('&', document)
+    self.assertEqual(
+        yaml_codec.Load(document), [{'path': list(path), 'data': {}}] * 2)
+
+  def test_load_is_safe(self):
+    with self.assertRaises(yaml_codec.YAMLError):
+      yaml_codec.Load('!!python/object/apply:os.system ["true"]')
+    with self.assertRaises(yaml_codec.YAMLError):
+      yaml_codec.Load('[unclosed')
+
+  def test_fallback(self):
+    with mock.patch.object(yaml, '__with_libyaml__', False):
+      importlib.reload(yaml_codec)
+    self.assertFalse(yaml_codec.LIBYAML)
+    self.assertIs(yaml_codec.SafeLoader, yaml.SafeLoader)
+    self.assertTrue(issubclass(yaml_codec.Dumper, yaml.Dumper))
+    self.assertEqual(yaml_codec.Load(yaml_codec.Dump(_TASKS)), _TASKS)
+
+  def test_libyaml(self):
+    if not yaml.__with_libyaml__:
+      self.skipTest('PyYAML was built without libyaml.')
+    self.assertTrue(yaml_codec.LIBYAML)
+    self.assertIs(yaml_codec.SafeLoader, yaml.CSafeLoader)
+
+
+if __name__ == '__main__':
+  absltest.main()
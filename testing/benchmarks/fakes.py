@@ -0,0 +1,233 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-memory stand-ins for the Windows APIs Glazier reads host state from.
+
+Install() registers fake gwinpy modules, so that glazier.lib can be imported
+and benchmarked on any platform. The registry is a dict, and WMI describes a
+fixed host. Each WMI query can be given a latency, to model the cost of the
+real provider. Install() must run before anything from glazier.lib is imported.
+"""
+
+import collections
+import sys
+import threading
+import time
+import types
+from typing import Any, Dict, Optional, Tuple
+
+# Seconds each fake WMI query takes.
+WMI_LATENCY = 0.0
+
+# The fake registry, keyed by (root, path, name). Paths are case insensitive.
+REGISTRY = {
+    ('HKLM', r'software\microsoft\windows nt\currentversion', 'EditionID'):
+        'Enterprise',
+}  # type: Dict[Tuple[str, str, str], Any]
+
+# Counts of calls to each fake, by name.
+CALLS = collections.Counter()
+
+_lock = threading.Lock()
+
+PciDevice = collections.namedtuple('PciDevice', ['ven', 'dev', 'subsys', 'rev'])
+
+
+def _Call(name: str, latency: bool = False):
+  with _lock:
+    CALLS[name] += 1
+  if latency and WMI_LATENCY:
+    time.sleep(WMI_LATENCY)
+
+
+class RegistryError(Exception):
+
+  def __init__(self, message: str = '', errno: int = 0):
+    super().__init__(message)
+    self.errno = errno
+
+
+class Registry(object):
+  """gwinpy.registry.registry.Registry, backed by REGISTRY."""
+
+  def __init__(self, root_key: str = 'HKLM'):
+    self._root = root_key
+
+  def _Key(self, key_path: Optional[str], key_name: str):
+    return (self._root, (key_path or '').lower(), key_name)
+
+  def GetKeyValue(self, key_path=None, key_name='', use_64bit=True):
+    del use_64bit
+    _Call('Registry.GetKeyValue')
+    key = self._Key(key_path, key_name)
+    with _lock:
+      if key not in REGISTRY:
+        raise RegistryError('Registry key not found: %s' % (key,), errno=2)
+      return REGISTRY[key]
+
+  def SetKeyValue(self, key_path=None, key_name='', key_value=None,
+                  key_type='REG_SZ', use_64bit=True):
+    del key_type, use_64bit
+    _Call('Registry.SetKeyValue')
+    with _lock:
+      REGISTRY[self._Key(key_path, key_name)] = key_value
+
+  def RemoveKeyValue(self, key_path=None, key_name='', use_64bit=True):
+    del use_64bit
+    _Call('Registry.RemoveKeyValue')
+    with _lock:
+      if REGISTRY.pop(self._Key(key_path, key_name), None) is None:
+        raise RegistryError('Registry key not found.', errno=2)
+
+  def GetRegKeysAndValues(self, key_path=None, use_64bit=True):
+    del use_64bit
+    _Call('Registry.GetRegKeysAndValues')
+    path = (key_path or '').lower()
+    with _lock:
+      return {
+          name: value
+          for (root, p, name), value in REGISTRY.items()
+          if root == self._root and p == path
+      }
+
+  def GetRegKeys(self, key_path=None, use_64bit=True):
+    return list(self.GetRegKeysAndValues(key_path, use_64bit))
+
+
+class HWInfo(object):
+  """gwinpy.wmi.hw_info.HWInfo, describing a fixed workstation."""
+
+  DEVICES = 60
+
+  def BIOSVersion(self):
+    _Call('HWInfo.BIOSVersion', latency=True)
+    return 'Fake BIOS 1.0'
+
+  def BiosSerial(self):
+    _Call('HWInfo.BiosSerial', latency=True)
+    return 'FAKE0123456'
+
+  def ChassisType(self):
+    _Call('HWInfo.ChassisType', latency=True)
+    return 3
+
+  def ComputerSystemManufacturer(self):
+    _Call('HWInfo.ComputerSystemManufacturer', latency=True)
+    return 'Fake Computers Inc.'
+
+  def ComputerSystemModel(self):
+    _Call('HWInfo.ComputerSystemModel', latency=True)
+    return 'Fake Workstation Z640'
+
+  def IsLaptop(self):
+    _Call('HWInfo.IsLaptop', latency=True)
+    return False
+
+  def IsOnBattery(self):
+    _Call('HWInfo.IsOnBattery', latency=True)
+    return False
+
+  def IsVirtualMachine(self):
+    _Call('HWInfo.IsVirtualMachine', latency=True)
+    return False
+
+  def PciDevices(self):
+    _Call('HWInfo.PciDevices', latency=True)
+    return [
+        PciDevice('%04X' % (0x8000 + i), '%04X' % i, '%08X' % i, '%02X' % i)
+        for i in range(self.DEVICES)
+    ]
+
+  def VideoControllers(self):
+    _Call('HWInfo.VideoControllers', latency=True)
+    return [{'name': 'Fake Graphics 3000'}]
+
+
+class NetInfo(object):
+  """gwinpy.wmi.net_info.NetInfo, for a host without network interfaces."""
+
+  def __init__(self, active_only=True, poll=False):
+    del active_only, poll
+    _Call('NetInfo', latency=True)
+
+  def Interfaces(self):
+    return []
+
+
+class TpmInfo(object):
+  """gwinpy.wmi.tpm_info.TpmInfo, for a host with a TPM."""
+
+  def TpmPresent(self):
+    _Call('TpmInfo.TpmPresent', latency=True)
+    return True
+
+
+class WmiError(Exception):
+  pass
+
+
+class WMIQuery(object):
+  """gwinpy.wmi.wmi_query.WMIQuery, which answers no query."""
+
+  def Query(self, query):
+    _Call('WMIQuery.Query', latency=True)
+    raise WmiError('Fake WMI has no results for %s' % query)
+
+
+def GetDhcpOption(*args, **kwargs):
+  del args, kwargs
+  _Call('dhcp.GetDhcpOption')
+  return None
+
+
+def _Module(name: str, **attrs) -> types.ModuleType:
+  module = types.ModuleType(name)
+  module.__dict__.update(attrs)
+  return module
+
+
+def Install():
+  """Registers the fake gwinpy modules in place of any real ones."""
+  modules = {
+      'gwinpy.registry.registry':
+          _Module(
+              'gwinpy.registry.registry',
+              Registry=Registry,
+              RegistryError=RegistryError),
+      'gwinpy.wmi.hw_info':
+          _Module('gwinpy.wmi.hw_info', HWInfo=HWInfo),
+      'gwinpy.wmi.net_info':
+          _Module('gwinpy.wmi.net_info', NetInfo=NetInfo),
+      'gwinpy.wmi.tpm_info':
+          _Module('gwinpy.wmi.tpm_info', TpmInfo=TpmInfo),
+      'gwinpy.wmi.wmi_query':
+          _Module('gwinpy.wmi.wmi_query', WMIQuery=WMIQuery, WmiError=WmiError),
+      'gwinpy.net.dhcp':
+          _Module('gwinpy.net.dhcp', GetDhcpOption=GetDhcpOption),
+  }
+  for name in ('gwinpy', 'gwinpy.registry', 'gwinpy.wmi', 'gwinpy.net'):
+    modules[name] = _Module(name, __path__=[])
+  for name, module in modules.items():
+    parent, _, child = name.rpartition('.')
+    if parent:
+      setattr(modules[parent], child, module)
+  sys.modules.update(modules)
+
+
+def Reset():
+  """Empties the registry, apart from the defaults, and the call counts."""
+  with _lock:
+    for key in list(REGISTRY):
+      if key[2] != 'EditionID':
+        del REGISTRY[key]
+    CALLS.clear()
@@ -0,0 +1,219 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Synthetic inputs for the benchmarks.
+
+Every generator is seeded, so the same arguments always produce the same
+configs, task lists and files, and results from different runs compare.
+"""
+
+import contextlib
+import functools
+import hashlib
+import http.server
+import os
+import random
+import threading
+from typing import Any, Dict, Iterator, List
+
+from glazier.lib import yaml_codec
+
+# Pin values, and whether each matches the host described by fakes.HWInfo.
+PIN_VALUES = {
+    'computer_model': [('Fake Workstation', True), ('Fake Laptop', False),
+                       ('Other Model', False)],
+    'device_id': [('8000-0000', True), ('8001', True), ('9999-0000', False)],
+    'graphics': [('Fake Graphics 3000', True), ('Other Graphics', False)],
+    'is_laptop': [('false', True), ('true', False)],
+    'encryption_type': [('tpm', True), ('none', False)],
+}
+
+
+def Pins(count: int, values: int, seed: int = 0) -> List[Dict[str, List[str]]]:
+  """Generates pins, as found on controls.
+
+  Args:
+    count: The number of pins to generate.
+    values: The number of values in each pin.
+    seed: Seeds the choice of pins.
+
+  Returns:
+    Pin dicts, each pinning one to all of the names in PIN_VALUES. Values are
+    sometimes negated, and otherwise padded with values which never match.
+  """
+  rand = random.Random(seed)
+  names = sorted(PIN_VALUES)
+  pins = []
+  for _ in range(count):
+    pin = {}
+    for name in rand.sample(names, rand.randint(1, len(names))):
+      value, _ = rand.choice(PIN_VALUES[name])
+      if rand.random() < 0.2:
+        value = '!' + value
+      pin[name] = [value] + [
+          'Unmatched %s %d' % (name, i) for i in range(values - 1)
+      ]
+    pins.append(pin)
+  return pins
+
+
+def WriteIncludeTree(root: str,
+                     depth: int,
+                     width: int,
+                     controls: int,
+                     pinned: float = 0.0,
+                     seed: int = 0) -> Dict[str, int]:
+  """Writes a tree of config files, each including the next level.
+
+  Args:
+    root: The directory to write build.yaml and its includes to.
+    depth: The number of levels of includes below build.yaml.
+    width: The number of files each file includes.
+    controls: The number of controls in each file.
+    pinned: The share of controls which carry a pin.
+    seed: Seeds the choice of pins.
+
+  Returns:
+    The number of files and controls written.
+  """
+  rand = random.Random(seed)
+  pins = Pins(64, 4, seed)
+  totals = {'files': 0, 'controls': 0}
+
+  def _Write(path: str, name: str, level: int):
+    config_controls = []
+    if level < depth:
+      config_controls.append({
+          'include': [['d%d/' % i, 'build.yaml'] for i in range(width)]
+      })
+    for i in range(controls):
+      control = {'SetTimer': ['timer_%d_%d' % (totals['files'], i)]}
+      if rand.random() < pinned:
+        control['pin'] = rand.choice(pins)
+      config_controls.append(control)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, name), 'w') as f:
+      yaml_codec.Dump({'controls': config_controls}, f)
+    totals['files'] += 1
+    totals['controls'] += len(config_controls)
+    if level < depth:
+      for i in range(width):
+        _Write(os.path.join(path, 'd%d' % i), 'build.yaml', level + 1)
+
+  _Write(root, 'build.yaml', 0)
+  return totals
+
+
+def TaskList(count: int, paths: int = 50) -> List[Dict[str, Any]]:
+  """Generates a compiled task list.
+
+  Args:
+    count: The number of tasks.
+    paths: The number of distinct config paths the tasks come from.
+
+  Returns:
+    Tasks as written by ConfigBuilder, each setting a timer.
+  """
+  return [{
+      'path': ['/autobuild', 'd%d' % (i % paths)],
+      'data': {
+          'SetTimer': ['timer_%d' % i]
+      }
+  } for i in range(count)]
+
+
+def Configs(count: int, controls: int = 10,
+            seed: int = 0) -> List[Dict[str, Any]]:
+  """Generates config files, as read by ConfigBuilder.
+
+  Args:
+    count: The number of config files.
+    controls: The number of pinned controls in each file.
+    seed: Seeds the choice of pins.
+
+  Returns:
+    Config dicts, each including a child and holding a template.
+  """
+  pins = Pins(64, 4, seed)
+  configs = []
+  for i in range(count):
+    config_controls = [{'include': [['child%d/' % i, 'build.yaml']]}]
+    for j in range(controls):
+      config_controls.append({
+          'pin': pins[(i + j) % len(pins)],
+          'Get': [['@pkg/%d/%d.msi' % (i, j), r'C:\pkg.msi', '%064x' % j]],
+          'Execute': [[r'C:\pkg.msi /qn', [0, 3010]]],
+      })
+    configs.append({
+        'controls': config_controls,
+        'templates': {
+            'common': {
+                'SetTimer': ['common%d' % i]
+            }
+        }
+    })
+  return configs
+
+
+def WriteFile(path: str, size: int, seed: int = 0) -> str:
+  """Writes a file of pseudo-random bytes.
+
+  Args:
+    path: The file to write.
+    size: The size of the file, in bytes.
+    seed: Seeds the content.
+
+  Returns:
+    The hex SHA256 digest of the file.
+  """
+  rand = random.Random(seed)
+  block = rand.randbytes(1048576)
+  digest = hashlib.sha256()
+  with open(path, 'wb') as f:
+    while size > 0:
+      chunk = block[:size]
+      f.write(chunk)
+      digest.update(chunk)
+      size -= len(chunk)
+      # Rotate the block, so that no two megabytes are the same.
+      block = block[1:] + block[:1]
+  return digest.hexdigest()
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+
+  def log_message(self, *args):
+    pass
+
+
+@contextlib.contextmanager
+def FileServer(directory: str) -> Iterator[str]:
+  """Serves a directory over HTTP on the loopback interface.
+
+  Args:
+    directory: The directory to serve.
+
+  Yields:
+    The base URL of the server, with a trailing slash.
+  """
+  server = http.server.ThreadingHTTPServer(
+      ('127.0.0.1', 0),
+      functools.partial(_QuietHandler, directory=directory))
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  try:
+    yield 'http://127.0.0.1:%d/' % server.server_address[1]
+  finally:
+    server.shutdown()
+    server.server_close()
+    thread.join()
@@ -0,0 +1,584 @@
+# Copyright 2023 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks the hot paths of the builder, runner, downloader and pinning.
+
+Usage:
+  python -m testing.benchmarks.suite [--benchmarks=builder_start,...]
+      [--output=results.json] [--baseline=previous.json] [--tolerance=0.1]
+
+Runs on any platform: the registry and WMI are replaced by the in-memory fakes
+in testing.benchmarks.fakes, and files are served by a local HTTP server. All
+inputs come from the seeded generators in testing.benchmarks.generators, so
+results from different runs of the same revision, or of two revisions, compare.
+
+Each benchmark is run once to warm up and then --repeat times. Benchmarks
+which trace memory are run once more under tracemalloc, which is too slow to
+time, for the peak memory allocated by Python during a run. Results are
+printed, and written as JSON to --output. With --baseline, the median time of
+each benchmark is compared with that of an earlier --output file, and the suite
+exits with status 1 if any benchmark is slower by more than --tolerance.
+"""
+
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List
+from unittest import mock
+
+from absl import app
+from absl import flags
+from absl.testing import flagsaver
+from testing.benchmarks import fakes
+import yaml
+
+fakes.Install()
+
+# glazier.lib must only be imported once the fakes are installed.
+# pylint: disable=g-import-not-at-top,g-bad-import-order
+from glazier.lib import buildinfo
+from glazier.lib import cache
+from glazier.lib import connection_pool
+from glazier.lib import download
+from glazier.lib import registry
+from glazier.lib import yaml_codec
+from glazier.lib.actions import registry as registry_actions
+from glazier.lib.config import builder
+from glazier.lib.config import files
+from glazier.lib.config import runner
+from glazier.lib.config import task_file
+from testing.benchmarks import generators
+# pylint: enable=g-import-not-at-top,g-bad-import-order
+
+RESULTS_VERSION = 1
+
+_BENCHMARKS = flags.DEFINE_list(
+    'benchmarks', [], 'Benchmarks to run. Defaults to all of them.')
+_REPEAT = flags.DEFINE_integer('repeat', 5, 'Timed runs of each benchmark.')
+_OUTPUT = flags.DEFINE_string('output', '', 'Write results as JSON here.')
+_BASELINE = flags.DEFINE_string(
+    'baseline', '', 'Compare results with this earlier --output file.')
+_TOLERANCE = flags.DEFINE_float(
+    'tolerance', 0.1,
+    'How much slower than the baseline a benchmark may be, as a fraction.')
+_WMI_LATENCY = flags.DEFINE_float(
+    'wmi_latency', 0.0, 'Seconds each fake WMI query takes.')
+
+_TREE_DEPTH = flags.DEFINE_integer(
+    'tree_depth', 3, 'Levels of includes below the root config.')
+_TREE_WIDTH = flags.DEFINE_integer(
+    'tree_width', 4, 'Files included by each config file.')
+_TREE_CONTROLS = flags.DEFINE_integer(
+    'tree_controls', 20, 'Controls in each config file.')
+_TREE_PINNED = flags.DEFINE_float(
+    'tree_pinned', 0.3, 'Share of controls which carry a pin.')
+_TASKS = flags.DEFINE_integer('tasks', 2000, 'Tasks in the task list.')
+_PINS = flags.DEFINE_integer('pins', 2000, 'Pinned controls to match.')
+_PIN_VALUES = flags.DEFINE_integer('pin_values', 8, 'Values in each pin.')
+_FILE_MB = flags.DEFINE_integer(
+    'file_mb', 64, 'Size of the file downloaded and hashed, in MiB.')
+_CACHE_LINES = flags.DEFINE_integer(
+    'cache_lines', 100, 'Command lines to cache the files of.')
+_CACHE_FILES = flags.DEFINE_integer(
+    'cache_files', 20, 'Distinct files referenced by the command lines.')
+_CACHE_FILE_KB = flags.DEFINE_integer(
+    'cache_file_kb', 256, 'Size of each file referenced, in KiB.')
+_CONFIGS = flags.DEFINE_integer(
+    'configs', 200, 'Config files loaded and dumped as YAML.')
+_REG_VALUES = flags.DEFINE_integer(
+    'reg_values', 500, 'Registry values set by MultiRegAdd.')
+_REG_KEYS = flags.DEFINE_integer(
+    'reg_keys', 10, 'Registry keys the values are spread across.')
+_REG_LATENCY = flags.DEFINE_float(
+    'reg_latency', 0.0002, 'Seconds each registry key takes to open.')
+
+
+class Benchmark(object):
+  """A measurement of one code path.
+
+  SetUp runs once, and Prepare before every run. Only Run is timed. Contexts
+  entered on self.stack are exited by TearDown. With trace_memory, the peak
+  memory of a run is measured too.
+  """
+
+  name = ''
+  unit = ''
+  trace_memory = False
+
+  def __init__(self, root: str):
+    self.root = root
+    self.stack = contextlib.ExitStack()
+
+  def Params(self) -> Dict[str, Any]:
+    """The inputs of the benchmark, which results are only compared across."""
+    return {}
+
+  def Ops(self) -> int:
+    """The number of units of work done by a single run."""
+    return 1
+
+  def SetUp(self):
+    pass
+
+  def Prepare(self):
+    pass
+
+  def Run(self):
+    raise NotImplementedError
+
+  def TearDown(self):
+    self.stack.close()
+
+
+class BuilderStart(Benchmark):
+  """ConfigBuilder.Start over a tree of nested includes."""
+
+  name = 'builder_start'
+  unit = 'controls'
+  trace_memory = True
+
+  def Params(self):
+    return {
+        'depth': _TREE_DEPTH.value,
+        'width': _TREE_WIDTH.value,
+        'controls': _TREE_CONTROLS.value,
+        'pinned': _TREE_PINNED.value,
+    }
+
+  def Ops(self):
+    return self._totals['controls']
+
+  def SetUp(self):
+    self._config = os.path.join(self.root, 'config')
+    self._totals = generators.WriteIncludeTree(
+        self._config, _TREE_DEPTH.value, _TREE_WIDTH.value,
+        _TREE_CONTROLS.value, _TREE_PINNED.value)
+    self._out_file = os.path.join(self.root, 'task_list.yaml')
+
+  def Prepare(self):
+    self._build_info = buildinfo.BuildInfo()
+    self._build_info.ConfigServer(set_to=self._config)
+    self._build_info.ReleasePath = lambda: self._config + '/'
+    if os.path.exists(self._out_file):
+      os.remove(self._out_file)
+
+  def Run(self):
+    builder.ConfigBuilder(self._build_info).Start(
+        out_file=self._out_file, in_path='')
+
+
+class RunnerTasks(Benchmark):
+  """ConfigRunner._ProcessTasks and _PopTask over a YAML task list."""
+
+  name = 'runner_tasks'
+  unit = 'tasks'
+  binary = False
+
+  def Params(self):
+    return {'tasks': _TASKS.value}
+
+  def Ops(self):
+    return _TASKS.value
+
+  def SetUp(self):
+    # The runner checks these URLs are reachable before it starts.
+    self.stack.enter_context(flagsaver.flagsaver(verify_urls=[]))
+    self._tasks = generators.TaskList(_TASKS.value)
+    self._task_list = os.path.join(self.root, 'task_list.yaml')
+
+  def Prepare(self):
+    fakes.Reset()
+    if self.binary:
+      task_file.Write(self._task_list, self._tasks)
+    else:
+      files.Dump(self._task_list, self._tasks, mode='w')
+    self._build_info = buildinfo.BuildInfo()
+
+  def Run(self):
+    runner.ConfigRunner(self._build_info).Start(task_list=self._task_list)
+
+
+class RunnerTasksBinary(RunnerTasks):
+  """ConfigRunner._ProcessTasks and _PopTask over a binary task list."""
+
+  name = 'runner_tasks_binary'
+  binary = True
+
+
+class BuildPinMatch(Benchmark):
+  """BuildInfo.BuildPinMatch for every pin of many pinned controls."""
+
+  name = 'build_pin_match'
+  unit = 'pins'
+
+  def Params(self):
+    return {'pins': _PINS.value, 'values': _PIN_VALUES.value}
+
+  def Ops(self):
+    return self._checks
+
+  def SetUp(self):
+    self._pins = [
+        list(pin.items())
+        for pin in generators.Pins(_PINS.value, _PIN_VALUES.value)
+    ]
+    self._checks = sum(len(pin) for pin in self._pins)
+
+  def Prepare(self):
+    self._build_info = buildinfo.BuildInfo()
+
+  def Run(self):
+    for pin in self._pins:
+      for name, values in pin:
+        self._build_info.BuildPinMatch(name, values)
+
+
+class YamlLoad(Benchmark):
+  """yaml_codec.Load of a task list and a set of config files."""
+
+  name = 'yaml_load'
+  unit = 'bytes'
+
+  def Params(self):
+    return {
+        'tasks': _TASKS.value,
+        'configs': _CONFIGS.value,
+        'libyaml': yaml_codec.LIBYAML,
+    }
+
+  def Ops(self):
+    return sum(len(d) for d in self._documents)
+
+  def SetUp(self):
+    self._data = [generators.TaskList(_TASKS.value)]
+    self._data.extend(generators.Configs(_CONFIGS.value))
+    self._documents = [yaml.dump(d) for d in self._data]
+
+  def Run(self):
+    for document in self._documents:
+      yaml_codec.Load(document)
+
+
+class YamlLoadPure(YamlLoad):
+  """yaml.load with PyYAML's pure Python loader, to compare with yaml_load."""
+
+  name = 'yaml_load_pure'
+
+  def Run(self):
+    for document in self._documents:
+      yaml.load(document, Loader=yaml.SafeLoader)
+
+
+class YamlDump(YamlLoad):
+  """yaml_codec.Dump of a task list and a set of config files."""
+
+  name = 'yaml_dump'
+
+  def Run(self):
+    for data in self._data:
+      yaml_codec.Dump(data)
+
+
+class YamlDumpPure(YamlLoad):
+  """yaml.dump with PyYAML's pure Python dumper, to compare with yaml_dump."""
+
+  name = 'yaml_dump_pure'
+
+  def Run(self):
+    for data in self._data:
+      yaml.dump(data, Dumper=yaml.Dumper)
+
+
+class _Served(Benchmark):
+  """A benchmark downloading from a local HTTP server, at self.url."""
+
+  def SetUp(self):
+    self._www = os.path.join(self.root, 'www')
+    os.makedirs(self._www)
+    self.url = self.stack.enter_context(generators.FileServer(self._www))
+    # The downloader only installs an HTTPS handler, and the server is HTTP.
+    self.stack.enter_context(
+        mock.patch.object(
+            download.BaseDownloader,
+            '_GetHandlers',
+            autospec=True,
+            return_value=[connection_pool.HTTPHandler()]))
+
+
+class StreamToDisk(_Served):
+  """BaseDownloader._StreamToDisk from a local HTTP server."""
+
+  name = 'stream_to_disk'
+  unit = 'bytes'
+
+  def Params(self):
+    return {'mb': _FILE_MB.value}
+
+  def Ops(self):
+    return _FILE_MB.value * 1048576
+
+  def SetUp(self):
+    super(StreamToDisk, self).SetUp()
+    self._sha256 = generators.WriteFile(
+        os.path.join(self._www, 'large.bin'), self.Ops())
+    self._save_location = os.path.join(self.root, 'large.bin')
+
+  def Prepare(self):
+    if os.path.exists(self._save_location):
+      os.remove(self._save_location)
+    self._downloader = download.Download()
+    self._downloader._save_location = self._save_location  # pylint: disable=protected-access
+    self._stream = connection_pool.BuildOpener().open(self.url + 'large.bin')
+
+  def Run(self):
+    self._downloader._StreamToDisk(self._stream, show_progress=False)  # pylint: disable=protected-access
+
+
+class DownloadFileSha256(StreamToDisk):
+  """BaseDownloader.DownloadFile with an expected SHA256 digest."""
+
+  name = 'download_file_sha256'
+
+  def Prepare(self):
+    if os.path.exists(self._save_location):
+      os.remove(self._save_location)
+    self._downloader = download.Download()
+
+  def Run(self):
+    self._downloader.DownloadFile(
+        self.url + 'large.bin',
+        self._save_location,
+        digests={'sha256': self._sha256})
+
+
+class VerifyShaHash(Benchmark):
+  """BaseDownloader.VerifyShaHash of a large file."""
+
+  name = 'verify_sha_hash'
+  unit = 'bytes'
+
+  def Params(self):
+    return {'mb': _FILE_MB.value}
+
+  def Ops(self):
+    return _FILE_MB.value * 1048576
+
+  def SetUp(self):
+    self._path = os.path.join(self.root, 'large.bin')
+    self._sha256 = generators.WriteFile(self._path, self.Ops())
+
+  def Run(self):
+    if not download.Download().VerifyShaHash(self._path, self._sha256):
+      raise ValueError('VerifyShaHash did not match.')
+
+
+class CacheFromLine(_Served):
+  """Cache.CacheFromLine for command lines referencing remote files."""
+
+  name = 'cache_from_line'
+  unit = 'lines'
+
+  def Params(self):
+    return {
+        'lines': _CACHE_LINES.value,
+        'files': _CACHE_FILES.value,
+        'kb': _CACHE_FILE_KB.value,
+    }
+
+  def Ops(self):
+    return _CACHE_LINES.value
+
+  def SetUp(self):
+    super(CacheFromLine, self).SetUp()
+    for i in range(_CACHE_FILES.value):
+      generators.WriteFile(
+          os.path.join(self._www, 'file%d.bin' % i),
+          _CACHE_FILE_KB.value * 1024, seed=i)
+    self._lines = []
+    for i in range(_CACHE_LINES.value):
+      refs = ['@file%d.bin' % ((i + j) % _CACHE_FILES.value)
+              for j in range(i % 4)]
+      self._lines.append(' '.join(['setup.exe', '/quiet'] + refs))
+    self._cache = os.path.join(self.root, 'cache')
+
+  def Prepare(self):
+    self._build_info = buildinfo.BuildInfo()
+    self._build_info.BinaryPath = lambda: self.url
+    self._build_info.Branch = lambda: 'stable'
+    self._build_info.ReleasePath = lambda: self.url + 'stable/'
+    self._build_info.CachePath = lambda: self._cache
+    shutil.rmtree(self._cache, ignore_errors=True)
+    os.makedirs(self._cache)
+
+  def Run(self):
+    c = cache.Cache()
+    for line in self._lines:
+      c.CacheFromLine(line, self._build_info)
+
+
+class MultiRegAdd(Benchmark):
+  """MultiRegAdd of many values, over the in-memory registry backend."""
+
+  name = 'multi_reg_add'
+  unit = 'values'
+
+  def Params(self):
+    return {
+        'values': _REG_VALUES.value,
+        'keys': _REG_KEYS.value,
+        'latency': _REG_LATENCY.value,
+    }
+
+  def Ops(self):
+    return _REG_VALUES.value
+
+  def SetUp(self):
+    self._args = [[
+        'HKLM', r'SOFTWARE\Glazier\Benchmark%d' % (i % _REG_KEYS.value),
+        'value%d' % i, i, 'REG_DWORD'
+    ] for i in range(_REG_VALUES.value)]
+
+    self.stack.callback(registry.set_backend, registry.get_backend())
+
+  def Prepare(self):
+    registry.set_backend(registry.MemoryBackend(_REG_LATENCY.value))
+
+  def Run(self):
+    registry_actions.MultiRegAdd(self._args, None).Run()
+
+
+ALL = [
+    BuilderStart, RunnerTasks, RunnerTasksBinary, BuildPinMatch, YamlLoad,
+    YamlLoadPure, YamlDump, YamlDumpPure, StreamToDisk, DownloadFileSha256,
+    VerifyShaHash, CacheFromLine, MultiRegAdd
+]
+
+
+def RunBenchmark(benchmark: Benchmark, repeat: int) -> Dict[str, Any]:
+  """Times a benchmark.
+
+  Args:
+    benchmark: The benchmark, not yet set up.
+    repeat: The number of timed runs.
+
+  Returns:
+    The result of the benchmark, for the results file.
+  """
+  benchmark.SetUp()
+  try:
+    runs = []
+    for i in range(repeat + 1):
+      benchmark.Prepare()
+      start = time.perf_counter()
+      benchmark.Run()
+      elapsed = time.perf_counter() - start
+      if i:  # The first run only warms up.
+        runs.append(elapsed)
+    median = statistics.median(runs)
+    result = {
+        'params': benchmark.Params(),
+        'unit': benchmark.unit,
+        'ops': benchmark.Ops(),
+        'runs': runs,
+        'min': min(runs),
+        'median': median,
+        'ops_per_second': benchmark.Ops() / median if median else None,
+    }
+    if benchmark.trace_memory:
+      benchmark.Prepare()
+      tracemalloc.start()
+      try:
+        benchmark.Run()
+        _, result['peak_bytes'] = tracemalloc.get_traced_memory()
+      finally:
+        tracemalloc.stop()
+    return result
+  finally:
+    benchmark.TearDown()
+
+
+def Compare(results: Dict[str, Any], baseline: Dict[str, Any],
+            tolerance: float) -> List[str]:
+  """Compares results with a baseline.
+
+  Args:
+    results: The benchmarks of this run, by name.
+    baseline: The benchmarks of an earlier run, by name.
+    tolerance: How much slower a benchmark may get, as a fraction.
+
+  Returns:
+    The names of the benchmarks which got slower by more than tolerance.
+  """
+  regressions = []
+  for name, result in results.items():
+    before = baseline.get(name)
+    if not before or before.get('params') != result['params']:
+      print('%-20s no baseline with the same parameters' % name)
+      continue
+    ratio = result['median'] / before['median']
+    regressed = ratio > 1 + tolerance
+    print('%-20s %8.3fs -> %8.3fs  %+6.1f%%%s' %
+          (name, before['median'], result['median'], (ratio - 1) * 100,
+           '  REGRESSION' if regressed else ''))
+    if regressed:
+      regressions.append(name)
+  return regressions
+
+
+def main(unused_argv):
+  fakes.WMI_LATENCY = _WMI_LATENCY.value
+  selected = [b for b in ALL if not _BENCHMARKS.value or
+              b.name in _BENCHMARKS.value]
+  unknown = set(_BENCHMARKS.value) - set(b.name for b in ALL)
+  if unknown:
+    raise app.UsageError('Unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+
+  results = {}
+  for benchmark in selected:
+    with tempfile.TemporaryDirectory() as root:
+      result = RunBenchmark(benchmark(root), _REPEAT.value)
+    results[benchmark.name] = result
+    print('%-20s median %8.3fs  min %8.3fs  %12.1f %s/s%s' %
+          (benchmark.name, result['median'], result['min'],
+           result['ops_per_second'] or 0, result['unit'],
+           '  peak %.1f MiB' % (result['peak_bytes'] / 2**20)
+           if 'peak_bytes' in result else ''))
+
+  if _OUTPUT.value:
+    with open(_OUTPUT.value, 'w') as f:
+      json.dump({
+          'version': RESULTS_VERSION,
+          'python': platform.python_version(),
+          'platform': platform.platform(),
+          'wmi_latency': _WMI_LATENCY.value,
+          'benchmarks': results,
+      }, f, indent=2)
+
+  if _BASELINE.value:
+    with open(_BASELINE.value) as f:
+      baseline = json.load(f)
+    if baseline.get('version') != RESULTS_VERSION:
+      raise app.UsageError('Unsupported baseline version.')
+    if Compare(results, baseline['benchmarks'], _TOLERANCE.value):
+      sys.exit(1)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -11,41 +11,268 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Locate *_test modules and run the tests in them."""
+"""Locate *_test modules and run the tests in them.
+
+Usage:
+  python -m testing.run_tests [--workers=N] [--junit_xml=results.xml]
+      [--json=results.json] [--reuse_workers] [module ...]
+
+Test modules run in a pool of worker processes, one per core by default. The
+modules every test needs (absl, yaml, mock and glazier's test utilities) are
+imported once, before the pool starts. Where processes can be forked, each
+test module then runs in a fresh worker forked from that state, so modules
+stay isolated from one another without paying for the imports again. With
+--reuse_workers, each worker runs many modules in turn instead.
+
+Results are collected from unittest directly, rather than from the output of
+each module, and can be written as JUnit XML or JSON. The exit status is 1 if
+any test failed, or any module could not be loaded.
+"""
 
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
 import pkgutil
-import re
-import subprocess
 import sys
+import time
+import traceback
+import unittest
+from xml.etree import ElementTree
 
 import glazier
 
-FAILED_RE = re.compile(r'FAILED\s*\(errors=(\d*)\)')
-
-
-def main():
-  results = {'codes': {0: 0, 1: 0}, 'errors': 0}
-  for _, test, _ in pkgutil.walk_packages(glazier.__path__,
-                                          glazier.__name__ + '.'):
-    if '_test' in test:
-      print('**** %s ****\n' % test)
-      proc = subprocess.Popen(['python', '-m', test], stderr=subprocess.PIPE)
-      _, err = proc.communicate()
-      err = err.decode()
-      print(err)
-      failed = FAILED_RE.search(err)
-      if failed:
-        results['errors'] += int(failed.group(1))
-      results['codes'][proc.returncode] = results['codes'].setdefault(
-          proc.returncode, 0) + 1
-
-  print('Success: %s' % results['codes'][0])
-  print('Failure: %s' % results['codes'][1])
-  sys.exit(results['codes'][1])
+# Imported once, ahead of the workers, by every test run.
+SHARED_MODULES = (
+    'absl.flags',
+    'absl.testing.absltest',
+    'absl.testing.flagsaver',
+    'absl.testing.parameterized',
+    'mock',
+    'unittest.mock',
+    'yaml',
+    'glazier.lib.test_utils',
+)
+
+PASSED = 'passed'
+FAILED = 'failed'
+ERROR = 'error'
+SKIPPED = 'skipped'
+
+
+class _Result(unittest.TestResult):
+  """Records the outcome and duration of every test as plain data."""
+
+  def __init__(self):
+    super(_Result, self).__init__()
+    self.buffer = True
+    self.tests = []
+    self._start = 0.0
+
+  def startTest(self, test):
+    self._start = time.perf_counter()
+    super(_Result, self).startTest(test)
+
+  def _Add(self, test, status, message=''):
+    self.tests.append({
+        'id': test.id(),
+        'status': status,
+        'seconds': round(time.perf_counter() - self._start, 6),
+        'message': message,
+    })
+
+  def addSuccess(self, test):
+    super(_Result, self).addSuccess(test)
+    self._Add(test, PASSED)
+
+  def addFailure(self, test, err):
+    super(_Result, self).addFailure(test, err)
+    self._Add(test, FAILED, self.failures[-1][1])
+
+  def addError(self, test, err):
+    super(_Result, self).addError(test, err)
+    self._Add(test, ERROR, self.errors[-1][1])
+
+  def addSkip(self, test, reason):
+    super(_Result, self).addSkip(test, reason)
+    self._Add(test, SKIPPED, reason)
+
+  def addExpectedFailure(self, test, err):
+    super(_Result, self).addExpectedFailure(test, err)
+    self._Add(test, PASSED)
+
+  def addUnexpectedSuccess(self, test):
+    super(_Result, self).addUnexpectedSuccess(test)
+    self._Add(test, FAILED, 'Unexpected success')
+
+  def addSubTest(self, test, subtest, err):
+    super(_Result, self).addSubTest(test, subtest, err)
+    if err is not None:
+      status = FAILED if issubclass(err[0], test.failureException) else ERROR
+      self._Add(subtest, status, self._exc_info_to_string(err, test))
+
+
+def FindTestModules():
+  """Lists the *_test modules below the glazier package."""
+  return sorted(
+      name for _, name, _ in pkgutil.walk_packages(glazier.__path__,
+                                                   glazier.__name__ + '.')
+      if name.endswith('_test'))
+
+
+def ImportSharedModules():
+  """Imports SHARED_MODULES, and parses the flags tests rely on."""
+  for name in SHARED_MODULES:
+    try:
+      importlib.import_module(name)
+    except ImportError:
+      pass
+  try:
+    from absl import flags  # pylint: disable=g-import-not-at-top
+  except ImportError:
+    return
+  if not flags.FLAGS.is_parsed():
+    flags.FLAGS([sys.argv[0]])
+
+
+def RunModule(name):
+  """Runs the tests of a single module, in the current process.
+
+  Args:
+    name: The name of the test module.
+
+  Returns:
+    A dict with the name of the module, the seconds taken, each test run, and
+    the traceback of any error loading the module.
+  """
+  start = time.perf_counter()
+  result = _Result()
+  error = ''
+  try:
+    module = importlib.import_module(name)
+    suite = unittest.defaultTestLoader.loadTestsFromModule(module)
+    suite.run(result)
+  except Exception:  # pylint: disable=broad-except
+    error = traceback.format_exc()
+  return {
+      'module': name,
+      'seconds': round(time.perf_counter() - start, 6),
+      'tests': result.tests,
+      'error': error,
+  }
+
+
+def WriteJUnitXml(path, results):
+  """Writes results in the JUnit XML format read by most CI systems."""
+  root = ElementTree.Element('testsuites')
+  for module in results:
+    tests = module['tests']
+    suite = ElementTree.SubElement(
+        root,
+        'testsuite',
+        name=module['module'],
+        tests=str(len(tests) + bool(module['error'])),
+        failures=str(sum(t['status'] == FAILED for t in tests)),
+        errors=str(
+            sum(t['status'] == ERROR for t in tests) + bool(module['error'])),
+        skipped=str(sum(t['status'] == SKIPPED for t in tests)),
+        time='%.3f' % module['seconds'])
+    if module['error']:
+      case = ElementTree.SubElement(
+          suite, 'testcase', classname=module['module'], name='load', time='0')
+      ElementTree.SubElement(
+          case, 'error', message='Unable to load module').text = module['error']
+    for test in tests:
+      classname, _, name = test['id'].rpartition('.')
+      case = ElementTree.SubElement(
+          suite,
+          'testcase',
+          classname=classname,
+          name=name,
+          time='%.3f' % test['seconds'])
+      if test['status'] in (FAILED, ERROR):
+        ElementTree.SubElement(
+            case, 'failure' if test['status'] == FAILED else 'error',
+            message=test['message'].strip().split('\n')[-1]
+        ).text = test['message']
+      elif test['status'] == SKIPPED:
+        ElementTree.SubElement(case, 'skipped', message=test['message'])
+  ElementTree.ElementTree(root).write(
+      path, encoding='utf-8', xml_declaration=True)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument(
+      'modules', nargs='*',
+      help='Test modules to run. Defaults to every *_test module.')
+  parser.add_argument(
+      '--workers', type=int, default=os.cpu_count() or 1,
+      help='Worker processes. Defaults to the number of cores.')
+  parser.add_argument(
+      '--reuse_workers', action='store_true',
+      help='Run many modules in each worker, rather than one per worker.')
+  parser.add_argument('--junit_xml', help='Write results as JUnit XML here.')
+  parser.add_argument('--json', help='Write results as JSON here.')
+  args = parser.parse_args(argv)
+
+  modules = args.modules or FindTestModules()
+  start = time.perf_counter()
+  ImportSharedModules()
+  context = multiprocessing.get_context(
+      'fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+  # A spawned worker starts from scratch, so is reused to share its imports.
+  reuse = args.reuse_workers or context.get_start_method() != 'fork'
+  results = []
+  with context.Pool(
+      processes=max(1, min(args.workers, len(modules))),
+      initializer=ImportSharedModules,
+      maxtasksperchild=None if reuse else 1) as pool:
+    for result in pool.imap_unordered(RunModule, modules):
+      results.append(result)
+      counts = {}
+      for test in result['tests']:
+        counts[test['status']] = counts.get(test['status'], 0) + 1
+      ok = not result['error'] and not counts.get(FAILED) and not counts.get(
+          ERROR)
+      print('%-4s %-50s %3d tests %7.2fs' %
+            ('OK' if ok else 'FAIL', result['module'], len(result['tests']),
+             result['seconds']))
+  results.sort(key=lambda r: r['module'])
+
+  failed_modules = 0
+  totals = {PASSED: 0, FAILED: 0, ERROR: 0, SKIPPED: 0}
+  for result in results:
+    failed = [t for t in result['tests'] if t['status'] in (FAILED, ERROR)]
+    for test in result['tests']:
+      totals[test['status']] += 1
+    if result['error']:
+      print('\n**** %s: unable to load ****\n%s' %
+            (result['module'], result['error']))
+    for test in failed:
+      print('\n**** %s: %s ****\n%s' %
+            (test['id'], test['status'].upper(), test['message']))
+    if failed or result['error']:
+      failed_modules += 1
+
+  if args.junit_xml:
+    WriteJUnitXml(args.junit_xml, results)
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump({'modules': results}, f, indent=2)
+
+  print('\nRan %d tests in %d modules in %.1fs: %d passed, %d failed, '
+        '%d errors, %d skipped.' %
+        (sum(totals.values()), len(results), time.perf_counter() - start,
+         totals[PASSED], totals[FAILED], totals[ERROR], totals[SKIPPED]))
+  print('Success: %s' % (len(results) - failed_modules))
+  print('Failure: %s' % failed_modules)
+  sys.exit(1 if failed_modules else 0)
 
 
 if __name__ == '__main__':